@@ -104,8 +104,10 @@ class PretixScanSecurityProfile(AllowListSecurityProfile):
         ('GET', 'api-v1:badgeitem-list'),
         ('GET', 'api-v1:checkinlist-list'),
         ('GET', 'api-v1:checkinlist-status'),
+        ('GET', 'api-v1:checkinlist-snapshot'),
         ('POST', 'api-v1:checkinlist-failed_checkins'),
         ('GET', 'api-v1:checkinlistpos-list'),
+        ('GET', 'api-v1:checkinlistpos-sync'),
         ('POST', 'api-v1:checkinlistpos-redeem'),
         ('GET', 'api-v1:revokedsecrets-list'),
         ('GET', 'api-v1:blockedsecrets-list'),
@@ -115,6 +117,7 @@ class PretixScanSecurityProfile(AllowListSecurityProfile):
         ('GET', 'api-v1:event.settings'),
         ('POST', 'api-v1:upload'),
         ('POST', 'api-v1:checkinrpc.redeem'),
+        ('POST', 'api-v1:checkinrpc.redeem_batch'),
         ('POST', 'api-v1:checkinrpc.annul'),
         ('GET', 'api-v1:checkinrpc.search'),
         ('GET', 'api-v1:reusablemedium-list'),
@@ -154,6 +157,7 @@ class PretixScanNoSyncNoSearchSecurityProfile(AllowListSecurityProfile):
         ('GET', 'api-v1:event.settings'),
         ('POST', 'api-v1:upload'),
         ('POST', 'api-v1:checkinrpc.redeem'),
+        ('POST', 'api-v1:checkinrpc.redeem_batch'),
         ('POST', 'api-v1:checkinrpc.annul'),
         ('GET', 'api-v1:checkinrpc.search'),
     )
@@ -191,6 +195,7 @@ class PretixScanNoSyncSecurityProfile(AllowListSecurityProfile):
         ('GET', 'api-v1:event.settings'),
         ('POST', 'api-v1:upload'),
         ('POST', 'api-v1:checkinrpc.redeem'),
+        ('POST', 'api-v1:checkinrpc.redeem_batch'),
         ('POST', 'api-v1:checkinrpc.annul'),
         ('GET', 'api-v1:checkinrpc.search'),
     )
@@ -103,6 +103,35 @@ class CheckinRPCRedeemInputSerializer(serializers.Serializer):
         return attrs
 
 
+class CheckinRPCRedeemScanSerializer(serializers.Serializer):
+    secret = serializers.CharField(required=True, allow_null=False)
+    force = serializers.BooleanField(default=False, required=False)
+    source_type = serializers.ChoiceField(choices=[(k, v) for k, v in MEDIA_TYPES.items()], default='barcode')
+    type = serializers.ChoiceField(choices=Checkin.CHECKIN_TYPES, default=Checkin.TYPE_ENTRY)
+    ignore_unpaid = serializers.BooleanField(default=False, required=False)
+    nonce = serializers.CharField(required=False, allow_null=True)
+    datetime = serializers.DateTimeField(required=False, allow_null=True)
+    answers = serializers.JSONField(required=False, allow_null=True)
+
+
+class CheckinRPCRedeemBatchInputSerializer(serializers.Serializer):
+    MAX_SCANS = 1000
+
+    lists = serializers.PrimaryKeyRelatedField(required=True, many=True, queryset=CheckinList.objects.none())
+    questions_supported = serializers.BooleanField(default=True, required=False)
+    use_order_locale = serializers.BooleanField(default=False, required=False)
+    scans = CheckinRPCRedeemScanSerializer(many=True, allow_empty=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['lists'].child_relation.queryset = CheckinList.objects.filter(event__in=self.context['events']).select_related('event')
+
+    def validate_scans(self, scans):
+        if len(scans) > self.MAX_SCANS:
+            raise ValidationError(f"You can submit at most {self.MAX_SCANS} scans at once.")
+        return scans
+
+
 class MiniCheckinListSerializer(I18nAwareModelSerializer):
     event = serializers.SlugRelatedField(slug_field='slug', read_only=True)
     subevent = serializers.PrimaryKeyRelatedField(read_only=True)
@@ -745,6 +745,9 @@ class EventSettingsSerializer(SettingsSerializer):
         'waiting_list_phones_required',
         'waiting_list_phones_explanation_text',
         'waiting_list_limit_per_user',
+        'waiting_room_enabled',
+        'waiting_room_rate',
+        'waiting_room_admission_minutes',
         'max_items_per_order',
         'reservation_time',
         'contact_mail',
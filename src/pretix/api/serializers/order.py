@@ -66,12 +66,19 @@ from pretix.base.models.orders import (
 from pretix.base.payment import GiftCardPayment, PaymentException
 from pretix.base.pdf import get_images, get_variables
 from pretix.base.services.cart import error_messages
+from pretix.base.services.checkincounters import (
+    count_new_order_on_checkin_lists, track_checkin_counters,
+)
 from pretix.base.services.locking import LOCK_TRUST_WINDOW, lock_objects
 from pretix.base.services.pricing import (
     apply_discounts, apply_rounding, get_line_price, get_listed_price,
     is_included_for_free,
 )
+from pretix.base.services.quotacounters import (
+    count_new_order, track_quota_counters,
+)
 from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotashards import reclaim_quota_shards
 from pretix.base.settings import (
     COUNTRIES_WITH_STATE_IN_ADDRESS, ROUNDING_MODES,
 )
@@ -728,6 +735,31 @@ class CheckinListOrderPositionSerializer(OrderPositionSerializer):
             self.fields['addons'] = subl
 
 
+class CheckinListSyncCheckinSerializer(I18nAwareModelSerializer):
+    class Meta:
+        model = Checkin
+        fields = ('type', 'datetime')
+
+
+class CheckinListSyncPositionSerializer(I18nAwareModelSerializer):
+    """
+    Compact representation of an order position for the check-in sync feed, limited to the fields scanning
+    devices need to validate tickets offline.
+    """
+    order = serializers.SlugRelatedField(slug_field='code', read_only=True)
+    attendee_name = AttendeeNameField(source='*')
+    require_attention = RequireAttentionField(source='*')
+    order__status = serializers.SlugRelatedField(read_only=True, slug_field='status', source='order')
+    order__valid_if_pending = serializers.SlugRelatedField(read_only=True, slug_field='valid_if_pending', source='order')
+    checkins = CheckinListSyncCheckinSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = OrderPosition
+        fields = ('id', 'order', 'positionid', 'item', 'variation', 'subevent', 'secret', 'attendee_name',
+                  'addon_to', 'blocked', 'valid_from', 'valid_until', 'canceled', 'require_attention',
+                  'order__status', 'order__valid_if_pending', 'checkins')
+
+
 class OrderPaymentTypeField(serializers.Field):
     # TODO: Remove after pretix 2.2
     def to_representation(self, instance: Order):
@@ -1180,6 +1212,27 @@ class WrappedModel:
         raise NotImplementedError
 
 
+class OrderCreateBatch:
+    """
+    Shared state for creating multiple orders with ``OrderCreateSerializer`` inside the same transaction.
+
+    The caller acquires the locks of all orders at once (see ``OrderCreateSerializer.get_lock_objects``),
+    then calls ``compute()`` to calculate quota availability a single time. Every order created afterwards
+    checks against the same availability, and the quota usage of each successfully created order is added
+    to ``quota_usage`` so that later orders in the batch see it.
+    """
+
+    def __init__(self):
+        self.quota_availability = None
+        self.quota_usage = Counter()
+
+    def compute(self, quotas):
+        qa = QuotaAvailability()
+        qa.queue(*quotas)
+        qa.compute()
+        self.quota_availability = qa
+
+
 class OrderCreateSerializer(I18nAwareModelSerializer):
     invoice_address = InvoiceAddressSerializer(required=False)
     positions = OrderPositionCreateSerializer(many=True, required=True)
@@ -1314,6 +1367,37 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
             raise ValidationError(errs)
         return data
 
+    def get_lock_objects(self):
+        """
+        Returns the objects that need to be locked to create this order as a tuple of
+        ``(full_lock_required, lock_objects, quotas)``. Cart positions that will be consumed are not taken
+        into account, so this might be a superset of what ``create()`` would lock on its own.
+        """
+        event = self.context['event']
+        force = self.validated_data.get('force', False)
+        full_lock_required = False
+        objects = set()
+        quotas = set()
+
+        for pos_data in self.validated_data.get('positions', []):
+            if pos_data.get('variation'):
+                pos_quotas = list(pos_data['variation'].quotas.filter(subevent=pos_data.get('subevent')))
+            else:
+                pos_quotas = list(pos_data['item'].quotas.filter(subevent=pos_data.get('subevent')))
+            quotas.update(pos_quotas)
+            if not force:
+                objects.update(q for q in pos_quotas if q.size is not None)
+                if pos_data.get('voucher'):
+                    objects.add(pos_data['voucher'])
+            if pos_data.get('seat'):
+                if event.settings.seating_minimal_distance > 0:
+                    full_lock_required = True
+                seat = event.seats.filter(seat_guid=pos_data['seat'], subevent=pos_data.get('subevent')).first()
+                if seat:
+                    objects.add(seat)
+
+        return full_lock_required, objects, quotas
+
     def create(self, validated_data):
         fees_data = validated_data.pop('fees') if 'fees' in validated_data else []
         positions_data = validated_data.pop('positions') if 'positions' in validated_data else []
@@ -1323,7 +1407,10 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
         force = validated_data.pop('force', False)
         simulate = validated_data.pop('simulate', False)
         gift_card_secrets = validated_data.pop('use_gift_cards') if 'use_gift_cards' in validated_data else []
+        batch = self.context.get('batch')
 
+        if simulate and batch:
+            raise ValidationError({"simulate": ['Simulation is not supported when creating multiple orders at once.']})
         if (payment_provider is not None or payment_info != '{}') and len(gift_card_secrets) > 0:
             raise ValidationError({"use_gift_cards": ['The attribute use_gift_cards is not compatible with payment_provider or payment_info']})
         if validated_data.get('status') != Order.STATUS_PENDING and len(gift_card_secrets) > 0:
@@ -1356,7 +1443,7 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
         quota_diff_for_locking = Counter()
         voucher_diff_for_locking = Counter()
         seat_diff_for_locking = Counter()
-        quota_usage = Counter()
+        quota_usage = Counter(batch.quota_usage) if batch else Counter()
         voucher_usage = Counter()
         seat_usage = Counter()
         v_budget = {}
@@ -1405,7 +1492,7 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
                     seat_usage[cp.seat] -= 1
                 delete_cps.append(cp)
 
-        if not simulate:
+        if not simulate and not batch:  # a batch acquires the locks of all its orders up front
             full_lock_required = seat_diff_for_locking and self.context['event'].settings.seating_minimal_distance > 0
             if full_lock_required:
                 # We lock the entire event in this case since we don't want to deal with fine-granular locking
@@ -1418,10 +1505,16 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
                     [s for s, d in seat_diff_for_locking.items() if d > 0],
                     shared_lock_objects=[self.context['event']]
                 )
+            if not force:
+                # Capacity pre-allocated to quota shards is free to use for us, see quotashards.py
+                reclaim_quota_shards([q for q, d in quota_diff_for_locking.items() if d > 0])
 
-        qa = QuotaAvailability()
-        qa.queue(*[q for q, d in quota_diff_for_locking.items() if d > 0])
-        qa.compute()
+        if batch:
+            qa = batch.quota_availability
+        else:
+            qa = QuotaAvailability()
+            qa.queue(*[q for q, d in quota_diff_for_locking.items() if d > 0])
+            qa.compute()
         v_avail = {}
 
         # These are not technically correct as diff use due to the time offset applied above, so let's prevent accidental
@@ -1560,6 +1653,15 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
         if any(errs):
             raise ValidationError({'positions': errs})
 
+        # Positions that skipped the quota check above still use quota once the order exists, so later orders
+        # of the same batch need to see them as well.
+        self._quota_usage = quota_usage
+        for pos_data in positions_data:
+            v = pos_data.get('voucher')
+            if force or (v and (v.allow_ignore_quota or v.block_quota)):
+                for quota in quotas_by_item[pos_data.get('item'), pos_data.get('variation'), pos_data.get('subevent')]:
+                    self._quota_usage[quota] += 1
+
         if validated_data.get('locale', None) is None:
             validated_data['locale'] = self.context['event'].settings.locale
 
@@ -1820,6 +1922,8 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
             return order  # ignore payments
         else:
             order.save(update_fields=['total'])
+            count_new_order(order)
+            count_new_order_on_checkin_lists(order)
 
         if order.total == Decimal('0.00') and validated_data.get('status') == Order.STATUS_PAID and not payment_provider:
             payment_provider = 'free'
@@ -1867,8 +1971,9 @@ class OrderCreateSerializer(I18nAwareModelSerializer):
                              send_mail=False)
 
         if order.total == Decimal('0.00') and validated_data.get('status') != Order.STATUS_PAID and not validated_data.get('require_approval'):
-            order.status = Order.STATUS_PAID
-            order.save()
+            with track_quota_counters(order), track_checkin_counters(order):
+                order.status = Order.STATUS_PAID
+                order.save()
             order.payments.create(
                 amount=order.total, provider='free', state=OrderPayment.PAYMENT_STATE_CONFIRMED,
                 payment_date=now()
@@ -23,6 +23,7 @@ import logging
 import os
 
 import pycountry
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.files import File
 from django.core.validators import RegexValidator
 from rest_framework import serializers
@@ -33,6 +34,7 @@ from pretix.api.serializers.order import (
     OrderFeeCreateSerializer, OrderPositionCreateSerializer,
 )
 from pretix.base.models import ItemVariation, Order, OrderFee, OrderPosition
+from pretix.base.services.bulkchange import OPERATION_TYPES, resolve_operations
 from pretix.base.services.orders import OrderChangeManager, OrderError
 from pretix.base.settings import COUNTRIES_WITH_STATE_IN_ADDRESS
 
@@ -497,3 +499,58 @@ class OrderChangeOperationSerializer(serializers.Serializer):
 
 class BlockNameSerializer(serializers.Serializer):
     name = serializers.CharField(validators=[RegexValidator('^(admin|api:[a-zA-Z0-9._]+)$')])
+
+
+class OrderBulkChangeOperationSerializer(serializers.Serializer):
+    required_fields = {
+        'change_subevent': ('subevent',),
+        'change_item': ('item',),
+        'change_price': ('price',),
+        'add_block': ('name',),
+    }
+
+    type = serializers.ChoiceField(choices=[(t, t) for t in OPERATION_TYPES])
+    subevent = serializers.IntegerField(required=False)
+    item = serializers.IntegerField(required=False)
+    variation = serializers.IntegerField(required=False, allow_null=True)
+    price = serializers.DecimalField(required=False, decimal_places=2, max_digits=13)
+    name = serializers.CharField(required=False, validators=[RegexValidator('^(admin|api:[a-zA-Z0-9._]+)$')])
+    filter = serializers.DictField(child=serializers.IntegerField(allow_null=True), required=False)
+
+    def validate_filter(self, value):
+        unknown = set(value) - {'item', 'variation', 'subevent'}
+        if unknown:
+            raise ValidationError('Unknown filter keys: {}'.format(', '.join(sorted(unknown))))
+        return value
+
+    def validate(self, data):
+        for f in self.required_fields[data['type']]:
+            if data.get(f) is None:
+                raise ValidationError({f: ['This field is required for this operation type.']})
+        if 'price' in data:
+            data['price'] = str(data['price'])
+        return data
+
+
+class OrderBulkChangeSerializer(serializers.Serializer):
+    operations = OrderBulkChangeOperationSerializer(many=True, allow_empty=False)
+    orders = serializers.ListField(child=serializers.CharField(), required=False, allow_null=True)
+    send_email = serializers.BooleanField(default=False, required=False)
+    reissue_invoice = serializers.BooleanField(default=True, required=False)
+    dry_run = serializers.BooleanField(default=False, required=False)
+
+    def validate_operations(self, operations):
+        try:
+            resolve_operations(self.context['event'], operations)
+        except ObjectDoesNotExist:
+            raise ValidationError('An operation refers to an object that does not exist in this event.')
+        return operations
+
+    def validate_orders(self, codes):
+        if codes is None:
+            return None
+        orders = dict(self.context['event'].orders.filter(code__in=codes).values_list('code', 'pk'))
+        unknown = set(codes) - set(orders)
+        if unknown:
+            raise ValidationError('Unknown order codes: {}'.format(', '.join(sorted(unknown))))
+        return list(orders.values())
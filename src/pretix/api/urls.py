@@ -133,6 +133,8 @@ urlpatterns = [
     re_path(r'^organizers/(?P<organizer>[^/]+)/', include(orga_router.urls)),
     re_path(r'^organizers/(?P<organizer>[^/]+)/checkinrpc/redeem/$', checkin.CheckinRPCRedeemView.as_view(),
             name="checkinrpc.redeem"),
+    re_path(r'^organizers/(?P<organizer>[^/]+)/checkinrpc/redeem_batch/$', checkin.CheckinRPCRedeemBatchView.as_view(),
+            name="checkinrpc.redeem_batch"),
     re_path(r'^organizers/(?P<organizer>[^/]+)/checkinrpc/search/$', checkin.CheckinRPCSearchView.as_view(),
             name="checkinrpc.search"),
     re_path(r'^organizers/(?P<organizer>[^/]+)/checkinrpc/annul/$', checkin.CheckinRPCAnnulView.as_view(),
@@ -43,6 +43,7 @@ from pretix.base.services.cart import (
     _get_quota_availability, _get_voucher_availability, error_messages,
 )
 from pretix.base.services.locking import lock_objects
+from pretix.base.services.quotashards import reclaim_quota_shards
 
 
 class CartPositionViewSet(CreateModelMixin, DestroyModelMixin, viewsets.ReadOnlyModelViewSet):
@@ -165,6 +166,8 @@ class CartPositionViewSet(CreateModelMixin, DestroyModelMixin, viewsets.ReadOnly
                     [s for s, d in seat_diff.items() if d > 0],
                     shared_lock_objects=[self.request.event]
                 )
+            # Capacity pre-allocated to quota shards is free to use for us, see quotashards.py
+            reclaim_quota_shards([q for q, d in quota_diff.items() if d > 0])
 
             vouchers_ok, vouchers_depend_on_cart = _get_voucher_availability(
                 self.request.event,
@@ -19,7 +19,11 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import hashlib
+import json
+import logging
 import operator
+from collections import Counter, defaultdict
 from datetime import timedelta
 from functools import reduce
 
@@ -52,12 +56,13 @@ from rest_framework.response import Response
 
 from pretix.api.serializers.checkin import (
     CheckinListSerializer, CheckinRPCAnnulInputSerializer,
-    CheckinRPCRedeemInputSerializer, MiniCheckinListSerializer,
+    CheckinRPCRedeemBatchInputSerializer, CheckinRPCRedeemInputSerializer,
+    MiniCheckinListSerializer,
 )
 from pretix.api.serializers.item import QuestionSerializer
 from pretix.api.serializers.order import (
-    CheckinListOrderPositionSerializer, CheckinSerializer,
-    FailedCheckinSerializer,
+    CheckinListOrderPositionSerializer, CheckinListSyncPositionSerializer,
+    CheckinSerializer, FailedCheckinSerializer,
 )
 from pretix.api.views import RichOrderingFilter
 from pretix.api.views.order import OrderPositionFilter
@@ -72,9 +77,20 @@ from pretix.base.services.checkin import (
     CheckInError, RequiredMediaExchangeError, RequiredQuestionsError, SQLLogic,
     perform_checkin,
 )
+from pretix.base.services.checkincounters import checkin_list_counts
+from pretix.base.services.checkinindex import (
+    checkin_index_enabled, index_positions, lookup_positions, record_lookup,
+)
+from pretix.base.services.checkinsnapshot import (
+    SYNC_SETTLE_TIME, encode_sync_cursor, filter_sync_cursor,
+    get_checkin_snapshot, sync_positions_queryset, sync_resume_cursor,
+)
 from pretix.base.services.media import perform_media_exchange
 from pretix.base.signals import checkin_annulled
 from pretix.helpers import OF_SELF
+from pretix.helpers.http import ChunkBasedFileResponse
+
+logger = logging.getLogger(__name__)
 
 with scopes_disabled():
     class CheckinListFilter(FilterSet):
@@ -240,47 +256,70 @@ class CheckinListViewSet(viewsets.ModelViewSet):
     def status(self, *args, **kwargs):
         with language(self.request.event.settings.locale):
             clist = self.get_object()
-            cqs = clist.positions.annotate(
-                checkedin=Exists(Checkin.objects.filter(list_id=clist.pk, position=OuterRef('pk'), type=Checkin.TYPE_ENTRY))
-            ).filter(
-                checkedin=True,
-            )
-            pqs = clist.positions
+
+            if not clist.all_products:
+                items = clist.limit_products
+            else:
+                items = clist.event.items
+            items = list(items.order_by('category__position', 'position', 'pk').prefetch_related('variations'))
+
+            counts = checkin_list_counts(clist, expected=[
+                (item.pk, var.pk)
+                for item in items for var in item.variations.all()
+            ] + [
+                (item.pk, None)
+                for item in items if not item.variations.all()
+            ])
 
             ev = clist.subevent or clist.event
             response = {
                 'event': {
                     'name': str(ev.name),
                 },
-                'checkin_count': cqs.count(),
-                'position_count': pqs.count(),
-                'inside_count': clist.inside_count,
             }
 
-            op_by_item = {
-                p['item']: p['cnt']
-                for p in pqs.order_by().values('item').annotate(cnt=Count('id'))
-            }
-            op_by_variation = {
-                p['variation']: p['cnt']
-                for p in pqs.order_by().values('variation').annotate(cnt=Count('id'))
-            }
-            c_by_item = {
-                p['item']: p['cnt']
-                for p in cqs.order_by().values('item').annotate(cnt=Count('id'))
-            }
-            c_by_variation = {
-                p['variation']: p['cnt']
-                for p in cqs.order_by().values('variation').annotate(cnt=Count('id'))
-            }
+            if counts is None:
+                cqs = clist.positions.annotate(
+                    checkedin=Exists(Checkin.objects.filter(list_id=clist.pk, position=OuterRef('pk'), type=Checkin.TYPE_ENTRY))
+                ).filter(
+                    checkedin=True,
+                )
+                pqs = clist.positions
 
-            if not clist.all_products:
-                items = clist.limit_products
+                response['checkin_count'] = cqs.count()
+                response['position_count'] = pqs.count()
+                response['inside_count'] = clist.inside_count
+
+                op_by_item = {
+                    p['item']: p['cnt']
+                    for p in pqs.order_by().values('item').annotate(cnt=Count('id'))
+                }
+                op_by_variation = {
+                    p['variation']: p['cnt']
+                    for p in pqs.order_by().values('variation').annotate(cnt=Count('id'))
+                }
+                c_by_item = {
+                    p['item']: p['cnt']
+                    for p in cqs.order_by().values('item').annotate(cnt=Count('id'))
+                }
+                c_by_variation = {
+                    p['variation']: p['cnt']
+                    for p in cqs.order_by().values('variation').annotate(cnt=Count('id'))
+                }
             else:
-                items = clist.event.items
+                op_by_item, op_by_variation = Counter(), Counter()
+                c_by_item, c_by_variation = Counter(), Counter()
+                for (item_id, variation_id), (position_count, checkin_count, inside_count) in counts.items():
+                    op_by_item[item_id] += position_count
+                    op_by_variation[variation_id] += position_count
+                    c_by_item[item_id] += checkin_count
+                    c_by_variation[variation_id] += checkin_count
+                response['checkin_count'] = sum(c[1] for c in counts.values())
+                response['position_count'] = sum(c[0] for c in counts.values())
+                response['inside_count'] = sum(c[2] for c in counts.values())
 
             response['items'] = []
-            for item in items.order_by('category__position', 'position', 'pk').prefetch_related('variations'):
+            for item in items:
                 i = {
                     'id': item.pk,
                     'name': str(item),
@@ -298,7 +337,25 @@ class CheckinListViewSet(viewsets.ModelViewSet):
                     })
                 response['items'].append(i)
 
-            return Response(response)
+            # Devices poll this endpoint all the time, so we allow them to skip the download if nothing changed
+            etag = '"{}"'.format(hashlib.sha1(json.dumps(response, sort_keys=True).encode()).hexdigest())
+            if etag in [t.strip() for t in self.request.headers.get('If-None-Match', '').split(',')]:
+                return Response(status=304, headers={'ETag': etag})
+            return Response(response, headers={'ETag': etag})
+
+    @action(detail=True, methods=['GET'])
+    def snapshot(self, *args, **kwargs):
+        if 'event.orders:read' not in self.request.eventpermset:
+            raise PermissionDenied('You do not have permission to download all positions of this list.')
+
+        clist = self.get_object()
+        cf = get_checkin_snapshot(clist)
+        if not cf or not cf.file:
+            return Response({'status': 'running'}, status=status.HTTP_409_CONFLICT)
+
+        resp = ChunkBasedFileResponse(cf.file.file, content_type=cf.type)
+        resp['Content-Disposition'] = 'attachment; filename="{}"'.format(cf.filename)
+        return resp
 
 
 with scopes_disabled():
@@ -456,10 +513,67 @@ def _checkin_list_position_queryset(checkinlists, ignore_status=False, ignore_pr
     return qs
 
 
+def _redeem_candidates_from_index(queryset, checkinlists, raw_barcode):
+    """
+    Returns the same positions as searching ``queryset`` for ``raw_barcode``, but loads them by the position IDs
+    known to the check-in index. Returns ``None`` if the index is not ready for all events, does not know the barcode
+    or is outdated.
+    """
+    position_ids = lookup_positions({cl.event_id for cl in checkinlists}, raw_barcode)
+    if position_ids is None:
+        record_lookup('not_ready')
+        return None
+    if not position_ids:
+        record_lookup('miss')
+        return None
+
+    q = Q(pk__in=position_ids)
+    if any(cl.addon_match for cl in checkinlists):
+        q |= Q(addon_to_id__in=position_ids)
+    candidates = list(queryset.filter(q))
+
+    # The index might be outdated, e.g. if the secret of a ticket has been changed
+    matches = {op.pk for op in candidates if op.secret == raw_barcode}
+    if not matches:
+        record_lookup('outdated')
+        return None
+    record_lookup('hit')
+    return [op for op in candidates if op.pk in matches or op.addon_to_id in matches]
+
+
+def _redeem_batch_candidates(checkinlists, secrets, pdf_data):
+    """
+    Searches the positions for many scanned secrets at once. Returns a dictionary mapping every secret to the same
+    positions, in the same order, that ``_redeem_process`` would find for it on its own.
+    """
+    queryset = _checkin_list_position_queryset(checkinlists, pdf_data=pdf_data, ignore_status=True, ignore_products=True).order_by(
+        F('addon_to').asc(nulls_first=True)
+    )
+    addon_match = any(cl.addon_match for cl in checkinlists)
+    secrets = sorted(secrets)
+
+    candidates = defaultdict(list)
+    for i in range(0, len(secrets), 500):
+        chunk = secrets[i:i + 500]
+        q = Q(secret__in=chunk)
+        if addon_match:
+            q |= Q(addon_to__secret__in=chunk)
+        for op in queryset.filter(q):
+            if op.secret in chunk:
+                candidates[op.secret].append(op)
+            if addon_match and op.addon_to_id and op.addon_to.secret in chunk:
+                candidates[op.addon_to.secret].append(op)
+    return candidates
+
+
 def _redeem_process(*, checkinlists, raw_barcode, answers_data, datetime, force, checkin_type, ignore_unpaid, nonce,
                     untrusted_input, user, auth, expand, pdf_data, request, questions_supported, canceled_supported,
                     source_type='barcode', legacy_url_support=False, simulate=False, gate=None, use_order_locale=False,
-                    exchange_medium_type=None, exchange_medium_identifier=None):
+                    exchange_medium_type=None, exchange_medium_identifier=None, candidates=None):
+    """
+    Redeems a scanned barcode on one of the given check-in lists. If ``candidates`` is given, it needs to contain the
+    result of ``_redeem_batch_candidates`` for the barcode and no further search is performed.
+    """
     if not checkinlists:
         raise ValidationError('No check-in list passed.')
 
@@ -513,7 +627,19 @@ def _redeem_process(*, checkinlists, raw_barcode, answers_data, datetime, force,
     if raw_barcode.isnumeric() and not untrusted_input and legacy_url_support:
         q |= Q(pk=raw_barcode)
 
-    op_candidates = list(queryset.filter(q))
+    # The index only knows secrets, so it can not be used if the barcode could also be a position ID
+    use_index = candidates is None and checkin_index_enabled() and not (
+        raw_barcode.isnumeric() and not untrusted_input and legacy_url_support
+    )
+    op_candidates = None
+    if candidates is not None:
+        op_candidates = list(candidates.get(raw_barcode, ()))
+    elif use_index:
+        op_candidates = _redeem_candidates_from_index(queryset, checkinlists, raw_barcode)
+    if op_candidates is None:
+        op_candidates = list(queryset.filter(q))
+        if use_index:
+            index_positions([op for op in op_candidates if op.secret == raw_barcode])
     if not op_candidates and '+' in raw_barcode and legacy_url_support:
         # In application/x-www-form-urlencoded, you can encodes space ' ' with '+' instead of '%20'.
         # `id`, however, is part of a path where this technically is not allowed. Old versions of our
@@ -961,6 +1087,9 @@ class CheckinListPositionViewSet(viewsets.ReadOnlyModelViewSet):
     permission = AnyPermissionOf('event.orders:read', 'event.orders:checkin')
     write_permission = AnyPermissionOf('event.orders:write', 'event.orders:checkin')
 
+    SYNC_PAGE_SIZE = 1000
+    SYNC_MAX_PAGE_SIZE = 5000
+
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
         ctx['event'] = self.request.event
@@ -996,6 +1125,54 @@ class CheckinListPositionViewSet(viewsets.ReadOnlyModelViewSet):
 
         return qs
 
+    @action(detail=False, methods=['GET'])
+    def sync(self, *args, **kwargs):
+        """
+        Delta sync feed for offline scanning. Positions are ordered by the modification time of their order and
+        their ID and paginated by a keyset cursor instead of an offset, so every page is equally cheap to compute
+        and an interrupted sync can be resumed with the last cursor the device received. Unlike the regular list,
+        the feed also contains positions of canceled or unpaid orders, so devices learn about tickets that became
+        invalid. Once there are no more pages, the cursor is moved back by ``SYNC_OVERLAP`` to pick up changes from
+        transactions that committed late, so devices will receive some positions more than once.
+        """
+        if 'event.orders:read' not in self.request.eventpermset:
+            raise PermissionDenied('You do not have permission to sync all positions of this list.')
+
+        try:
+            page_size = int(self.request.query_params.get('page_size', self.SYNC_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError('page_size needs to be an integer.')
+        page_size = max(1, min(page_size, self.SYNC_MAX_PAGE_SIZE))
+
+        clist = self.checkinlist
+        qs = sync_positions_queryset(clist).filter(order__last_modified__lt=now() - SYNC_SETTLE_TIME)
+        cursor = self.request.query_params.get('cursor')
+        if cursor:
+            try:
+                qs = filter_sync_cursor(qs, cursor)
+            except ValueError as e:
+                raise ValidationError(str(e))
+
+        positions = list(
+            qs.select_related(
+                'order', 'order__invoice_address', 'item', 'variation', 'addon_to',
+            ).prefetch_related(
+                Prefetch('checkins', queryset=Checkin.objects.filter(list=clist).only('position_id', 'type', 'datetime')),
+            ).order_by('order__last_modified', 'pk')[:page_size + 1]
+        )
+        has_more = len(positions) > page_size
+        positions = positions[:page_size]
+        if positions and has_more:
+            cursor = encode_sync_cursor(positions[-1].order.last_modified, positions[-1].pk)
+        elif positions:
+            cursor = sync_resume_cursor(positions[-1].order.last_modified)
+
+        return Response({
+            'results': CheckinListSyncPositionSerializer(positions, many=True, context=self.get_serializer_context()).data,
+            'cursor': cursor,
+            'has_more': has_more,
+        })
+
     @action(detail=False, methods=['POST'], url_name='redeem', url_path='(?P<pk>.*)/redeem')
     def redeem(self, *args, **kwargs):
         force = bool(self.request.data.get('force', False))
@@ -1075,6 +1252,82 @@ class CheckinRPCRedeemView(views.APIView):
         )
 
 
+class CheckinRPCRedeemBatchView(views.APIView):
+    # Scans are committed in chunks, so a large upload does not hold its locks for the whole request
+    TRANSACTION_SIZE = 100
+
+    def post(self, request, *args, **kwargs):
+        if isinstance(self.request.auth, (TeamAPIToken, Device)):
+            events = self.request.auth.get_events_with_permission(('event.orders:write', 'event.orders:checkin'))
+        elif self.request.user.is_authenticated:
+            events = self.request.user.get_events_with_permission(('event.orders:write', 'event.orders:checkin'), self.request).filter(
+                organizer=self.request.organizer
+            )
+        else:
+            raise ValueError("unknown authentication method")
+
+        s = CheckinRPCRedeemBatchInputSerializer(data=request.data, context={'events': events})
+        s.is_valid(raise_exception=True)
+        checkinlists = s.validated_data['lists']
+        scans = s.validated_data['scans']
+        pdf_data = self.request.query_params.get('pdf_data', 'false').lower() == 'true'
+        if not checkinlists:
+            raise ValidationError('No check-in list passed.')
+
+        candidates = _redeem_batch_candidates(checkinlists, {scan['secret'] for scan in scans}, pdf_data)
+
+        # Scans are processed in the order they happened, e.g. an offline exit needs to be processed before the
+        # following entry of the same ticket. Scans with the same nonce are deduplicated by perform_checkin.
+        request_time = now()
+        scan_order = sorted(range(len(scans)), key=lambda i: scans[i].get('datetime') or request_time)
+        results = [None] * len(scans)
+        for chunk_start in range(0, len(scan_order), self.TRANSACTION_SIZE):
+            with transaction.atomic():
+                for i in scan_order[chunk_start:chunk_start + self.TRANSACTION_SIZE]:
+                    results[i] = self._redeem_scan(scans[i], s.validated_data, checkinlists, candidates, pdf_data,
+                                                   request_time)
+
+        return Response({'results': results})
+
+    def _redeem_scan(self, scan, data, checkinlists, candidates, pdf_data, request_time):
+        # Every scan gets its own savepoint, so an unexpected error only affects this scan and not the others in
+        # the same chunk
+        try:
+            with transaction.atomic():
+                response = _redeem_process(
+                    checkinlists=checkinlists,
+                    raw_barcode=scan['secret'],
+                    source_type=scan['source_type'],
+                    answers_data=scan.get('answers'),
+                    datetime=scan.get('datetime') or request_time,
+                    force=scan['force'],
+                    checkin_type=scan['type'],
+                    ignore_unpaid=scan['ignore_unpaid'],
+                    nonce=scan.get('nonce'),
+                    untrusted_input=True,
+                    user=self.request.user,
+                    auth=self.request.auth,
+                    expand=self.request.query_params.getlist('expand'),
+                    pdf_data=pdf_data,
+                    questions_supported=data['questions_supported'],
+                    use_order_locale=data['use_order_locale'],
+                    canceled_supported=True,
+                    request=self.request,  # this is not clean, but we need it in the serializers for URL generation
+                    legacy_url_support=False,
+                    candidates=candidates,
+                )
+        except Exception:
+            logger.exception('Could not process scan in batch redeem')
+            return {
+                'status': 'error',
+                'reason': Checkin.REASON_ERROR,
+                'reason_explanation': None,
+                'require_attention': False,
+                'checkin_texts': [],
+            }
+        return response.data
+
+
 class CheckinRPCSearchView(ListAPIView):
     serializer_class = CheckinListOrderPositionSerializer
     queryset = OrderPosition.all.none()
@@ -27,7 +27,9 @@ from decimal import Decimal
 from zoneinfo import ZoneInfo
 
 import django_filters
+from celery.result import AsyncResult
 from django.conf import settings
+from django.core.cache import cache
 from django.db import IntegrityError, transaction
 from django.db.models import (
     Exists, F, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects,
@@ -49,23 +51,25 @@ from rest_framework.exceptions import (
 from rest_framework.mixins import CreateModelMixin
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.serializers import as_serializer_error
 
 from pretix.api.filters import MultipleCharFilter
 from pretix.api.models import OAuthAccessToken
 from pretix.api.pagination import TotalOrderingFilter
 from pretix.api.serializers.order import (
-    BlockedTicketSecretSerializer, InvoiceSerializer, OrderCreateSerializer,
-    OrderPaymentCreateSerializer, OrderPaymentSerializer,
-    OrderPositionSerializer, OrderRefundCreateSerializer,
-    OrderRefundSerializer, OrderSerializer, OrganizerOrderPositionSerializer,
-    OrganizerTransactionSerializer, PriceCalcSerializer, PrintLogSerializer,
-    RevokedTicketSecretSerializer, SimulatedOrderSerializer,
-    TransactionSerializer,
+    BlockedTicketSecretSerializer, InvoiceSerializer, OrderCreateBatch,
+    OrderCreateSerializer, OrderPaymentCreateSerializer,
+    OrderPaymentSerializer, OrderPositionSerializer,
+    OrderRefundCreateSerializer, OrderRefundSerializer, OrderSerializer,
+    OrganizerOrderPositionSerializer, OrganizerTransactionSerializer,
+    PriceCalcSerializer, PrintLogSerializer, RevokedTicketSecretSerializer,
+    SimulatedOrderSerializer, TransactionSerializer,
 )
 from pretix.api.serializers.orderchange import (
-    BlockNameSerializer, OrderChangeOperationSerializer,
-    OrderFeeChangeSerializer, OrderFeeCreateForExistingOrderSerializer,
-    OrderPositionChangeSerializer,
+    BlockNameSerializer, OrderBulkChangeSerializer,
+    OrderChangeOperationSerializer, OrderFeeChangeSerializer,
+    OrderFeeCreateForExistingOrderSerializer, OrderPositionChangeSerializer,
     OrderPositionCreateForExistingOrderSerializer,
     OrderPositionInfoPatchSerializer,
 )
@@ -87,17 +91,21 @@ from pretix.base.payment import PaymentException
 from pretix.base.pdf import get_images
 from pretix.base.secrets import assign_ticket_secret
 from pretix.base.services import tickets
+from pretix.base.services.bulkchange import bulk_change_orders
+from pretix.base.services.checkincounters import track_checkin_counters
 from pretix.base.services.invoices import (
     generate_cancellation, generate_invoice, invoice_pdf, invoice_qualified,
     regenerate_invoice, transmit_invoice,
 )
+from pretix.base.services.locking import lock_objects
 from pretix.base.services.orders import (
     OrderChangeManager, OrderError, _order_placed_email,
     _order_placed_email_attendee, approve_order, cancel_order, deny_order,
     extend_order, mark_order_expired, mark_order_refunded, reactivate_order,
 )
 from pretix.base.services.pricing import get_price
-from pretix.base.services.tickets import generate
+from pretix.base.services.quotashards import reclaim_quota_shards
+from pretix.base.services.tickets import generate, get_cached_ticket
 from pretix.base.signals import (
     order_modified, order_paid, order_placed, register_ticket_outputs,
 )
@@ -340,6 +348,8 @@ class OrganizerOrderViewSet(OrderViewSetMixin, viewsets.ReadOnlyModelViewSet):
 class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
     permission = 'event.orders:read'
     write_permission = 'event.orders:write'
+    # Results of bulk changes can be fetched for as long as Celery keeps them
+    BULK_CHANGE_STATUS_TIMEOUT = 3600 * 24
 
     def get_serializer_context(self):
         ctx = super().get_serializer_context()
@@ -370,10 +380,10 @@ class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
         if order.status == Order.STATUS_PENDING and not (order.valid_if_pending or request.event.settings.ticket_download_pending):
             raise PermissionDenied("Downloads are not available for pending orders.")
 
-        ct = CachedCombinedTicket.objects.filter(
-            order=order, provider=provider.identifier, file__isnull=False
-        ).last()
-        if not ct or not ct.file:
+        ct = get_cached_ticket(CachedCombinedTicket.objects.filter(
+            order=order, provider=provider.identifier
+        ))
+        if not ct:
             generate.apply_async(args=('order', order.pk, provider.identifier))
             raise RetryException()
         else:
@@ -553,8 +563,9 @@ class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        order.status = Order.STATUS_PENDING
-        order.save(update_fields=['status'])
+        with transaction.atomic(), track_checkin_counters(order):
+            order.status = Order.STATUS_PENDING
+            order.save(update_fields=['status'])
         order.log_action(
             'pretix.event.order.unpaid',
             user=request.user if request.user.is_authenticated else None,
@@ -730,6 +741,154 @@ class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
                 auth=request.auth,
             )
 
+        serializer = self._order_placed(request, order, send_mail, serializer.context)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @action(detail=False, methods=['POST'])
+    def bulk_change(self, request, *args, **kwargs):
+        serializer = OrderBulkChangeSerializer(data=request.data, context={'event': request.event})
+        serializer.is_valid(raise_exception=True)
+        d = serializer.validated_data
+
+        async_result = bulk_change_orders.apply_async(kwargs={
+            'event': request.event.pk,
+            'operations': d['operations'],
+            'orders': d.get('orders'),
+            'user': request.user.pk if request.user.is_authenticated else None,
+            'notify': d['send_email'],
+            'reissue_invoice': d['reissue_invoice'],
+            'dry_run': d['dry_run'],
+        })
+        if async_result.ready():
+            # Celery runs in eager mode
+            return self._bulk_change_response(async_result)
+        # Task results are not bound to an event, so we remember which tasks may be looked up through this event
+        cache.set(self._bulk_change_cache_key(async_result.id), True, self.BULK_CHANGE_STATUS_TIMEOUT)
+        return Response({
+            'id': async_result.id,
+            'status': reverse('api-v1:order-bulk_change_status', kwargs={
+                'organizer': request.organizer.slug,
+                'event': request.event.slug,
+                'asyncid': async_result.id,
+            }, request=request),
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['GET'], url_name='bulk_change_status', url_path='bulk_change/(?P<asyncid>[^/]+)')
+    def bulk_change_status(self, request, asyncid, **kwargs):
+        if not cache.get(self._bulk_change_cache_key(asyncid)):
+            raise NotFound('Unknown bulk change.')
+        return self._bulk_change_response(AsyncResult(asyncid))
+
+    def _bulk_change_cache_key(self, asyncid):
+        return f'api_order_bulk_change_{self.request.event.pk}_{asyncid}'
+
+    def _bulk_change_response(self, res):
+        if res.failed():
+            return Response(
+                {'status': 'failed', 'message': 'Internal error'},
+                status=status.HTTP_410_GONE
+            )
+        if res.successful():
+            return Response({'status': 'ok', **res.result}, status=status.HTTP_200_OK)
+        return Response(
+            {
+                'status': 'running' if res.state in ('PROGRESS', 'STARTED') else 'waiting',
+                'percentage': res.result.get('value', None) if isinstance(res.result, dict) else None,
+            },
+            status=status.HTTP_409_CONFLICT
+        )
+
+    @action(detail=False, methods=['POST'])
+    def bulk_create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):  # noqa
+            return Response({"error": "Please supply a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > 500:
+            return Response({"error": "Please do not submit more than 500 orders at once."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        batch = OrderCreateBatch()
+        ctx = self.get_serializer_context()
+        ctx['batch'] = batch
+        serializers = []
+        for d in request.data:
+            if isinstance(d, dict) and 'send_mail' in d and 'send_email' not in d:
+                d['send_email'] = d['send_mail']
+            serializers.append(OrderCreateSerializer(data=d, context=ctx))
+
+        results = [{} for oserializer in serializers]
+        full_lock_required = False
+        objects_to_lock = set()
+        quotas = set()
+        for i, oserializer in enumerate(serializers):
+            if not oserializer.is_valid():
+                results[i] = {
+                    'success': False,
+                    'data': None,
+                    'errors': oserializer.errors,
+                }
+                continue
+            o_full_lock_required, o_objects, o_quotas = oserializer.get_lock_objects()
+            full_lock_required = full_lock_required or o_full_lock_required
+            objects_to_lock |= o_objects
+            quotas |= o_quotas
+
+        created = []
+        with transaction.atomic():
+            if full_lock_required:
+                # We lock the entire event in this case since we don't want to deal with fine-granular locking
+                # in the case of seating distance enforcement
+                lock_objects([request.event])
+                reclaim_quota_shards(quotas)
+            else:
+                lock_objects(list(objects_to_lock), shared_lock_objects=[request.event])
+                # Capacity pre-allocated to quota shards is free to use for us, see quotashards.py
+                reclaim_quota_shards([q for q in objects_to_lock if isinstance(q, Quota)])
+            batch.compute(quotas)
+
+            for i, oserializer in enumerate(serializers):
+                if results[i]:
+                    continue
+
+                try:
+                    # Use a savepoint per order, so a failing order does not take the rest of the batch with it
+                    with transaction.atomic():
+                        try:
+                            self.perform_create(oserializer)
+                        except TaxRule.SaleNotAllowed:
+                            raise ValidationError(_('One of the selected products is not available in the selected country.'))
+                        oserializer.instance.log_action(
+                            'pretix.event.order.placed',
+                            user=request.user if request.user.is_authenticated else None,
+                            auth=request.auth,
+                        )
+                except ValidationError as e:
+                    results[i] = {
+                        'success': False,
+                        'data': None,
+                        'errors': as_serializer_error(e),
+                    }
+                except Exception:
+                    logger.exception('Could not create order in bulk_create')
+                    results[i] = {
+                        'success': False,
+                        'data': None,
+                        'errors': {'non_field_errors': ['An internal error occurred while creating this order.']},
+                    }
+                else:
+                    batch.quota_usage = oserializer._quota_usage
+                    created.append(i)
+
+        for i in created:
+            oserializer = serializers[i]
+            results[i] = {
+                'success': True,
+                'data': self._order_placed(request, oserializer.instance, oserializer._send_mail, ctx).data,
+                'errors': None,
+            }
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    def _order_placed(self, request, order, send_mail, context):
         with language(order.locale, self.request.event.settings.region):
             payment = order.payments.last()
             # OrderCreateSerializer creates at most one payment
@@ -773,7 +932,7 @@ class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
 
             # Refresh serializer only after running signals
             prefetch_related_objects([order], self._positions_prefetch(request))
-            serializer = OrderSerializer(order, context=serializer.context)
+            serializer = OrderSerializer(order, context=context)
 
             if send_mail:
                 free_flow = (
@@ -817,8 +976,7 @@ class EventOrderViewSet(OrderViewSetMixin, viewsets.ModelViewSet):
                             if p.addon_to_id is None and p.attendee_email and p.attendee_email != order.email:
                                 payment._send_paid_mail_attendee(p, None)
 
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        return serializer
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.get('partial', False)
@@ -1397,10 +1555,10 @@ class EventOrderPositionViewSet(OrderPositionViewSetMixin, viewsets.ModelViewSet
         if not pos.generate_ticket:
             raise PermissionDenied("Downloads are not enabled for this product.")
 
-        ct = CachedTicket.objects.filter(
-            order_position=pos, provider=provider.identifier, file__isnull=False
-        ).last()
-        if not ct or not ct.file:
+        ct = get_cached_ticket(CachedTicket.objects.filter(
+            order_position=pos, provider=provider.identifier
+        ))
+        if not ct:
             generate.apply_async(args=('orderposition', pos.pk, provider.identifier))
             raise RetryException()
         else:
@@ -1768,13 +1926,14 @@ class PaymentViewSet(CreateModelMixin, viewsets.ReadOnlyModelViewSet):
                                         user=self.request.user if self.request.user.is_authenticated else None,
                                         auth=self.request.auth)
                 else:
-                    payment.order.status = Order.STATUS_PENDING
-                    payment.order.set_expires(
-                        now(),
-                        payment.order.event.subevents.filter(
-                            id__in=payment.order.positions.values_list('subevent_id', flat=True))
-                    )
-                    payment.order.save(update_fields=['status', 'expires'])
+                    with transaction.atomic(), track_checkin_counters(payment.order):
+                        payment.order.status = Order.STATUS_PENDING
+                        payment.order.set_expires(
+                            now(),
+                            payment.order.event.subevents.filter(
+                                id__in=payment.order.positions.values_list('subevent_id', flat=True))
+                        )
+                        payment.order.save(update_fields=['status', 'expires'])
             return Response(OrderRefundSerializer(r).data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['POST'])
@@ -1841,13 +2000,14 @@ class RefundViewSet(CreateModelMixin, viewsets.ReadOnlyModelViewSet):
             mark_order_refunded(refund.order, user=self.request.user if self.request.user.is_authenticated else None,
                                 auth=self.request.auth)
         elif not (refund.order.status == Order.STATUS_PAID and refund.order.pending_sum <= 0):
-            refund.order.status = Order.STATUS_PENDING
-            refund.order.set_expires(
-                now(),
-                refund.order.event.subevents.filter(
-                    id__in=refund.order.positions.values_list('subevent_id', flat=True))
-            )
-            refund.order.save(update_fields=['status', 'expires'])
+            with transaction.atomic(), track_checkin_counters(refund.order):
+                refund.order.status = Order.STATUS_PENDING
+                refund.order.set_expires(
+                    now(),
+                    refund.order.event.subevents.filter(
+                        id__in=refund.order.positions.values_list('subevent_id', flat=True))
+                )
+                refund.order.save(update_fields=['status', 'expires'])
         return self.retrieve(request, [], **kwargs)
 
     @action(detail=True, methods=['POST'])
@@ -1908,13 +2068,14 @@ class RefundViewSet(CreateModelMixin, viewsets.ReadOnlyModelViewSet):
                     raise ValidationError(str(e))
             elif mark_pending:
                 if r.order.status == Order.STATUS_PAID and r.order.pending_sum > 0:
-                    r.order.status = Order.STATUS_PENDING
-                    r.order.set_expires(
-                        now(),
-                        r.order.event.subevents.filter(
-                            id__in=r.order.positions.values_list('subevent_id', flat=True))
-                    )
-                    r.order.save(update_fields=['status', 'expires'])
+                    with transaction.atomic(), track_checkin_counters(r.order):
+                        r.order.status = Order.STATUS_PENDING
+                        r.order.set_expires(
+                            now(),
+                            r.order.event.subevents.filter(
+                                id__in=r.order.positions.values_list('subevent_id', flat=True))
+                        )
+                        r.order.save(update_fields=['status', 'expires'])
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
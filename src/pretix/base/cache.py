@@ -65,6 +65,9 @@ class NamespacedCache:
     def set(self, key: str, value: any, timeout: int=300):
         return self.cache.set(self._prefix_key(key), value, timeout)
 
+    def add(self, key: str, value: any, timeout: int=300) -> bool:
+        return self.cache.add(self._prefix_key(key), value, timeout)
+
     def get(self, key: str) -> any:
         return self.cache.get(self._prefix_key(key, known_prefix=self._last_prefix))
 
@@ -201,10 +201,13 @@ class BaseReportlabInvoiceRenderer(BaseInvoiceRenderer):
     canvas_class = Canvas
     font_regular = 'OpenSans'
     font_bold = 'OpenSansBd'
+    _initialized = False
 
     def _init(self):
         """
         Initialize the renderer. By default, this registers fonts and sets ``self.stylesheet``.
+        This is only called once per renderer instance, so the result must only depend on the
+        event, not on the invoice being rendered.
         """
         self._register_fonts()
         self.stylesheet = self._get_stylesheet()
@@ -308,7 +311,9 @@ class BaseReportlabInvoiceRenderer(BaseInvoiceRenderer):
         """
         Build a PDF document in a given file handle
         """
-        self._init()
+        if not self._initialized:
+            self._init()
+            self._initialized = True
         doc = self.doc_template_class(fhandle, pagesize=self.pagesize,
                                       leftMargin=self.left_margin, rightMargin=self.right_margin,
                                       topMargin=self.top_margin, bottomMargin=self.bottom_margin)
@@ -0,0 +1,113 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import json
+import platform
+import random
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix import __version__
+from pretix.testutils.benchmark.data import delete_data, generate_data
+from pretix.testutils.benchmark.runner import run_scenario
+from pretix.testutils.benchmark.scenarios import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic organizer and measure the performance of quota computation, cart creation, order "
+        "creation and check-in. Unless --keep-data is given, all generated data is deleted after the run. Do not run "
+        "this against a production database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1)
+        parser.add_argument('--subevents', type=int, default=0, help='Number of dates per event')
+        parser.add_argument('--items', type=int, default=5, help='Number of products per event')
+        parser.add_argument('--variations', type=int, default=0, help='Number of variations per product')
+        parser.add_argument('--quotas', type=int, default=1, help='Number of quotas per date')
+        parser.add_argument('--orders', type=int, default=1000, help='Number of existing orders per event')
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS.keys()), default=sorted(SCENARIOS.keys()))
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', type=str, help='Write JSON results to this file instead of stdout')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Keep the generated data instead of deleting it after the run')
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('At least one iteration is required.')
+        if options['events'] < 1 or options['items'] < 1 or options['quotas'] < 1:
+            raise CommandError('At least one event, product and quota is required.')
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
+        results = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'redis': settings.HAS_REDIS,
+            'started': now().isoformat(),
+            'parameters': {
+                k: options[k] for k in ('events', 'subevents', 'items', 'variations', 'quotas', 'orders',
+                                        'iterations', 'seed')
+            },
+            'scenarios': {},
+        }
+
+        self.stderr.write('Generating data…')
+        data = generate_data(
+            events=options['events'],
+            subevents=options['subevents'],
+            items=options['items'],
+            variations=options['variations'],
+            quotas=options['quotas'],
+            orders=options['orders'],
+        )
+        try:
+            for name in options['scenarios']:
+                scenario = SCENARIOS[name](data)
+                skip_reason = scenario.skip_reason()
+                if skip_reason:
+                    self.stderr.write(f'Skipping {name}: {skip_reason}')
+                    results['scenarios'][name] = {'skipped': skip_reason}
+                    continue
+                self.stderr.write(f'Running {name}…')
+                results['scenarios'][name] = run_scenario(scenario, options['iterations'])
+        finally:
+            if options['keep_data']:
+                self.stderr.write(f'Data has been kept in organizer {data.organizer.slug}.')
+            else:
+                self.stderr.write('Deleting data…')
+                delete_data(data)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            sys.stdout.write(output + '\n')
@@ -0,0 +1,88 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.db.models import Max
+from django.db.models.functions import Cast
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Invoice, InvoiceNumberCounter, Organizer
+
+
+class Command(BaseCommand):
+    help = "Check consecutive invoice number counters for consistency with existing invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Move counters that have fallen behind the existing invoices forward and create missing counters',
+        )
+
+    @scopes_disabled()
+    def handle(self, *args, **options):
+        highest_numbers = {
+            (r['organizer_id'], r['prefix']): r['max']
+            for r in Invoice.objects.filter(
+                invoice_no__regex=r'^[0-9]+$',
+            ).annotate(
+                numeric_number=Cast('invoice_no', models.BigIntegerField())
+            ).order_by().values('organizer_id', 'prefix').annotate(
+                max=Max('numeric_number')
+            )
+        }
+        errors = 0
+        counters = set()
+
+        for counter in InvoiceNumberCounter.objects.select_related('organizer').order_by('organizer_id', 'prefix'):
+            counters.add((counter.organizer_id, counter.prefix))
+            highest = highest_numbers.get((counter.organizer_id, counter.prefix), 0)
+            if counter.value < highest:
+                errors += 1
+                print(f"Counter behind invoices for organizer {counter.organizer.slug}, prefix {counter.prefix!r}: "
+                      f"counter={counter.value}, highest invoice number={highest}")
+                if options['fix']:
+                    InvoiceNumberCounter.resync(counter.organizer_id, counter.prefix)
+            elif counter.value > highest:
+                print(f"Unused numbers for organizer {counter.organizer.slug}, prefix {counter.prefix!r}: "
+                      f"counter={counter.value}, highest invoice number={highest}")
+
+        # Counters are usually created by the migration introducing them or on first use, so invoices without a
+        # counter mean that the backfill failed or has been skipped
+        missing = sorted(
+            set(Invoice.objects.order_by().values_list('organizer_id', 'prefix').distinct()) - counters
+        )
+        slugs = dict(Organizer.objects.filter(pk__in={o for o, p in missing}).values_list('pk', 'slug'))
+        for organizer_id, prefix in missing:
+            errors += 1
+            print(f"Missing counter for organizer {slugs[organizer_id]}, prefix {prefix!r}: "
+                  f"highest invoice number={highest_numbers.get((organizer_id, prefix), 0)}")
+            if options['fix']:
+                InvoiceNumberCounter.objects.get_or_create(
+                    organizer_id=organizer_id,
+                    prefix=prefix,
+                    defaults={'value': InvoiceNumberCounter.highest_number(organizer_id, prefix)},
+                )
+
+        if errors and not options['fix']:
+            self.stderr.write(self.style.ERROR(f'Check completed, {errors} counters need to be fixed, run with --fix.'))
+        else:
+            self.stderr.write(self.style.SUCCESS('Check completed.'))
@@ -65,6 +65,21 @@ def _float_to_go_string(d):
         return repr(float(d))
 
 
+def get_redis_pipeline():
+    """
+    Returns a Redis pipeline that can be passed to ``inc()`` and ``observe()`` to send multiple metric updates in a
+    single round trip, or ``None`` if Redis is not configured. The caller is responsible for calling
+    ``execute_redis_pipeline()`` afterwards.
+    """
+    if settings.HAS_REDIS:
+        return redis.pipeline()
+
+
+def execute_redis_pipeline(pipeline):
+    if settings.HAS_REDIS and pipeline is not None:
+        return pipeline.execute()
+
+
 class Metric(object):
     """
     Base Metrics Object
@@ -110,7 +125,7 @@ class Metric(object):
         Increments given key in Redis.
         """
         if settings.HAS_REDIS:
-            if not pipeline:
+            if pipeline is None:
                 pipeline = redis
             pipeline.hincrbyfloat(REDIS_KEY, key, amount)
 
@@ -119,7 +134,7 @@ class Metric(object):
         Sets given key in Redis.
         """
         if settings.HAS_REDIS:
-            if not pipeline:
+            if pipeline is None:
                 pipeline = redis
             pipeline.hset(REDIS_KEY, key, value)
 
@@ -139,7 +154,7 @@ class Counter(Metric):
     nor decreased.
     """
 
-    def inc(self, amount=1, **kwargs):
+    def inc(self, amount=1, pipeline=None, **kwargs):
         """
         Increments Counter by given amount for the labels specified in kwargs.
         """
@@ -149,7 +164,7 @@ class Counter(Metric):
         self._check_label_consistency(kwargs)
 
         fullmetric = self._construct_metric_identifier(self.name, kwargs)
-        self._inc_in_redis(fullmetric, amount)
+        self._inc_in_redis(fullmetric, amount, pipeline=pipeline)
 
 
 class Gauge(Metric):
@@ -213,16 +228,17 @@ class Histogram(Metric):
         self.buckets = buckets
         super().__init__(name, helpstring, labelnames)
 
-    def observe(self, amount, **kwargs):
+    def observe(self, amount, pipeline=None, **kwargs):
         """
-        Stores a value in the histogram for the labels specified in kwargs.
+        Stores a value in the histogram for the labels specified in kwargs. If a ``pipeline`` is passed, the update is
+        added to it instead of being sent right away.
         """
         if amount < 0:
             raise ValueError("Amount must be greater than zero. Otherwise use inc().")
 
         self._check_label_consistency(kwargs)
 
-        pipe = self._get_redis_pipeline()
+        pipe = self._get_redis_pipeline() if pipeline is None else pipeline
 
         countmetric = self._construct_metric_identifier(self.name + '_count', kwargs)
         self._inc_in_redis(countmetric, 1, pipeline=pipe)
@@ -238,7 +254,8 @@ class Histogram(Metric):
                                                             labelnames=self.labelnames + ["le"])
                 self._inc_in_redis(bmetric, 1, pipeline=pipe)
 
-        self._execute_redis_pipeline(pipe)
+        if pipeline is None:
+            self._execute_redis_pipeline(pipe)
 
 
 def estimate_count_fast(type):
@@ -335,3 +352,52 @@ pretix_task_duration_seconds = Histogram("pretix_task_duration_seconds", "Call t
                                          ["task_name"])
 pretix_successful_logins = Counter("pretix_logins_successful", "Successful logins", [])
 pretix_failed_logins = Counter("pretix_logins_failed", "Failed logins", ["reason"])
+pretix_quota_cache_results_total = Counter("pretix_quota_cache_results_total",
+                                           "Quota availability cache lookups by result (hit, stale, miss)",
+                                           ["result"])
+pretix_lock_wait_seconds = Histogram("pretix_lock_wait_seconds",
+                                     "Time spent acquiring locks by key space and lock mode",
+                                     ["keyspace", "mode"],
+                                     buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.0, 3.0, _INF))
+pretix_lock_timeouts_total = Counter("pretix_lock_timeouts_total",
+                                     "Lock acquisitions that timed out by key space and lock mode",
+                                     ["keyspace", "mode"])
+pretix_lock_keys_per_call = Histogram("pretix_lock_keys_per_call", "Number of objects locked per call", [],
+                                      buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250, _INF))
+pretix_lock_shared_fallback_total = Counter("pretix_lock_shared_fallback_total",
+                                            "Lock calls where exclusive locks were replaced by an exclusive lock on "
+                                            "the shared objects because too many objects were involved", [])
+pretix_cleanup_cart_positions_deleted_total = Counter("pretix_cleanup_cart_positions_deleted_total",
+                                                      "Expired cart positions deleted by the periodic cleanup", [])
+pretix_order_placement_phase_seconds = Histogram("pretix_order_placement_phase_seconds",
+                                                 "Time spent in the phases of placing an order by event",
+                                                 ["phase", "event"])
+pretix_periodic_order_backlog = Gauge("pretix_periodic_order_backlog",
+                                      "Orders that are candidates for a periodic order task at the time of planning",
+                                      ["task"])
+pretix_periodic_order_delay_seconds = Histogram("pretix_periodic_order_delay_seconds",
+                                                "Time between an order becoming due for a periodic order task and "
+                                                "it being processed",
+                                                ["task"],
+                                                buckets=(60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600,
+                                                         24 * 3600, 48 * 3600, _INF))
+pretix_ticket_cache_results_total = Counter("pretix_ticket_cache_results_total",
+                                            "Ticket file lookups for downloads and emails by result (hit, miss)",
+                                            ["result"])
+pretix_ticket_pregeneration_queued = Gauge("pretix_ticket_pregeneration_queued",
+                                           "Orders waiting for their ticket files to be pre-generated", [])
+pretix_pdf_barcode_cache_results_total = Counter("pretix_pdf_barcode_cache_results_total",
+                                                 "QR code lookups while rendering PDF files by result (hit, "
+                                                 "miss)",
+                                                 ["result"])
+pretix_pdf_barcode_cache_evictions_total = Counter("pretix_pdf_barcode_cache_evictions_total",
+                                                   "QR code drawings evicted from the in-process cache", [])
+pretix_checkin_index_lookups_total = Counter("pretix_checkin_index_lookups_total",
+                                             "Barcode lookups through the check-in index by result (hit, miss, "
+                                             "outdated, not_ready)",
+                                             ["result"])
+pretix_checkin_exit_all_checkins_total = Counter("pretix_checkin_exit_all_checkins_total",
+                                                 "Exit scans created by the automatic check-out of check-in lists", [])
+pretix_checkin_exit_all_duration_seconds = Histogram("pretix_checkin_exit_all_duration_seconds",
+                                                     "Time spent on the automatic check-out of one check-in list", [],
+                                                     buckets=(.1, .5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, _INF))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0309_alter_questionanswer_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('paid_orders', models.IntegerField(default=0)),
+                ('pending_orders', models.IntegerField(default=0)),
+                ('reconciled', models.DateTimeField(null=True)),
+                ('quota', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='counter', to='pretixbase.quota')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-16 21:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0310_quotacounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('index', models.PositiveIntegerField()),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('quota', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='pretixbase.quota')),
+            ],
+            options={
+                'unique_together': {('quota', 'index')},
+            },
+        ),
+    ]
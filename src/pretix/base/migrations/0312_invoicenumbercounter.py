@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import Cast
+
+
+def seed_invoice_number_counters(apps, schema_editor):
+    Invoice = apps.get_model('pretixbase', 'Invoice')
+    InvoiceNumberCounter = apps.get_model('pretixbase', 'InvoiceNumberCounter')
+
+    highest_numbers = Invoice.objects.filter(
+        invoice_no__regex=r'^[0-9]+$',
+    ).annotate(
+        numeric_number=Cast('invoice_no', models.BigIntegerField())
+    ).order_by().values('organizer_id', 'prefix').annotate(
+        max=Max('numeric_number')
+    )
+    InvoiceNumberCounter.objects.bulk_create(
+        [
+            InvoiceNumberCounter(organizer_id=r['organizer_id'], prefix=r['prefix'], value=r['max'])
+            for r in highest_numbers.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0311_quotashard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('prefix', models.CharField(max_length=160)),
+                ('value', models.PositiveBigIntegerField(default=0)),
+                ('organizer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_number_counters', to='pretixbase.organizer')),
+            ],
+            options={
+                'unique_together': {('organizer', 'prefix')},
+            },
+        ),
+        migrations.RunPython(
+            seed_invoice_number_counters,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0312_invoicenumbercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckinListCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('position_count', models.IntegerField(default=0)),
+                ('checkin_count', models.IntegerField(default=0)),
+                ('inside_count', models.IntegerField(default=0)),
+                ('reconciled', models.DateTimeField(null=True)),
+                ('checkin_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='pretixbase.checkinlist')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.item')),
+                ('variation', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pretixbase.itemvariation')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0313_checkinlistcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['event', 'last_modified', 'id'], name='pretixbase_order_event_lastmod'),
+        ),
+    ]
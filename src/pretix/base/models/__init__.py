@@ -22,7 +22,7 @@
 from ..settings import GlobalSettingsObject_SettingsStore
 from .auth import U2FDevice, User, WebAuthnDevice
 from .base import CachedFile, LoggedModel, cachedfile_name
-from .checkin import Checkin, CheckinList
+from .checkin import Checkin, CheckinList, CheckinListCounter
 from .currencies import ExchangeRate
 from .customers import Customer
 from .devices import Device, Gate
@@ -33,12 +33,14 @@ from .event import (
 )
 from .exports import ScheduledEventExport, ScheduledOrganizerExport
 from .giftcards import GiftCard, GiftCardAcceptance, GiftCardTransaction
-from .invoices import Invoice, InvoiceLine, invoice_filename
+from .invoices import (
+    Invoice, InvoiceLine, InvoiceNumberCounter, invoice_filename,
+)
 from .items import (
     Item, ItemAddOn, ItemBundle, ItemCategory, ItemMetaProperty, ItemMetaValue,
     ItemProgramTime, ItemVariation, ItemVariationMetaValue, Question,
-    QuestionOption, Quota, SubEventItem, SubEventItemVariation,
-    itempicture_upload_to,
+    QuestionOption, Quota, QuotaCounter, QuotaShard, SubEventItem,
+    SubEventItemVariation, itempicture_upload_to,
 )
 from .log import LogEntry
 from .mail import OutgoingMail
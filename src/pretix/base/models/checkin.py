@@ -461,17 +461,58 @@ class Checkin(models.Model):
         )
 
     def save(self, **kwargs):
-        super().save(**kwargs)
+        from pretix.base.services.checkincounters import track_checkin
+
+        with track_checkin(self):
+            super().save(**kwargs)
         if self.position:
             self.position.order.touch()
         self.list.event.cache.delete('checkin_count')
         self.list.touch()
 
     def delete(self, **kwargs):
-        super().delete(**kwargs)
+        from pretix.base.services.checkincounters import track_checkin
+
+        with track_checkin(self):
+            super().delete(**kwargs)
         self.position.order.touch()
         self.list.touch()
 
     @property
     def is_late_upload(self):
         return self.created and abs(self.created - self.datetime) > timedelta(minutes=2)
+
+
+class CheckinListCounter(models.Model):
+    """
+    Incrementally maintained numbers of positions, checked-in positions and positions currently inside for one
+    product (or variation) on a check-in list. These counters are only used if ``[checkin] counters`` is enabled
+    in the configuration file. They are updated with atomic deltas when check-ins are created or deleted and in
+    the transactions that change orders, see ``pretix.base.services.checkincounters``, and regularly compared to
+    the real numbers by a periodic reconciliation job.
+
+    Since not every code path updates the counters, they are only used for statistics such as the check-in list
+    status and never for the decision whether somebody may enter.
+
+    :param checkin_list: The list these numbers belong to
+    :type checkin_list: CheckinList
+    :param item: The product these numbers belong to
+    :type item: Item
+    :param variation: The variation these numbers belong to, if any
+    :type variation: ItemVariation
+    :param position_count: Number of valid positions on the list
+    :type position_count: int
+    :param checkin_count: Number of valid positions with at least one entry
+    :type checkin_count: int
+    :param inside_count: Number of valid positions whose last scan was an entry
+    :type inside_count: int
+    :param reconciled: The time the counter was last recomputed from scratch
+    :type reconciled: datetime
+    """
+    checkin_list = models.ForeignKey(CheckinList, on_delete=models.CASCADE, related_name='counters')
+    item = models.ForeignKey('Item', on_delete=models.CASCADE, related_name='+')
+    variation = models.ForeignKey('ItemVariation', on_delete=models.CASCADE, related_name='+', null=True)
+    position_count = models.IntegerField(default=0)
+    checkin_count = models.IntegerField(default=0)
+    inside_count = models.IntegerField(default=0)
+    reconciled = models.DateTimeField(null=True)
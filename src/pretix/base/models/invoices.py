@@ -37,7 +37,9 @@ import warnings
 from decimal import Decimal
 
 import pycountry
-from django.db import DatabaseError, models, transaction
+from django.db import (
+    DatabaseError, IntegrityError, connection, models, transaction,
+)
 from django.db.models import Max
 from django.db.models.functions import Cast
 from django.utils import timezone
@@ -292,15 +294,7 @@ class Invoice(models.Model):
         return '\n'.join([p.strip() for p in parts if p and p.strip()])
 
     def _get_numeric_invoice_number(self, c_length):
-        numeric_invoices = Invoice.objects.filter(
-            event__organizer=self.event.organizer,
-            prefix=self.prefix,
-        ).exclude(invoice_no__contains='-').annotate(
-            numeric_number=Cast('invoice_no', models.IntegerField())
-        ).aggregate(
-            max=Max('numeric_number')
-        )['max'] or 0
-        return self._to_numeric_invoice_number(numeric_invoices + 1, c_length)
+        return self._to_numeric_invoice_number(InvoiceNumberCounter.allocate(self.organizer_id, self.prefix), c_length)
 
     def _get_invoice_number_from_order(self):
         return '{order}-{count}'.format(
@@ -331,19 +325,25 @@ class Invoice(models.Model):
         if not self.invoice_no:
             if self.order.testmode:
                 self.prefix += 'TEST-'
+            consecutive = self.event.settings.get('invoice_numbers_consecutive')
             for i in range(10):
-                if self.event.settings.get('invoice_numbers_consecutive'):
-                    self.invoice_no = self._get_numeric_invoice_number(self.event.settings.invoice_numbers_counter_length)
-                else:
-                    self.invoice_no = self._get_invoice_number_from_order()
                 try:
                     with transaction.atomic():
+                        # Consecutive numbers are allocated in the same transaction, so the counter stays locked until
+                        # the invoice is stored and no number is lost if storing it fails
+                        if consecutive:
+                            self.invoice_no = self._get_numeric_invoice_number(self.event.settings.invoice_numbers_counter_length)
+                        else:
+                            self.invoice_no = self._get_invoice_number_from_order()
                         self.full_invoice_no = self.prefix + self.invoice_no
                         return super().save(*args, **kwargs)
                 except DatabaseError:
                     # Suppress duplicate key errors and try again
                     if i == 9:
                         raise
+                    if consecutive:
+                        # The number is already taken, e.g. by an invoice created before the counter existed
+                        InvoiceNumberCounter.resync(self.organizer_id, self.prefix)
             if 'update_fields' in kwargs:
                 kwargs['update_fields'] = {'invoice_no'}.union(kwargs['update_fields'])
 
@@ -415,6 +415,81 @@ class Invoice(models.Model):
         )
 
 
+class InvoiceNumberCounter(models.Model):
+    """
+    Keeps track of the last consecutive invoice number allocated for an organizer and prefix, so that allocating a
+    number does not need to look at all existing invoices.
+
+    :param organizer: The organizer the invoice numbers belong to
+    :type organizer: Organizer
+    :param prefix: The invoice number prefix, including the ``TEST-`` suffix for test mode invoices
+    :type prefix: str
+    :param value: The last allocated number
+    :type value: int
+    """
+    organizer = models.ForeignKey('Organizer', related_name='invoice_number_counters', on_delete=models.CASCADE)
+    prefix = models.CharField(max_length=160)
+    value = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('organizer', 'prefix')
+
+    @staticmethod
+    def highest_number(organizer_id, prefix):
+        """
+        Returns the highest numeric invoice number in use for the given organizer and prefix.
+        """
+        return Invoice.objects.filter(
+            organizer_id=organizer_id,
+            prefix=prefix,
+            invoice_no__regex=r'^[0-9]+$',
+        ).annotate(
+            numeric_number=Cast('invoice_no', models.BigIntegerField())
+        ).aggregate(
+            max=Max('numeric_number')
+        )['max'] or 0
+
+    @classmethod
+    def _increment(cls, organizer_id, prefix):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {cls._meta.db_table} SET value = value + 1 WHERE organizer_id = %s AND prefix = %s '
+                f'RETURNING value',
+                [organizer_id, prefix]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def allocate(cls, organizer_id, prefix):
+        """
+        Returns the next invoice number for the given organizer and prefix. The counter is locked until the end of the
+        current transaction, so this should be called in the same transaction that stores the invoice.
+        """
+        value = cls._increment(organizer_id, prefix)
+        if value is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        organizer_id=organizer_id,
+                        prefix=prefix,
+                        value=cls.highest_number(organizer_id, prefix),
+                    )
+            except IntegrityError:
+                # Created concurrently
+                pass
+            value = cls._increment(organizer_id, prefix)
+        return value
+
+    @classmethod
+    def resync(cls, organizer_id, prefix):
+        """
+        Moves the counter forward to the highest invoice number in use, if it has fallen behind.
+        """
+        highest = cls.highest_number(organizer_id, prefix)
+        return cls.objects.filter(organizer_id=organizer_id, prefix=prefix, value__lt=highest).update(value=highest)
+
+
 class InvoiceLine(models.Model):
     """
     One position listed on an Invoice.
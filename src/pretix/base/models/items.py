@@ -2122,6 +2122,11 @@ class Quota(LoggedModel):
             self.event.cache.clear()
 
     def rebuild_cache(self, now_dt=None):
+        if settings.QUOTA_COUNTERS_ENABLED:
+            from ..services.quotacounters import reconcile_quota_counters
+
+            # The set of products might have changed, so the counter needs to be recounted
+            reconcile_quota_counters([self])
         if settings.HAS_REDIS:
             rc = django_redis.get_redis_connection("redis")
             p = rc.pipeline()
@@ -2200,6 +2205,62 @@ class Quota(LoggedModel):
                 raise ValidationError(_('The subevent does not belong to this event.'))
 
 
+class QuotaCounter(models.Model):
+    """
+    Incrementally maintained number of paid and pending order positions counting towards a quota. These
+    counters are only used if ``[quotas] counters`` is enabled in the configuration file. They are updated
+    with atomic deltas in the transactions that change orders, see ``pretix.base.services.quotacounters``,
+    and regularly compared to the real numbers by a periodic reconciliation job.
+
+    Since some code paths (e.g. manual status changes through plugins) do not update the counters, they are
+    only used for computations that are allowed to be served from a cache and never for the decision whether
+    something can be sold.
+
+    :param quota: The quota these numbers belong to
+    :type quota: Quota
+    :param paid_orders: Number of positions in paid orders
+    :type paid_orders: int
+    :param pending_orders: Number of positions in pending orders
+    :type pending_orders: int
+    :param reconciled: The time the counter was last recomputed from scratch
+    :type reconciled: datetime
+    """
+    quota = models.OneToOneField(
+        Quota,
+        on_delete=models.CASCADE,
+        related_name='counter',
+    )
+    paid_orders = models.IntegerField(default=0)
+    pending_orders = models.IntegerField(default=0)
+    reconciled = models.DateTimeField(null=True)
+
+
+class QuotaShard(models.Model):
+    """
+    A bucket of pre-allocated capacity of a quota. These are only used if ``[quotas] shards`` is set in the
+    configuration file. Tokens in a shard are subtracted from the availability of the quota just like cart
+    positions, and carts can consume them while holding only a shared lock on the quota, see
+    ``pretix.base.services.quotashards``.
+
+    :param quota: The quota this capacity belongs to
+    :type quota: Quota
+    :param index: The number of this shard, starting at 0
+    :type index: int
+    :param tokens: The number of tickets that can still be reserved from this shard
+    :type tokens: int
+    """
+    quota = models.ForeignKey(
+        Quota,
+        on_delete=models.CASCADE,
+        related_name='shards',
+    )
+    index = models.PositiveIntegerField()
+    tokens = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('quota', 'index'),)
+
+
 class ItemMetaProperty(LoggedModel):
     """
     An event can have ItemMetaProperty objects attached to define meta information fields
@@ -337,6 +337,8 @@ class Order(LockModel, LoggedModel):
         indexes = [
             models.Index(fields=["datetime", "id"], name="pretixbase__datetim_66aff0_idx"),
             models.Index(fields=["last_modified", "id"], name="pretixbase__last_mo_4ebf8b_idx"),
+            # Supports the check-in sync feed, which pages through the positions of an event by order modification
+            models.Index(fields=["event", "last_modified", "id"], name="pretixbase_order_event_lastmod"),
         ]
         constraints = [
             models.UniqueConstraint(fields=["organizer", "code"], name="order_organizer_code_uniq"),
@@ -1080,6 +1082,7 @@ class Order(LockModel, LoggedModel):
         from pretix.base.services.memberships import (
             validate_memberships_in_order,
         )
+        from pretix.base.services.quotashards import reclaim_quota_shards
 
         error_messages = {
             'unavailable': _('The ordered product "{item}" is no longer available.'),
@@ -1109,6 +1112,7 @@ class Order(LockModel, LoggedModel):
                     [op.seat for op in positions if op.seat],
                     shared_lock_objects=[self.event]
                 )
+                reclaim_quota_shards(reduce(operator.or_, (set(cp._cached_quotas) for cp in positions), set()))
 
             for i, op in enumerate(positions):
                 if op.seat:
@@ -1853,6 +1857,8 @@ class OrderPayment(models.Model):
 
     @transaction.atomic()
     def _mark_paid_inner(self, force, count_waitinglist, user, auth, ignore_date=False, overpaid=False, lock=False):
+        from pretix.base.services.checkincounters import track_checkin_counters
+        from pretix.base.services.quotacounters import track_quota_counters
         from pretix.base.signals import order_paid
         can_be_paid = self.order._can_be_paid(count_waitinglist=count_waitinglist, ignore_date=ignore_date, force=force,
                                               lock=lock)
@@ -1862,8 +1868,9 @@ class OrderPayment(models.Model):
             }, user=user, auth=auth)
             raise Quota.QuotaExceededException(can_be_paid)
         status_change = self.order.status != Order.STATUS_PENDING
-        self.order.status = Order.STATUS_PAID
-        self.order.save(update_fields=['status'])
+        with track_quota_counters(self.order), track_checkin_counters(self.order):
+            self.order.status = Order.STATUS_PAID
+            self.order.save(update_fields=['status'])
 
         self.order.log_action('pretix.event.order.paid', {
             'provider': self.provider,
@@ -454,7 +454,8 @@ class Voucher(LoggedModel):
     @staticmethod
     def clean_quota_check(data, cnt, old_instance, event, quota, item, variation):
         from ..services.locking import lock_objects
-        from ..services.quotas import QuotaAvailability
+        from ..services.quotas import QuotaAvailability, invalidate_quota_cache
+        from ..services.quotashards import reclaim_quota_shards
 
         old_quotas = Voucher.clean_quota_get_ignored(old_instance)
 
@@ -470,6 +471,8 @@ class Voucher(LoggedModel):
             return
 
         lock_objects([q for q in (new_quotas - old_quotas) if q.size is not None], shared_lock_objects=[event])
+        # Capacity pre-allocated to quota shards is free to be blocked by the voucher, see quotashards.py
+        reclaim_quota_shards(new_quotas - old_quotas)
 
         qa = QuotaAvailability(count_waitinglist=False)
         qa.queue(*(new_quotas - old_quotas))
@@ -479,6 +482,9 @@ class Voucher(LoggedModel):
             raise ValidationError(_('You cannot create a voucher that blocks quota as the selected product or '
                                     'quota is currently sold out or completely reserved.'))
 
+        # The voucher will be saved in the same transaction, so the cache is invalidated once it is committed
+        invalidate_quota_cache(new_quotas - old_quotas)
+
     @staticmethod
     def clean_voucher_code(data, event, pk):
         if 'code' in data and Voucher.objects.filter(Q(code__iexact=data['code'].upper()) & Q(event=event) & ~Q(pk=pk)).exists():
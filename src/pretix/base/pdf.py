@@ -41,11 +41,14 @@ import os
 import re
 import subprocess
 import tempfile
+import threading
+import time
 import unicodedata
 import uuid
-from collections import OrderedDict, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from functools import partial
 from io import BytesIO
+from typing import BinaryIO, Callable, List
 
 import pypdf
 import pypdf.generic
@@ -54,11 +57,13 @@ from bidi import get_display
 from django.conf import settings
 from django.contrib.staticfiles import finders
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.models import Exists, Max, Min, OuterRef
 from django.db.models.fields.files import FieldFile
 from django.dispatch import receiver
 from django.utils.deconstruct import deconstructible
 from django.utils.formats import date_format
+from django.utils.functional import cached_property
 from django.utils.html import conditional_escape
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _, pgettext
@@ -76,6 +81,11 @@ from reportlab.pdfgen.canvas import Canvas
 from reportlab.platypus import Paragraph
 
 from pretix.base.i18n import language
+from pretix.base.metrics import (
+    execute_redis_pipeline, get_redis_pipeline,
+    pretix_pdf_barcode_cache_evictions_total,
+    pretix_pdf_barcode_cache_results_total,
+)
 from pretix.base.models import Checkin, Event, Order, OrderPosition, Question
 from pretix.base.services.placeholders import PlaceholderContext
 from pretix.base.settings import PERSON_NAME_SCHEMES
@@ -83,6 +93,7 @@ from pretix.base.signals import layout_image_variables, layout_text_variables
 from pretix.base.templatetags.money import money_filter
 from pretix.base.templatetags.phone_format import phone_format
 from pretix.helpers.daterange import datetimerange
+from pretix.helpers.processpool import process_pool
 from pretix.helpers.reportlab import (
     ThumbnailingImageReader, register_ttf_font_if_new, reshaper,
 )
@@ -801,7 +812,99 @@ def generate_compressed_addon_list(op, order, event, only_checked_in=False):
     return addonlist
 
 
+class BarcodeCache:
+    """
+    Bounded, content-addressed cache of rendered QR code drawings. Encoding a QR code is much more expensive than
+    drawing it, and the same codes are drawn over and over again for ticket downloads, badge prints and exports.
+
+    Drawings are kept in process memory only with least-recently-used eviction. QR codes usually encode ticket
+    secrets, so they are never written to a shared cache, and entries are keyed by a hash of their content.
+    Lookup results are counted locally and only sent to the metrics store every ``metrics_flush_interval`` lookups
+    or seconds, whichever comes first.
+    """
+    metrics_flush_interval = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._drawings = OrderedDict()
+        self._results = Counter()
+        self._evictions = 0
+        self._last_flush = time.monotonic()
+
+    @staticmethod
+    def _key(content: str, size: float, level: str, color, border) -> str:
+        return hashlib.sha256(json.dumps([content, size, level, color, border]).encode()).hexdigest()
+
+    @staticmethod
+    def _render(content: str, size: float, level: str, color, border) -> Drawing:
+        kwargs = {}
+        if border is not None:
+            kwargs['barBorder'] = border
+        if color:
+            kwargs['barFillColor'] = Color(color[0] / 255, color[1] / 255, color[2] / 255)
+
+        qrw = QrCodeWidget(content, barLevel=level, barHeight=size, barWidth=size, **kwargs)
+        d = Drawing(size, size)
+        # The widget encodes the QR code again every time it is drawn, so we only keep the resulting shapes
+        d.add(qrw.draw())
+        return d
+
+    def get(self, content: str, size: float, level: str, color=None, border=None) -> Drawing:
+        """
+        Returns a drawing of a QR code of ``size`` points encoding ``content`` with error correction ``level``.
+        ``color`` is an optional RGB tuple in the range 0-255, ``border`` an optional number of quiet zone modules.
+        The returned drawing is shared and must not be modified.
+        """
+        key = self._key(content, size, level, color, border)
+        with self._lock:
+            d = self._drawings.get(key)
+            if d is not None:
+                self._drawings.move_to_end(key)
+                self._results['hit'] += 1
+        if d is None:
+            d = self._render(content, size, level, color, border)
+            with self._lock:
+                self._results['miss'] += 1
+                self._drawings[key] = d
+                while len(self._drawings) > settings.PDF_BARCODE_CACHE_SIZE:
+                    self._drawings.popitem(last=False)
+                    self._evictions += 1
+        self._flush_metrics()
+        return d
+
+    def clear(self):
+        with self._lock:
+            self._drawings.clear()
+
+    def _flush_metrics(self, force=False):
+        with self._lock:
+            if not force and (
+                sum(self._results.values()) < self.metrics_flush_interval and
+                time.monotonic() - self._last_flush < self.metrics_flush_interval
+            ):
+                return
+            results, evictions = self._results, self._evictions
+            self._results, self._evictions = Counter(), 0
+            self._last_flush = time.monotonic()
+        if not settings.METRICS_ENABLED:
+            return
+        pipe = get_redis_pipeline()
+        for result, count in results.items():
+            pretix_pdf_barcode_cache_results_total.inc(count, pipeline=pipe, result=result)
+        if evictions:
+            pretix_pdf_barcode_cache_evictions_total.inc(evictions, pipeline=pipe)
+        execute_redis_pipeline(pipe)
+
+
+barcode_cache = BarcodeCache()
+
+
 class Renderer:
+    """
+    Renders order positions onto a canvas according to a JSON layout. The layout is compiled lazily into a list of
+    drawing functions per page, with variable lookups, text templates and paragraph styles resolved only once, so an
+    instance should be reused for all positions that share the same layout and background.
+    """
 
     def __init__(self, event, layout, background_file):
         self.layout = layout
@@ -816,6 +919,9 @@ class Renderer:
             self.bg_bytes = None
             self.bg_pdf = None
         self.event_fonts = list(get_fonts(event, pdf_support_required=True).keys()) + ['Open Sans']
+        self._text_content_cache = {}
+        self._text_style_cache = {}
+        self._poweredby_cache = {}
 
     @classmethod
     def _register_fonts(cls, event: Event = None):
@@ -841,14 +947,17 @@ class Renderer:
         content = o.get('content', 'dark')
         if content not in ('dark', 'white'):
             content = 'dark'
-        img = finders.find('pretixpresale/pdf/powered_by_pretix_{}.png'.format(content))
-
-        ir = ThumbnailingImageReader(img)
-        try:
-            width, height = ir.resize(None, float(o['size']) * mm, 300)
-        except:
-            logger.exception("Can not resize image")
-            pass
+        key = (content, o['size'])
+        if key not in self._poweredby_cache:
+            img = finders.find('pretixpresale/pdf/powered_by_pretix_{}.png'.format(content))
+            ir = ThumbnailingImageReader(img)
+            try:
+                width, height = ir.resize(None, float(o['size']) * mm, 300)
+            except:
+                logger.exception("Can not resize image")
+                pass
+            self._poweredby_cache[key] = ir, width, height
+        ir, width, height = self._poweredby_cache[key]
         canvas.drawImage(ir,
                          float(o['left']) * mm, float(o['bottom']) * mm,
                          width=width, height=height,
@@ -873,16 +982,11 @@ class Renderer:
         if len(content) > 128:
             level = 'L'
         reqs = float(o['size']) * mm
-        kwargs = {}
-        if o.get('nowhitespace', False):
-            kwargs['barBorder'] = 0
-
-        if o.get('color'):
-            kwargs['barFillColor'] = Color(o['color'][0] / 255, o['color'][1] / 255, o['color'][2] / 255)
-
-        qrw = QrCodeWidget(content, barLevel=level, barHeight=reqs, barWidth=reqs, **kwargs)
-        d = Drawing(reqs, reqs)
-        d.add(qrw)
+        d = barcode_cache.get(
+            content, reqs, level,
+            color=list(o['color'][:3]) if o.get('color') else None,
+            border=0 if o.get('nowhitespace', False) else None,
+        )
         qr_x = float(o['left']) * mm
         qr_y = float(o['bottom']) * mm
         renderPDF.draw(d, canvas, qr_x, qr_y)
@@ -908,55 +1012,94 @@ class Renderer:
                 return self._get_text_content(op, order, o, True)
 
         ev = self._get_ev(op, order)
-
+        entry = self._text_content_cache.get(id(o))
+        if entry is None:
+            # The element itself is kept in the cache entry, so its id() can not be reused by another object
+            entry = self._text_content_cache[id(o)] = (o, self._compile_text_content(o))
+        return entry[1](op, order, ev)
+
+    def _compile_text_content(self, o: dict):
+        """
+        Returns a function ``(op, order, ev) -> str`` that computes the text content of the layout element ``o``.
+        """
         if not o['content']:
-            return '(error)'
+            return lambda op, order, ev: '(error)'
 
-        if o['content'] == 'other' or o['content'] == 'other_i18n':
-            if o['content'] == 'other_i18n':
-                text = str(LazyI18nString(o.get('text_i18n', {})))
-            else:
-                text = o.get('text', '')
-
-            def replace(x):
-                if x.group(1).startswith('itemmeta:'):
-                    if op.variation_id:
-                        return op.variation.meta_data.get(x.group(1)[9:]) or ''
-                    return op.item.meta_data.get(x.group(1)[9:]) or ''
-                elif x.group(1).startswith('meta:'):
-                    return ev.meta_data.get(x.group(1)[5:]) or ''
-                elif x.group(1) not in self.variables:
-                    return x.group(0)
-                if x.group(1) == 'secret':
-                    # Do not use shortened version
-                    return op.secret
+        if o['content'] == 'other':
+            return self._compile_text(o.get('text', ''))
+
+        elif o['content'] == 'other_i18n':
+            text_i18n = LazyI18nString(o.get('text_i18n', {}))
+            compiled = {}
 
+            def evaluate(op, order, ev):
+                # The text depends on the active language, so we compile once per resulting text
+                text = str(text_i18n)
+                if text not in compiled:
+                    compiled[text] = self._compile_text(text)
+                return compiled[text](op, order, ev)
+
+            return evaluate
+
+        return self._compile_variable(o['content']) or (lambda op, order, ev: '')
+
+    def _compile_variable(self, name: str):
+        """
+        Returns a function ``(op, order, ev) -> str`` that evaluates the variable ``name``, or ``None`` if there is
+        no such variable.
+        """
+        if name.startswith('itemmeta:'):
+            key = name[9:]
+
+            def evaluate(op, order, ev):
+                if op.variation_id:
+                    return op.variation.meta_data.get(key) or ''
+                return op.item.meta_data.get(key) or ''
+
+        elif name.startswith('meta:'):
+            key = name[5:]
+
+            def evaluate(op, order, ev):
+                return ev.meta_data.get(key) or ''
+
+        elif name in self.variables:
+            func = self.variables[name]['evaluate']
+
+            def evaluate(op, order, ev):
                 try:
-                    return self.variables[x.group(1)]['evaluate'](op, order, ev)
+                    return func(op, order, ev)
                 except:
                     logger.exception('Failed to process variable.')
                     return '(error)'
 
-            # We do not use str.format like in emails so we (a) can evaluate lazily and (b) can re-implement this
-            # 1:1 on other platforms that render PDFs through our API (libpretixprint)
-            return re.sub(r'\{([-a-zA-Z0-9:_]+)\}', replace, text)
-
-        elif o['content'].startswith('itemmeta:'):
-            if op.variation_id:
-                return op.variation.meta_data.get(o['content'][9:]) or ''
-            return op.item.meta_data.get(o['content'][9:]) or ''
-
-        elif o['content'].startswith('meta:'):
-            return ev.meta_data.get(o['content'][5:]) or ''
-
-        elif o['content'] in self.variables:
-            try:
-                return self.variables[o['content']]['evaluate'](op, order, ev)
-            except:
-                logger.exception('Failed to process variable.')
-                return '(error)'
+        else:
+            return None
+        return evaluate
+
+    def _compile_text(self, text: str):
+        """
+        Returns a function ``(op, order, ev) -> str`` that fills the placeholders in ``text``. Unknown placeholders
+        are left in the text as they are.
+        """
+        # We do not use str.format like in emails so we (a) can evaluate lazily and (b) can re-implement this
+        # 1:1 on other platforms that render PDFs through our API (libpretixprint)
+        parts = []
+        pos = 0
+        for m in re.finditer(r'\{([-a-zA-Z0-9:_]+)\}', text):
+            parts.append(text[pos:m.start()])
+            if m.group(1) == 'secret':
+                # Do not use shortened version
+                parts.append(lambda op, order, ev: op.secret)
+            else:
+                parts.append(self._compile_variable(m.group(1)) or m.group(0))
+            pos = m.end()
+        parts.append(text[pos:])
+        parts = [p for p in parts if p]
 
-        return ''
+        if all(isinstance(p, str) for p in parts):
+            static_text = ''.join(parts)
+            return lambda op, order, ev: static_text
+        return lambda op, order, ev: ''.join(p if isinstance(p, str) else p(op, order, ev) for p in parts)
 
     def _draw_imagearea(self, canvas: Canvas, op: OrderPosition, order: Order, o: dict):
         ev = self._get_ev(op, order)
@@ -1015,6 +1158,33 @@ class Renderer:
             canvas.restoreState()
 
     def _text_paragraph(self, op: OrderPosition, order: Order, o: dict, legacy_lineheight=False, override_fontsize=None):
+        fontsize = override_fontsize if override_fontsize is not None else float(o['fontsize'])
+        key = (id(o), legacy_lineheight, fontsize)
+        entry = self._text_style_cache.get(key)
+        if entry is None:
+            entry = self._text_style_cache[key] = (o, self._text_style(o, legacy_lineheight, fontsize))
+        style, ad, lineheight = entry[1]
+
+        # add an almost-invisible space &hairsp; after hyphens as word-wrap in ReportLab only works on space chars
+        text = conditional_escape(
+            self._get_text_content(op, order, o) or "",
+        ).replace("\n", "<br/>\n").replace("-", "-&hairsp;")
+
+        # reportlab does not support unicode combination characters
+        # It's important we do this before we use ArabicReshaper
+        text = unicodedata.normalize("NFC", text)
+
+        # reportlab does not support RTL, ligature-heavy scripts like Arabic. Therefore, we use ArabicReshaper
+        # to resolve all ligatures and python-bidi to switch RTL texts.
+        try:
+            text = "<br/>".join(get_display(reshaper.reshape(l)) for l in text.split("<br/>"))
+        except:
+            logger.exception('Reshaping/Bidi fixes failed on string {}'.format(repr(text)))
+
+        p = Paragraph(text, style=style)  # not using AutoEscapeParagraph is safe as we escape above
+        return p, ad, lineheight
+
+    def _text_style(self, o: dict, legacy_lineheight, fontsize):
         font = o['fontfamily']
 
         # Since pdfmetrics.registerFont is global, we want to make sure that no one tries to sneak in a font, they
@@ -1028,7 +1198,6 @@ class Renderer:
         if o['italic']:
             font += ' I'
 
-        fontsize = override_fontsize if override_fontsize is not None else float(o['fontsize'])
         try:
             ad = getAscentDescent(font, fontsize)
         except KeyError:  # font not known, fall back
@@ -1056,24 +1225,7 @@ class Renderer:
             alignment=align_map[o['align']],
             splitLongWords=o.get('splitlongwords', True),
         )
-        # add an almost-invisible space &hairsp; after hyphens as word-wrap in ReportLab only works on space chars
-        text = conditional_escape(
-            self._get_text_content(op, order, o) or "",
-        ).replace("\n", "<br/>\n").replace("-", "-&hairsp;")
-
-        # reportlab does not support unicode combination characters
-        # It's important we do this before we use ArabicReshaper
-        text = unicodedata.normalize("NFC", text)
-
-        # reportlab does not support RTL, ligature-heavy scripts like Arabic. Therefore, we use ArabicReshaper
-        # to resolve all ligatures and python-bidi to switch RTL texts.
-        try:
-            text = "<br/>".join(get_display(reshaper.reshape(l)) for l in text.split("<br/>"))
-        except:
-            logger.exception('Reshaping/Bidi fixes failed on string {}'.format(repr(text)))
-
-        p = Paragraph(text, style=style)  # not using AutoEscapeParagraph is safe as we escape above
-        return p, ad, lineheight
+        return style, ad, lineheight
 
     def _draw_textcontainer(self, canvas: Canvas, op: OrderPosition, order: Order, o: dict):
         fontsize = float(o['fontsize'])
@@ -1130,40 +1282,68 @@ class Renderer:
             p.drawOn(canvas, 0, -h - ad[1])
         canvas.restoreState()
 
-    def draw_page(self, canvas: Canvas, order: Order, op: OrderPosition, show_page=True, only_page=None):
-        page_count = len(self.bg_pdf.pages)
+    @cached_property
+    def _page_programs(self):
+        """
+        The layout compiled into a list of drawing functions for every page of the background. Pages that do not
+        contain any layout element are ``None``.
+        """
+        draw_functions = {
+            'barcodearea': self._draw_barcodearea,
+            'imagearea': self._draw_imagearea,
+            'textcontainer': self._draw_textcontainer,
+            'textarea': self._draw_textarea,
+            'poweredby': lambda canvas, op, order, o: self._draw_poweredby(canvas, op, o),
+        }
+        programs = [None] * len(self.bg_pdf.pages)
+        for o in self.layout:
+            page = o.get('page', 1)
+            if not 1 <= page <= len(programs):
+                continue
+            if programs[page - 1] is None:
+                programs[page - 1] = []
+            if o['type'] in draw_functions:
+                programs[page - 1].append(partial(draw_functions[o['type']], o=o))
+        return programs
+
+    @cached_property
+    def _page_size(self):
+        if not self.bg_pdf:
+            return None
+        page_size = (
+            self.bg_pdf.pages[0].mediabox[2] - self.bg_pdf.pages[0].mediabox[0],
+            self.bg_pdf.pages[0].mediabox[3] - self.bg_pdf.pages[0].mediabox[1]
+        )
+        if self.bg_pdf.pages[0].get('/Rotate') in (90, 270):
+            # swap dimensions due to pdf being rotated
+            page_size = page_size[::-1]
+        return page_size
 
+    def draw_page(self, canvas: Canvas, order: Order, op: OrderPosition, show_page=True, only_page=None):
         if not only_page and not show_page:
             raise ValueError("only_page=None and show_page=False cannot be combined")
 
-        for page in range(page_count):
+        for page, program in enumerate(self._page_programs):
             if only_page and only_page != page + 1:
                 continue
-            for o in self.layout:
-                if o.get('page', 1) != page + 1:
-                    continue
-                if o['type'] == "barcodearea":
-                    self._draw_barcodearea(canvas, op, order, o)
-                elif o['type'] == "imagearea":
-                    self._draw_imagearea(canvas, op, order, o)
-                elif o['type'] == "textcontainer":
-                    self._draw_textcontainer(canvas, op, order, o)
-                elif o['type'] == "textarea":
-                    self._draw_textarea(canvas, op, order, o)
-                elif o['type'] == "poweredby":
-                    self._draw_poweredby(canvas, op, o)
-                if self.bg_pdf:
-                    page_size = (
-                        self.bg_pdf.pages[0].mediabox[2] - self.bg_pdf.pages[0].mediabox[0],
-                        self.bg_pdf.pages[0].mediabox[3] - self.bg_pdf.pages[0].mediabox[1]
-                    )
-                    if self.bg_pdf.pages[0].get('/Rotate') in (90, 270):
-                        # swap dimensions due to pdf being rotated
-                        page_size = page_size[::-1]
-                    canvas.setPageSize(page_size)
+            if program is not None:
+                for draw in program:
+                    draw(canvas, op, order)
+                if self._page_size:
+                    canvas.setPageSize(self._page_size)
             if show_page:
                 canvas.showPage()
 
+    @cached_property
+    def _background_pages(self):
+        """
+        The pages of the background PDF, prepared once for being merged below any number of rendered pages.
+        """
+        pages = list(self.bg_pdf.pages)
+        for page in pages:
+            _correct_page_media_box(page)
+        return pages
+
     def render_background(self, buffer, title=_('Ticket')):
         buffer.seek(0)
         fg_pdf = PdfReader(buffer)
@@ -1231,9 +1411,7 @@ class Renderer:
             output = PdfWriter()
 
             for i, page in enumerate(fg_pdf.pages):
-                bg_page = self.bg_pdf.pages[i]
-                _correct_page_media_box(bg_page)
-                page.merge_page(bg_page, over=False)
+                page.merge_page(self._background_pages[i], over=False)
                 output.add_page(page)
 
             # pdf_header is a string like "%pdf-X.X"
@@ -1311,6 +1489,64 @@ def merge_background(fg_pdf: PdfWriter, bg_pdf: PdfWriter, out_file, compress):
         fg_pdf.write(out_file)
 
 
+def merge_pdf_files(file_paths: List[str], output_file: BinaryIO, title: str):
+    """
+    Concatenate the PDF files named ``file_paths`` into ``output_file``. If pdftk is available, the files are
+    streamed through it instead of being loaded into memory at once.
+    """
+    if settings.PDFTK and file_paths:
+        subprocess.run([
+            settings.PDFTK,
+            *file_paths,
+            'cat',
+            'output',
+            '-',
+            'compress'
+        ], check=True, stdout=output_file)
+    else:
+        merger = PdfWriter()
+        merger.add_metadata({
+            '/Title': str(title),
+            '/Creator': 'pretix',
+        })
+        for file_path in file_paths:
+            merger.append(file_path)
+        merger.write(output_file)
+
+
+def render_pdf_chunks(render_chunk: Callable, chunks: list, tmp_dir: str, progress_callback=None) -> list:
+    """
+    Call ``render_chunk(chunk, file_name)`` for every element of ``chunks`` to render it into its own PDF file in
+    ``tmp_dir``. Returns a list of ``(file_name, result)`` tuples in the order of ``chunks``.
+
+    Unless we are inside a database transaction, the chunks are rendered in a pool of ``PDF_RENDERING_PROCESSES``
+    processes. ``render_chunk`` therefore needs to be a module-level function and the chunks need to be picklable,
+    e.g. lists of IDs. ``render_chunk`` is responsible for activating the correct scope.
+    """
+    jobs = [(render_chunk, chunk, os.path.join(tmp_dir, 'chunk-%d.pdf' % i)) for i, chunk in enumerate(chunks)]
+    processes = min(settings.PDF_RENDERING_PROCESSES, len(jobs))
+
+    def _results():
+        if processes > 1 and not connection.in_atomic_block:
+            with process_pool(processes) as pool:
+                yield from pool.imap(_render_pdf_chunk, jobs)
+        else:
+            for job in jobs:
+                yield _render_pdf_chunk(job)
+
+    results = []
+    for result in _results():
+        results.append(result)
+        if progress_callback:
+            progress_callback(len(results) / len(jobs) * 100)
+    return results
+
+
+def _render_pdf_chunk(job):
+    render_chunk, chunk, file_name = job
+    return file_name, render_chunk(chunk, file_name)
+
+
 def _correct_page_media_box(page: pypdf.PageObject):
     if page.rotation != 0:
         page.transfer_rotation_to_content()
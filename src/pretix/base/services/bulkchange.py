@@ -0,0 +1,213 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import logging
+from collections import Counter
+from decimal import Decimal
+from typing import List
+
+from django.db import transaction
+from django.db.models import Prefetch
+
+from pretix.base.models import Event, Order, OrderPosition, Quota, User
+from pretix.base.services.locking import LockTimeoutException, lock_objects
+from pretix.base.services.orders import OrderChangeManager, OrderError
+from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotashards import reclaim_quota_shards
+from pretix.base.services.tasks import ProfiledEventTask
+from pretix.celery_app import app
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100
+OPERATION_TYPES = ('change_subevent', 'change_item', 'change_price', 'add_block')
+
+
+def resolve_operations(event, operations):
+    """
+    Loads the objects referenced by ``operations`` once for the whole job. Every operation is a dictionary with a
+    ``type`` out of ``OPERATION_TYPES``, the type-specific target and an optional ``filter`` dictionary with the keys
+    ``item``, ``variation`` and ``subevent`` that restricts the operation to matching positions.
+    """
+    resolved = []
+    for op in operations:
+        filters = {k: v for k, v in op.get('filter', {}).items() if k in ('item', 'variation', 'subevent')}
+        if op['type'] == 'change_subevent':
+            target = event.subevents.get(pk=op['subevent'])
+        elif op['type'] == 'change_item':
+            item = event.items.get(pk=op['item'])
+            target = (item, item.variations.get(pk=op['variation']) if op.get('variation') else None)
+        elif op['type'] == 'change_price':
+            target = Decimal(op['price'])
+        elif op['type'] == 'add_block':
+            target = op['name']
+        else:
+            raise ValueError('Unknown operation type: {}'.format(op['type']))
+        resolved.append((op['type'], filters, target))
+    return resolved
+
+
+def _queue_operations(ocm, order, resolved):
+    """
+    Queues the operations matching the positions of ``order`` on ``ocm``. Filters are always evaluated against the
+    position as it is before the change. Returns whether any position matched.
+    """
+    matched = False
+    for p in order.positions.all():
+        changes = {}
+        blocks = []
+        for op_type, filters, target in resolved:
+            if any(getattr(p, '{}_id'.format(k)) != v for k, v in filters.items()):
+                continue
+            if op_type == 'add_block':
+                blocks.append(target)
+            else:
+                changes[op_type] = target
+        if not changes and not blocks:
+            continue
+        matched = True
+
+        if 'change_item' in changes and 'change_subevent' in changes:
+            ocm.change_item_and_subevent(p, *changes['change_item'], changes['change_subevent'])
+        elif 'change_item' in changes:
+            ocm.change_item(p, *changes['change_item'])
+        elif 'change_subevent' in changes:
+            ocm.change_subevent(p, changes['change_subevent'])
+        if 'change_price' in changes:
+            ocm.change_price(p, changes['change_price'])
+        for block_name in blocks:
+            ocm.add_block(p, block_name)
+    return matched
+
+
+def _quota_diff(ocm):
+    if ocm.order.status not in (Order.STATUS_PENDING, Order.STATUS_PAID):
+        return Counter()
+    return Counter({q: d for q, d in ocm._quotadiff.items() if d > 0})
+
+
+def _process_chunk(event, order_ids, resolved, user, notify, reissue_invoice, dry_run, result):
+    with transaction.atomic():
+        orders = event.orders.filter(pk__in=order_ids).prefetch_related(
+            Prefetch('positions', queryset=OrderPosition.objects.select_related('item', 'variation', 'subevent', 'seat'))
+        ).order_by('pk')
+
+        ocms = []
+        for o in orders:
+            ocm = OrderChangeManager(o, user=user, notify=notify, reissue_invoice=reissue_invoice)
+            try:
+                if not _queue_operations(ocm, o, resolved):
+                    result['skipped'] += 1
+                    continue
+            except OrderError as e:
+                result['failed'].append({'order': o.code, 'error': str(e)})
+                continue
+            ocms.append(ocm)
+
+        # Lock and compute quotas once for all orders in this chunk instead of once per order
+        quota_diff = Counter()
+        seats = set()
+        for ocm in ocms:
+            quota_diff.update(_quota_diff(ocm))
+            seats.update(s for s, d in ocm._seatdiff.items() if d > 0)
+        if not dry_run:
+            if seats and event.settings.seating_minimal_distance > 0:
+                lock_objects([event])
+            else:
+                lock_objects(
+                    [q for q in quota_diff if q.size is not None] + list(seats),
+                    shared_lock_objects=[event]
+                )
+            reclaim_quota_shards(list(quota_diff))
+        qa = QuotaAvailability()
+        qa.queue(*quota_diff.keys())
+        qa.compute()
+        quotas_left = {
+            q: (0 if state != Quota.AVAILABILITY_OK else avail)
+            for q, (state, avail) in qa.results.items()
+        }
+
+        for ocm in ocms:
+            needed = _quota_diff(ocm)
+            try:
+                for q, d in needed.items():
+                    if quotas_left[q] is not None and quotas_left[q] < d:
+                        raise OrderError(ocm.error_messages['quota'].format(name=q.name))
+                if dry_run:
+                    ocm._check_order_size()
+                    if ocm.order.status in (Order.STATUS_PENDING, Order.STATUS_PAID):
+                        ocm._check_seats()
+                else:
+                    ocm.commit(check_quotas=False, defer_side_effects=True)
+            except (OrderError, LockTimeoutException) as e:
+                logger.info('Bulk change of order %s failed: %s', ocm.order.code, e)
+                result['failed'].append({'order': ocm.order.code, 'error': str(e)})
+                continue
+
+            for q, d in needed.items():
+                if quotas_left[q] is not None:
+                    quotas_left[q] -= d
+            result['changed'] += 1
+
+
+@app.task(base=ProfiledEventTask, bind=True)
+def bulk_change_orders(self, event: Event, operations: List[dict], orders: List[int]=None, user: int=None,
+                       notify: bool=False, reissue_invoice: bool=True, dry_run: bool=False):
+    """
+    Applies ``operations`` (see ``resolve_operations``) to the given orders, or all pending and paid orders of the
+    event if ``orders`` is ``None``, using one ``OrderChangeManager`` per order. Orders are processed in chunks of
+    ``CHUNK_SIZE`` that share their locks and quota computation. Orders that cannot be changed are reported in the
+    result and do not prevent other orders from being changed.
+
+    In a dry run, operations are validated and checked against quotas and seats, but nothing is committed. Checks
+    that only happen while committing, e.g. regarding price changes of paid orders, are not covered by a dry run.
+    """
+    if user:
+        user = User.objects.get(pk=user)
+    resolved = resolve_operations(event, operations)
+
+    qs = event.orders.all()
+    if orders is None:
+        qs = qs.filter(status__in=(Order.STATUS_PENDING, Order.STATUS_PAID))
+    else:
+        qs = qs.filter(pk__in=orders)
+    order_ids = list(qs.order_by('pk').values_list('pk', flat=True))
+
+    result = {
+        'dry_run': dry_run,
+        'id': self.request.id,
+        'total': len(order_ids),
+        'changed': 0,
+        'skipped': 0,
+        'failed': [],
+    }
+    self.update_state(
+        state='PROGRESS',
+        meta={'value': 0}
+    )
+    for i in range(0, len(order_ids), CHUNK_SIZE):
+        _process_chunk(event, order_ids[i:i + CHUNK_SIZE], resolved, user, notify, reissue_invoice, dry_run, result)
+        if not self.request.called_directly:
+            self.update_state(
+                state='PROGRESS',
+                meta={'value': round(min(i + CHUNK_SIZE, len(order_ids)) / len(order_ids) * 100, 2)}
+            )
+    return result
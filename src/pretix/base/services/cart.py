@@ -43,7 +43,7 @@ from celery.exceptions import MaxRetriesExceededError
 from django import forms
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import DatabaseError, transaction
+from django.db import transaction
 from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Value
 from django.db.models.aggregates import Min
 from django.dispatch import receiver
@@ -70,7 +70,14 @@ from pretix.base.services.pricing import (
     apply_discounts, apply_rounding, get_line_price, get_listed_price,
     get_price, is_included_for_free,
 )
-from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotas import (
+    QuotaAvailability, invalidate_quota_cache,
+)
+from pretix.base.services.quotashards import (
+    QuotaShardsExhausted, quota_is_sharded, quota_shards_enabled,
+    quotas_with_low_shards, reclaim_quota_shards, refill_quota_shards,
+    return_shard_tokens, take_shard_tokens,
+)
 from pretix.base.services.tasks import ProfiledEventTask
 from pretix.base.settings import PERSON_NAME_SCHEMES, LazyI18nStringList
 from pretix.base.signals import validate_cart_addons
@@ -227,15 +234,22 @@ error_messages = {
 }
 
 
-def _get_quota_availability(quota_diff, now_dt):
+def _get_quota_availability(quota_diff, now_dt, granted=(), availability=None):
     quotas_ok = defaultdict(int)
-    qa = QuotaAvailability()
-    qa.queue(*[k for k, v in quota_diff.items() if v > 0])
+    # Shards that are not reclaimed by this operation keep their tokens, so they are not available to us
+    qa = QuotaAvailability(count_shard_tokens=True)
+    qa.queue(*[k for k, v in quota_diff.items() if v > 0 and k not in granted])
     qa.compute(now_dt=now_dt)
+    if availability is not None:
+        availability.update(qa.results)
     for quota, count in quota_diff.items():
         if count <= 0:
             quotas_ok[quota] = 0
             break
+        if quota in granted:
+            # Capacity has already been reserved through quota shards
+            quotas_ok[quota] = count
+            continue
         avail = qa.results[quota]
         if avail[1] is not None and avail[1] < count:
             quotas_ok[quota] = min(count, avail[1])
@@ -663,6 +677,7 @@ class CartManager:
             'addons'
         ).order_by('-is_bundled')
         err = None
+        bundle_cache = {}
         for cp in expired:
             removed_positions = {op.position.pk for op in self._operations if isinstance(op, self.RemoveOperation)}
             if cp.pk in removed_positions or (cp.addon_to_id and cp.addon_to_id in removed_positions):
@@ -671,7 +686,12 @@ class CartManager:
             cp.item.requires_seat = self.event.settings.seating_choice and cp.requires_seat
 
             if cp.is_bundled:
-                bundle = cp.addon_to.item.bundles.filter(bundled_item=cp.item, bundled_variation=cp.variation).first()
+                bundle_key = (cp.addon_to.item_id, cp.item_id, cp.variation_id)
+                if bundle_key not in bundle_cache:
+                    bundle_cache[bundle_key] = cp.addon_to.item.bundles.filter(
+                        bundled_item=cp.item, bundled_variation=cp.variation
+                    ).first()
+                bundle = bundle_cache[bundle_key]
                 if bundle:
                     if cp.addon_to.voucher_id and cp.addon_to.voucher.all_bundles_included:
                         listed_price = Decimal('0.00')
@@ -690,7 +710,11 @@ class CartManager:
                 else:
                     price_after_voucher = listed_price
 
-            quotas = list(cp.quotas)
+            # Use the prefetched quotas instead of cp.quotas to avoid one query per position in large carts
+            quotas = [
+                q for q in (cp.variation.quotas.all() if cp.variation_id else cp.item.quotas.all())
+                if q.subevent_id == cp.subevent_id
+            ]
             if not quotas:
                 self._operations.append(self.RemoveOperation(position=cp))
                 err = error_messages['unavailable']
@@ -1242,23 +1266,45 @@ class CartManager:
         return err
 
     @transaction.atomic(durable=True)
-    def _perform_operations(self):
+    def _perform_operations(self, use_shards=True):
         full_lock_required = any(getattr(o, 'seat', False) for o in self._operations) and self.event.settings.seating_minimal_distance > 0
+        quotas_to_lock = [q for q, d in self._quota_diff.items() if q.size is not None and d > 0]
+        shards_enabled = quota_shards_enabled(self.event)
+        sharded_quotas = [q for q in quotas_to_lock if use_shards and shards_enabled and quota_is_sharded(q)]
         if full_lock_required:
             # We lock the entire event in this case since we don't want to deal with fine-granular locking
             # in the case of seating distance enforcement
             lock_objects([self.event])
+            sharded_quotas = []
         else:
+            # Quotas we can reserve from pre-allocated shards only need a shared lock, see quotashards.py
             lock_objects(
-                [q for q, d in self._quota_diff.items() if q.size is not None and d > 0] +
+                [q for q in quotas_to_lock if q not in sharded_quotas] +
                 [v for v, d in self._voucher_use_diff.items() if d > 0] +
                 [getattr(o, 'seat', False) for o in self._operations if getattr(o, 'seat', False)],
-                shared_lock_objects=[self.event]
+                shared_lock_objects=[self.event] + sharded_quotas
             )
+        refill_quotas = []
+        if sharded_quotas:
+            shards = take_shard_tokens({q: self._quota_diff[q] for q in sharded_quotas})
+        else:
+            shards = {}
+            if shards_enabled:
+                # Only shards that could not serve this operation are returned and refilled afterwards
+                refill_quotas = quotas_with_low_shards({q: self._quota_diff[q] for q in quotas_to_lock})
+                reclaim_quota_shards(refill_quotas)
+            else:
+                # Tokens might be left over from before a plugin modifying quota availability has been enabled
+                reclaim_quota_shards(quotas_to_lock)
         vouchers_ok = self._get_voucher_availability()
-        quotas_ok = _get_quota_availability(self._quota_diff, self.real_now_dt)
+        availability = {}
+        quotas_ok = _get_quota_availability(self._quota_diff, self.real_now_dt, granted=shards,
+                                            availability=availability)
+        quotas_ok_before = dict(quotas_ok)
+        quotas_released = Counter()
         err = None
         new_cart_positions = []
+        extended_positions = []
         deleted_positions = set()
 
         err = err or self._check_min_max_per_product()
@@ -1276,6 +1322,7 @@ class CartManager:
                 if op.position.expires > self.real_now_dt:
                     for q in op.position.quotas:
                         quotas_ok[q] += 1
+                        quotas_released[q] += 1
                 addons = op.position.addons.all()
                 deleted_positions |= {a.pk for a in addons}
                 addons.delete()
@@ -1463,13 +1510,8 @@ class CartManager:
                         op.position.listed_price = op.listed_price
                         op.position.price_after_voucher = op.price_after_voucher
                         # op.position.price will be updated by recompute_final_prices_and_taxes()
-                        if op.position.pk not in deleted_positions:
-                            try:
-                                op.position.save(force_update=True, update_fields=['expires', 'max_extend', 'listed_price', 'price_after_voucher'])
-                                self.num_extended_positions += 1
-                            except DatabaseError:
-                                # Best effort... The position might have been deleted in the meantime!
-                                pass
+                        # The position is saved below together with all other extended positions
+                        extended_positions.append(op.position)
                     elif available_count == 0:
                         addons = op.position.addons.all()
                         deleted_positions |= {a.pk for a in addons}
@@ -1513,6 +1555,13 @@ class CartManager:
                             # op.positon.price will be set in recompute_final_prices_and_taxes
                             a.save(update_fields=['listed_price', 'price_after_voucher'])
 
+        extended_positions = [p for p in extended_positions if p.pk not in deleted_positions]
+        if extended_positions:
+            # Positions that have been deleted in the meantime are silently skipped by the UPDATE
+            self.num_extended_positions += CartPosition.objects.bulk_update(
+                extended_positions, ['expires', 'max_extend', 'listed_price', 'price_after_voucher']
+            )
+
         for p in new_cart_positions:
             if getattr(p, '_answers', None):
                 if not p.pk:  # We stored some to the database already before
@@ -1520,6 +1569,16 @@ class CartManager:
                 _save_answers(p, {}, p._answers)
         CartPosition.objects.bulk_create([p for p in new_cart_positions if not getattr(p, '_answers', None) and not p.pk])
 
+        if shards:
+            return_shard_tokens(shards, {
+                q: min(quotas_ok[q] - quotas_released[q], self._quota_diff[q]) for q in shards
+            })
+        elif refill_quotas:
+            # Free capacity after this operation, based on the availability computed above
+            refill_quota_shards({
+                q: availability[q][1] - (quotas_ok_before.get(q, 0) - quotas_ok[q]) for q in refill_quotas
+            })
+
         if 'sleep-before-commit' in debugflags_var.get():
             sleep(2)
 
@@ -1578,7 +1637,11 @@ class CartManager:
 
         self._extend_expiry_of_valid_existing_positions()
         self._remove_parents_if_bundles_are_removed()
-        err = self._perform_operations() or err
+        try:
+            err = self._perform_operations() or err
+        except QuotaShardsExhausted:
+            err = self._perform_operations(use_shards=False) or err
+        invalidate_quota_cache([q for q, d in self._quota_diff.items() if d])
         self.recompute_final_prices_and_taxes()
 
         if err:
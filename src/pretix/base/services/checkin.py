@@ -31,36 +31,46 @@
 # Unless required by applicable law or agreed to in writing, software distributed under the Apache License 2.0 is
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations under the License.
+import json
 import logging
 import os
+import time
 from datetime import datetime, timedelta, timezone
-from functools import partial, reduce
+from functools import lru_cache, partial, reduce
 
 import dateutil
 import dateutil.parser
 from dateutil.tz import datetime_exists
+from django.conf import settings
 from django.core.files import File
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import (
-    BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, Max, Min,
-    OuterRef, Q, Subquery, TextField, Value, When,
+    BooleanField, Case, Count, Exists, ExpressionWrapper, F, IntegerField, Max,
+    Min, OuterRef, Q, Subquery, TextField, Value, When,
 )
 from django.db.models.functions import Coalesce, TruncDate
 from django.dispatch import receiver
 from django.utils.formats import date_format
 from django.utils.functional import cached_property
-from django.utils.timezone import make_aware, now, override
+from django.utils.timezone import get_default_timezone, make_aware, now
 from django.utils.translation import gettext as _
 from django_scopes import scope, scopes_disabled
 
+from pretix.base.metrics import (
+    pretix_checkin_exit_all_checkins_total,
+    pretix_checkin_exit_all_duration_seconds,
+)
 from pretix.base.models import (
     Checkin, CheckinList, Device, Event, Gate, Item, ItemVariation, Order,
     OrderPosition, QuestionOption,
 )
+from pretix.base.services.checkincounters import (
+    reconcile_checkin_list_counters,
+)
 from pretix.base.signals import checkin_created, periodic_task
 from pretix.helpers import OF_SELF
 from pretix.helpers.database import conditional_atomic
-from pretix.helpers.jsonlogic import Logic
+from pretix.helpers.jsonlogic import Logic, compile_logic
 from pretix.helpers.jsonlogic_boolalg import convert_to_dnf
 from pretix.helpers.jsonlogic_query import (
     Equal, GreaterEqualThan, GreaterThan, InList, LowerEqualThan, LowerThan,
@@ -69,6 +79,9 @@ from pretix.helpers.jsonlogic_query import (
 
 logger = logging.getLogger(__name__)
 
+# Number of exit scans created per transaction by the automatic check-out
+EXIT_ALL_CHUNK_SIZE = 1000
+
 
 def _build_time(t=None, value=None, ev=None, now_dt=None):
     now_dt = now_dt or now()
@@ -428,19 +441,46 @@ def _get_logic_environment(ev, rule_data, now_dt):
     return logic
 
 
+@lru_cache(maxsize=512)
+def _compile_rules(rules_json):
+    # Rules are cached by their serialized form, so changed rules are compiled again without any invalidation
+    return compile_logic(json.loads(rules_json))
+
+
 class LazyRuleVars:
     def __init__(self, position, clist, dt, gate):
         self._position = position
         self._clist = clist
         self._dt = dt
         self._gate = gate
-        self.__cache = {}
 
     def __getitem__(self, item):
         if item[0] != '_' and hasattr(self, item):
             return getattr(self, item)
         raise KeyError()
 
+    @cached_property
+    def _checkins(self):
+        # Rules commonly combine multiple check-in based variables, so we load all check-ins of the position on
+        # this list with one query and compute the variables from them instead of querying for each variable.
+        return list(
+            self._position.checkins.filter(list=self._clist).order_by('datetime').values_list('datetime', 'type')
+        )
+
+    @cached_property
+    def _entries(self):
+        return [dt for dt, type in self._checkins if type == Checkin.TYPE_ENTRY]
+
+    def _entries_filtered(self, cutoff, before):
+        if cutoff.tzinfo is None:
+            # Same interpretation as in a database query
+            cutoff = make_aware(cutoff, get_default_timezone())
+        return [dt for dt in self._entries if (dt < cutoff) == before]
+
+    def _days(self, datetimes):
+        tz = self._clist.event.timezone
+        return len({dt.astimezone(tz).date() for dt in datetimes})
+
     @property
     def now(self):
         return self._dt
@@ -462,90 +502,55 @@ class LazyRuleVars:
     def variation(self):
         return self._position.variation_id
 
-    @cached_property
+    @property
     def entries_number(self):
-        return self._position.checkins.filter(type=Checkin.TYPE_ENTRY, list=self._clist).count()
+        return len(self._entries)
 
-    @cached_property
+    @property
     def entries_today(self):
         tz = self._clist.event.timezone
         midnight = self._dt.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
-        return self._position.checkins.filter(type=Checkin.TYPE_ENTRY, list=self._clist, datetime__gte=midnight).count()
+        return len(self._entries_filtered(midnight, before=False))
 
     def entries_since(self, cutoff):
-        if ('entries_since', cutoff) not in self.__cache:
-            self.__cache['entries_since', cutoff] = self._position.checkins.filter(type=Checkin.TYPE_ENTRY, list=self._clist, datetime__gte=cutoff).count()
-        return self.__cache['entries_since', cutoff]
+        return len(self._entries_filtered(cutoff, before=False))
 
     def entries_before(self, cutoff):
-        if ('entries_before', cutoff) not in self.__cache:
-            self.__cache['entries_before', cutoff] = self._position.checkins.filter(type=Checkin.TYPE_ENTRY, list=self._clist, datetime__lt=cutoff).count()
-        return self.__cache['entries_before', cutoff]
+        return len(self._entries_filtered(cutoff, before=True))
 
     def entries_days_since(self, cutoff):
-        tz = self._clist.event.timezone
-        with override(tz):
-            if ('entries_days_since', cutoff) not in self.__cache:
-                self.__cache['entries_days_since', cutoff] = self._position.checkins.filter(
-                    type=Checkin.TYPE_ENTRY,
-                    list=self._clist,
-                    datetime__gte=cutoff
-                ).annotate(
-                    day=TruncDate('datetime', tzinfo=tz)
-                ).values('day').distinct().count()
-            return self.__cache['entries_days_since', cutoff]
+        return self._days(self._entries_filtered(cutoff, before=False))
 
     def entries_days_before(self, cutoff):
-        tz = self._clist.event.timezone
-        with override(tz):
-            if ('entries_days_before', cutoff) not in self.__cache:
-                self.__cache['entries_days_before', cutoff] = self._position.checkins.filter(
-                    type=Checkin.TYPE_ENTRY,
-                    list=self._clist,
-                    datetime__lt=cutoff
-                ).annotate(
-                    day=TruncDate('datetime', tzinfo=tz)
-                ).values('day').distinct().count()
-            return self.__cache['entries_days_before', cutoff]
+        return self._days(self._entries_filtered(cutoff, before=True))
 
-    @cached_property
+    @property
     def entries_days(self):
-        tz = self._clist.event.timezone
-        with override(tz):
-            return self._position.checkins.filter(list=self._clist, type=Checkin.TYPE_ENTRY).annotate(
-                day=TruncDate('datetime', tzinfo=tz)
-            ).values('day').distinct().count()
+        return self._days(self._entries)
 
-    @cached_property
+    @property
     def entry_status(self):
-        last_checkin = self._position.checkins.filter(list=self._clist).order_by('datetime').last()
-        if not last_checkin or last_checkin.type == Checkin.TYPE_EXIT:
+        if not self._checkins or self._checkins[-1][1] == Checkin.TYPE_EXIT:
             return "absent"
         return "present"
 
-    @cached_property
+    @property
     def minutes_since_last_entry(self):
-        tz = self._clist.event.timezone
-        with override(tz):
-            last_entry = self._position.checkins.filter(list=self._clist, type=Checkin.TYPE_ENTRY).order_by('datetime').last()
-            if last_entry is None:
-                # Returning "None" would be "correct", but the handling of "None" in JSON logic is inconsistent
-                # between platforms (None<1 is true on some, but not all), we rather choose something that is at least
-                # consistent.
-                return -1
-            return (self._dt - last_entry.datetime).total_seconds() // 60
+        if not self._entries:
+            # Returning "None" would be "correct", but the handling of "None" in JSON logic is inconsistent
+            # between platforms (None<1 is true on some, but not all), we rather choose something that is at least
+            # consistent.
+            return -1
+        return (self._dt - self._entries[-1]).total_seconds() // 60
 
-    @cached_property
+    @property
     def minutes_since_first_entry(self):
-        tz = self._clist.event.timezone
-        with override(tz):
-            last_entry = self._position.checkins.filter(list=self._clist, type=Checkin.TYPE_ENTRY).order_by('datetime').first()
-            if last_entry is None:
-                # Returning "None" would be "correct", but the handling of "None" in JSON logic is inconsistent
-                # between platforms (None<1 is true on some, but not all), we rather choose something that is at least
-                # consistent.
-                return -1
-            return (self._dt - last_entry.datetime).total_seconds() // 60
+        if not self._entries:
+            # Returning "None" would be "correct", but the handling of "None" in JSON logic is inconsistent
+            # between platforms (None<1 is true on some, but not all), we rather choose something that is at least
+            # consistent.
+            return -1
+        return (self._dt - self._entries[0]).total_seconds() // 60
 
 
 class SQLLogic:
@@ -1085,7 +1090,7 @@ def perform_checkin(op: OrderPosition, clist: CheckinList, given_answers: dict,
             rule_data = LazyRuleVars(op, clist, dt, gate=gate)
             logic = _get_logic_environment(op.subevent or clist.event, rule_data, now_dt=dt)
             try:
-                logic_result = logic.apply(clist.rules, rule_data)
+                logic_result = logic.apply_compiled(_compile_rules(json.dumps(clist.rules)), rule_data)
             except Exception:
                 logger.exception("Check-in rule evaluation failed")
                 raise CheckInError(
@@ -1184,6 +1189,53 @@ def perform_checkin(op: OrderPosition, clist: CheckinList, given_answers: dict,
             )
 
 
+def _exit_all(cl):
+    """
+    Creates an exit scan at ``cl.exit_all_at`` for every position that is inside at that time. Exits are inserted in
+    chunks of ``EXIT_ALL_CHUNK_SIZE``, each in its own short transaction, and ``checkin_created`` is sent for the
+    exits of a chunk after it has been committed. Returns the number of created exits.
+    """
+    positions = cl.positions_inside_query(ignore_status=True, at_time=cl.exit_all_at).exclude(
+        # An earlier run might have been interrupted after creating some of the exits
+        Exists(Checkin.objects.filter(
+            position_id=OuterRef('pk'), list=cl, auto_checked_in=True, type=Checkin.TYPE_EXIT, datetime=cl.exit_all_at
+        ))
+    ).order_by().values_list('pk', 'order_id')
+
+    created = 0
+    chunk = []
+    for row in positions.iterator(chunk_size=EXIT_ALL_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) >= EXIT_ALL_CHUNK_SIZE:
+            created += _exit_all_chunk(cl, chunk)
+            chunk = []
+    if chunk:
+        created += _exit_all_chunk(cl, chunk)
+
+    if created:
+        cl.event.cache.delete('checkin_count')
+        cl.touch()
+        if settings.CHECKIN_COUNTERS_ENABLED and cl.counters.exists():
+            # Exits are not tracked one by one here, it is a lot cheaper to recount the list once
+            reconcile_checkin_list_counters(cl)
+    return created
+
+
+def _exit_all_chunk(cl, chunk):
+    with transaction.atomic():
+        checkins = Checkin.objects.bulk_create([
+            Checkin(position_id=position_id, list=cl, auto_checked_in=True, type=Checkin.TYPE_EXIT,
+                    datetime=cl.exit_all_at)
+            for position_id, order_id in chunk
+        ])
+        # Checkin.save() would do this for every single check-in
+        Order.objects.filter(pk__in={order_id for position_id, order_id in chunk}).update(last_modified=now())
+
+    for ci in checkins:
+        checkin_created.send(cl.event, checkin=ci)
+    return len(checkins)
+
+
 @receiver(periodic_task, dispatch_uid="autocheckout_exit_all")
 @scopes_disabled()
 def process_exit_all(sender, **kwargs):
@@ -1192,14 +1244,14 @@ def process_exit_all(sender, **kwargs):
         exit_all_at__isnull=False
     ).select_related('event', 'event__organizer')
     for cl in qs:
-        positions = cl.positions_inside_query(ignore_status=True, at_time=cl.exit_all_at)
-        for p in positions:
-            with scope(organizer=cl.event.organizer):
-                ci, created = Checkin.objects.get_or_create(
-                    position=p, list=cl, auto_checked_in=True, type=Checkin.TYPE_EXIT, datetime=cl.exit_all_at
-                )
-                if created:
-                    checkin_created.send(cl.event, checkin=ci)
+        t0 = time.monotonic()
+        with scope(organizer=cl.event.organizer):
+            created = _exit_all(cl)
+        if settings.METRICS_ENABLED:
+            pretix_checkin_exit_all_duration_seconds.observe(time.monotonic() - t0)
+            pretix_checkin_exit_all_checkins_total.inc(created)
+        if created:
+            logger.info(f'Automatically checked out {created} positions from check-in list {cl.pk}')
         d = cl.exit_all_at.astimezone(cl.event.timezone)
         if cl.event.settings.get(f'autocheckin_dst_hack_{cl.pk}'):  # move time back if yesterday was DST switch
             d -= timedelta(hours=1)
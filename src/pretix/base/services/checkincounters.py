@@ -0,0 +1,363 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+Incrementally maintained check-in list statistics.
+
+Every scanning device regularly polls the status of its check-in list, which used to count all positions and
+check-ins of the list from scratch on every request. If ``[checkin] counters`` is enabled, we keep these numbers
+per product and variation in ``CheckinListCounter`` objects instead. Creating or deleting a single check-in applies
+a delta to the counter of its product, and code paths changing orders compare the check-in "footprint" of the
+order before and after the change, the same way ``pretix.base.services.quotacounters`` does it for quotas.
+
+Counters of a list are only created when its status is requested for the first time, and they are dropped whenever
+the configuration of the list changes in a way that changes which tickets are valid on it, so they are rebuilt
+on the next request. A periodic job recounts lists with recent changes to repair drift caused by code paths that
+are not tracked, e.g. bulk deletions of check-ins.
+"""
+import logging
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import (
+    Checkin, CheckinList, CheckinListCounter, ItemVariation, Order,
+    OrderPosition,
+)
+from pretix.base.signals import periodic_task
+from pretix.helpers.periodic import minimum_interval
+
+logger = logging.getLogger(__name__)
+
+# Counters are recounted at most once per RECONCILIATION_INTERVAL, and only if their event has seen order changes
+# since the last recount.
+RECONCILIATION_INTERVAL = timedelta(minutes=10)
+
+# Changes to these fields of a check-in list change which positions are counted
+LIST_FIELDS = {'all_products', 'subevent', 'subevent_id', 'include_pending'}
+
+
+def _position_valid(clist, limit_product_ids, item_id, subevent_id, canceled, order_status, valid_if_pending):
+    """
+    Returns whether a position is valid on a check-in list. Needs to stay in sync with
+    ``CheckinList.positions_query``.
+    """
+    if canceled:
+        return False
+    if clist.subevent_id and subevent_id != clist.subevent_id:
+        return False
+    if not clist.all_products and item_id not in limit_product_ids:
+        return False
+    if order_status == Order.STATUS_PAID:
+        return True
+    return order_status == Order.STATUS_PENDING and (clist.include_pending or valid_if_pending)
+
+
+def _scan_state(scans):
+    """
+    Returns whether a position with the given successful ``(type, datetime)`` scans on a list counts as checked in
+    and whether it counts as inside. Needs to stay in sync with ``CheckinList._filter_positions_inside``.
+    """
+    last_entry = max((dt for t, dt in scans if t == Checkin.TYPE_ENTRY), default=None)
+    last_exit = max((dt for t, dt in scans if t == Checkin.TYPE_EXIT), default=None)
+    checked_in = last_entry is not None
+    return checked_in, checked_in and (last_exit is None or last_exit < last_entry)
+
+
+def _apply_delta(delta):
+    changes = defaultdict(dict)
+    for (list_id, item_id, variation_id, field), c in delta.items():
+        if c:
+            changes[list_id, item_id, variation_id][field] = c
+
+    for (list_id, item_id, variation_id), fields in sorted(changes.items(), key=lambda e: (e[0][0], e[0][1], e[0][2] or 0)):
+        # Counters that do not exist yet are created on the next status request, we do not create them here to
+        # avoid concurrent inserts.
+        CheckinListCounter.objects.filter(
+            checkin_list_id=list_id, item_id=item_id, variation_id=variation_id,
+        ).update(**{f: F(f) + c for f, c in fields.items()})
+
+
+@scopes_disabled()
+def _counted_lists(event_id):
+    """
+    Returns the check-in lists of an event that currently have counters and the products they are limited to.
+    """
+    lists = list(CheckinList.objects.filter(
+        Exists(CheckinListCounter.objects.filter(checkin_list=OuterRef('pk'))),
+        event_id=event_id,
+    ).order_by())
+    limit_products = defaultdict(set)
+    if any(not cl.all_products for cl in lists):
+        for list_id, item_id in CheckinList.limit_products.through.objects.filter(
+                checkinlist_id__in=[cl.pk for cl in lists]
+        ).values_list('checkinlist_id', 'item_id'):
+            limit_products[list_id].add(item_id)
+    return lists, limit_products
+
+
+@scopes_disabled()
+def _order_footprint(order_id, lists, limit_products):
+    """
+    Returns the numbers the positions of an order contribute to the counters of the given lists, keyed by
+    ``(list_id, item_id, variation_id, field)``.
+    """
+    positions = list(OrderPosition.all.filter(order_id=order_id).values_list(
+        'id', 'item_id', 'variation_id', 'subevent_id', 'canceled', 'order__status', 'order__valid_if_pending',
+    ))
+    scans = defaultdict(list)
+    if positions:
+        for position_id, list_id, t, dt in Checkin.objects.filter(
+                position__order_id=order_id, list__in=lists
+        ).values_list('position_id', 'list_id', 'type', 'datetime'):
+            scans[position_id, list_id].append((t, dt))
+
+    footprint = Counter()
+    for cl in lists:
+        for position_id, item_id, variation_id, subevent_id, canceled, status, valid_if_pending in positions:
+            if not _position_valid(cl, limit_products[cl.pk], item_id, subevent_id, canceled, status, valid_if_pending):
+                continue
+            checked_in, inside = _scan_state(scans[position_id, cl.pk])
+            footprint[cl.pk, item_id, variation_id, 'position_count'] += 1
+            footprint[cl.pk, item_id, variation_id, 'checkin_count'] += checked_in
+            footprint[cl.pk, item_id, variation_id, 'inside_count'] += inside
+    return footprint
+
+
+@contextmanager
+def track_checkin_counters(order):
+    """
+    Wrap any code changing the status or the positions of an existing order in this context manager to keep the
+    check-in list counters up to date. Needs to be used inside the database transaction performing the change.
+    """
+    if not settings.CHECKIN_COUNTERS_ENABLED or not order.pk:
+        yield
+        return
+
+    lists, limit_products = _counted_lists(order.event_id)
+    if not lists:
+        yield
+        return
+
+    before = _order_footprint(order.pk, lists, limit_products)
+    yield
+    after = _order_footprint(order.pk, lists, limit_products)
+    after.subtract(before)
+    _apply_delta(after)
+
+
+def count_new_order_on_checkin_lists(order):
+    """
+    Adds a newly created order to the check-in list counters. Needs to be called inside the database transaction
+    creating the order.
+    """
+    if not settings.CHECKIN_COUNTERS_ENABLED:
+        return
+    lists, limit_products = _counted_lists(order.event_id)
+    if lists:
+        _apply_delta(_order_footprint(order.pk, lists, limit_products))
+
+
+@scopes_disabled()
+def _position_scans(position_id, list_id):
+    return list(Checkin.objects.filter(position_id=position_id, list_id=list_id).values_list('type', 'datetime'))
+
+
+@contextmanager
+def track_checkin(checkin):
+    """
+    Wrap the creation or deletion of a single check-in in this context manager to keep the counters of its list up
+    to date. This is done by ``Checkin.save()`` and ``Checkin.delete()``, but not by bulk operations on querysets.
+    """
+    if not settings.CHECKIN_COUNTERS_ENABLED or not checkin.position_id or not checkin.list_id:
+        yield
+        return
+
+    if not CheckinListCounter.objects.filter(checkin_list_id=checkin.list_id).exists():
+        # Counters are created from scratch when the status of the list is requested for the first time
+        yield
+        return
+
+    before = _scan_state(_position_scans(checkin.position_id, checkin.list_id))
+    yield
+    after = _scan_state(_position_scans(checkin.position_id, checkin.list_id))
+    if before == after:
+        # Most scans on lists allowing multiple entries end up here without any further query
+        return
+
+    op = checkin.position
+    clist = checkin.list
+    limit_product_ids = (
+        set() if clist.all_products else set(clist.limit_products.filter(pk=op.item_id).values_list('pk', flat=True))
+    )
+    if _position_valid(clist, limit_product_ids, op.item_id, op.subevent_id, op.canceled, op.order.status,
+                       op.order.valid_if_pending):
+        _apply_delta({
+            (clist.pk, op.item_id, op.variation_id, 'checkin_count'): after[0] - before[0],
+            (clist.pk, op.item_id, op.variation_id, 'inside_count'): after[1] - before[1],
+        })
+
+
+@scopes_disabled()
+def _count_from_scratch(clist):
+    counts = defaultdict(lambda: [0, 0, 0])
+    pqs = clist.positions.order_by()
+    cqs = pqs.filter(
+        Exists(Checkin.objects.filter(list_id=clist.pk, position=OuterRef('pk'), type=Checkin.TYPE_ENTRY))
+    )
+    iqs = clist.positions_inside.order_by()
+    for i, qs in enumerate((pqs, cqs, iqs)):
+        for r in qs.values('item_id', 'variation_id').annotate(c=Count('*')):
+            counts[r['item_id'], r['variation_id']][i] = r['c']
+
+    # Make sure every product of the list has a counter, even if nothing has been sold yet
+    items = clist.event.items if clist.all_products else clist.limit_products
+    item_ids = set(items.values_list('pk', flat=True))
+    with_variations = set()
+    for item_id, variation_id in ItemVariation.objects.filter(item_id__in=item_ids).values_list('item_id', 'pk'):
+        counts.setdefault((item_id, variation_id), [0, 0, 0])
+        with_variations.add(item_id)
+    for item_id in item_ids - with_variations:
+        counts.setdefault((item_id, None), [0, 0, 0])
+    return counts
+
+
+@scopes_disabled()
+def reconcile_checkin_list_counters(clist):
+    """
+    Recounts the counters of the given check-in list from scratch and creates missing counters.
+    """
+    with transaction.atomic():
+        # Serializes concurrent rebuilds of the same list, so we never create duplicate counters
+        CheckinList.objects.select_for_update().filter(pk=clist.pk).order_by().first()
+        # Locking the counters first makes sure that concurrent transactions applying deltas either commit before we
+        # count (and we see their changes) or apply their delta after we are done.
+        existing = {
+            (c.item_id, c.variation_id): c
+            for c in CheckinListCounter.objects.select_for_update().filter(checkin_list=clist).order_by('pk')
+        }
+
+        counts = _count_from_scratch(clist)
+
+        now_dt = now()
+        to_create = []
+        for key, values in counts.items():
+            c = existing.get(key)
+            if not c:
+                to_create.append(CheckinListCounter(
+                    checkin_list=clist, item_id=key[0], variation_id=key[1], position_count=values[0],
+                    checkin_count=values[1], inside_count=values[2], reconciled=now_dt,
+                ))
+                continue
+            if [c.position_count, c.checkin_count, c.inside_count] != values:
+                logger.info(
+                    f'Repaired drift in check-in list counter for list {clist.pk}, product {key[0]}, variation '
+                    f'{key[1]}: {[c.position_count, c.checkin_count, c.inside_count]} -> {values}'
+                )
+            c.position_count, c.checkin_count, c.inside_count = values
+            c.reconciled = now_dt
+        for key, c in existing.items():
+            if key not in counts:
+                c.position_count = c.checkin_count = c.inside_count = 0
+                c.reconciled = now_dt
+        CheckinListCounter.objects.bulk_update(
+            existing.values(), ['position_count', 'checkin_count', 'inside_count', 'reconciled']
+        )
+        CheckinListCounter.objects.bulk_create(to_create)
+
+
+def checkin_list_counts(clist, expected=()):
+    """
+    Returns the statistics of a check-in list as a dictionary mapping ``(item_id, variation_id)`` to a tuple of
+    ``(position_count, checkin_count, inside_count)``, based on the counters. The counters are created first if
+    they do not exist yet or if any of the ``(item_id, variation_id)`` pairs in ``expected`` is missing.
+
+    Returns ``None`` if counters are disabled, in which case the caller needs to count on its own.
+    """
+    if not settings.CHECKIN_COUNTERS_ENABLED:
+        return None
+
+    def _read():
+        return {
+            (c[0], c[1]): c[2:]
+            for c in CheckinListCounter.objects.filter(checkin_list=clist).values_list(
+                'item_id', 'variation_id', 'position_count', 'checkin_count', 'inside_count',
+            )
+        }
+
+    counts = _read()
+    if not counts or any(key not in counts for key in expected):
+        reconcile_checkin_list_counters(clist)
+        counts = _read()
+    return counts
+
+
+@receiver(post_save, sender=CheckinList, dispatch_uid="checkincounters_list_saved")
+def _drop_counters_on_list_change(sender, instance, created, update_fields=None, **kwargs):
+    if not settings.CHECKIN_COUNTERS_ENABLED or created:
+        return
+    if update_fields and not LIST_FIELDS.intersection(update_fields):
+        return
+    CheckinListCounter.objects.filter(checkin_list=instance).delete()
+
+
+@receiver(m2m_changed, sender=CheckinList.limit_products.through, dispatch_uid="checkincounters_list_products")
+def _drop_counters_on_list_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not settings.CHECKIN_COUNTERS_ENABLED or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        CheckinListCounter.objects.filter(checkin_list=instance).delete()
+    elif pk_set:
+        CheckinListCounter.objects.filter(checkin_list_id__in=pk_set).delete()
+    else:
+        CheckinListCounter.objects.filter(checkin_list__event_id=instance.event_id).delete()
+
+
+@receiver(signal=periodic_task)
+@scopes_disabled()
+@minimum_interval(minutes_after_success=5)
+def reconcile_checkin_list_counters_periodic(sender, **kwargs):
+    if not settings.CHECKIN_COUNTERS_ENABLED:
+        return
+
+    qs = CheckinList.objects.annotate(
+        last_reconciled=Subquery(
+            CheckinListCounter.objects.filter(checkin_list=OuterRef('pk')).order_by('reconciled').values('reconciled')[:1]
+        )
+    ).filter(
+        last_reconciled__lt=now() - RECONCILIATION_INTERVAL,
+    ).filter(
+        Exists(Order.objects.filter(
+            event_id=OuterRef('event_id'),
+            last_modified__gt=OuterRef('last_reconciled'),
+        ))
+    ).select_related('event').order_by('event_id', 'pk')
+
+    for cl in qs.iterator():
+        reconcile_checkin_list_counters(cl)
@@ -0,0 +1,159 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+Optional lookup index from ticket secrets to order positions for the check-in redeem endpoint.
+
+Searching a scanned barcode across all check-in lists of a device is an expensive query, since it needs to look at
+both the secret of a position and the secret of its parent position for add-on matching. If ``[checkin] index``
+is enabled, we keep a mapping of ``(event, secret)`` to position IDs in the cache, so the redeem endpoint can load
+the positions by their primary keys instead.
+
+The index is built for a whole event in the background as soon as the event's check-in lists are used, and kept
+current by the order signals as well as by everything the redeem endpoint learns from full searches. Since secrets
+can change through many code paths, a hit from the index is never trusted blindly: the redeem endpoint verifies
+the secret of the positions it loads and falls back to the full search if it does not match. A miss in the index
+always falls back to the full search as well, so an incomplete index only costs performance. The index is only
+used if it has been built for all events the scan is looked up in.
+"""
+import hashlib
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from pretix.base.metrics import pretix_checkin_index_lookups_total
+from pretix.base.models import Event, OrderPosition
+from pretix.base.services.tasks import EventTask
+from pretix.base.signals import order_changed, order_placed
+from pretix.celery_app import app
+
+logger = logging.getLogger(__name__)
+
+# Entries are dropped after some time without being refreshed. The marker that an event's index has been built
+# expires earlier, so the index is rebuilt before its oldest entries expire.
+INDEX_TIMEOUT = 24 * 3600
+INDEX_READY_TIMEOUT = 12 * 3600
+BUILD_BATCH_SIZE = 5000
+
+
+def checkin_index_enabled():
+    # With a dummy cache, every lookup would be a miss and trigger another build of the index
+    return settings.CHECKIN_INDEX_ENABLED and settings.REAL_CACHE_USED
+
+
+def _entry_key(event_id, secret):
+    # Secrets may contain characters that are not allowed in cache keys and may be longer than allowed
+    return 'pretix_checkin_index_{}_{}'.format(event_id, hashlib.sha256(secret.encode()).hexdigest())
+
+
+def _ready_key(event_id):
+    return f'pretix_checkin_index_{event_id}_ready'
+
+
+def _building_key(event_id):
+    return f'pretix_checkin_index_{event_id}_building'
+
+
+def lookup_positions(event_ids, secret):
+    """
+    Returns the IDs of the positions in one of the events ``event_ids`` that had the secret ``secret`` when they
+    were indexed, or an empty set if the index does not know the secret. Returns ``None`` if any of the events does
+    not have a complete index yet, since positions of that event could be missing from the result. Starts building
+    the index of those events.
+    """
+    entry_keys = [_entry_key(event_id, secret) for event_id in event_ids]
+    ready_keys = {event_id: _ready_key(event_id) for event_id in event_ids}
+    found = cache.get_many(entry_keys + list(ready_keys.values()))
+
+    all_ready = True
+    for event_id, key in ready_keys.items():
+        if key not in found:
+            all_ready = False
+            if cache.add(_building_key(event_id), True, timeout=3600):
+                build_checkin_index.apply_async(kwargs={'event': event_id})
+    if not all_ready:
+        return None
+
+    position_ids = set()
+    for key in entry_keys:
+        position_ids.update(found.get(key, ()))
+    return position_ids
+
+
+def record_lookup(result):
+    if settings.METRICS_ENABLED:
+        pretix_checkin_index_lookups_total.inc(result=result)
+
+
+def index_positions(positions):
+    """
+    Adds the given positions to the index with their current secrets. Existing entries for the same secrets are
+    kept, since secrets are not guaranteed to be unique.
+    """
+    new_entries = defaultdict(set)
+    for op in positions:
+        new_entries[_entry_key(op.order.event_id, op.secret)].add(op.pk)
+    if not new_entries:
+        return
+    existing = cache.get_many(list(new_entries))
+    cache.set_many({
+        key: sorted(ids | set(existing.get(key, ())))
+        for key, ids in new_entries.items()
+    }, timeout=INDEX_TIMEOUT)
+
+
+@app.task(base=EventTask)
+def build_checkin_index(event: Event):
+    try:
+        entries = defaultdict(list)
+        qs = OrderPosition.objects.filter(order__event=event).order_by('secret', 'pk').values_list('pk', 'secret')
+        for pk, secret in qs.iterator(chunk_size=BUILD_BATCH_SIZE):
+            key = _entry_key(event.pk, secret)
+            if key not in entries and len(entries) >= BUILD_BATCH_SIZE:
+                # Positions with the same secret are adjacent, so no entry is split between two batches
+                cache.set_many(entries, timeout=INDEX_TIMEOUT)
+                entries.clear()
+            entries[key].append(pk)
+        if entries:
+            cache.set_many(entries, timeout=INDEX_TIMEOUT)
+        cache.set(_ready_key(event.pk), True, timeout=INDEX_READY_TIMEOUT)
+    finally:
+        cache.delete(_building_key(event.pk))
+
+
+def _index_order(order):
+    if not checkin_index_enabled() or cache.get(_ready_key(order.event_id)) is None:
+        # Events without an index are indexed completely as soon as they are needed
+        return
+    index_positions(order.positions.select_related('order'))
+
+
+@receiver(order_placed, dispatch_uid="checkinindex_order_placed")
+def index_order_placed(sender, order, **kwargs):
+    _index_order(order)
+
+
+@receiver(order_changed, dispatch_uid="checkinindex_order_changed")
+def index_order_changed(sender, order, **kwargs):
+    _index_order(order)
@@ -0,0 +1,322 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+Offline data for scanning devices.
+
+Devices that validate tickets offline keep a local copy of all positions of a check-in list. They can either page
+through the keyset-paginated sync feed from the start, or bootstrap from a snapshot: a gzip-compressed SQLite
+database with all positions, check-ins, products, variations, dates, check-in questions and revoked secrets of
+the list, built in the background and shared by all devices using the same list. The snapshot contains a sync
+cursor, so devices can switch to the sync feed right after importing it.
+
+Snapshots are rebuilt when they are older than ``SNAPSHOT_MAX_AGE``, when the configuration of the list changes, or
+when the event cache is cleared, e.g. because products or questions changed. Changes to orders in between are
+picked up by the sync feed.
+"""
+import base64
+import binascii
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.core.files import File
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from pretix.base.models import (
+    CachedFile, Checkin, CheckinList, Event, ItemVariation, OrderPosition,
+    cachedfile_name,
+)
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+from pretix.helpers import repeatable_reads_transaction
+
+# Changes younger than this are not part of the sync feed yet, since transactions that started before them could
+# still commit an order with an earlier modification time.
+SYNC_SETTLE_TIME = timedelta(seconds=5)
+
+# Transactions that run longer than SYNC_SETTLE_TIME can still commit changes behind a cursor the device already
+# received. Once a device has caught up, its cursor is therefore moved back by this window, so these changes are sent
+# on the next sync. Everything changed within the window is sent again on every poll, e.g. all recent check-ins
+# during peak entry, so this only covers the usual commit delay.
+SYNC_OVERLAP = timedelta(seconds=10)
+
+SNAPSHOT_MAX_AGE = timedelta(hours=1)
+
+# A snapshot that has not been written after this time is considered failed and will be started again
+SNAPSHOT_BUILD_TIMEOUT = timedelta(minutes=15)
+
+SNAPSHOT_BATCH_SIZE = 5000
+
+SNAPSHOT_SCHEMA_VERSION = 1
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE positions (
+    id INTEGER PRIMARY KEY, order_code TEXT, positionid INTEGER, item INTEGER, variation INTEGER,
+    subevent INTEGER, secret TEXT, attendee_name TEXT, addon_to INTEGER, blocked TEXT, valid_from TEXT,
+    valid_until TEXT, canceled INTEGER, require_attention INTEGER, order_status TEXT,
+    order_valid_if_pending INTEGER
+);
+CREATE INDEX positions_secret ON positions (secret);
+CREATE TABLE checkins (position INTEGER, type TEXT, datetime TEXT);
+CREATE INDEX checkins_position ON checkins (position);
+CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, admission INTEGER);
+CREATE TABLE variations (id INTEGER PRIMARY KEY, item INTEGER, value TEXT);
+CREATE TABLE subevents (id INTEGER PRIMARY KEY, name TEXT, date_from TEXT, date_to TEXT);
+CREATE TABLE questions (
+    id INTEGER PRIMARY KEY, question TEXT, type TEXT, required INTEGER, ask_during_checkin INTEGER,
+    show_during_checkin INTEGER, items TEXT, options TEXT
+);
+CREATE TABLE revoked_secrets (secret TEXT PRIMARY KEY);
+"""
+
+
+def sync_positions_queryset(clist):
+    """
+    Returns all positions that are part of the offline data of a check-in list. Unlike ``CheckinList.positions``,
+    this includes canceled positions and positions of orders that are not paid, so devices learn about tickets
+    that are no longer valid.
+    """
+    qs = OrderPosition.all.filter(order__event_id=clist.event_id)
+    if clist.subevent_id:
+        qs = qs.filter(subevent_id=clist.subevent_id)
+    if not clist.all_products:
+        qs = qs.filter(item__in=clist.limit_products.values_list('id', flat=True))
+    return qs
+
+
+def encode_sync_cursor(last_modified, pk):
+    return base64.urlsafe_b64encode(f'{last_modified.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_sync_cursor(cursor):
+    """
+    Returns the ``(last_modified, pk)`` tuple encoded in a sync cursor or raises ``ValueError``.
+    """
+    try:
+        last_modified, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        last_modified = parse_datetime(last_modified)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Invalid cursor.')
+    if not last_modified:
+        raise ValueError('Invalid cursor.')
+    return last_modified, pk
+
+
+def sync_resume_cursor(last_modified):
+    """
+    Returns the cursor a device should continue with after it has received all changes up to ``last_modified``.
+    """
+    return encode_sync_cursor(last_modified - SYNC_OVERLAP, 0)
+
+
+def filter_sync_cursor(qs, cursor):
+    last_modified, pk = decode_sync_cursor(cursor)
+    return qs.filter(Q(order__last_modified__gt=last_modified) | Q(order__last_modified=last_modified, pk__gt=pk))
+
+
+def _snapshot_cache_key(clist):
+    return f'checkin_snapshot_{clist.pk}'
+
+
+def _dt(value):
+    return value.isoformat() if value else None
+
+
+def _i18n(value):
+    return json.dumps(value.data if hasattr(value, 'data') else value)
+
+
+def _insert_batched(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SNAPSHOT_BATCH_SIZE:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def _write_snapshot(clist, conn):
+    event = clist.event
+    conn.executescript(SNAPSHOT_SCHEMA)
+
+    positions = sync_positions_queryset(clist).order_by().values_list(
+        'id', 'order__code', 'positionid', 'item_id', 'variation_id', 'subevent_id', 'secret',
+        'attendee_name_cached', 'addon_to__attendee_name_cached', 'order__invoice_address__name_cached',
+        'addon_to_id', 'blocked', 'valid_from', 'valid_until', 'canceled', 'order__checkin_attention',
+        'item__checkin_attention', 'variation__checkin_attention', 'order__status', 'order__valid_if_pending',
+    )
+    _insert_batched(conn, 'INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+        (
+            pk, code, positionid, item_id, variation_id, subevent_id, secret,
+            attendee_name or addon_attendee_name or invoice_name or None,
+            addon_to_id, json.dumps(blocked) if blocked else None, _dt(valid_from), _dt(valid_until), canceled,
+            bool(order_attention or item_attention or variation_attention), status, valid_if_pending,
+        )
+        for (
+            pk, code, positionid, item_id, variation_id, subevent_id, secret,
+            attendee_name, addon_attendee_name, invoice_name,
+            addon_to_id, blocked, valid_from, valid_until, canceled,
+            order_attention, item_attention, variation_attention, status, valid_if_pending,
+        ) in positions.iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+    ))
+
+    checkins = Checkin.objects.filter(list=clist).order_by().values_list('position_id', 'type', 'datetime')
+    _insert_batched(conn, 'INSERT INTO checkins VALUES (?, ?, ?)', (
+        (position_id, t, _dt(dt)) for position_id, t, dt in checkins.iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+    ))
+
+    items = list(event.items.all() if clist.all_products else clist.limit_products.all())
+    conn.executemany('INSERT INTO items VALUES (?, ?, ?)', [
+        (i.pk, _i18n(i.name), i.admission) for i in items
+    ])
+    conn.executemany('INSERT INTO variations VALUES (?, ?, ?)', [
+        (v.pk, v.item_id, _i18n(v.value)) for v in ItemVariation.objects.filter(item__in=items)
+    ])
+
+    if event.has_subevents:
+        subevents = [clist.subevent] if clist.subevent else event.subevents.all()
+        conn.executemany('INSERT INTO subevents VALUES (?, ?, ?, ?)', [
+            (s.pk, _i18n(s.name), _dt(s.date_from), _dt(s.date_to)) for s in subevents
+        ])
+
+    questions = event.questions.filter(
+        Q(ask_during_checkin=True) | Q(show_during_checkin=True)
+    ).prefetch_related('items', 'options')
+    conn.executemany('INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        (
+            q.pk, _i18n(q.question), q.type, q.required, q.ask_during_checkin, q.show_during_checkin,
+            json.dumps([i.pk for i in q.items.all()]),
+            json.dumps([{'id': o.pk, 'identifier': o.identifier, 'answer': o.answer.data} for o in q.options.all()]),
+        )
+        for q in questions
+    ])
+
+    _insert_batched(conn, 'INSERT OR IGNORE INTO revoked_secrets VALUES (?)', (
+        (s,) for s in event.revoked_secrets.values_list('secret', flat=True).iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+    ))
+
+
+def _build_snapshot(event, clist, cf):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'snapshot.sqlite3')
+        conn = sqlite3.connect(path)
+        try:
+            # Changes made while we are reading will be contained in the sync feed starting at this cursor
+            cursor = sync_resume_cursor(now() - SYNC_SETTLE_TIME)
+            with repeatable_reads_transaction():
+                _write_snapshot(clist, conn)
+            conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('schema_version', str(SNAPSHOT_SCHEMA_VERSION)),
+                ('event', event.slug),
+                ('list', str(clist.pk)),
+                ('created', now().isoformat()),
+                ('sync_cursor', cursor),
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+        with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        with open(path + '.gz', 'rb') as f:
+            cf.file.save(cachedfile_name(cf, cf.filename), File(f))
+
+
+@app.task(base=EventTask)
+def build_checkin_snapshot(event: Event, list_id: int, fileid: str):
+    clist = event.checkin_lists.get(pk=list_id)
+    cf = CachedFile.objects.get(id=fileid)
+    cache_key = _snapshot_cache_key(clist)
+    try:
+        _build_snapshot(event, clist, cf)
+    except Exception:
+        # Without this, devices would be told to wait for this build until SNAPSHOT_BUILD_TIMEOUT has passed
+        if event.cache.get(cache_key) == fileid:
+            event.cache.delete(cache_key)
+        raise
+    # The build marker expires after SNAPSHOT_BUILD_TIMEOUT, keep the finished snapshot for longer unless it has
+    # been invalidated in the meantime
+    if event.cache.get(cache_key) == fileid:
+        event.cache.set(cache_key, fileid, int(SNAPSHOT_MAX_AGE.total_seconds()))
+
+
+def get_checkin_snapshot(clist):
+    """
+    Returns the ``CachedFile`` holding the current snapshot of the given check-in list. If there is no recent
+    snapshot, a new one is built in the background and the returned ``CachedFile`` does not have a file yet.
+    Returns ``None`` if another request has just started a build.
+    """
+    cache_key = _snapshot_cache_key(clist)
+    cfid = clist.event.cache.get(cache_key)
+    if cfid:
+        cf = CachedFile.objects.filter(id=cfid).first()
+        if cf and (cf.file or cf.date > now() - SNAPSHOT_BUILD_TIMEOUT):
+            return cf
+
+    # Many devices might ask for a snapshot at the same moment, only one of them may start the build. The marker
+    # expires after SNAPSHOT_BUILD_TIMEOUT, so a build that got lost, e.g. because the worker died, is started again.
+    fileid = uuid.uuid4()
+    if not clist.event.cache.add(cache_key, str(fileid), int(SNAPSHOT_BUILD_TIMEOUT.total_seconds())):
+        return CachedFile.objects.filter(id=clist.event.cache.get(cache_key)).first()
+
+    cf = CachedFile.objects.create(
+        id=fileid,
+        web_download=False,
+        date=now(),
+        expires=now() + SNAPSHOT_MAX_AGE + SNAPSHOT_BUILD_TIMEOUT,
+        filename=f'checkin_list_{clist.pk}.sqlite3.gz',
+        type='application/gzip',
+    )
+    build_checkin_snapshot.apply_async(args=(clist.event_id,), kwargs={'list_id': clist.pk, 'fileid': str(cf.pk)})
+    cf.refresh_from_db()
+    return cf
+
+
+@receiver(post_save, sender=CheckinList, dispatch_uid="checkinsnapshot_list_saved")
+def _drop_snapshot_on_list_change(sender, instance, created, **kwargs):
+    if not created:
+        instance.event.cache.delete(_snapshot_cache_key(instance))
+
+
+@receiver(m2m_changed, sender=CheckinList.limit_products.through, dispatch_uid="checkinsnapshot_list_products")
+def _drop_snapshot_on_list_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.event.cache.delete(_snapshot_cache_key(instance))
+    elif pk_set:
+        instance.event.cache.delete_many([f'checkin_snapshot_{pk}' for pk in pk_set])
+    else:
+        instance.event.cache.clear()
@@ -19,10 +19,13 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import logging
+import time
 from datetime import timedelta
 
 from django.conf import settings
 from django.core.management import call_command
+from django.db import transaction
 from django.db.models import Exists, OuterRef
 from django.dispatch import receiver
 from django.utils.timezone import now
@@ -31,19 +34,51 @@ from django_scopes import scopes_disabled
 from pretix.base.models import CachedCombinedTicket, CachedTicket, OutgoingMail
 from pretix.base.models.customers import CustomerSSOGrant
 
+from ..metrics import pretix_cleanup_cart_positions_deleted_total
 from ..models import CachedFile, CartPosition, InvoiceAddress
 from ..models.auth import UserKnownLoginSource
 from ..models.orders import CheckoutSession
 from ..signals import periodic_task
 
+logger = logging.getLogger(__name__)
+
+
+def _delete_expired_cart_positions(cutoff, deadline):
+    """
+    Deletes cart positions that expired before ``cutoff`` in chunks of ``CLEANUP_CART_BATCH_SIZE`` rows, add-ons first
+    since their parents are protected from deletion. Stops early if ``deadline`` has been reached, the remaining rows
+    are deleted in the next run. Returns the number of deleted cart positions.
+    """
+    deleted = 0
+    for addons in (True, False):
+        while time.monotonic() < deadline:
+            # Ordering by expires allows the database to walk the index on CartPosition.expires
+            pks = list(
+                CartPosition.objects.filter(expires__lt=cutoff, addon_to__isnull=not addons).order_by(
+                    'expires'
+                ).values_list('pk', flat=True)[:settings.CLEANUP_CART_BATCH_SIZE]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                for qs in (CartPosition.objects.filter(addon_to_id__in=pks), CartPosition.objects.filter(pk__in=pks)):
+                    _, counts = qs.delete()
+                    deleted += counts.get(CartPosition._meta.label, 0)
+    return deleted
+
 
 @receiver(signal=periodic_task)
 @scopes_disabled()
 def clean_cart_positions(sender, **kwargs):
-    for cp in CartPosition.objects.filter(expires__lt=now() - timedelta(days=14), addon_to__isnull=False):
-        cp.delete()
-    for cp in CartPosition.objects.filter(expires__lt=now() - timedelta(days=14), addon_to__isnull=True):
-        cp.delete()
+    deleted = _delete_expired_cart_positions(
+        cutoff=now() - timedelta(days=14),
+        deadline=time.monotonic() + settings.CLEANUP_CART_TIME_BUDGET,
+    )
+    if deleted:
+        logger.info(f'Deleted {deleted} expired cart positions')
+        if settings.METRICS_ENABLED:
+            pretix_cleanup_cart_positions_deleted_total.inc(deleted)
+
     for cs in CheckoutSession.objects.filter(created__lt=now() - timedelta(days=14)).exclude(
         Exists(CartPosition.objects.filter(cart_id=OuterRef("cart_id")))
     ):
@@ -36,6 +36,7 @@ import inspect
 import logging
 from datetime import timedelta
 from decimal import ROUND_HALF_UP, Decimal
+from time import monotonic
 
 from django.conf import settings
 from django.core.files.base import ContentFile
@@ -56,12 +57,12 @@ from pretix.base.invoicing.transmission import (
     get_transmission_types, transmission_providers,
 )
 from pretix.base.models import (
-    ExchangeRate, Invoice, InvoiceAddress, InvoiceLine, Order, OrderFee,
+    Event, ExchangeRate, Invoice, InvoiceAddress, InvoiceLine, Order, OrderFee,
 )
 from pretix.base.models.orders import OrderPayment
 from pretix.base.models.tax import EU_CURRENCIES
 from pretix.base.services.tasks import (
-    TransactionAwareProfiledEventTask, TransactionAwareTask,
+    ProfiledEventTask, TransactionAwareProfiledEventTask, TransactionAwareTask,
 )
 from pretix.base.signals import (
     build_invoice_data, invoice_line_text, periodic_task,
@@ -69,9 +70,12 @@ from pretix.base.signals import (
 from pretix.celery_app import app
 from pretix.helpers.database import OF_SELF, rolledback_transaction
 from pretix.helpers.models import modelcopy
+from pretix.helpers.processpool import process_pool
 
 logger = logging.getLogger(__name__)
 
+INVOICE_PDF_CHUNK_SIZE = 50
+
 
 def _location_oneliner(loc):
     return ', '.join([l.strip() for l in loc.splitlines() if l and l.strip()])
@@ -526,13 +530,106 @@ def invoice_pdf_task(invoice: int):
     with scope(organizer=i.order.event.organizer):
         if i.shredded:
             return None
-        if i.file:
-            i.file.delete()
-        with language(i.locale, i.event.settings.region):
-            fname, ftype, fcontent = i.event.invoice_renderer.generate(i)
-            i.file.save(fname, ContentFile(fcontent), save=False)
-            i.save(update_fields=['file'])
-            return i.file.name
+        _store_invoice_pdf(i, i.event.invoice_renderer)
+        return i.file.name
+
+
+def _store_invoice_pdf(i: Invoice, renderer):
+    if i.file:
+        i.file.delete()
+    with language(i.locale, i.event.settings.region):
+        fname, ftype, fcontent = renderer.generate(i)
+        i.file.save(fname, ContentFile(fcontent), save=False)
+        i.save(update_fields=['file'])
+
+
+# Renderers kept by a batch rendering process, keyed by event ID. A renderer only registers its fonts and builds its
+# stylesheet once, so reusing it for all invoices of an event is what makes batch rendering cheap.
+_batch_invoice_renderers = {}
+
+
+def _reset_batch_invoice_renderers():
+    _batch_invoice_renderers.clear()
+
+
+def _render_invoice_pdf_chunk(args):
+    event_id, invoice_ids = args
+    renderer = _batch_invoice_renderers.get(event_id)
+    if renderer is None:
+        with scopes_disabled():
+            event = Event.objects.select_related('organizer').get(pk=event_id)
+        renderer = _batch_invoice_renderers[event_id] = event.invoice_renderer
+    event = renderer.event
+
+    rendered = failed = 0
+    with scope(organizer=event.organizer):
+        for i in event.invoices.filter(pk__in=invoice_ids, shredded=False).select_related('order'):
+            i.event = event
+            try:
+                _store_invoice_pdf(i, renderer)
+                rendered += 1
+            except Exception:
+                logger.exception('Could not render PDF of invoice %s', i.full_invoice_no)
+                failed += 1
+    return rendered, failed
+
+
+@app.task(base=ProfiledEventTask, bind=True)
+def invoice_pdf_batch_task(self, event: Event, invoices: list = None, processes: int = None) -> dict:
+    """
+    Renders the PDF files of many invoices of an event, e.g. after the invoice layout has been changed. If no list of
+    invoice IDs is given, all invoices of the event are rendered. The work is split into chunks that are distributed
+    across a pool of ``processes`` worker processes (``PDF_RENDERING_PROCESSES`` by default), each of which keeps one
+    initialized renderer for the event.
+    """
+    qs = event.invoices.filter(shredded=False)
+    if invoices is not None:
+        qs = qs.filter(pk__in=invoices)
+    invoice_ids = list(qs.order_by('pk').values_list('pk', flat=True))
+    chunks = [
+        (event.pk, invoice_ids[i:i + INVOICE_PDF_CHUNK_SIZE])
+        for i in range(0, len(invoice_ids), INVOICE_PDF_CHUNK_SIZE)
+    ]
+    processes = min(processes or settings.PDF_RENDERING_PROCESSES, len(chunks))
+
+    result = {
+        'total': len(invoice_ids),
+        'rendered': 0,
+        'failed': 0,
+        'seconds': 0,
+        'invoices_per_second': 0,
+    }
+    self.update_state(
+        state='PROGRESS',
+        meta={'value': 0}
+    )
+    started = monotonic()
+
+    def _chunk_results():
+        if processes > 1:
+            with process_pool(processes, initializer=_reset_batch_invoice_renderers) as pool:
+                yield from pool.imap_unordered(_render_invoice_pdf_chunk, chunks)
+        else:
+            _reset_batch_invoice_renderers()
+            for chunk in chunks:
+                yield _render_invoice_pdf_chunk(chunk)
+            _reset_batch_invoice_renderers()
+
+    for rendered, failed in _chunk_results():
+        result['rendered'] += rendered
+        result['failed'] += failed
+        if not self.request.called_directly:
+            self.update_state(
+                state='PROGRESS',
+                meta={'value': round((result['rendered'] + result['failed']) / len(invoice_ids) * 100, 2)}
+            )
+
+    result['seconds'] = round(monotonic() - started, 2)
+    if result['seconds']:
+        result['invoices_per_second'] = round(result['rendered'] / result['seconds'], 2)
+    logger.info('Rendered %d invoice PDFs of event %s in %.2f seconds using %d processes, %d failed.',
+                result['rendered'], event.slug, result['seconds'], max(processes, 1), result['failed'])
+    return result
 
 
 def invoice_qualified(order: Order):
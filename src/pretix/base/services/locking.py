@@ -20,14 +20,23 @@
 # <https://www.gnu.org/licenses/>.
 #
 
+import contextvars
 import logging
+import time
+from functools import partial
 from itertools import groupby
 
 from django.conf import settings
-from django.db import DatabaseError, connection
+from django.db import DatabaseError, connection, transaction
 from django.utils.timezone import now
 
+from pretix.base.metrics import (
+    execute_redis_pipeline, get_redis_pipeline, pretix_lock_keys_per_call,
+    pretix_lock_shared_fallback_total, pretix_lock_timeouts_total,
+    pretix_lock_wait_seconds,
+)
 from pretix.base.models import Event, Membership, Quota, Seat, Voucher
+from pretix.helpers.timing import phase_timer_var
 from pretix.testutils.middleware import debugflags_var
 
 logger = logging.getLogger('pretix.base.locking')
@@ -68,6 +77,14 @@ def pg_lock_key(obj):
     return key
 
 
+# Lock acquisitions taking longer than LOCK_SLOW_THRESHOLD seconds are logged with the objects involved to find out
+# which quotas, vouchers, or seats are contended
+LOCK_SLOW_THRESHOLD = 1
+
+# If this is set to a list, lock_objects() appends the time in seconds it spent acquiring locks, e.g. for benchmarks
+lock_wait_times_var = contextvars.ContextVar('lock_wait_times', default=None)
+
+
 class LockTimeoutException(Exception):
     pass
 
@@ -97,29 +114,92 @@ def lock_objects(objects, *, shared_lock_objects=None, replace_exclusive_with_sh
             "You cannot create locks outside of an transaction"
         )
 
-    if 'postgresql' in settings.DATABASES['default']['ENGINE']:
-        shared_keys = set(pg_lock_key(obj) for obj in shared_lock_objects) if shared_lock_objects else set()
+    objects = list(objects)
+    shared_lock_objects = list(shared_lock_objects or [])
+    use_shared_fallback = bool(
+        replace_exclusive_with_shared_when_exclusive_are_more_than and shared_lock_objects and
+        len(set(objects)) > replace_exclusive_with_shared_when_exclusive_are_more_than
+    )
+
+    t0 = time.monotonic()
+    timed_out = False
+    try:
+        if 'postgresql' in settings.DATABASES['default']['ENGINE']:
+            _lock_objects_postgres(objects, shared_lock_objects, use_shared_fallback)
+        else:
+            for model, instances in groupby(objects, key=lambda o: type(o)):
+                model.objects.select_for_update().filter(pk__in=[o.pk for o in instances])
+    except LockTimeoutException:
+        timed_out = True
+        raise
+    finally:
+        wait_time = time.monotonic() - t0
+        lock_wait_times = lock_wait_times_var.get()
+        if lock_wait_times is not None:
+            lock_wait_times.append(wait_time)
+        phase_timer = phase_timer_var.get()
+        if phase_timer is not None:
+            phase_timer.add('lock_wait', wait_time)
+        if settings.METRICS_ENABLED:
+            metrics = _collect_lock_metrics(objects, shared_lock_objects, use_shared_fallback) + (
+                use_shared_fallback, wait_time, timed_out
+            )
+            if timed_out:
+                # Nothing is held, so we can report right away
+                _record_lock_metrics(*metrics)
+            else:
+                # Talking to Redis while holding the locks would make everyone else wait for it, too. The locks are
+                # only released at the end of the transaction, so we report afterwards. Calls in transactions that
+                # are rolled back are not recorded.
+                transaction.on_commit(partial(_record_lock_metrics, *metrics))
+        if wait_time > LOCK_SLOW_THRESHOLD and not timed_out:
+            logger.warning(
+                f"Waited {wait_time:.2f}s for locks on "
+                f"{', '.join(f'{type(o).__name__} {o.pk}' for o in objects or shared_lock_objects)}"
+            )
+
+
+def _lock_objects_postgres(objects, shared_lock_objects, use_shared_fallback):
+    shared_keys = set(pg_lock_key(obj) for obj in shared_lock_objects)
+    if use_shared_fallback:
+        exclusive_keys = shared_keys
+    else:
         exclusive_keys = set(pg_lock_key(obj) for obj in objects)
-        if replace_exclusive_with_shared_when_exclusive_are_more_than and shared_keys and \
-                len(exclusive_keys) > replace_exclusive_with_shared_when_exclusive_are_more_than:
-            exclusive_keys = shared_keys
-        keys = sorted(list(shared_keys | exclusive_keys))
-        calls = ", ".join([
-            (f"pg_advisory_xact_lock({k})" if k in exclusive_keys else f"pg_advisory_xact_lock_shared({k})") for k in keys
-        ])
-
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_ACQUISITION_TIMEOUT}s';")
-                cursor.execute(f"SELECT {calls};")
-                cursor.execute("SET LOCAL lock_timeout = '0';")  # back to default
-        except DatabaseError as e:
-            logger.warning(f"Waiting for locks timed out: {e} on SELECT {calls};")
-            raise LockTimeoutException()
+    keys = sorted(list(shared_keys | exclusive_keys))
+    calls = ", ".join([
+        (f"pg_advisory_xact_lock({k})" if k in exclusive_keys else f"pg_advisory_xact_lock_shared({k})") for k in keys
+    ])
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_ACQUISITION_TIMEOUT}s';")
+            cursor.execute(f"SELECT {calls};")
+            cursor.execute("SET LOCAL lock_timeout = '0';")  # back to default
+    except DatabaseError as e:
+        logger.warning(f"Waiting for locks timed out: {e} on SELECT {calls};")
+        raise LockTimeoutException()
+
 
+def _collect_lock_metrics(objects, shared_lock_objects, use_shared_fallback):
+    if use_shared_fallback:
+        locks = {(o, 'exclusive') for o in shared_lock_objects}
     else:
-        for model, instances in groupby(objects, key=lambda o: type(o)):
-            model.objects.select_for_update().filter(pk__in=[o.pk for o in instances])
+        locks = {(o, 'exclusive') for o in objects} | {(o, 'shared') for o in shared_lock_objects if o not in objects}
+    return len(locks), {(type(o)._meta.model_name, mode) for o, mode in locks}
+
+
+def _record_lock_metrics(num_keys, keyspaces, use_shared_fallback, wait_time, timed_out):
+    pipe = get_redis_pipeline()
+    if use_shared_fallback:
+        pretix_lock_shared_fallback_total.inc(1, pipeline=pipe)
+    pretix_lock_keys_per_call.observe(num_keys, pipeline=pipe)
+    # All locks of a call are acquired in a single statement, so every key space involved is attributed the full
+    # waiting time.
+    for keyspace, mode in keyspaces:
+        pretix_lock_wait_seconds.observe(wait_time, pipeline=pipe, keyspace=keyspace, mode=mode)
+        if timed_out:
+            pretix_lock_timeouts_total.inc(1, pipeline=pipe, keyspace=keyspace, mode=mode)
+    execute_redis_pipeline(pipe)
 
 
 class NoLockManager:
@@ -39,8 +39,12 @@ from pretix.base.models import (
     OrderPosition, User, Voucher,
 )
 from pretix.base.models.orders import Transaction
+from pretix.base.services.checkincounters import (
+    count_new_order_on_checkin_lists,
+)
 from pretix.base.services.invoices import generate_invoice, invoice_qualified
 from pretix.base.services.locking import lock_objects
+from pretix.base.services.quotacounters import count_new_order
 from pretix.base.services.tasks import ProfiledEventTask
 from pretix.base.signals import order_paid, order_placed
 from pretix.celery_app import app
@@ -216,6 +220,8 @@ def import_orders(event: Event, fileid: str, settings: dict, locale: str, user,
                     o._address.save()
                     for c in cols:
                         c.save(o)
+                    count_new_order(o)
+                    count_new_order_on_checkin_lists(o)
                     save_logentries.append(o.log_action(
                         'pretix.event.order.placed',
                         user=user,
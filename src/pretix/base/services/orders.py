@@ -40,8 +40,8 @@ import sys
 from collections import Counter, defaultdict, namedtuple
 from datetime import datetime, time, timedelta
 from decimal import Decimal
-from functools import reduce
-from time import sleep
+from functools import reduce, wraps
+from time import monotonic, sleep
 from typing import List, Optional
 
 from celery.exceptions import MaxRetriesExceededError
@@ -66,6 +66,10 @@ from pretix.base.decimal import round_decimal
 from pretix.base.email import get_email_context
 from pretix.base.i18n import get_language_without_region, language
 from pretix.base.media import MEDIA_TYPES
+from pretix.base.metrics import (
+    pretix_order_placement_phase_seconds, pretix_periodic_order_backlog,
+    pretix_periodic_order_delay_seconds,
+)
 from pretix.base.models import (
     CartPosition, Device, Event, GiftCard, Item, ItemVariation, LogEntry,
     Membership, Order, OrderPayment, OrderPosition, Quota, Seat,
@@ -76,12 +80,17 @@ from pretix.base.models.orders import (
     BlockedTicketSecret, CheckoutSession, InvoiceAddress, OrderFee,
     OrderRefund, generate_secret,
 )
-from pretix.base.models.organizer import SalesChannel, TeamAPIToken
+from pretix.base.models.organizer import (
+    Organizer_SettingsStore, SalesChannel, TeamAPIToken,
+)
 from pretix.base.models.tax import TAXED_ZERO, TaxedPrice, TaxRule
 from pretix.base.payment import GiftCardPayment, PaymentException
 from pretix.base.reldate import RelativeDateWrapper
 from pretix.base.secrets import assign_ticket_secret
 from pretix.base.services import cart, tickets
+from pretix.base.services.checkincounters import (
+    count_new_order_on_checkin_lists, track_checkin_counters,
+)
 from pretix.base.services.invoices import (
     generate_cancellation, generate_invoice, invoice_qualified,
     invoice_transmission_separately, order_invoice_transmission_separately,
@@ -96,8 +105,16 @@ from pretix.base.services.memberships import (
 from pretix.base.services.pricing import (
     apply_discounts, apply_rounding, get_listed_price, get_price,
 )
-from pretix.base.services.quotas import QuotaAvailability
-from pretix.base.services.tasks import ProfiledEventTask, ProfiledTask
+from pretix.base.services.quotacounters import (
+    count_new_order, track_quota_counters,
+)
+from pretix.base.services.quotas import (
+    QuotaAvailability, invalidate_quota_cache,
+)
+from pretix.base.services.quotashards import reclaim_quota_shards
+from pretix.base.services.tasks import (
+    EventTask, ProfiledEventTask, ProfiledTask,
+)
 from pretix.base.services.tax import split_fee_for_taxes
 from pretix.base.signals import (
     order_approved, order_canceled, order_changed, order_denied, order_expired,
@@ -110,6 +127,7 @@ from pretix.celery_app import app
 from pretix.helpers import OF_SELF
 from pretix.helpers.models import modelcopy
 from pretix.helpers.periodic import minimum_interval
+from pretix.helpers.timing import PhaseTimer, phase_timer_var, timed_phase
 from pretix.presale.productlist import prepare_item_list_for_shop
 from pretix.testutils.middleware import debugflags_var
 
@@ -208,6 +226,9 @@ error_messages = {
 
 logger = logging.getLogger(__name__)
 
+# Order placements taking longer than ORDER_PLACEMENT_SLOW_THRESHOLD seconds are logged with their timing breakdown
+ORDER_PLACEMENT_SLOW_THRESHOLD = 5
+
 
 def mark_order_paid(*args, **kwargs):
     raise NotImplementedError("This method is no longer supported since pretix 1.17.")
@@ -221,7 +242,7 @@ def reactivate_order(order: Order, force: bool=False, user: User=None, auth=None
     if order.status != Order.STATUS_CANCELED:
         raise OrderError(_('The order was not canceled.'))
 
-    with transaction.atomic():
+    with transaction.atomic(), track_quota_counters(order), track_checkin_counters(order):
         is_available = order._is_still_available(now(), count_waitinglist=False, check_voucher_usage=True,
                                                  check_memberships=True, lock=True, force=force)
         if is_available is True:
@@ -336,7 +357,7 @@ def extend_order(order: Order, new_date: datetime, force: bool=False, valid_if_p
                     })
             order.create_transactions()
 
-    with transaction.atomic():
+    with transaction.atomic(), track_quota_counters(order), track_checkin_counters(order):
         if order.status == Order.STATUS_PENDING:
             change(was_expired=False)
         else:
@@ -368,8 +389,9 @@ def mark_order_expired(order, user=None, auth=None):
             order = Order.objects.get(pk=order)
         if isinstance(user, int):
             user = User.objects.get(pk=user)
-        order.status = Order.STATUS_EXPIRED
-        order.save(update_fields=['status'])
+        with track_quota_counters(order), track_checkin_counters(order):
+            order.status = Order.STATUS_EXPIRED
+            order.save(update_fields=['status'])
 
         order.log_action('pretix.event.order.expired', user=user, auth=auth)
         i = order.invoices.filter(is_cancellation=False).last()
@@ -483,8 +505,9 @@ def deny_order(order, comment='', user=None, send_mail: bool=True, auth=None):
         if not order.require_approval or not order.status == Order.STATUS_PENDING:
             raise OrderError(_('This order is not pending approval.'))
 
-        order.status = Order.STATUS_CANCELED
-        order.save(update_fields=['status'])
+        with track_quota_counters(order), track_checkin_counters(order):
+            order.status = Order.STATUS_CANCELED
+            order.save(update_fields=['status'])
 
         order.log_action('pretix.event.order.denied', user=user, auth=auth, data={
             'comment': comment
@@ -573,86 +596,87 @@ def _cancel_order(order, user=None, send_mail: bool=True, api_token=None, device
                 m.canceled = True
                 m.save()
 
-        if cancellation_fee:
-            positions = []
-            for position in order.positions.all():
-                positions.append(position)
-                if position.voucher:
-                    Voucher.objects.filter(pk=position.voucher.pk).update(redeemed=Greatest(0, F('redeemed') - 1))
-                position.canceled = True
-                assign_ticket_secret(
-                    event=order.event, position=position, force_invalidate_if_revokation_list_used=True, force_invalidate=False, save=False
-                )
-                position.save(update_fields=['canceled', 'secret'])
-            new_fee = cancellation_fee
-            for fee in order.fees.all():
-                if keep_fees and fee in keep_fees:
-                    new_fee -= fee.value
-                else:
-                    positions.append(fee)
-                    fee.canceled = True
-                    fee.save(update_fields=['canceled'])
-
-            if new_fee:
-                tax_rule_zero = TaxRule.zero()
-                if tax_mode == "default":
-                    fee_values = [(order.event.cached_default_tax_rule or tax_rule_zero, new_fee)]
-                elif tax_mode == "split":
-                    fee_values = split_fee_for_taxes(positions, new_fee, order.event)
-                else:
-                    fee_values = [(tax_rule_zero, new_fee)]
-
-                try:
-                    ia = order.invoice_address
-                except InvoiceAddress.DoesNotExist:
-                    ia = None
-
-                for tax_rule, price in fee_values:
-                    tax_rule = tax_rule or tax_rule_zero
-                    tax = tax_rule.tax(
-                        price, invoice_address=ia, base_price_is="gross"
-                    )
-                    f = OrderFee(
-                        fee_type=OrderFee.FEE_TYPE_CANCELLATION,
-                        value=price,
-                        order=order,
-                        tax_rate=tax.rate,
-                        tax_code=tax.code,
-                        tax_value=tax.tax,
-                        tax_rule=tax_rule,
+        with track_quota_counters(order), track_checkin_counters(order):
+            if cancellation_fee:
+                positions = []
+                for position in order.positions.all():
+                    positions.append(position)
+                    if position.voucher:
+                        Voucher.objects.filter(pk=position.voucher.pk).update(redeemed=Greatest(0, F('redeemed') - 1))
+                    position.canceled = True
+                    assign_ticket_secret(
+                        event=order.event, position=position, force_invalidate_if_revokation_list_used=True, force_invalidate=False, save=False
                     )
-                    f.save()
+                    position.save(update_fields=['canceled', 'secret'])
+                new_fee = cancellation_fee
+                for fee in order.fees.all():
+                    if keep_fees and fee in keep_fees:
+                        new_fee -= fee.value
+                    else:
+                        positions.append(fee)
+                        fee.canceled = True
+                        fee.save(update_fields=['canceled'])
+
+                if new_fee:
+                    tax_rule_zero = TaxRule.zero()
+                    if tax_mode == "default":
+                        fee_values = [(order.event.cached_default_tax_rule or tax_rule_zero, new_fee)]
+                    elif tax_mode == "split":
+                        fee_values = split_fee_for_taxes(positions, new_fee, order.event)
+                    else:
+                        fee_values = [(tax_rule_zero, new_fee)]
 
-            if cancellation_fee > order.total:
-                raise OrderError(_('The cancellation fee cannot be higher than the total amount of this order.'))
-            elif order.payment_refund_sum < cancellation_fee:
-                order.status = Order.STATUS_PENDING
-                order.set_expires()
-            else:
-                order.status = Order.STATUS_PAID
-            order.total = cancellation_fee
-            order.cancellation_date = now()
-            order.save(update_fields=['status', 'cancellation_date', 'total'])
+                    try:
+                        ia = order.invoice_address
+                    except InvoiceAddress.DoesNotExist:
+                        ia = None
+
+                    for tax_rule, price in fee_values:
+                        tax_rule = tax_rule or tax_rule_zero
+                        tax = tax_rule.tax(
+                            price, invoice_address=ia, base_price_is="gross"
+                        )
+                        f = OrderFee(
+                            fee_type=OrderFee.FEE_TYPE_CANCELLATION,
+                            value=price,
+                            order=order,
+                            tax_rate=tax.rate,
+                            tax_code=tax.code,
+                            tax_value=tax.tax,
+                            tax_rule=tax_rule,
+                        )
+                        f.save()
 
-            if cancel_invoice and i:
-                try:
-                    invoices.append(generate_invoice(order))
-                except Exception as e:
-                    logger.exception("Could not generate invoice.")
-                    order.log_action("pretix.event.order.invoice.failed", data={
-                        "exception": str(e)
-                    })
-        else:
-            order.status = Order.STATUS_CANCELED
-            order.cancellation_date = now()
-            order.save(update_fields=['status', 'cancellation_date'])
+                if cancellation_fee > order.total:
+                    raise OrderError(_('The cancellation fee cannot be higher than the total amount of this order.'))
+                elif order.payment_refund_sum < cancellation_fee:
+                    order.status = Order.STATUS_PENDING
+                    order.set_expires()
+                else:
+                    order.status = Order.STATUS_PAID
+                order.total = cancellation_fee
+                order.cancellation_date = now()
+                order.save(update_fields=['status', 'cancellation_date', 'total'])
 
-            for position in order.positions.all():
-                assign_ticket_secret(
-                    event=order.event, position=position, force_invalidate_if_revokation_list_used=True, force_invalidate=False, save=True
-                )
-                if position.voucher:
-                    Voucher.objects.filter(pk=position.voucher.pk).update(redeemed=Greatest(0, F('redeemed') - 1))
+                if cancel_invoice and i:
+                    try:
+                        invoices.append(generate_invoice(order))
+                    except Exception as e:
+                        logger.exception("Could not generate invoice.")
+                        order.log_action("pretix.event.order.invoice.failed", data={
+                            "exception": str(e)
+                        })
+            else:
+                order.status = Order.STATUS_CANCELED
+                order.cancellation_date = now()
+                order.save(update_fields=['status', 'cancellation_date'])
+
+                for position in order.positions.all():
+                    assign_ticket_secret(
+                        event=order.event, position=position, force_invalidate_if_revokation_list_used=True, force_invalidate=False, save=True
+                    )
+                    if position.voucher:
+                        Voucher.objects.filter(pk=position.voucher.pk).update(redeemed=Greatest(0, F('redeemed') - 1))
 
         order.log_action('pretix.event.order.canceled', user=user, auth=api_token or oauth_application or device,
                          data={'cancellation_fee': cancellation_fee, 'comment': comment})
@@ -791,6 +815,8 @@ def _check_positions(event: Event, now_dt: datetime, time_machine_now_dt: dateti
                 [op.seat for op in sorted_positions if op.seat],
                 shared_lock_objects=[event]
             )
+        # Capacity pre-allocated to quota shards is free to use for expired carts, see quotashards.py
+        reclaim_quota_shards(reduce(operator.or_, (set(cp._cached_quotas) for cp in sorted_positions), set()))
     elif any(cp.voucher and cp.voucher.budget for cp in sorted_positions):
         # Voucher budgets are not guaranteed by the cart manager
         lock_objects(
@@ -871,7 +897,8 @@ def _check_positions(event: Event, now_dt: datetime, time_machine_now_dt: dateti
                 if cp.voucher and cp.voucher.block_quota and cp.voucher.quota_id == quota.pk:
                     continue
                 if quota not in q_avail:
-                    avail = quota.availability(now_dt)
+                    with timed_phase('quota'):
+                        avail = quota.availability(now_dt)
                     q_avail[quota] = avail[1] if avail[1] is not None else sys.maxsize
                 q_avail[quota] -= 1
                 if q_avail[quota] < 0:
@@ -891,53 +918,57 @@ def _check_positions(event: Event, now_dt: datetime, time_machine_now_dt: dateti
             })
 
     # Check prices
-    sorted_positions = [cp for cp in sorted_positions if cp.pk and cp.pk not in deleted_positions]  # eliminate deleted
-    old_total = sum(cp.price for cp in sorted_positions)
-    for i, cp in enumerate(sorted_positions):
-        if cp.listed_price is None:
-            # migration from pre-discount cart positions
-            cp.update_listed_price_and_voucher(max_discount=None)
-            cp.migrate_free_price_if_necessary()
-
-        # deal with max discount
-        max_discount = None
-        if cp.voucher and cp.voucher.budget is not None:
-            if cp.voucher not in v_budget:
-                v_budget[cp.voucher] = cp.voucher.budget - cp.voucher.budget_used()
-            max_discount = max(v_budget[cp.voucher], 0)
-
-        if cp.expires < now_dt or cp.listed_price is None:
-            # Guarantee on listed price is expired
-            cp.update_listed_price_and_voucher(max_discount=max_discount)
-        elif cp.voucher:
-            cp.update_listed_price_and_voucher(max_discount=max_discount, voucher_only=True)
-
-        if max_discount is not None:
-            v_budget[cp.voucher] = v_budget[cp.voucher] - (cp.listed_price - cp.price_after_voucher)
+    with timed_phase('pricing'):
+        sorted_positions = [cp for cp in sorted_positions if cp.pk and cp.pk not in deleted_positions]  # eliminate deleted
+        old_total = sum(cp.price for cp in sorted_positions)
+        for i, cp in enumerate(sorted_positions):
+            if cp.listed_price is None:
+                # migration from pre-discount cart positions
+                cp.update_listed_price_and_voucher(max_discount=None)
+                cp.migrate_free_price_if_necessary()
+
+            # deal with max discount
+            max_discount = None
+            if cp.voucher and cp.voucher.budget is not None:
+                if cp.voucher not in v_budget:
+                    v_budget[cp.voucher] = cp.voucher.budget - cp.voucher.budget_used()
+                max_discount = max(v_budget[cp.voucher], 0)
+
+            if cp.expires < now_dt or cp.listed_price is None:
+                # Guarantee on listed price is expired
+                cp.update_listed_price_and_voucher(max_discount=max_discount)
+            elif cp.voucher:
+                cp.update_listed_price_and_voucher(max_discount=max_discount, voucher_only=True)
+
+            if max_discount is not None:
+                v_budget[cp.voucher] = v_budget[cp.voucher] - (cp.listed_price - cp.price_after_voucher)
 
-        try:
-            cp.update_line_price(address, [b for b in sorted_positions if b.addon_to_id == cp.pk and b.is_bundled and b.pk and b.pk not in deleted_positions])
-        except TaxRule.SaleNotAllowed:
-            err = err or error_messages['country_blocked']
-            delete(cp)
-            continue
+            try:
+                cp.update_line_price(address, [
+                    b for b in sorted_positions
+                    if b.addon_to_id == cp.pk and b.is_bundled and b.pk and b.pk not in deleted_positions
+                ])
+            except TaxRule.SaleNotAllowed:
+                err = err or error_messages['country_blocked']
+                delete(cp)
+                continue
 
-    sorted_positions = [cp for cp in sorted_positions if cp.pk and cp.pk not in deleted_positions]  # eliminate deleted
-    discount_results = apply_discounts(
-        event,
-        sales_channel.identifier,
-        [
-            (cp.item_id, cp.subevent_id, cp.subevent.date_from if cp.subevent_id else None, cp.line_price_gross,
-             cp.addon_to, cp.is_bundled, cp.listed_price - cp.price_after_voucher)
-            for cp in sorted_positions
-        ]
-    )
-    for cp, (new_price, discount) in zip(sorted_positions, discount_results):
-        if cp.gross_price_before_rounding != new_price or cp.discount_id != (discount.pk if discount else None):
-            cp.price = new_price
-            cp.price_includes_rounding_correction = Decimal("0.00")
-            cp.discount = discount
-            cp.save(update_fields=['price', 'price_includes_rounding_correction', 'discount'])
+        sorted_positions = [cp for cp in sorted_positions if cp.pk and cp.pk not in deleted_positions]  # eliminate deleted
+        discount_results = apply_discounts(
+            event,
+            sales_channel.identifier,
+            [
+                (cp.item_id, cp.subevent_id, cp.subevent.date_from if cp.subevent_id else None, cp.line_price_gross,
+                 cp.addon_to, cp.is_bundled, cp.listed_price - cp.price_after_voucher)
+                for cp in sorted_positions
+            ]
+        )
+        for cp, (new_price, discount) in zip(sorted_positions, discount_results):
+            if cp.gross_price_before_rounding != new_price or cp.discount_id != (discount.pk if discount else None):
+                cp.price = new_price
+                cp.price_includes_rounding_correction = Decimal("0.00")
+                cp.discount = discount
+                cp.save(update_fields=['price', 'price_includes_rounding_correction', 'discount'])
 
     # After applying discounts, add-on positions might still have a reference to the *old* version of the
     # parent position, which can screw up ordering later since the system sees inconsistent data.
@@ -1043,7 +1074,8 @@ def _create_order(event: Event, *, email: str, positions: List[CartPosition], no
 
     # Final calculation of fees, also performs final rounding
     try:
-        fees = _apply_rounding_and_fees(positions, payment_requests, address, meta_info, event, require_approval=require_approval)
+        with timed_phase('pricing'):
+            fees = _apply_rounding_and_fees(positions, payment_requests, address, meta_info, event, require_approval=require_approval)
     except TaxRule.SaleNotAllowed:
         raise OrderError(error_messages['country_blocked'])
 
@@ -1108,6 +1140,8 @@ def _create_order(event: Event, *, email: str, positions: List[CartPosition], no
 
     orderpositions = OrderPosition.transform_cart_positions(positions, order)
     order.create_transactions(positions=orderpositions, fees=fees, is_new=True)
+    count_new_order(order)
+    count_new_order_on_checkin_lists(order)
     order.log_action('pretix.event.order.placed')
     if order.require_approval:
         order.log_action('pretix.event.order.placed.require_approval')
@@ -1123,7 +1157,8 @@ def _create_order(event: Event, *, email: str, positions: List[CartPosition], no
             session.answers.update(order=order, checkoutsession=None)
             session.delete()
 
-    order_placed.send(event, order=order, bulk=False)
+    with timed_phase('signals'):
+        order_placed.send(event, order=order, bulk=False)
     return order, payments
 
 
@@ -1167,6 +1202,32 @@ def _order_placed_email_attendee(event: Event, order: Order, position: OrderPosi
     )
 
 
+def _record_order_placement_phases(func):
+    """
+    Measures the time ``_perform_order`` spends in its phases, see ``timed_phase``. The timings are added to the
+    result of the task, exported as metrics and logged for slow order placements.
+    """
+    @wraps(func)
+    def wrapper(event: Event, *args, **kwargs):
+        timer = PhaseTimer()
+        token = phase_timer_var.set(timer)
+        try:
+            result = func(event, *args, **kwargs)
+        finally:
+            phase_timer_var.reset(token)
+            timings = timer.as_dict()
+            event_label = f'{event.organizer.slug}/{event.slug}'
+            if settings.METRICS_ENABLED:
+                for phase, duration in timings.items():
+                    pretix_order_placement_phase_seconds.observe(duration / 1000, phase=phase, event=event_label)
+            if timer.total() > ORDER_PLACEMENT_SLOW_THRESHOLD:
+                logger.warning(f'Slow order placement for event {event_label}: {timings}')
+        result['timings'] = timings
+        return result
+    return wrapper
+
+
+@_record_order_placement_phases
 def _perform_order(event: Event, payment_requests: List[dict], position_ids: List[str],
                    email: str, locale: str, address: int, meta_info: dict=None, sales_channel: str='web',
                    shown_total=None, customer=None, api_meta: dict=None, tax_rounding_mode=None, cart_id: str=None):
@@ -1211,21 +1272,10 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
     if shown_total is not None and Decimal(shown_total) > Decimal("0.00") and event.currency == "XXX":
         raise OrderError(error_messages['currency_XXX'])
 
-    validate_order.send(
-        event,
-        payment_provider=payment_requests[0]['provider'] if payment_requests else None,  # only for backwards compatibility
-        payments=payment_requests,
-        email=email,
-        positions=positions,
-        locale=locale,
-        invoice_address=addr,
-        meta_info=meta_info,
-        customer=customer,
-    )
-
-    valid_if_pending = False
-    for recv, result in order_valid_if_pending.send(
+    with timed_phase('signals'):
+        validate_order.send(
             event,
+            payment_provider=payment_requests[0]['provider'] if payment_requests else None,  # only for backwards compatibility
             payments=payment_requests,
             email=email,
             positions=positions,
@@ -1233,9 +1283,21 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
             invoice_address=addr,
             meta_info=meta_info,
             customer=customer,
-    ):
-        if result:
-            valid_if_pending = True
+        )
+
+        valid_if_pending = False
+        for recv, result in order_valid_if_pending.send(
+                event,
+                payments=payment_requests,
+                email=email,
+                positions=positions,
+                locale=locale,
+                invoice_address=addr,
+                meta_info=meta_info,
+                customer=customer,
+        ):
+            if result:
+                valid_if_pending = True
 
     warnings = []
     any_payment_failed = False
@@ -1243,7 +1305,7 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
     real_now_dt = now()
     time_machine_now_dt = time_machine_now(real_now_dt)
     err_out = None
-    with transaction.atomic(durable=True):
+    with timed_phase('db_writes'), transaction.atomic(durable=True):
         positions = list(
             positions.select_related('item', 'variation', 'subevent', 'seat', 'addon_to').prefetch_related('addons')
         )
@@ -1253,8 +1315,9 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
         if len(position_ids) != len(positions):
             raise OrderError(error_messages['internal'])
         try:
-            _check_positions(event, real_now_dt, time_machine_now_dt, positions,
-                             address=addr, sales_channel=sales_channel, customer=customer)
+            with timed_phase('checks'):
+                _check_positions(event, real_now_dt, time_machine_now_dt, positions,
+                                 address=addr, sales_channel=sales_channel, customer=customer)
         except OrderError as e:
             err_out = e  # Don't raise directly to make sure transaction is committed, as it might have deleted things
         else:
@@ -1287,6 +1350,8 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
                         p.confirm(send_mail=False, lock=False, generate_invoice=False)
             except Quota.QuotaExceededException:
                 pass
+
+            invalidate_quota_cache(reduce(operator.or_, (set(p._cached_quotas) for p in positions), set()))
     if err_out:
         raise err_out
 
@@ -1295,19 +1360,20 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
     # It would be great to give external gift card plugins the same special treatment, but it feels to risky for now, as
     # (a) there would be no email at all if the plugin fails in a weird way and (b) we'd be able to run into
     # contradictions when a plugin set both execute_payment_needs_user=False as well as requires_invoice_immediately=True
-    for p in payment_objs:
-        if isinstance(p.payment_provider, GiftCardPayment):
-            try:
-                p.process_initiated = True
-                p.save(update_fields=['process_initiated'])
-                p.payment_provider.execute_payment(None, p, is_early_special_case=True)
-            except PaymentException as e:
-                warnings.append(str(e))
-                any_payment_failed = True
-            except Exception:
-                logger.exception('Error during payment attempt')
-            else:
-                order.refresh_from_db()
+    with timed_phase('payment'):
+        for p in payment_objs:
+            if isinstance(p.payment_provider, GiftCardPayment):
+                try:
+                    p.process_initiated = True
+                    p.save(update_fields=['process_initiated'])
+                    p.payment_provider.execute_payment(None, p, is_early_special_case=True)
+                except PaymentException as e:
+                    warnings.append(str(e))
+                    any_payment_failed = True
+                except Exception:
+                    logger.exception('Error during payment attempt')
+                else:
+                    order.refresh_from_db()
 
     pending_sum = order.pending_sum
     free_order_flow = (
@@ -1323,86 +1389,89 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
     transmit_invoice_task = order_invoice_transmission_separately(order)
     transmit_invoice_mail = not transmit_invoice_task and order.event.settings.invoice_email_attachment and order.email
 
-    invoice = order.invoices.last()  # Might be generated by plugin already
-    if not invoice and invoice_qualified(order):
-        invoice_required = (
-            event.settings.get('invoice_generate') == 'True' or (
-                event.settings.get('invoice_generate') == 'paid' and (
-                    any(p['pprov'].requires_invoice_immediately for p in payment_requests) or
-                    pending_sum <= Decimal('0.00')
+    with timed_phase('invoice'):
+        invoice = order.invoices.last()  # Might be generated by plugin already
+        if not invoice and invoice_qualified(order):
+            invoice_required = (
+                event.settings.get('invoice_generate') == 'True' or (
+                    event.settings.get('invoice_generate') == 'paid' and (
+                        any(p['pprov'].requires_invoice_immediately for p in payment_requests) or
+                        pending_sum <= Decimal('0.00')
+                    )
                 )
             )
-        )
-        if invoice_required:
-            try:
-                invoice = generate_invoice(
-                    order,
-                    # send_mail will trigger PDF generation later
-                    trigger_pdf=not transmit_invoice_mail
-                )
-                if transmit_invoice_task:
-                    transmit_invoice.apply_async(args=(event.pk, invoice.pk, False))
-            except Exception as e:
-                logger.exception("Could not generate invoice.")
-                order.log_action("pretix.event.order.invoice.failed", data={
-                    "exception": str(e)
-                })
-
-    if order.email:
-        if order.require_approval:
-            email_template = event.settings.mail_text_order_placed_require_approval
-            subject_template = event.settings.mail_subject_order_placed_require_approval
-            log_entry = 'pretix.event.order.email.order_placed_require_approval'
-
-            email_attendees = False
-        elif free_order_flow:
-            email_template = event.settings.mail_text_order_free
-            subject_template = event.settings.mail_subject_order_free
-            log_entry = 'pretix.event.order.email.order_free'
-
-            email_attendees = event.settings.mail_send_order_free_attendee
-            email_attendees_template = event.settings.mail_text_order_free_attendee
-            subject_attendees_template = event.settings.mail_subject_order_free_attendee
-        else:
-            email_template = event.settings.mail_text_order_placed
-            subject_template = event.settings.mail_subject_order_placed
-            log_entry = 'pretix.event.order.email.order_placed'
+            if invoice_required:
+                try:
+                    invoice = generate_invoice(
+                        order,
+                        # send_mail will trigger PDF generation later
+                        trigger_pdf=not transmit_invoice_mail
+                    )
+                    if transmit_invoice_task:
+                        transmit_invoice.apply_async(args=(event.pk, invoice.pk, False))
+                except Exception as e:
+                    logger.exception("Could not generate invoice.")
+                    order.log_action("pretix.event.order.invoice.failed", data={
+                        "exception": str(e)
+                    })
 
-            email_attendees = event.settings.mail_send_order_placed_attendee
-            email_attendees_template = event.settings.mail_text_order_placed_attendee
-            subject_attendees_template = event.settings.mail_subject_order_placed_attendee
+    with timed_phase('email'):
+        if order.email:
+            if order.require_approval:
+                email_template = event.settings.mail_text_order_placed_require_approval
+                subject_template = event.settings.mail_subject_order_placed_require_approval
+                log_entry = 'pretix.event.order.email.order_placed_require_approval'
+
+                email_attendees = False
+            elif free_order_flow:
+                email_template = event.settings.mail_text_order_free
+                subject_template = event.settings.mail_subject_order_free
+                log_entry = 'pretix.event.order.email.order_free'
+
+                email_attendees = event.settings.mail_send_order_free_attendee
+                email_attendees_template = event.settings.mail_text_order_free_attendee
+                subject_attendees_template = event.settings.mail_subject_order_free_attendee
+            else:
+                email_template = event.settings.mail_text_order_placed
+                subject_template = event.settings.mail_subject_order_placed
+                log_entry = 'pretix.event.order.email.order_placed'
 
-        if sales_channel.identifier in event.settings.mail_sales_channel_placed_paid:
-            _order_placed_email(
-                event,
-                order,
-                email_template,
-                subject_template,
-                log_entry,
-                invoice if transmit_invoice_mail else None,
-                payment_objs,
-                is_free=free_order_flow
-            )
-            if email_attendees:
-                for p in order.positions.all():
-                    if p.addon_to_id is None and p.attendee_email and p.attendee_email != order.email:
-                        _order_placed_email_attendee(event, order, p, email_attendees_template, subject_attendees_template, log_entry,
-                                                     is_free=free_order_flow)
+                email_attendees = event.settings.mail_send_order_placed_attendee
+                email_attendees_template = event.settings.mail_text_order_placed_attendee
+                subject_attendees_template = event.settings.mail_subject_order_placed_attendee
 
-    if not any_payment_failed:
-        for p in payment_objs:
-            if not p.payment_provider.execute_payment_needs_user and not p.process_initiated:
-                try:
-                    p.process_initiated = True
-                    p.save(update_fields=['process_initiated'])
-                    resp = p.payment_provider.execute_payment(None, p)
-                    if isinstance(resp, str):
-                        logger.warning('Payment provider returned URL from execute_payment even though execute_payment_needs_user is not set')
-                except PaymentException as e:
-                    warnings.append(str(e))
-                    any_payment_failed = True
-                except Exception:
-                    logger.exception('Error during payment attempt')
+            if sales_channel.identifier in event.settings.mail_sales_channel_placed_paid:
+                _order_placed_email(
+                    event,
+                    order,
+                    email_template,
+                    subject_template,
+                    log_entry,
+                    invoice if transmit_invoice_mail else None,
+                    payment_objs,
+                    is_free=free_order_flow
+                )
+                if email_attendees:
+                    for p in order.positions.all():
+                        if p.addon_to_id is None and p.attendee_email and p.attendee_email != order.email:
+                            _order_placed_email_attendee(event, order, p, email_attendees_template, subject_attendees_template, log_entry,
+                                                         is_free=free_order_flow)
+
+    with timed_phase('payment'):
+        if not any_payment_failed:
+            for p in payment_objs:
+                if not p.payment_provider.execute_payment_needs_user and not p.process_initiated:
+                    try:
+                        p.process_initiated = True
+                        p.save(update_fields=['process_initiated'])
+                        resp = p.payment_provider.execute_payment(None, p)
+                        if isinstance(resp, str):
+                            logger.warning('Payment provider returned URL from execute_payment even though execute_payment_needs_user is not set')
+                    except PaymentException as e:
+                        warnings.append(str(e))
+                        any_payment_failed = True
+                    except Exception:
+                        logger.exception('Error during payment attempt')
 
     if any_payment_failed:
         # Cancel all other payments because their amount might be wrong now.
@@ -1417,13 +1486,60 @@ def _perform_order(event: Event, payment_requests: List[dict], position_ids: Lis
     }
 
 
-@receiver(signal=periodic_task)
-@scopes_disabled()
-def expire_orders(sender, **kwargs):
-    event_id = None
-    expire = None
+def _periodic_order_task_key(task, event_id):
+    return 'periodic_order_task:{}:{}'.format(task.name, event_id)
+
+
+def _periodic_order_task_timeout():
+    return settings.PERIODIC_ORDER_TIME_BUDGET * 10
+
+
+def _dispatch_periodic_order_task(task, event_ids, task_kwargs=None):
+    """
+    Starts ``task`` for every event in ``event_ids``, unless a previous run for the same event has not finished yet.
+    ``task_kwargs`` may map event IDs to additional keyword arguments for the task.
+    """
+    for event_id in event_ids:
+        if cache.add(_periodic_order_task_key(task, event_id), True, timeout=_periodic_order_task_timeout()):
+            task.apply_async(kwargs={'event': event_id, **(task_kwargs or {}).get(event_id, {})})
+
+
+def _process_periodic_order_batches(task, event, qs, after, process, task_kwargs=None):
+    """
+    Calls ``process`` for every order in ``qs`` with a primary key larger than ``after``, fetched in batches of
+    ``PERIODIC_ORDER_BATCH_SIZE``. If the time budget is used up before all orders have been processed, ``task`` is
+    started again with ``task_kwargs`` to continue where we left off, so runs for other events get their turn in
+    the meantime.
+    """
+    deadline = monotonic() + settings.PERIODIC_ORDER_TIME_BUDGET
+    while True:
+        batch = list(qs.filter(pk__gt=after).order_by('pk')[:settings.PERIODIC_ORDER_BATCH_SIZE])
+        for o in batch:
+            process(o)
+        if len(batch) < settings.PERIODIC_ORDER_BATCH_SIZE:
+            break
+        after = batch[-1].pk
+        if monotonic() >= deadline:
+            # The run is still in progress, so make sure the next planning does not start a second one for this
+            # event while the continuation waits in the queue
+            cache.set(_periodic_order_task_key(task, event.pk), True, timeout=_periodic_order_task_timeout())
+            task.apply_async(kwargs={'event': event.pk, 'after': after, **(task_kwargs or {})})
+            return
+    cache.delete(_periodic_order_task_key(task, event.pk))
+
+
+def _record_periodic_order_backlog(task, qs):
+    if settings.METRICS_ENABLED:
+        pretix_periodic_order_backlog.set(qs.order_by().count(), task=task)
+
 
-    qs = Order.objects.filter(
+def _record_periodic_order_delay(task, due):
+    if settings.METRICS_ENABLED:
+        pretix_periodic_order_delay_seconds.observe(max((now() - due).total_seconds(), 0), task=task)
+
+
+def _expirable_orders():
+    return Order.objects.filter(
         expires__lt=now(),
         status=Order.STATUS_PENDING,
         valid_if_pending=False,
@@ -1432,29 +1548,83 @@ def expire_orders(sender, **kwargs):
         Exists(
             OrderFee.objects.filter(order_id=OuterRef('pk'), fee_type=OrderFee.FEE_TYPE_CANCELLATION)
         )
-    ).prefetch_related('event').order_by('event_id')
-    for o in qs:
-        if o.event_id != event_id:
-            expire = o.event.settings.get('payment_term_expire_automatically', as_type=bool)
-            event_id = o.event_id
-        if expire and now() >= o.payment_term_expire_date:
+    )
+
+
+@receiver(signal=periodic_task)
+@scopes_disabled()
+def expire_orders(sender, **kwargs):
+    qs = _expirable_orders()
+    _record_periodic_order_backlog('expire_orders', qs)
+
+    # Skip events that do not expire orders automatically, either on event level or inherited from the organizer
+    event_setting = Event_SettingsStore.objects.filter(
+        object=OuterRef('pk'), key='payment_term_expire_automatically'
+    ).values('value')[:1]
+    organizer_setting = Organizer_SettingsStore.objects.filter(
+        object=OuterRef('organizer_id'), key='payment_term_expire_automatically'
+    ).values('value')[:1]
+    events = Event.objects.filter(
+        pk__in=qs.order_by().values('event_id'),
+    ).annotate(
+        event_setting=Subquery(event_setting),
+        organizer_setting=Subquery(organizer_setting),
+    ).exclude(
+        Q(event_setting='False') | Q(event_setting__isnull=True, organizer_setting='False')
+    ).order_by()
+    _dispatch_periodic_order_task(
+        expire_orders_for_event,
+        events.values_list('pk', flat=True)
+    )
+
+
+@app.task(base=EventTask)
+def expire_orders_for_event(event, after=0):
+    if not event.settings.get('payment_term_expire_automatically', as_type=bool):
+        cache.delete(_periodic_order_task_key(expire_orders_for_event, event.pk))
+        return
+
+    def process(o):
+        o.event = event
+        if now() >= o.payment_term_expire_date:
             mark_order_expired(o)
+            _record_periodic_order_delay('expire_orders', o.payment_term_expire_date)
+
+    _process_periodic_order_batches(expire_orders_for_event, event, _expirable_orders().filter(event=event), after, process)
+
+
+def _expiry_warning_candidates(today):
+    return Order.objects.filter(
+        expires__gte=today, expiry_reminder_sent=False, status=Order.STATUS_PENDING,
+        datetime__lte=now() - timedelta(hours=2), require_approval=False
+    )
 
 
 @receiver(signal=periodic_task)
 @scopes_disabled()
 @minimum_interval(minutes_after_success=60)
 def send_expiry_warnings(sender, **kwargs):
-    today = now().replace(hour=0, minute=0, second=0)
-    days = None
-    settings = None
-    event_id = None
+    qs = _expiry_warning_candidates(now().replace(hour=0, minute=0, second=0))
+    _record_periodic_order_backlog('send_expiry_warnings', qs)
+    _dispatch_periodic_order_task(
+        send_expiry_warnings_for_event,
+        qs.order_by().values_list('event_id', flat=True).distinct()
+    )
+
 
-    for o in Order.objects.filter(
-            expires__gte=today, expiry_reminder_sent=False, status=Order.STATUS_PENDING,
-            datetime__lte=now() - timedelta(hours=2), require_approval=False
-    ).only('pk', 'event_id', 'expires').order_by('event_id'):
+@app.task(base=EventTask)
+def send_expiry_warnings_for_event(event, after=0):
+    today = now().replace(hour=0, minute=0, second=0)
+    settings = event.settings
+    days = cache.get_or_set('{}:{}:setting_mail_days_order_expire_warning'.format('event', event.pk),
+                            default=lambda: settings.get('mail_days_order_expire_warning', as_type=int),
+                            timeout=3600)
+    if not days:
+        cache.delete(_periodic_order_task_key(send_expiry_warnings_for_event, event.pk))
+        return
 
+    def process(o):
+        o.event = event
         lp = o.payments.last()
         if (
                 lp and
@@ -1462,21 +1632,14 @@ def send_expiry_warnings(sender, **kwargs):
                 lp.payment_provider and
                 lp.payment_provider.prevent_reminder_mail(o, lp)
         ):
-            continue
-
-        if event_id != o.event_id:
-            settings = o.event.settings
-            days = cache.get_or_set('{}:{}:setting_mail_days_order_expire_warning'.format('event', o.event_id),
-                                    default=lambda: settings.get('mail_days_order_expire_warning', as_type=int),
-                                    timeout=3600)
-            event_id = o.event_id
+            return
 
-        if days and (o.expires - today).days <= days:
+        if (o.expires - today).days <= days:
             with transaction.atomic():
                 o = Order.objects.select_related('event').select_for_update(of=OF_SELF).get(pk=o.pk)
                 if o.status != Order.STATUS_PENDING or o.expiry_reminder_sent:
                     # Race condition
-                    continue
+                    return
 
                 with language(o.locale, settings.region):
                     o.expiry_reminder_sent = True
@@ -1498,13 +1661,21 @@ def send_expiry_warnings(sender, **kwargs):
                         email_subject, email_template, email_context,
                         'pretix.event.order.email.expire_warning_sent'
                     )
+            _record_periodic_order_delay(
+                'send_expiry_warnings',
+                max(o.expires - timedelta(days=days), o.datetime + timedelta(hours=2))
+            )
+
+    _process_periodic_order_batches(
+        send_expiry_warnings_for_event, event,
+        _expiry_warning_candidates(today).filter(event=event).only('pk', 'event_id', 'expires', 'datetime'),
+        after, process
+    )
 
 
 @receiver(signal=periodic_task)
 @scopes_disabled()
 def send_download_reminders(sender, **kwargs):
-    today = now().replace(hour=0, minute=0, second=0, microsecond=0)
-
     events = Event.objects.filter(
         Q(has_subevents=False, date_from__gte=now()) |
         (Q(has_subevents=True) & Q(Exists(
@@ -1525,83 +1696,168 @@ def send_download_reminders(sender, **kwargs):
         reminder_days__isnull=False,
     ).order_by()
 
-    for event in events.iterator(chunk_size=10_000):
-        qs = event.orders.filter(
-            download_reminder_sent=False,
-            datetime__lte=now() - timedelta(hours=2),
+    event_ids = []
+    task_kwargs = {}
+    pregenerate_event_ids = []
+    pregenerate_lead = timedelta(hours=settings.CACHE_TICKETS_PREGENERATE_LEAD_HOURS)
+    for event in events.only('pk', 'has_subevents', 'date_from').iterator(chunk_size=10_000):
+        if not event.has_subevents:
+            event_reminder_date = (event.date_from - timedelta(days=event.reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+            if now() < event_reminder_date:
+                if now() >= event_reminder_date - pregenerate_lead:
+                    pregenerate_event_ids.append(event.pk)
+                continue
+        else:
+            pregenerate_event_ids.append(event.pk)
+        event_ids.append(event.pk)
+        task_kwargs[event.pk] = {'reminder_days': event.reminder_days}
+
+    if settings.METRICS_ENABLED:
+        pretix_periodic_order_backlog.set(
+            Order.objects.filter(
+                event_id__in=event_ids, download_reminder_sent=False, datetime__lte=now() - timedelta(hours=2),
+            ).count(),
+            task='send_download_reminders'
+        )
+    _dispatch_periodic_order_task(send_download_reminders_for_event, event_ids, task_kwargs)
+
+    if settings.CACHE_TICKETS_PREGENERATE:
+        # The ticket files are pre-generated ahead of the reminders, as the reminders cause lots of ticket downloads
+        # within a short time. Every event is only planned once per lead time, since the planning itself considers
+        # all reminders that are due within the lead time.
+        for event_id in pregenerate_event_ids:
+            if cache.add(_periodic_order_task_key(pregenerate_tickets_for_download_reminders, event_id), True,
+                         timeout=int(pregenerate_lead.total_seconds())):
+                pregenerate_tickets_for_download_reminders.apply_async(kwargs={'event': event_id})
+
+
+@app.task(base=EventTask)
+def send_download_reminders_for_event(event, after=0, reminder_days=None):
+    today = now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if reminder_days is None:
+        # Not passed by the planning task
+        reminder_days = event.settings.get('mail_days_download_reminder', as_type=int)
+    if reminder_days is None:
+        cache.delete(_periodic_order_task_key(send_download_reminders_for_event, event.pk))
+        return
+
+    qs = event.orders.filter(
+        download_reminder_sent=False,
+        datetime__lte=now() - timedelta(hours=2),
+    )
+
+    if event.has_subevents:
+        qs = qs.annotate(
+            first_date=Min('all_positions__subevent__date_from')
+        ).filter(
+            Q(first_date__gte=today)
         )
+    else:
+        event_reminder_date = (event.date_from - timedelta(days=reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    qs = qs.only(
+        'pk', 'event_id', 'sales_channel', 'datetime',
+    )
+
+    def process(o):
+        if o.sales_channel.identifier not in event.settings.mail_sales_channel_download_reminder:
+            return
 
         if event.has_subevents:
-            qs = qs.annotate(
-                first_date=Min('all_positions__subevent__date_from')
-            ).filter(
-                Q(first_date__gte=today)
-            )
+            reminder_date = ((o.first_date or event.date_from) - timedelta(days=reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
         else:
-            event_reminder_date = (event.date_from - timedelta(days=event.reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
-            if now() < event_reminder_date:
-                continue
+            reminder_date = event_reminder_date
+        if now() < reminder_date or o.datetime > reminder_date:
+            return
+        due = reminder_date
 
-        qs = qs.only(
-            'pk', 'event_id', 'sales_channel', 'datetime',
-        ).order_by()
+        with transaction.atomic():
+            o = Order.objects.select_for_update(of=OF_SELF).get(pk=o.pk)
+            if o.download_reminder_sent:
+                # Race condition
+                return
+            positions = list(o.positions_with_tickets)
+            if not positions:
+                return
+
+            if not o.ticket_download_available:
+                return
+
+            if o.status != Order.STATUS_PAID:
+                if o.status != Order.STATUS_PENDING or o.require_approval or (not o.valid_if_pending and not o.event.settings.ticket_download_pending):
+                    return
+
+            with language(o.locale, o.event.settings.region):
+                o.download_reminder_sent = True
+                o.save(update_fields=['download_reminder_sent'])
+                email_template = event.settings.mail_text_download_reminder
+                email_subject = event.settings.mail_subject_download_reminder
+                email_context = get_email_context(event=event, order=o)
+                o.send_mail(
+                    email_subject, email_template, email_context,
+                    'pretix.event.order.email.download_reminder_sent',
+                    attach_tickets=True
+                )
 
-        for o in qs:
-            if o.sales_channel.identifier not in event.settings.mail_sales_channel_download_reminder:
-                continue
+                if event.settings.mail_send_download_reminder_attendee:
+                    for p in positions:
+                        if p.subevent_id:
+                            reminder_date = (p.subevent.date_from - timedelta(days=reminder_days)).replace(
+                                hour=0, minute=0, second=0, microsecond=0
+                            )
+                            if now() < reminder_date:
+                                continue
+                        if p.addon_to_id is None and p.attendee_email and p.attendee_email != o.email:
+                            email_template = event.settings.mail_text_download_reminder_attendee
+                            email_subject = event.settings.mail_subject_download_reminder_attendee
+                            email_context = get_email_context(event=event, order=o, position=p)
+                            o.send_mail(
+                                email_subject, email_template, email_context,
+                                'pretix.event.order.email.download_reminder_sent',
+                                attach_tickets=True, position=p
+                            )
+        _record_periodic_order_delay('send_download_reminders', due)
 
-            if event.has_subevents:
-                reminder_date = ((o.first_date or event.date_from) - timedelta(days=event.reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
-            else:
-                reminder_date = event_reminder_date
-            if now() < reminder_date or o.datetime > reminder_date:
-                continue
+    _process_periodic_order_batches(
+        send_download_reminders_for_event, event, qs, after, process, task_kwargs={'reminder_days': reminder_days}
+    )
 
-            with transaction.atomic():
-                o = Order.objects.select_for_update(of=OF_SELF).get(pk=o.pk)
-                if o.download_reminder_sent:
-                    # Race condition
-                    continue
-                positions = list(o.positions_with_tickets)
-                if not positions:
-                    continue
 
-                if not o.ticket_download_available:
-                    continue
+@app.task(base=EventTask)
+def pregenerate_tickets_for_download_reminders(event):
+    reminder_days = event.settings.get('mail_days_download_reminder', as_type=int)
+    if reminder_days is None:
+        return
+    today = now().replace(hour=0, minute=0, second=0, microsecond=0)
+    horizon = now() + timedelta(hours=settings.CACHE_TICKETS_PREGENERATE_LEAD_HOURS)
 
-                if o.status != Order.STATUS_PAID:
-                    if o.status != Order.STATUS_PENDING or o.require_approval or (not o.valid_if_pending and not o.event.settings.ticket_download_pending):
-                        continue
+    qs = event.orders.filter(
+        download_reminder_sent=False,
+        status__in=(Order.STATUS_PAID, Order.STATUS_PENDING),
+    )
+    if event.has_subevents:
+        qs = qs.annotate(
+            first_date=Min('all_positions__subevent__date_from')
+        ).filter(
+            first_date__gte=today,
+            first_date__lt=horizon + timedelta(days=reminder_days + 1),
+        )
+    else:
+        event_reminder_date = (event.date_from - timedelta(days=reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
 
-                with language(o.locale, o.event.settings.region):
-                    o.download_reminder_sent = True
-                    o.save(update_fields=['download_reminder_sent'])
-                    email_template = event.settings.mail_text_download_reminder
-                    email_subject = event.settings.mail_subject_download_reminder
-                    email_context = get_email_context(event=event, order=o)
-                    o.send_mail(
-                        email_subject, email_template, email_context,
-                        'pretix.event.order.email.download_reminder_sent',
-                        attach_tickets=True
-                    )
+    order_ids = []
+    for o in qs.only('pk', 'datetime', 'sales_channel').iterator(chunk_size=settings.PERIODIC_ORDER_BATCH_SIZE):
+        if o.sales_channel.identifier not in event.settings.mail_sales_channel_download_reminder:
+            continue
+        if event.has_subevents:
+            reminder_date = ((o.first_date or event.date_from) - timedelta(days=reminder_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        else:
+            reminder_date = event_reminder_date
+        if reminder_date > horizon or o.datetime > reminder_date:
+            continue
+        order_ids.append(o.pk)
 
-                    if event.settings.mail_send_download_reminder_attendee:
-                        for p in positions:
-                            if p.subevent_id:
-                                reminder_date = (p.subevent.date_from - timedelta(days=event.reminder_days)).replace(
-                                    hour=0, minute=0, second=0, microsecond=0
-                                )
-                                if now() < reminder_date:
-                                    continue
-                            if p.addon_to_id is None and p.attendee_email and p.attendee_email != o.email:
-                                email_template = event.settings.mail_text_download_reminder_attendee
-                                email_subject = event.settings.mail_subject_download_reminder_attendee
-                                email_context = get_email_context(event=event, order=o, position=p)
-                                o.send_mail(
-                                    email_subject, email_template, email_context,
-                                    'pretix.event.order.email.download_reminder_sent',
-                                    attach_tickets=True, position=p
-                                )
+    tickets.pregenerate_tickets_for_orders(event, order_ids)
 
 
 def notify_user_changed_order(order, user=None, auth=None, invoices=[]):
@@ -3093,6 +3349,7 @@ class OrderChangeManager:
                 [s for s, d in self._seatdiff.items() if d > 0],
                 shared_lock_objects=[self.event]
             )
+        reclaim_quota_shards([q for q, d in self._quotadiff.items() if d > 0])
 
     def guess_totaldiff(self):
         """
@@ -3101,7 +3358,12 @@ class OrderChangeManager:
         """
         return self._totaldiff_guesstimate
 
-    def commit(self, check_quotas=True):
+    def commit(self, check_quotas=True, defer_side_effects=False):
+        """
+        Performs all queued operations. If ``defer_side_effects`` is set, emails, invoice transmission, ticket cache
+        invalidation and the ``order_changed`` signal are only triggered once the surrounding transaction has been
+        committed. This is required if the caller might still roll back the change.
+        """
         if self._committed:
             # an order change can only be committed once
             raise OrderError(error_messages['internal'])
@@ -3132,21 +3394,34 @@ class OrderChangeManager:
             self._check_complete_cancel()
             self._check_and_lock_memberships()
             try:
-                self._perform_operations()
+                with track_quota_counters(self.order), track_checkin_counters(self.order):
+                    self._perform_operations()
             except TaxRule.SaleNotAllowed:
                 raise OrderError(self.error_messages['tax_rule_country_blocked'])
+            if self.split_order:
+                count_new_order(self.split_order)
+                count_new_order_on_checkin_lists(self.split_order)
             new_total = self._recalculate_rounding_total_and_payment_fee()
             totaldiff = new_total - original_total
             self._check_paid_price_change(totaldiff)
             self._check_paid_to_free(totaldiff)
             if self.order.status in (Order.STATUS_PENDING, Order.STATUS_PAID):
                 self._reissue_invoice()
-            self._clear_tickets_cache()
+            if defer_side_effects:
+                transaction.on_commit(self._clear_tickets_cache)
+            else:
+                self._clear_tickets_cache()
             self.order.touch()
             self.order.create_transactions()
             if self.split_order:
                 self.split_order.create_transactions()
 
+        if defer_side_effects:
+            transaction.on_commit(self._notify_and_transmit)
+        else:
+            self._notify_and_transmit()
+
+    def _notify_and_transmit(self):
         transmit_invoices_task = [i for i in self._invoices if invoice_transmission_separately(i)]
         transmit_invoices_mail = [
             i for i in self._invoices
@@ -0,0 +1,220 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+Incrementally maintained quota counters.
+
+Counting all paid and pending order positions of a quota is by far the most expensive part of computing quota
+availability for large events. If ``[quotas] counters`` is enabled, we keep the result of that count in
+``QuotaCounter`` objects and apply deltas to them in the same database transaction that changes an order. The
+deltas are computed by comparing the quota-relevant "footprint" of the order before and after the change, which
+means the code paths performing the change do not need to know anything about quotas.
+
+Not every code path that modifies orders is wrapped, and we do not want to risk overbooking due to a bug in this
+bookkeeping, so the counters are only used by ``QuotaAvailability.compute(allow_cache=True)``, i.e. in places where
+slightly outdated numbers are fine anyway. A periodic job recounts counters of events with recent changes to repair
+any drift.
+"""
+import logging
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Order, OrderPosition, Quota, QuotaCounter
+from pretix.base.signals import periodic_task
+from pretix.helpers.periodic import minimum_interval
+
+logger = logging.getLogger(__name__)
+
+# Counters are recounted at most once per RECONCILIATION_INTERVAL, and only if their event has seen order changes
+# since the last recount.
+RECONCILIATION_INTERVAL = timedelta(minutes=10)
+
+# Quotas of events without any order changes for this long are not considered by the periodic job anymore
+RECONCILIATION_MAX_AGE = timedelta(days=7)
+
+
+def _order_footprint(order_id):
+    """
+    Returns the number of positions of an order that count towards quotas, grouped by
+    ``(subevent_id, item_id, variation_id, status)``. The filters need to stay in sync with
+    ``QuotaAvailability._compute_orders``.
+    """
+    qs = OrderPosition.objects.filter(
+        order_id=order_id,
+        order__status__in=[Order.STATUS_PAID, Order.STATUS_PENDING],
+    ).filter(
+        ~Q(Q(ignore_from_quota_while_blocked=True) & Q(blocked__isnull=False))
+    ).order_by().values('subevent_id', 'item_id', 'variation_id', 'order__status').annotate(c=Count('*'))
+    return Counter({
+        (line['subevent_id'], line['item_id'], line['variation_id'], line['order__status']): line['c']
+        for line in qs
+    })
+
+
+def _apply_footprint_delta(event_id, delta):
+    delta = {k: v for k, v in delta.items() if v}
+    if not delta:
+        return
+
+    item_quotas = defaultdict(set)
+    var_quotas = defaultdict(set)
+    q_items = Quota.items.through.objects.filter(
+        quota__event_id=event_id,
+        item_id__in={k[1] for k in delta},
+    ).values('quota_id', 'item_id', 'quota__subevent_id')
+    for m in q_items:
+        item_quotas[m['item_id'], m['quota__subevent_id']].add(m['quota_id'])
+    q_vars = Quota.variations.through.objects.filter(
+        quota__event_id=event_id,
+        itemvariation_id__in={k[2] for k in delta if k[2]},
+    ).values('quota_id', 'itemvariation_id', 'quota__subevent_id')
+    for m in q_vars:
+        var_quotas[m['itemvariation_id'], m['quota__subevent_id']].add(m['quota_id'])
+
+    quota_deltas = defaultdict(lambda: [0, 0])
+    for (subevent_id, item_id, variation_id, status), c in delta.items():
+        if variation_id:
+            quota_ids = var_quotas[variation_id, subevent_id]
+        else:
+            quota_ids = item_quotas[item_id, subevent_id]
+        for quota_id in quota_ids:
+            quota_deltas[quota_id][0 if status == Order.STATUS_PAID else 1] += c
+
+    for quota_id, (paid, pending) in sorted(quota_deltas.items()):
+        if paid or pending:
+            # Counters that do not exist yet are created by the reconciliation job, we do not create them here to
+            # avoid concurrent inserts.
+            QuotaCounter.objects.filter(quota_id=quota_id).update(
+                paid_orders=F('paid_orders') + paid,
+                pending_orders=F('pending_orders') + pending,
+            )
+
+
+@contextmanager
+def track_quota_counters(order):
+    """
+    Wrap any code changing the status or the positions of an existing order in this context manager to keep the
+    quota counters up to date. Needs to be used inside the database transaction performing the change.
+
+    Usage example::
+
+        with transaction.atomic(), track_quota_counters(order):
+            order.status = Order.STATUS_EXPIRED
+            order.save(update_fields=['status'])
+    """
+    if not settings.QUOTA_COUNTERS_ENABLED or not order.pk:
+        yield
+        return
+
+    before = _order_footprint(order.pk)
+    yield
+    after = _order_footprint(order.pk)
+    after.subtract(before)
+    _apply_footprint_delta(order.event_id, after)
+
+
+def count_new_order(order):
+    """
+    Adds a newly created order to the quota counters. Needs to be called inside the database transaction
+    creating the order.
+    """
+    if not settings.QUOTA_COUNTERS_ENABLED:
+        return
+    _apply_footprint_delta(order.event_id, _order_footprint(order.pk))
+
+
+def reconcile_quota_counters(quotas):
+    """
+    Recounts the counters of the given quotas from scratch and creates missing counters.
+    """
+    from pretix.base.services.quotas import QuotaAvailability
+
+    quotas = [q for q in quotas if not q.release_after_exit]
+    if not quotas:
+        return
+
+    with transaction.atomic():
+        QuotaCounter.objects.bulk_create(
+            [QuotaCounter(quota=q) for q in quotas],
+            ignore_conflicts=True,
+        )
+        # Locking the counters first makes sure that concurrent transactions applying deltas either commit before we
+        # count (and we see their changes) or apply their delta after we are done.
+        counters = {
+            c.quota_id: c
+            for c in QuotaCounter.objects.select_for_update().filter(quota__in=quotas).order_by('pk')
+        }
+
+        qa = QuotaAvailability(full_results=True, early_out=False, count_waitinglist=False)
+        qa.queue(*quotas)
+        qa.compute()
+
+        now_dt = now()
+        for q in quotas:
+            c = counters[q.pk]
+            if (c.paid_orders, c.pending_orders) != (qa.count_paid_orders[q], qa.count_pending_orders[q]) \
+                    and c.reconciled:
+                logger.info(
+                    f'Repaired drift in quota counter for quota {q.pk}: '
+                    f'paid {c.paid_orders} -> {qa.count_paid_orders[q]}, '
+                    f'pending {c.pending_orders} -> {qa.count_pending_orders[q]}'
+                )
+            c.paid_orders = qa.count_paid_orders[q]
+            c.pending_orders = qa.count_pending_orders[q]
+            c.reconciled = now_dt
+        QuotaCounter.objects.bulk_update(counters.values(), ['paid_orders', 'pending_orders', 'reconciled'])
+
+
+@receiver(signal=periodic_task)
+@scopes_disabled()
+@minimum_interval(minutes_after_success=5)
+def reconcile_quota_counters_periodic(sender, **kwargs):
+    if not settings.QUOTA_COUNTERS_ENABLED:
+        return
+
+    now_dt = now()
+    qs = Quota.objects.filter(
+        Q(counter__isnull=True) | Q(counter__reconciled__isnull=True) | Q(counter__reconciled__lt=now_dt - RECONCILIATION_INTERVAL),
+        release_after_exit=False,
+    ).filter(
+        Exists(Order.objects.filter(
+            event_id=OuterRef('event_id'),
+            last_modified__gt=Coalesce(OuterRef('counter__reconciled'), now_dt - RECONCILIATION_MAX_AGE),
+        ))
+    ).select_related('event').order_by('event_id', 'pk')
+
+    batch = []
+    for q in qs.iterator():
+        if batch and (len(batch) >= 100 or batch[-1].event_id != q.event_id):
+            reconcile_quota_counters(batch)
+            batch = []
+        batch.append(q)
+    if batch:
+        reconcile_quota_counters(batch)
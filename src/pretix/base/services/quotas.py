@@ -19,26 +19,38 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
 # <https://www.gnu.org/licenses/>.
 #
+import math
+import random
 import sys
 import time
+import uuid
 from collections import Counter, defaultdict
 from itertools import zip_longest
 
 import django_redis
 from django.conf import settings
-from django.db import connection, models
+from django.db import connection, models, transaction
 from django.db.models import (
     Case, Count, F, Func, Max, OuterRef, Q, Subquery, Sum, Value, When,
     prefetch_related_objects,
 )
 from django.utils.timezone import now
+from redis.exceptions import WatchError
 
 from pretix.base.models import (
-    CartPosition, Checkin, Order, OrderPosition, Quota, Voucher,
+    CartPosition, Checkin, Order, OrderPosition, Quota, QuotaCounter, Voucher,
     WaitingListEntry,
 )
 
+from ..metrics import pretix_quota_cache_results_total
 from ..signals import quota_availability
+from .quotashards import shard_tokens
+
+# Cached quota availability is considered outdated after CACHE_TTL seconds
+CACHE_TTL = 120
+
+# Controls how early cache entries are refreshed before they expire, see QuotaAvailability._read_cache
+CACHE_EARLY_REFRESH_BETA = 1
 
 
 class QuotaAvailability:
@@ -62,10 +74,11 @@ class QuotaAvailability:
     * count_vouchers (dict mapping quotas to ints)
     * count_waitinglist (dict mapping quotas to ints)
     * count_cart (dict mapping quotas to ints)
+    * count_shard_tokens (dict mapping quotas to ints)
     """
 
     def __init__(self, count_waitinglist=True, ignore_closed=False, full_results=False, early_out=True,
-                 allow_repeatable_read=False):
+                 allow_repeatable_read=False, count_shard_tokens=False):
         """
         Initialize a new quota availability calculator
 
@@ -89,6 +102,12 @@ class QuotaAvailability:
                           performance improvements.
 
         :param allow_repeatable_read: Allow to run this even in REPEATABLE READ mode, generally not advised.
+
+        :param count_shard_tokens: If ``True``, tokens pre-allocated to quota shards are subtracted from the
+                                   availability like cart positions. This is only needed by cart operations that
+                                   leave the shards in place. Everyone else either holds an exclusive lock and
+                                   returns the tokens to the quota before computing, or only displays the
+                                   availability, so tokens count as free capacity by default.
         """
         self._queue = []
         self._count_waitinglist = count_waitinglist
@@ -99,6 +118,8 @@ class QuotaAvailability:
         self._early_out = early_out
         self._quota_objects = {}
         self._allow_repeatable_read = allow_repeatable_read
+        self._use_counters = False
+        self._count_shard_tokens = count_shard_tokens and settings.QUOTA_SHARDS > 1
         self.results = {}
         self.count_paid_orders = defaultdict(int)
         self.count_pending_orders = defaultdict(int)
@@ -106,12 +127,15 @@ class QuotaAvailability:
         self.count_vouchers = defaultdict(int)
         self.count_waitinglist = defaultdict(int)
         self.count_cart = defaultdict(int)
+        self.count_shard_tokens = defaultdict(int)
 
         self._cache_key_suffix = ""
         if not self._count_waitinglist:
             self._cache_key_suffix += ":nocw"
         if self._ignore_closed:
             self._cache_key_suffix += ":igcl"
+        if self._count_shard_tokens:
+            self._cache_key_suffix += ":shrd"
 
         self.sizes = {}
 
@@ -122,6 +146,8 @@ class QuotaAvailability:
         """
         Compute the queued quotas. If ``allow_cache`` is set, results may also be taken from a cache that might
         be a few minutes outdated. In this case, you may not rely on the results in the ``count_*`` properties.
+        If ``allow_cache`` is set and quota counters are enabled in the configuration, order positions are
+        not counted but taken from the incrementally maintained ``QuotaCounter`` objects.
         """
         if not self._allow_repeatable_read and getattr(connection, "tx_in_repeatable_read", False):
             raise ValueError("You cannot compute quotas in REPEATABLE READ mode unless you explicitly opted in to "
@@ -137,32 +163,71 @@ class QuotaAvailability:
                 raise ValueError("You cannot combine full_results and allow_cache.")
 
             elif settings.HAS_REDIS:
-                rc = django_redis.get_redis_connection("redis")
-                quotas_by_event = defaultdict(list)
-                for q in [_q for _q in self._queue if _q.id in quota_ids_set]:
-                    quotas_by_event[q.event_id].append(q)
-
-                for eventid, evquotas in quotas_by_event.items():
-                    d = rc.hmget(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', [str(q.pk) for q in evquotas])
-                    for redisval, q in zip(d, evquotas):
-                        if redisval is not None:
-                            data = [rv for rv in redisval.decode().split(',')]
-                            # Except for some rare situations, we don't want to use cache entries older than 2 minutes
-                            if time.time() - int(data[2]) < 120 or allow_cache_stale:
-                                quota_ids_set.remove(q.id)
-                                if data[1] == "None":
-                                    self.results[q] = int(data[0]), None
-                                else:
-                                    self.results[q] = int(data[0]), int(data[1])
+                fresh, outdated = self._read_cache([_q for _q in self._queue if _q.id in quota_ids_set], allow_cache_stale)
+                for q, result in fresh.items():
+                    quota_ids_set.discard(q.id)
+                    self.results[q] = result
+
+                lock_token = None
+                if outdated:
+                    lock_token = self._acquire_recompute_lock(quota_ids_set)
+                    if not lock_token:
+                        # Another process is already recomputing these quotas. Instead of joining the stampede, we
+                        # serve the outdated values in the meantime.
+                        for q, result in outdated.items():
+                            quota_ids_set.discard(q.id)
+                            self.results[q] = result
+
+                if settings.METRICS_ENABLED:
+                    if fresh:
+                        pretix_quota_cache_results_total.inc(len(fresh), result="hit")
+                    if outdated and not lock_token:
+                        pretix_quota_cache_results_total.inc(len(outdated), result="stale")
+                    if quota_ids_set:
+                        pretix_quota_cache_results_total.inc(len(quota_ids_set), result="miss")
+
+                if lock_token:
+                    try:
+                        self._compute_queue(quota_ids_set, now_dt, allow_cache)
+                    finally:
+                        self._release_recompute_lock(quota_ids_set, lock_token)
+                    return
+
+        self._compute_queue(quota_ids_set, now_dt, allow_cache)
+
+    def best_availability_summary(self, objects):
+        """
+        Summarizes the computed results per event or subevent, which is all most calendar and list views need. The
+        objects need to be fetched through ``Event.annotated()`` or ``SubEvent.annotated()`` and their
+        ``active_quotas`` need to be part of this computation. Returns a dictionary mapping the primary keys of
+        the objects to a 4-tuple as described in ``best_availability``, which is also populated on the objects
+        themselves.
+
+        Usage example::
+
+            qa = QuotaAvailability()
+            qa.queue(*[q for se in subevents for q in se.active_quotas])
+            qa.compute(allow_cache=True)
+            summary = qa.best_availability_summary(subevents)
+        """
+        summary = {}
+        for obj in objects:
+            obj._quota_cache = self.results
+            summary[obj.pk] = obj.best_availability
+        return summary
 
+    def _compute_queue(self, quota_ids_set, now_dt, allow_cache):
         if not quota_ids_set:
             return
 
         quotas = [_q for _q in self._queue if _q.id in quota_ids_set]
         quotas_original = list(quotas)
         self._queue.clear()
+        self._use_counters = allow_cache and settings.QUOTA_COUNTERS_ENABLED
 
+        t0 = time.time()
         self._compute(quotas, now_dt)
+        duration = time.time() - t0
 
         for q in quotas_original:
             for recv, resp in quota_availability.send(sender=q.event, quota=q, result=self.results[q],
@@ -170,46 +235,119 @@ class QuotaAvailability:
                 self.results[q] = resp
 
         self._close(quotas)
-        self._write_cache(quotas, now_dt)
+        self._write_cache(quotas, t0, duration)
+
+    def _read_cache(self, quotas, allow_cache_stale):
+        """
+        Reads the cached availability of the given quotas and returns two dictionaries mapping quotas to results,
+        one for results that may be used and one for results that are expired or have been invalidated since.
+        """
+        fresh, outdated = {}, {}
+        if not quotas:
+            return fresh, outdated
 
-    def _write_cache(self, quotas, now_dt):
+        rc = django_redis.get_redis_connection("redis")
+        quotas_by_event = defaultdict(list)
+        for q in quotas:
+            quotas_by_event[q.event_id].append(q)
+
+        pipe = rc.pipeline(transaction=False)
+        for eventid, evquotas in quotas_by_event.items():
+            pipe.hmget(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', [str(q.pk) for q in evquotas])
+            pipe.hmget(f'quotas:{eventid}:availabilitycache:invalidated', [str(q.pk) for q in evquotas])
+        redis_results = pipe.execute()
+
+        t = time.time()
+        for i, evquotas in enumerate(quotas_by_event.values()):
+            for q, redisval, invalidated in zip(evquotas, redis_results[2 * i], redis_results[2 * i + 1]):
+                if redisval is None:
+                    continue
+                data = redisval.decode().split(',')
+                result = int(data[0]), (None if data[1] == "None" else int(data[1]))
+                # Time the computation of the entry started, so invalidations that happened while it was running
+                # are considered newer than the entry
+                written = float(data[2])
+                # Entries written by older versions of pretix do not contain the time it took to compute them
+                compute_duration = float(data[3]) if len(data) > 3 else 0
+
+                if allow_cache_stale:
+                    fresh[q] = result
+                elif invalidated is not None and float(invalidated) >= written:
+                    outdated[q] = result
+                elif t - written - compute_duration * CACHE_EARLY_REFRESH_BETA * math.log(1 - random.random()) < CACHE_TTL:
+                    # Except for some rare situations, we don't want to use cache entries older than CACHE_TTL. To
+                    # prevent many entries from expiring at the same moment, we consider entries as expired a little
+                    # bit early with a probability that rises as the entry gets older and the longer it took to
+                    # compute it ("probabilistic early expiration").
+                    fresh[q] = result
+                else:
+                    outdated[q] = result
+        return fresh, outdated
+
+    def _recompute_lock_key(self, quota_ids):
+        lock_name = '_'.join([str(p) for p in sorted(quota_ids)])
+        return f'quotas:availabilitycachewrite:{lock_name}{self._cache_key_suffix}'
+
+    def _acquire_recompute_lock(self, quota_ids):
+        """
+        Tries to acquire a lock signalling that we are recomputing the given set of quotas. Returns an owner token
+        if successful and ``None`` otherwise. The lock automatically expires after 10 seconds, which should be well
+        above the duration of a computation.
+        """
+        rc = django_redis.get_redis_connection("redis")
+        token = uuid.uuid4().hex
+        if rc.set(self._recompute_lock_key(quota_ids), token, nx=True, ex=10):
+            return token
+
+    def _release_recompute_lock(self, quota_ids, token):
+        rc = django_redis.get_redis_connection("redis")
+        key = self._recompute_lock_key(quota_ids)
+        with rc.pipeline() as pipe:
+            try:
+                # Only release the lock if it is still ours, it might have expired and been acquired by someone else
+                pipe.watch(key)
+                if pipe.get(key) == token.encode():
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+            except WatchError:
+                pass
+
+    def _write_cache(self, quotas, started, compute_duration):
         if not settings.HAS_REDIS or not quotas:
             return
 
         rc = django_redis.get_redis_connection("redis")
         # We write the computed availability to redis in a per-event hash as
         #
-        #   quota_id -> (availability_state, availability_number, timestamp).
+        #   quota_id -> (availability_state, availability_number, timestamp, compute_duration).
+        #
+        # The timestamp is the time the computation started, not the time it finished, since an invalidation
+        # arriving while we compute might not be reflected in our result.
         #
         # We store this in a hash instead of individual values to avoid making too many redis requests
         # which would introduce latency.
-
-        # The individual entries in the hash are "valid" for 120 seconds. This means in a typical peak scenario with
-        # high load *to a specific calendar or event*, lots of parallel web requests will receive an "expired" result
-        # around the same time, recompute quotas and write back to the cache. To avoid overloading redis with lots of
-        # simultaneous write queries for the same page, we place a very naive and simple "lock" on the write process for
-        # these quotas. We choose 10 seconds since that should be well above the duration of a write.
-
-        lock_name = '_'.join([str(p) for p in sorted([q.pk for q in quotas])])
-        if rc.exists(f'quotas:availabilitycachewrite:{lock_name}{self._cache_key_suffix}'):
-            return
-        rc.set(f'quotas:availabilitycachewrite:{lock_name}{self._cache_key_suffix}', '1', ex=10)
-
+        #
+        # We used to skip writes while another process was writing the same quotas. We no longer do this, since
+        # a skipped write could keep an invalidated entry in place, and concurrent recomputations of cached
+        # values are already prevented by the recompute lock in compute(). All writes go through one pipeline.
         update = defaultdict(list)
         for q in quotas:
             update[q.event_id].append(q)
 
+        pipe = rc.pipeline(transaction=False)
         for eventid, quotas in update.items():
-            rc.hset(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', mapping={
+            pipe.hset(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', mapping={
                 str(q.id): ",".join(
                     [str(i) for i in self.results[q]] +
-                    [str(int(time.time()))]
+                    [f"{started:.3f}", f"{compute_duration:.3f}"]
                 ) for q in quotas
             })
             # To make sure old events do not fill up our redis instance, we set an expiry on the cache. However, we set it
             # on 7 days even though we mostly ignore values older than 2 monites. The reasoning is that we have some places
             # where we set allow_cache_stale and use the old entries anyways to save on performance.
-            rc.expire(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', 3600 * 24 * 7)
+            pipe.expire(f'quotas:{eventid}:availabilitycache{self._cache_key_suffix}', 3600 * 24 * 7)
+        pipe.execute()
 
         # We used to also delete item_quota_cache:* from the event cache here, but as the cache
         # gets more complex, this does not seem worth it. The cache is only present for up to
@@ -246,24 +384,33 @@ class QuotaAvailability:
             self.count_cart[q] = 0
             self.count_vouchers[q] = 0
             self.count_waitinglist[q] = 0
+            self.count_shard_tokens[q] = 0
 
         # Fetch which quotas belong to which items and variations
         q_items = Quota.items.through.objects.filter(
             quota_id__in=[q.pk for q in quotas]
         ).values('quota_id', 'item_id')
         for m in q_items:
-            self._item_to_quotas[m['item_id']].add(self._quota_objects[m['quota_id']])
+            q = self._quota_objects[m['quota_id']]
+            self._item_to_quotas[m['item_id'], q.subevent_id].add(q)
 
         q_vars = Quota.variations.through.objects.filter(
             quota_id__in=[q.pk for q in quotas]
         ).values('quota_id', 'itemvariation_id', 'itemvariation__item_id')
         for m in q_vars:
-            self._var_to_quotas[m['itemvariation_id']].add(self._quota_objects[m['quota_id']])
+            q = self._quota_objects[m['quota_id']]
+            self._var_to_quotas[m['itemvariation_id'], q.subevent_id].add(q)
             # We can't be 100% certain that a quota, when it is connected to a variation, is also always connected to
             # the parent item, so we double-check here just to be sure.
-            self._item_to_quotas[m['itemvariation__item_id']].add(self._quota_objects[m['quota_id']])
+            self._item_to_quotas[m['itemvariation__item_id'], q.subevent_id].add(q)
 
-        self._compute_orders(quotas, q_items, q_vars, size_left)
+        if self._use_counters:
+            counted_quotas = self._compute_orders_from_counters(quotas, size_left)
+            uncounted_quotas = [q for q in quotas if q not in counted_quotas]
+            if uncounted_quotas:
+                self._compute_orders(uncounted_quotas, q_items, q_vars, size_left)
+        else:
+            self._compute_orders(quotas, q_items, q_vars, size_left)
 
         if not self._full_results:
             quotas = [q for q in quotas if q not in self.results]
@@ -279,6 +426,14 @@ class QuotaAvailability:
 
         self._compute_carts(quotas, q_items, q_vars, size_left, now_dt)
 
+        if self._count_shard_tokens:
+            if not self._full_results:
+                quotas = [q for q in quotas if q not in self.results]
+                if not quotas:
+                    return
+
+            self._compute_shard_tokens(quotas, size_left)
+
         if self._count_waitinglist:
             if not self._full_results:
                 quotas = [q for q in quotas if q not in self.results]
@@ -294,6 +449,20 @@ class QuotaAvailability:
                 else:
                     raise ValueError("inconclusive quota")
 
+    def _quotas_for_line(self, line):
+        """
+        Returns the quotas a result line of one of the grouped aggregations below counts towards. The lookup tables are
+        keyed by item/variation *and* subevent, so this stays cheap even if we compute thousands of quotas of the same
+        items across many dates at once.
+        """
+        if line['variation_id']:
+            return self._var_to_quotas.get((line['variation_id'], line['subevent_id']), ())
+        elif line['item_id']:
+            return self._item_to_quotas.get((line['item_id'], line['subevent_id']), ())
+        else:
+            q = self._quota_objects[line['quota_id']]
+            return (q,) if q.subevent_id == line['subevent_id'] else ()
+
     def _compute_orders(self, quotas, q_items, q_vars, size_left):
         events = {q.event_id for q in quotas}
         subevents = {q.subevent_id for q in quotas}
@@ -301,6 +470,7 @@ class QuotaAvailability:
         if None in subevents:
             seq |= Q(subevent__isnull=True)
         quota_ids = {q.pk for q in quotas}
+        quota_set = set(quotas)
         op_lookup = OrderPosition.objects.filter(
             order__status__in=[Order.STATUS_PAID, Order.STATUS_PENDING],
             order__event_id__in=events,
@@ -349,26 +519,47 @@ class QuotaAvailability:
             )
         op_lookup = op_lookup.values('order__status', 'item_id', 'subevent_id', 'variation_id', 'is_exited').annotate(c=Count('*'))
         for line in sorted(op_lookup, key=lambda li: (int(li['is_exited']), li['order__status']), reverse=True):  # p before n, exited before non-exited
-            if line['variation_id']:
-                qs = self._var_to_quotas[line['variation_id']]
-            else:
-                qs = self._item_to_quotas[line['item_id']]
-            for q in qs:
-                if q.subevent_id == line['subevent_id']:
-                    if line['order__status'] == Order.STATUS_PAID:
-                        self.count_paid_orders[q] += line['c']
-                        q.cached_availability_paid_orders = self.count_paid_orders[q]
-                    elif line['order__status'] == Order.STATUS_PENDING:
-                        self.count_pending_orders[q] += line['c']
-                    if q.release_after_exit and line['is_exited']:
-                        self.count_exited_orders[q] += line['c']
-                    else:
-                        size_left[q] -= line['c']
-                        if size_left[q] <= 0 and q not in self.results:
-                            if line['order__status'] == Order.STATUS_PAID:
-                                self.results[q] = Quota.AVAILABILITY_GONE, 0
-                            else:
-                                self.results[q] = Quota.AVAILABILITY_ORDERED, 0
+            for q in self._quotas_for_line(line):
+                if q not in quota_set:
+                    # Already counted, e.g. from a quota counter
+                    continue
+                if line['order__status'] == Order.STATUS_PAID:
+                    self.count_paid_orders[q] += line['c']
+                    q.cached_availability_paid_orders = self.count_paid_orders[q]
+                elif line['order__status'] == Order.STATUS_PENDING:
+                    self.count_pending_orders[q] += line['c']
+                if q.release_after_exit and line['is_exited']:
+                    self.count_exited_orders[q] += line['c']
+                else:
+                    size_left[q] -= line['c']
+                    if size_left[q] <= 0 and q not in self.results:
+                        if line['order__status'] == Order.STATUS_PAID:
+                            self.results[q] = Quota.AVAILABILITY_GONE, 0
+                        else:
+                            self.results[q] = Quota.AVAILABILITY_ORDERED, 0
+
+    def _compute_orders_from_counters(self, quotas, size_left):
+        counters = QuotaCounter.objects.filter(
+            quota_id__in=[q.pk for q in quotas if not q.release_after_exit],
+            reconciled__isnull=False,
+        ).values('quota_id', 'paid_orders', 'pending_orders')
+        counted_quotas = set()
+        for c in counters:
+            q = self._quota_objects[c['quota_id']]
+            # Counters might have drifted into negative numbers in case of bugs, we never want to use that
+            paid, pending = max(c['paid_orders'], 0), max(c['pending_orders'], 0)
+            self.count_paid_orders[q] = paid
+            self.count_pending_orders[q] = pending
+            q.cached_availability_paid_orders = paid
+
+            size_left[q] -= paid
+            if size_left[q] <= 0 and q not in self.results:
+                self.results[q] = Quota.AVAILABILITY_GONE, 0
+            size_left[q] -= pending
+            if size_left[q] <= 0 and q not in self.results:
+                self.results[q] = Quota.AVAILABILITY_ORDERED, 0
+            counted_quotas.add(q)
+        return counted_quotas
 
     def _compute_vouchers(self, quotas, q_items, q_vars, size_left, now_dt):
         events = {q.event_id for q in quotas}
@@ -404,18 +595,11 @@ class QuotaAvailability:
             free=Sum(Func(F('max_usages') - F('redeemed'), 0, function=func))
         )
         for line in v_lookup:
-            if line['variation_id']:
-                qs = self._var_to_quotas[line['variation_id']]
-            elif line['item_id']:
-                qs = self._item_to_quotas[line['item_id']]
-            else:
-                qs = [self._quota_objects[line['quota_id']]]
-            for q in qs:
-                if q.subevent_id == line['subevent_id']:
-                    size_left[q] -= line['free']
-                    self.count_vouchers[q] += line['free']
-                    if q not in self.results and size_left[q] <= 0:
-                        self.results[q] = Quota.AVAILABILITY_ORDERED, 0
+            for q in self._quotas_for_line(line):
+                size_left[q] -= line['free']
+                self.count_vouchers[q] += line['free']
+                if q not in self.results and size_left[q] <= 0:
+                    self.results[q] = Quota.AVAILABILITY_ORDERED, 0
 
     def _compute_carts(self, quotas, q_items, q_vars, size_left, now_dt):
         events = {q.event_id for q in quotas}
@@ -443,22 +627,31 @@ class QuotaAvailability:
             )
         ).order_by().values('item_id', 'subevent_id', 'variation_id').annotate(c=Count('*'))
         for line in cart_lookup:
-            if line['variation_id']:
-                qs = self._var_to_quotas[line['variation_id']]
-            else:
-                qs = self._item_to_quotas[line['item_id']]
-            for q in qs:
-                if q.subevent_id == line['subevent_id']:
-                    size_left[q] -= line['c']
-                    self.count_cart[q] += line['c']
-                    if q not in self.results and size_left[q] <= 0:
-                        self.results[q] = Quota.AVAILABILITY_RESERVED, 0
+            for q in self._quotas_for_line(line):
+                size_left[q] -= line['c']
+                self.count_cart[q] += line['c']
+                if q not in self.results and size_left[q] <= 0:
+                    self.results[q] = Quota.AVAILABILITY_RESERVED, 0
+
+    def _compute_shard_tokens(self, quotas, size_left):
+        for quota_id, tokens in shard_tokens(quotas).items():
+            q = self._quota_objects[quota_id]
+            size_left[q] -= tokens
+            self.count_shard_tokens[q] += tokens
+            if q not in self.results and size_left[q] <= 0:
+                self.results[q] = Quota.AVAILABILITY_RESERVED, 0
 
     def _compute_waitinglist(self, quotas, q_items, q_vars, size_left):
         prefetch_related_objects(quotas, "event", "event__organizer")
+        # Quotas of the same event do not necessarily share the same event instance, look up the settings only once
+        # per event to avoid one query per quota when computing many dates of an event series
+        auto_disable = {}
+        for q in quotas:
+            if q.event_id not in auto_disable:
+                auto_disable[q.event_id] = q.event.settings.waiting_list_auto_disable
         quotas = [
             q for q in quotas
-            if not q.event.settings.waiting_list_auto_disable or q.event.settings.waiting_list_auto_disable.datetime(q.subevent or q.event) > now()
+            if not auto_disable[q.event_id] or auto_disable[q.event_id].datetime(q.subevent or q.event) > now()
         ]
 
         events = {q.event_id for q in quotas}
@@ -479,16 +672,11 @@ class QuotaAvailability:
             )
         ).order_by().values('item_id', 'subevent_id', 'variation_id').annotate(c=Count('*'))
         for line in w_lookup:
-            if line['variation_id']:
-                qs = self._var_to_quotas[line['variation_id']]
-            else:
-                qs = self._item_to_quotas[line['item_id']]
-            for q in qs:
-                if q.subevent_id == line['subevent_id']:
-                    size_left[q] -= line['c']
-                    self.count_waitinglist[q] += line['c']
-                    if q not in self.results and size_left[q] <= 0:
-                        self.results[q] = Quota.AVAILABILITY_ORDERED, 0
+            for q in self._quotas_for_line(line):
+                size_left[q] -= line['c']
+                self.count_waitinglist[q] += line['c']
+                if q not in self.results and size_left[q] <= 0:
+                    self.results[q] = Quota.AVAILABILITY_ORDERED, 0
 
     def _compute_early_outs(self, quotas):
         for q in quotas:
@@ -500,6 +688,33 @@ class QuotaAvailability:
                 self.results[q] = Quota.AVAILABILITY_GONE, 0
 
 
+def invalidate_quota_cache(quotas):
+    """
+    Marks the cached availability of the given quotas as outdated, e.g. because tickets have just been sold. If called
+    inside a database transaction, this only happens once the transaction is committed. The next request to use the
+    cache will recompute the availability while parallel requests are served the outdated value in the meantime.
+    """
+    if not settings.HAS_REDIS or not quotas:
+        return
+
+    quota_ids_by_event = defaultdict(set)
+    for q in quotas:
+        quota_ids_by_event[q.event_id].add(q.pk)
+
+    def _invalidate():
+        rc = django_redis.get_redis_connection("redis")
+        t = f"{time.time():.3f}"
+        pipe = rc.pipeline(transaction=False)
+        for eventid, quota_ids in quota_ids_by_event.items():
+            pipe.hset(f'quotas:{eventid}:availabilitycache:invalidated', mapping={
+                str(quota_id): t for quota_id in quota_ids
+            })
+            pipe.expire(f'quotas:{eventid}:availabilitycache:invalidated', 3600 * 24 * 7)
+        pipe.execute()
+
+    transaction.on_commit(_invalidate)
+
+
 def grouper(iterable, n, fillvalue=None):
     """Collect data into fixed-length chunks or blocks"""
     # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
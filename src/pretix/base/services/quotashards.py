@@ -0,0 +1,181 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+Sharded quota capacity for flash sales.
+
+Usually, every cart operation takes an exclusive lock on every quota it reserves tickets from, which serializes all
+buyers of the same product. If ``[quotas] shards`` is set, a part of the free capacity of a quota is pre-allocated
+into that many ``QuotaShard`` buckets. A cart operation that finds enough tokens in any shard converts them into cart positions while
+holding only a *shared* lock on the quota, so concurrent buyers only contend on the shard rows, and never on the same
+row since locked shards are skipped.
+
+Whenever no shard has enough tokens left, the cart operation falls back to the exact path with an exclusive lock on
+the quota. Since shared lock holders are excluded while we hold the exclusive lock, the exact path can safely return
+the tokens of the quota to the pool of free capacity and redistribute them evenly afterwards. This only happens if
+the shards of the quota are running low, and shards are only filled if there is enough capacity left, so close to
+selling out, all operations go through the exact path again. While the shards are left in place, the exact cart path
+subtracts their tokens from the availability of the quota just like cart positions.
+
+Tokens still count as free capacity for everyone else. Operations that sell or block quota outside of carts, e.g.
+orders created from expired carts, order changes, or vouchers, return all tokens of the quotas they lock to the
+free capacity before computing it, so they can use the whole quota.
+
+Since tokens bypass the regular availability computation, shards are never used for closed quotas or for events
+with plugins that modify quota availability, and all tokens of a quota are returned whenever the quota is saved,
+e.g. because its size was reduced or it has been closed.
+"""
+from django.conf import settings
+from django.db.models import Count, F, Min, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from pretix.base.models import Quota, QuotaShard
+from pretix.base.signals import is_receiver_active, quota_availability
+
+# Shards are only filled if every shard can receive at least MIN_TOKENS_PER_SHARD tokens
+MIN_TOKENS_PER_SHARD = 5
+
+# Only this share of the free capacity of a quota is pre-allocated to shards. The rest stays available to the exact
+# cart path without returning the tokens.
+SHARD_FILL_RATIO = 0.5
+
+
+class QuotaShardsExhausted(Exception):
+    pass
+
+
+def quota_shards_enabled(event):
+    """
+    Returns whether quota shards may be used for the given event. Tokens are handed out without computing the
+    availability of the quota, so this is not the case if a plugin modifying quota availability is active.
+    """
+    if settings.QUOTA_SHARDS <= 1:
+        return False
+    return not any(is_receiver_active(event, r) for r in quota_availability._live_receivers(event)[0])
+
+
+def quota_is_sharded(quota):
+    return settings.QUOTA_SHARDS > 1 and quota.size is not None and not quota.closed
+
+
+def shard_tokens(quotas):
+    """
+    Returns a dictionary mapping quota IDs to the number of tokens currently pre-allocated to their shards.
+    """
+    if settings.QUOTA_SHARDS <= 1:
+        return {}
+    return {
+        r['quota_id']: r['s']
+        for r in QuotaShard.objects.filter(
+            quota_id__in=[q.pk for q in quotas], tokens__gt=0
+        ).order_by().values('quota_id').annotate(s=Sum('tokens'))
+    }
+
+
+def take_shard_tokens(quota_diff):
+    """
+    Takes the given number of tokens per quota from the shards of the quota. Needs to be called inside the database
+    transaction that creates the cart positions, after acquiring at least a shared lock on the quotas. Returns a
+    dictionary mapping every quota to the ID of the shard the tokens were taken from, or raises
+    ``QuotaShardsExhausted`` if no shard of at least one quota has enough tokens. In this case, the transaction needs
+    to be rolled back to return the tokens taken so far.
+    """
+    shards = {}
+    for quota, count in sorted(quota_diff.items(), key=lambda i: i[0].pk):
+        shard_id = QuotaShard.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+            quota=quota,
+            quota__closed=False,
+            index__lt=settings.QUOTA_SHARDS,
+            tokens__gte=count,
+        ).order_by('?').values_list('pk', flat=True).first()
+        if shard_id is None:
+            raise QuotaShardsExhausted()
+        QuotaShard.objects.filter(pk=shard_id).update(tokens=F('tokens') - count)
+        shards[quota] = shard_id
+    return shards
+
+
+def return_shard_tokens(shards, unused):
+    """
+    Puts tokens that have been taken with ``take_shard_tokens`` but have not been used back into their shard.
+    """
+    for quota, shard_id in shards.items():
+        if unused.get(quota, 0) > 0:
+            QuotaShard.objects.filter(pk=shard_id).update(tokens=F('tokens') + unused[quota])
+
+
+def quotas_with_low_shards(quota_diff):
+    """
+    Returns the sharded quotas among the keys of ``quota_diff`` that have at least one shard that is missing or
+    holds fewer than ``MIN_TOKENS_PER_SHARD`` tokens or fewer than the requested number of tokens. Only these
+    need to be reclaimed and refilled on the exact path.
+    """
+    quotas = {q.pk: q for q in quota_diff if quota_is_sharded(q)}
+    if not quotas:
+        return []
+    full = {
+        r['quota_id']
+        for r in QuotaShard.objects.filter(
+            quota_id__in=quotas, index__lt=settings.QUOTA_SHARDS, tokens__gte=MIN_TOKENS_PER_SHARD,
+        ).order_by().values('quota_id').annotate(c=Count('*'), m=Min('tokens'))
+        if r['c'] >= settings.QUOTA_SHARDS and r['m'] >= quota_diff[quotas[r['quota_id']]]
+    }
+    return [q for pk, q in quotas.items() if pk not in full]
+
+
+def reclaim_quota_shards(quotas):
+    """
+    Returns all pre-allocated tokens of the given quotas to their free capacity. This may only be called while
+    holding an exclusive lock on the quotas or the event or while saving the quota. Every operation that computes
+    the availability of a quota to sell from it, except for cart operations, needs to call this after acquiring the
+    lock, since the computed availability does not include the tokens.
+    """
+    if settings.QUOTA_SHARDS > 1 and quotas:
+        QuotaShard.objects.filter(quota__in=quotas, tokens__gt=0).update(tokens=0)
+
+
+def refill_quota_shards(free):
+    """
+    Distributes a part of the free capacity of quotas evenly across their shards. ``free`` maps quotas to their
+    free capacity, which needs to be computed while holding an exclusive lock on the quotas and after calling
+    ``reclaim_quota_shards``.
+    """
+    for q, free_capacity in free.items():
+        if not quota_is_sharded(q):
+            continue
+        per_shard = int(free_capacity * SHARD_FILL_RATIO) // settings.QUOTA_SHARDS
+        if per_shard < MIN_TOKENS_PER_SHARD:
+            # Close to selling out, every operation should go through the exact path
+            continue
+        QuotaShard.objects.bulk_create(
+            [QuotaShard(quota=q, index=i) for i in range(settings.QUOTA_SHARDS)],
+            ignore_conflicts=True,
+        )
+        QuotaShard.objects.filter(quota=q, index__lt=settings.QUOTA_SHARDS).update(tokens=per_shard)
+
+
+@receiver(post_save, sender=Quota, dispatch_uid="quotashards_quota_saved")
+def quota_saved(sender, instance, created, **kwargs):
+    # Tokens have been handed out based on the size and state of the quota at the time, they are refilled with the
+    # new values on the next cart operation taking the exact path.
+    if not created:
+        reclaim_quota_shards([instance])
@@ -22,32 +22,45 @@
 import logging
 import os
 from decimal import Decimal
+from typing import List
 
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.dispatch import receiver
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from django_scopes import scopes_disabled
 
 from pretix.base.i18n import language
+from pretix.base.metrics import (
+    pretix_ticket_cache_results_total, pretix_ticket_pregeneration_queued,
+)
 from pretix.base.models import (
     CachedCombinedTicket, CachedTicket, Event, InvoiceAddress, Order,
     OrderPosition,
 )
-from pretix.base.services.tasks import EventTask, ProfiledTask
+from pretix.base.services.tasks import (
+    EventTask, ProfiledEventTask, ProfiledTask,
+)
 from pretix.base.settings import PERSON_NAME_SCHEMES
-from pretix.base.signals import register_ticket_outputs
+from pretix.base.signals import (
+    order_paid, order_placed, register_ticket_outputs,
+)
 from pretix.celery_app import app
 from pretix.helpers.database import rolledback_transaction
 
 logger = logging.getLogger(__name__)
 
+PREGENERATION_BATCH_SIZE = 50
+
 
 def generate_orderposition(order_position: int, provider: str):
     order_position = OrderPosition.objects.select_related('order', 'order__event').get(id=order_position)
 
     with language(order_position.order.locale, order_position.order.event.settings.region):
         responses = register_ticket_outputs.send(order_position.order.event)
-        for receiver, response in responses:
+        for recv, response in responses:
             prov = response(order_position.order.event)
             if prov.identifier == provider:
                 filename, ttype, data = prov.generate(order_position)
@@ -65,7 +78,7 @@ def generate_order(order: int, provider: str):
 
     with language(order.locale, order.event.settings.region):
         responses = register_ticket_outputs.send(order.event)
-        for receiver, response in responses:
+        for recv, response in responses:
             prov = response(order.event)
             if prov.identifier == provider:
                 filename, ttype, data = prov.generate_order(order)
@@ -116,12 +129,30 @@ def preview(event: int, provider: str):
         InvoiceAddress.objects.create(order=order, name_parts=sample, company=_("Sample company"))
 
         responses = register_ticket_outputs.send(event)
-        for receiver, response in responses:
+        for recv, response in responses:
             prov = response(event)
             if prov.identifier == provider:
                 return prov.generate(p)
 
 
+def _cached_ticket(qs):
+    ct = qs.filter(file__isnull=False).last()
+    if not ct or not ct.file:
+        return None
+    return ct
+
+
+def get_cached_ticket(qs):
+    """
+    Returns the newest ticket file in the queryset ``qs`` of ``CachedTicket`` or ``CachedCombinedTicket`` objects,
+    or ``None`` if the file still needs to be generated. The lookup is counted in the ticket cache metrics.
+    """
+    ct = _cached_ticket(qs)
+    if settings.METRICS_ENABLED:
+        pretix_ticket_cache_results_total.inc(result="hit" if ct else "miss")
+    return ct
+
+
 def get_tickets_for_order(order, base_position=None):
     positions = list(order.positions_with_tickets)
     if not positions:
@@ -150,10 +181,8 @@ def get_tickets_for_order(order, base_position=None):
             try:
                 if len(positions) == 0:
                     continue
-                ct = CachedCombinedTicket.objects.filter(
-                    order=order, provider=p.identifier, file__isnull=False
-                ).last()
-                if not ct or not ct.file:
+                ct = get_cached_ticket(CachedCombinedTicket.objects.filter(order=order, provider=p.identifier))
+                if not ct:
                     retval = generate_order(order.pk, p.identifier)
                     if not retval:
                         continue
@@ -173,10 +202,8 @@ def get_tickets_for_order(order, base_position=None):
         else:
             for pos in positions:
                 try:
-                    ct = CachedTicket.objects.filter(
-                        order_position=pos, provider=p.identifier, file__isnull=False
-                    ).last()
-                    if not ct or not ct.file:
+                    ct = get_cached_ticket(CachedTicket.objects.filter(order_position=pos, provider=p.identifier))
+                    if not ct:
                         retval = generate_orderposition(pos.pk, p.identifier)
                         if not retval:
                             continue
@@ -226,3 +253,85 @@ def invalidate_cache(event: Event, item: int=None, provider: str=None, order: in
         ct.delete()
     for ct in qsc:
         ct.delete()
+
+    if order:
+        # Queued from here instead of from the places that call us, so the new files are never generated before
+        # the old ones have been thrown away.
+        pregenerate_tickets_for_orders(event, [order])
+
+
+def pregenerate_order_tickets(order: Order) -> int:
+    """
+    Renders and stores all ticket files of ``order`` that are not in the cache yet, both for the single positions
+    and, if supported by the output, for the whole order. Returns the number of generated files.
+    """
+    # Unlike Order.ticket_download_available, we ignore the ticket download date, as we want the files to be ready
+    # once the date is reached.
+    if not order.event.settings.ticket_download:
+        return 0
+    if order.status != Order.STATUS_PAID and not (
+        (order.valid_if_pending or order.event.settings.ticket_download_pending) and
+        order.status == Order.STATUS_PENDING and
+        not order.require_approval
+    ):
+        return 0
+    positions = list(order.positions_with_tickets)
+    if not positions:
+        return 0
+
+    generated = 0
+    for recv, response in register_ticket_outputs.send(order.event):
+        p = response(order.event)
+        if not p.is_enabled:
+            continue
+        if p.multi_download_enabled:
+            if not _cached_ticket(CachedCombinedTicket.objects.filter(order=order, provider=p.identifier)):
+                if generate_order(order.pk, p.identifier):
+                    generated += 1
+        for pos in positions:
+            if not _cached_ticket(CachedTicket.objects.filter(order_position=pos, provider=p.identifier)):
+                if generate_orderposition(pos.pk, p.identifier):
+                    generated += 1
+    return generated
+
+
+def pregenerate_tickets_for_orders(event: Event, order_ids: List[int]):
+    """
+    Queues the pre-generation of the ticket files of the given orders once the current transaction has been
+    committed. Does nothing unless ticket pre-generation is enabled in the configuration.
+    """
+    if not settings.CACHE_TICKETS_PREGENERATE or not order_ids:
+        return
+    order_ids = list(order_ids)
+
+    def enqueue():
+        for i in range(0, len(order_ids), PREGENERATION_BATCH_SIZE):
+            batch = order_ids[i:i + PREGENERATION_BATCH_SIZE]
+            if settings.METRICS_ENABLED:
+                pretix_ticket_pregeneration_queued.inc(len(batch))
+            pregenerate_tickets.apply_async(kwargs={'event': event.pk, 'orders': batch},
+                                            priority=settings.PRIORITY_CELERY_LOW)
+
+    transaction.on_commit(enqueue)
+
+
+@app.task(base=ProfiledEventTask)
+def pregenerate_tickets(event: Event, orders: List[int]):
+    if settings.METRICS_ENABLED:
+        pretix_ticket_pregeneration_queued.dec(len(orders))
+    for order in event.orders.filter(pk__in=orders):
+        try:
+            pregenerate_order_tickets(order)
+        except:
+            logger.exception('Failed to pre-generate tickets.')
+
+
+@receiver(order_placed, dispatch_uid="pretixbase_order_placed_pregenerate_tickets")
+def pregenerate_tickets_order_placed(sender: Event, order: Order, **kwargs):
+    if order.status == Order.STATUS_PAID:
+        pregenerate_tickets_for_orders(sender, [order.pk])
+
+
+@receiver(order_paid, dispatch_uid="pretixbase_order_paid_pregenerate_tickets")
+def pregenerate_tickets_order_paid(sender: Event, order: Order, **kwargs):
+    pregenerate_tickets_for_orders(sender, [order.pk])
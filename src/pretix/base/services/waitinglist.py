@@ -36,6 +36,7 @@ from pretix.base.models import (
 )
 from pretix.base.models.waitinglist import WaitingListException
 from pretix.base.services.locking import lock_objects
+from pretix.base.services.quotashards import reclaim_quota_shards
 from pretix.base.services.tasks import EventTask
 from pretix.base.signals import periodic_task
 from pretix.celery_app import app
@@ -112,6 +113,7 @@ def assign_automatically(event: Event, user_id: int=None, subevent_id: int=None)
             quotas |= set(wle._quotas)
 
         lock_objects(quotas, shared_lock_objects=[event])
+        reclaim_quota_shards(quotas)
         for wle in qs:
             # add this event to wle.item as it is not yet cached and is needed in check_quotas
             wle.item.event = event
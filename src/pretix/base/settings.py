@@ -1754,6 +1754,49 @@ DEFAULTS = {
                         'grants one single ticket at a time.'),
         )
     },
+    'waiting_room_enabled': {
+        'default': 'False',
+        'type': bool,
+        'serializer_class': serializers.BooleanField,
+        'form_class': forms.BooleanField,
+        'form_kwargs': dict(
+            label=_("Enable virtual waiting room"),
+            help_text=_("Visitors need to queue up before they can access your shop and are admitted in the order of "
+                        "their arrival. Use this during on-sales with very high demand to keep your shop responsive."),
+        )
+    },
+    'waiting_room_rate': {
+        'default': '100',
+        'type': int,
+        'serializer_class': serializers.IntegerField,
+        'form_class': forms.IntegerField,
+        'serializer_kwargs': dict(
+            min_value=1,
+        ),
+        'form_kwargs': dict(
+            label=_("Admitted visitors per minute"),
+            min_value=1,
+            required=True,
+            widget=forms.NumberInput(),
+        )
+    },
+    'waiting_room_admission_minutes': {
+        'default': '30',
+        'type': int,
+        'serializer_class': serializers.IntegerField,
+        'form_class': forms.IntegerField,
+        'serializer_kwargs': dict(
+            min_value=5,
+        ),
+        'form_kwargs': dict(
+            label=_("Admission validity"),
+            min_value=5,
+            required=True,
+            widget=forms.NumberInput(),
+            help_text=_("Admitted visitors need to queue again if they have not accessed the shop for this many "
+                        "minutes."),
+        )
+    },
     'show_checkin_number_user': {
         'default': 'False',
         'type': bool,
@@ -58,6 +58,7 @@ from pretix.base.models import Item, ItemVariation, Quota, SubEvent, Voucher
 from pretix.base.models.vouchers import VoucherBulkData
 from pretix.base.services.locking import lock_objects
 from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotashards import reclaim_quota_shards
 from pretix.control.forms import SplitDateTimeField, SplitDateTimePickerWidget
 from pretix.control.forms.widgets import Select2, Select2ItemVarQuota
 from pretix.control.signals import voucher_form_validation
@@ -392,6 +393,7 @@ class VoucherBulkEditForm(VoucherForm):
 
             if any(v > 0 for q, v in quota_diff.items()):
                 lock_objects([q for q, v in quota_diff.items() if q.size is not None and v > 0], shared_lock_objects=[self.event])
+                reclaim_quota_shards([q for q, v in quota_diff.items() if v > 0])
                 qa = QuotaAvailability(count_waitinglist=False)
                 qa.queue(*(q for q, v in quota_diff.items() if v > 0))
                 qa.compute()
@@ -92,6 +92,7 @@ from pretix.base.payment import PaymentException
 from pretix.base.secrets import assign_ticket_secret
 from pretix.base.services import tickets
 from pretix.base.services.cancelevent import cancel_event
+from pretix.base.services.checkincounters import track_checkin_counters
 from pretix.base.services.export import (
     export, init_event_exporters, scheduled_event_export,
 )
@@ -948,13 +949,14 @@ class OrderRefundProcess(OrderView):
                 if self.request.POST.get("action") == "r":
                     mark_order_refunded(self.order, user=self.request.user)
                 elif not (self.order.status == Order.STATUS_PAID and self.order.pending_sum <= 0):
-                    self.order.status = Order.STATUS_PENDING
-                    self.order.set_expires(
-                        now(),
-                        self.order.event.subevents.filter(
-                            id__in=self.order.positions.values_list('subevent_id', flat=True))
-                    )
-                    self.order.save(update_fields=['status', 'expires'])
+                    with transaction.atomic(), track_checkin_counters(self.order):
+                        self.order.status = Order.STATUS_PENDING
+                        self.order.set_expires(
+                            now(),
+                            self.order.event.subevents.filter(
+                                id__in=self.order.positions.values_list('subevent_id', flat=True))
+                        )
+                        self.order.save(update_fields=['status', 'expires'])
 
             messages.success(self.request, _('The refund has been processed.'))
         else:
@@ -1385,13 +1387,14 @@ class OrderRefundView(OrderView):
                         mark_order_refunded(order, user=self.request.user)
                 elif self.start_form.cleaned_data.get('action') == 'mark_pending':
                     if not (order.status == Order.STATUS_PAID and self.order.pending_sum <= 0):
-                        order.status = Order.STATUS_PENDING
-                        order.set_expires(
-                            now(),
-                            order.event.subevents.filter(
-                                id__in=order.positions.values_list('subevent_id', flat=True))
-                        )
-                        order.save(update_fields=['status', 'expires'])
+                        with transaction.atomic(), track_checkin_counters(order):
+                            order.status = Order.STATUS_PENDING
+                            order.set_expires(
+                                now(),
+                                order.event.subevents.filter(
+                                    id__in=order.positions.values_list('subevent_id', flat=True))
+                            )
+                            order.save(update_fields=['status', 'expires'])
 
                 if giftcard_value and order.email:
                     messages.success(self.request, _('A new gift card was created. You can now send the user their '
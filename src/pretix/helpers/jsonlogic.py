@@ -33,6 +33,7 @@ In particular, we changed:
 * Full test coverage
 * Fully passing tests against shared tests suite at 2020-04-19
 * Option to add custom operations
+* Option to compile rules into Python functions once and apply them many times
 """
 import logging
 from functools import reduce
@@ -205,6 +206,10 @@ class Logic():
     def add_operation(self, name, func):
         self._operations[name] = func
 
+    def apply_compiled(self, compiled, data=None):
+        """Executes json-logic compiled with ``compile_logic`` with given data."""
+        return compiled(data, self._operations)
+
     def apply(self, tests, data=None):
         """Executes the json-logic with given data."""
         # You've recursed to a primitive, stop!
@@ -263,3 +268,71 @@ class Logic():
             return self._operations[operator](*values)
         else:
             raise ValueError("Unrecognized operation %s" % operator)
+
+
+def compile_logic(tests):
+    """
+    Compiles json-logic into a Python function ``f(data, custom_operations)`` which returns the same result as
+    ``Logic.apply`` but does not need to walk the rule tree on every call. Custom operations are only looked up
+    when the function is called, so the compiled rules can be reused with different custom operations.
+    """
+    # You've recursed to a primitive, stop!
+    if tests is None or not isinstance(tests, dict):
+        return lambda data, custom_operations: tests
+
+    operator = [k for k in tests.keys() if not k.startswith("__")][0]
+    values = tests[operator]
+
+    # Easy syntax for unary operators, like {"var": "x"} instead of strict
+    # {"var": ["x"]}
+    if not isinstance(values, list) and not isinstance(values, tuple):
+        values = [values]
+    compiled = [compile_logic(val) for val in values]
+
+    # Array-level operations
+    if operator == 'none':
+        elements, test = compiled[0], compiled[1]
+        return lambda data, ops: not any(test(i, ops) for i in elements(data, ops))
+    if operator == 'all':
+        elements_, test = compiled[0], compiled[1]
+
+        def all_(data, ops):
+            elements = elements_(data, ops)
+            if not elements:
+                return False
+            return all(test(i, ops) for i in elements)
+        return all_
+    if operator == 'some':
+        elements, test = compiled[0], compiled[1]
+        return lambda data, ops: any(test(i, ops) for i in elements(data, ops))
+    if operator == 'reduce':
+        elements, func, initial = compiled[0], compiled[1], compiled[2]
+        return lambda data, ops: reduce(
+            lambda acc, el: func({'current': el, 'accumulator': acc}, ops),
+            elements(data, ops) or [],
+            initial(data, ops)
+        )
+    if operator == 'map':
+        elements, func = compiled[0], compiled[1]
+        return lambda data, ops: [func(i, ops) for i in (elements(data, ops) or [])]
+    if operator == 'filter':
+        elements, test = compiled[0], compiled[1]
+        return lambda data, ops: [i for i in elements(data, ops) if test(i, ops)]
+
+    if operator == 'var':
+        return lambda data, ops: get_var(data or {}, *[c(data, ops) for c in compiled])
+    if operator == 'missing':
+        return lambda data, ops: missing(data or {}, *[c(data, ops) for c in compiled])
+    if operator == 'missing_some':
+        return lambda data, ops: missing_some(data or {}, *[c(data, ops) for c in compiled])
+
+    if operator in operations:
+        func = operations[operator]
+        return lambda data, ops: func(*[c(data, ops) for c in compiled])
+
+    def custom_operation(data, ops):
+        args = [c(data, ops) for c in compiled]
+        if operator not in ops:
+            raise ValueError("Unrecognized operation %s" % operator)
+        return ops[operator](*args)
+    return custom_operation
@@ -0,0 +1,47 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from contextlib import contextmanager
+
+# We use billiard instead of multiprocessing since celery worker processes are daemonic, and multiprocessing does not
+# allow daemonic processes to start child processes.
+from billiard import Pool
+from django.db import connections
+
+
+@contextmanager
+def process_pool(processes, initializer=None, initargs=()):
+    """
+    Context manager that provides a pool of ``processes`` worker processes, usable from within web requests as well
+    as celery tasks. Database connections are closed before the pool is started, so the workers open their own
+    connections instead of sharing the ones of the parent process. This means that the pool must not be used while a
+    database transaction is open.
+    """
+    connections.close_all()
+    pool = Pool(processes=processes, initializer=initializer, initargs=initargs)
+    try:
+        yield pool
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,94 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import contextvars
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# If set to a PhaseTimer, code deeper down the call stack can attribute its run time to a phase, see timed_phase()
+phase_timer_var = contextvars.ContextVar('phase_timer', default=None)
+
+
+class PhaseTimer:
+    """
+    Measures how much time an operation spends in named phases. Phases can be nested, in which case time spent in
+    the inner phase is only attributed to the inner phase, so that all phases add up to the total run time.
+
+    Usage example::
+
+        timer = PhaseTimer()
+        with timer.phase('db_writes'):
+            with timer.phase('pricing'):
+                ...
+        print(timer.as_dict())
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        t = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            self.durations[parent[0]] += t - parent[1]
+        self._stack.append([name, t])
+        try:
+            yield
+        finally:
+            t = time.perf_counter()
+            name, start = self._stack.pop()
+            self.durations[name] += t - start
+            if self._stack:
+                self._stack[-1][1] = t
+
+    def add(self, name, seconds):
+        """
+        Attributes ``seconds`` that have already been spent in the current phase to the phase ``name`` instead.
+        """
+        self.durations[name] += seconds
+        if self._stack:
+            self.durations[self._stack[-1][0]] -= seconds
+
+    def total(self):
+        return time.perf_counter() - self._start
+
+    def as_dict(self):
+        """
+        Returns the duration of all phases in milliseconds. Time not spent in any phase is reported as ``other``.
+        """
+        result = {name: round(d * 1000, 1) for name, d in self.durations.items()}
+        result['other'] = round(max(self.total() - sum(self.durations.values()), 0) * 1000, 1)
+        return result
+
+
+def timed_phase(name):
+    """
+    Attributes the time spent in the ``with`` block to the phase ``name`` of the currently active ``PhaseTimer``.
+    Does nothing if there is no active timer.
+    """
+    timer = phase_timer_var.get()
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name)
@@ -35,13 +35,12 @@
 import json
 import logging
 import os
-import subprocess
 import tempfile
 from collections import OrderedDict
 from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 from io import BytesIO
-from typing import BinaryIO, List, Optional, Tuple
+from typing import List, Optional, Tuple
 
 import dateutil.parser
 from django import forms
@@ -54,6 +53,7 @@ from django.db.models import Case, Exists, OuterRef, Q, Subquery, Value, When
 from django.db.models.functions import Cast, Coalesce
 from django.utils.timezone import make_aware
 from django.utils.translation import gettext as _, gettext_lazy, pgettext_lazy
+from django_scopes import scope, scopes_disabled
 from pypdf import PageObject, PdfReader, PdfWriter, Transformation
 from pypdf.generic import RectangleObject
 from reportlab.lib import pagesizes
@@ -65,7 +65,9 @@ from pretix.base.i18n import language
 from pretix.base.models import (
     Event, Order, OrderPosition, Question, QuestionAnswer,
 )
-from pretix.base.pdf import Renderer, merge_background
+from pretix.base.pdf import (
+    Renderer, merge_background, merge_pdf_files, render_pdf_chunks,
+)
 from pretix.base.services.export import ExportError
 from pretix.base.settings import PERSON_NAME_SCHEMES
 from pretix.helpers.templatetags.jsonfield import JSONExtract
@@ -250,33 +252,6 @@ def _render_nup_page(nup_pdf: PdfWriter, input_pages: PageObject, opt: dict) ->
     return nup_page
 
 
-def _merge_pages(file_paths: List[str], output_file: BinaryIO):
-    """
-    Merge all pages from the PDF files named `file_paths` into the `output_file`.
-    """
-    if settings.PDFTK:
-        subprocess.run([
-            settings.PDFTK,
-            *file_paths,
-            'cat',
-            'output',
-            '-',
-            'compress'
-        ], check=True, stdout=output_file)
-    else:
-        merger = PdfWriter()
-        merger.add_metadata({
-            '/Title': 'Badges',
-            '/Creator': 'pretix',
-        })
-        # append all temp-PDFs
-        for pdf in file_paths:
-            merger.append(pdf)
-
-        # write merged PDFs to buffer
-        merger.write(output_file)
-
-
 def _render_nup(input_files: List[str], num_pages: int, output_file: BytesIO, opt: dict):
     """
     Render the pages from the PDF files listed in `input_files` (file names) with a total number of `num_pages` pages
@@ -333,7 +308,7 @@ def _render_nup(input_files: List[str], num_pages: int, output_file: BytesIO, op
         del badges_pdf  # free up memory
 
         file_paths = [os.path.join(temp_dir.name, fp) for fp in nup_pdf_files]
-        _merge_pages(file_paths, output_file)
+        merge_pdf_files(file_paths, output_file, 'Badges')
     finally:
         if temp_dir:
             try:
@@ -357,8 +332,6 @@ def _render_badges(event: Event, positions: List[OrderPosition], opt: dict) -> T
         default_renderer = None
 
     op_renderers = [(op, renderermap.get(op.item_id, default_renderer)) for op in positions if renderermap.get(op.item_id, default_renderer)]
-    if not len(op_renderers):
-        raise ExportError(_("None of the selected products is configured to print badges."))
 
     fg_pdf = PdfWriter()
     fg_pdf.add_metadata({
@@ -386,42 +359,61 @@ def _render_badges(event: Event, positions: List[OrderPosition], opt: dict) -> T
     return fg_pdf, bg_pdf, num_pages
 
 
-def render_pdf(event, positions, opt, output_file):
+def _render_badge_chunk(chunk, file_name) -> int:
+    """
+    Render the badges for a chunk of order positions with their backgrounds into the file ``file_name`` and return
+    the number of pages. This is called in a separate process by ``render_pdf_chunks``.
+    """
+    event_id, position_ids, opt = chunk
+    with scopes_disabled():
+        event = Event.objects.select_related('organizer').get(pk=event_id)
+    with scope(organizer=event.organizer):
+        positions = {
+            op.pk: op for op in OrderPosition.objects.filter(
+                order__event=event, pk__in=position_ids
+            ).prefetch_related(
+                'answers', 'answers__question'
+            ).select_related('order', 'item', 'variation', 'addon_to')
+        }
+        fg_pdf, bg_pdf, num_pages = _render_badges(event, [positions[pk] for pk in position_ids if pk in positions], opt)
+        if num_pages:
+            with open(file_name, 'wb') as out_pdf:
+                merge_background(
+                    fg_pdf,
+                    bg_pdf,
+                    out_pdf,
+                    compress=False,
+                )
+    return num_pages
+
+
+def render_pdf(event, positions, opt, output_file, progress_callback=None):
     Renderer._register_fonts()
     badges_per_page = opt['cols'] * opt['rows']
-
-    if badges_per_page == 1:
-        fg_pdf, bg_pdf, _ = _render_badges(event, positions, opt)
-        merge_background(
-            fg_pdf,
-            bg_pdf,
-            output_file,
-            compress=True,
+    position_ids = list(positions.prefetch_related(None).values_list('pk', flat=True))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # We first render the foreground and background of every individual badge and merge them, but we do so in
+        # chunks that can be rendered in parallel, and since the n-up code is slower if it has to deal with huge PDFs.
+        # It doesn't matter that not every position has the same number of pages, as the n-up code can deal with that.
+        chunks = render_pdf_chunks(
+            _render_badge_chunk,
+            [(event.pk, position_chunk, opt) for position_chunk in _chunks(position_ids, 200)],
+            tmp_dir,
+            progress_callback=(lambda v: progress_callback(v * .9)) if progress_callback else None,
         )
-    else:
-        # place n-up badges/pages per page
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            page_pdfs = []
-            total_num_pages = 0
-            for position_chunk in _chunks(positions, 200):
-                # We first render the foreground and background of every individual badge and merge them, but we do
-                # so in chunks, since the n-up code is slower if it has to deal with huge PDFs. It doesn't matter
-                # that not every position has the same number of pages, as the n-up code can deal with that
-                fg_pdf, bg_pdf, num_pages = _render_badges(event, position_chunk, opt)
-                out_pdf_name = os.path.join(tmp_dir, f'chunk-{len(page_pdfs)}.pdf')
-                with open(out_pdf_name, 'wb') as out_pdf:
-                    merge_background(
-                        fg_pdf,
-                        bg_pdf,
-                        out_pdf,
-                        compress=False,
-                    )
-                page_pdfs.append(out_pdf_name)
-                total_num_pages += num_pages
-                del fg_pdf, bg_pdf  # free up memory
+        page_pdfs = [file_name for file_name, num_pages in chunks if num_pages]
+        total_num_pages = sum(num_pages for file_name, num_pages in chunks)
+        if not total_num_pages:
+            raise ExportError(_("None of the selected products is configured to print badges."))
 
+        if badges_per_page == 1:
+            merge_pdf_files(page_pdfs, output_file, 'Badges')
+        else:
             # Actually render a n-up file
-            return _render_nup(page_pdfs, total_num_pages, output_file, opt)
+            _render_nup(page_pdfs, total_num_pages, output_file, opt)
+        if progress_callback:
+            progress_callback(100)
 
 
 class BadgeExporter(BaseExporter):
@@ -431,6 +423,11 @@ class BadgeExporter(BaseExporter):
     description = gettext_lazy('Download all attendee badges as one large PDF for printing.')
     featured = True
 
+    @property
+    def repeatable_read(self) -> bool:
+        # Badges can only be rendered in multiple processes outside of the export transaction
+        return settings.PDF_RENDERING_PROCESSES <= 1
+
     @property
     def export_form_fields(self):
         name_scheme = PERSON_NAME_SCHEMES[self.event.settings.name_scheme]
@@ -656,11 +653,13 @@ class BadgeExporter(BaseExporter):
 
         try:
             if output_file:
-                render_pdf(self.event, qs, OPTIONS[form_data.get('rendering', 'one')], output_file=output_file)
+                render_pdf(self.event, qs, OPTIONS[form_data.get('rendering', 'one')], output_file=output_file,
+                           progress_callback=self.progress_callback)
                 return 'badges.pdf', 'application/pdf', None
             else:
                 with tempfile.NamedTemporaryFile(delete=True) as tmpfile:
-                    render_pdf(self.event, qs, OPTIONS[form_data.get('rendering', 'one')], output_file=tmpfile)
+                    render_pdf(self.event, qs, OPTIONS[form_data.get('rendering', 'one')], output_file=tmpfile,
+                               progress_callback=self.progress_callback)
                     tmpfile.seek(0)
                     return 'badges.pdf', 'application/pdf', tmpfile.read()
         except DataError:
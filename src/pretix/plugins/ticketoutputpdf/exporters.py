@@ -33,23 +33,24 @@
 # License for the specific language governing permissions and limitations under the License.
 
 import logging
+import tempfile
 from collections import OrderedDict
-from io import BytesIO
 
 from django import forms
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.db import DataError, models
 from django.db.models import Case, OuterRef, Q, Subquery, Value, When
 from django.db.models.functions import Cast, Coalesce
 from django.utils.timezone import now
 from django.utils.translation import gettext as _, gettext_lazy, pgettext_lazy
+from django_scopes import scope, scopes_disabled
 from pypdf import PdfWriter
 
 from pretix.base.exporter import BaseExporter
 from pretix.base.i18n import language
-from pretix.base.models import (
-    Event, Order, OrderPosition, Question, QuestionAnswer,
-)
+from pretix.base.models import Order, OrderPosition, Question, QuestionAnswer
+from pretix.base.pdf import merge_pdf_files, render_pdf_chunks
 from pretix.base.settings import PERSON_NAME_SCHEMES
 
 from ...base.services.export import ExportError
@@ -62,6 +63,8 @@ from .ticketoutput import PdfTicketOutput
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 200
+
 
 class AllTicketsPDF(BaseExporter):
     name = "alltickets"
@@ -117,8 +120,12 @@ class AllTicketsPDF(BaseExporter):
 
         return d
 
-    def render(self, form_data):
-        merger = PdfWriter()
+    @property
+    def repeatable_read(self) -> bool:
+        # Tickets can only be rendered in multiple processes outside of the export transaction
+        return settings.PDF_RENDERING_PROCESSES <= 1
+
+    def render(self, form_data, output_file=None):
         qs = OrderPosition.objects.filter(
             order__event__in=self.events
         ).prefetch_related(
@@ -212,30 +219,13 @@ class AllTicketsPDF(BaseExporter):
                 'question_answer'
             )
 
-        o = PdfTicketOutput(Event.objects.none())
+        if self.is_multievent:
+            filename = '{}_tickets.pdf'.format(self.organizer.slug)
+        else:
+            filename = '{}_tickets.pdf'.format(self.event.slug)
+
         try:
-            for op in qs:
-                if not op.generate_ticket:
-                    continue
-
-                if op.order.event != o.event:
-                    o = PdfTicketOutput(op.event)
-
-                with language(op.order.locale, o.event.settings.region):
-                    layout = o.layout_map.get(
-                        (op.item_id, op.order.sales_channel.identifier),
-                        o.layout_map.get(
-                            (op.item_id, 'web'),
-                            o.default_layout
-                        )
-                    )
-                    outbuffer = o._draw_page(layout, op, op.order)
-                    merger.append(ContentFile(outbuffer.read()))
-
-            outbuffer = BytesIO()
-            merger.write(outbuffer)
-            merger.close()
-            outbuffer.seek(0)
+            position_ids = list(qs.prefetch_related(None).values_list('pk', flat=True))
         except DataError:
             logging.exception('DataError during export')
             raise ExportError(
@@ -243,7 +233,66 @@ class AllTicketsPDF(BaseExporter):
                   'databases, such as answers to number questions which are not a number.')
             )
 
-        if self.is_multievent:
-            return '{}_tickets.pdf'.format(self.organizer.slug), 'application/pdf', outbuffer.read()
+        if output_file:
+            self._render_tickets(position_ids, output_file)
+            return filename, 'application/pdf', None
         else:
-            return '{}_tickets.pdf'.format(self.event.slug), 'application/pdf', outbuffer.read()
+            with tempfile.TemporaryFile() as tmpfile:
+                self._render_tickets(position_ids, tmpfile)
+                tmpfile.seek(0)
+                return filename, 'application/pdf', tmpfile.read()
+
+    def _render_tickets(self, position_ids, output_file):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            chunks = render_pdf_chunks(
+                _render_ticket_chunk,
+                [position_ids[i:i + CHUNK_SIZE] for i in range(0, len(position_ids), CHUNK_SIZE)],
+                tmp_dir,
+                progress_callback=lambda v: self.progress_callback(v * .9),
+            )
+            merge_pdf_files([file_name for file_name, num_pages in chunks if num_pages], output_file, 'Tickets')
+        self.progress_callback(100)
+
+
+def _render_ticket_chunk(position_ids, file_name) -> int:
+    """
+    Render the tickets for a chunk of order positions into the file ``file_name`` and return the number of pages.
+    This is called in a separate process by ``render_pdf_chunks``.
+    """
+    with scopes_disabled():
+        positions = {
+            op.pk: op for op in OrderPosition.objects.filter(
+                pk__in=position_ids
+            ).prefetch_related(
+                'answers', 'answers__question'
+            ).select_related('order', 'order__event', 'order__event__organizer', 'item', 'variation', 'addon_to')
+        }
+
+    merger = PdfWriter()
+    outputs = {}
+    for pk in position_ids:
+        op = positions.get(pk)
+        if not op or not op.generate_ticket:
+            continue
+
+        event = op.order.event
+        if event.pk not in outputs:
+            outputs[event.pk] = PdfTicketOutput(event)
+        o = outputs[event.pk]
+
+        with scope(organizer=event.organizer), language(op.order.locale, event.settings.region):
+            layout = o.layout_map.get(
+                (op.item_id, op.order.sales_channel.identifier),
+                o.layout_map.get(
+                    (op.item_id, 'web'),
+                    o.default_layout
+                )
+            )
+            outbuffer = o._draw_page(layout, op, op.order)
+            merger.append(ContentFile(outbuffer.read()))
+
+    num_pages = len(merger.pages)
+    if num_pages:
+        merger.write(file_name)
+    merger.close()
+    return num_pages
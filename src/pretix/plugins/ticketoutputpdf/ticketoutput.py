@@ -95,20 +95,32 @@ class PdfTicketOutput(BaseTicketOutput):
     def _register_fonts(self):
         Renderer._register_fonts(self.event)
 
-    def _draw_page(self, layout: TicketLayout, op: OrderPosition, order: Order):
-        buffer = BytesIO()
-        objs = self.override_layout or json.loads(layout.layout) or self._legacy_layout()
+    @cached_property
+    def _renderers(self):
+        # Renderers compile their layout on first use, so we keep one per layout for as long as this output lives,
+        # e.g. for all tickets of an order or of an export.
+        return {}
+
+    def _get_renderer(self, layout: TicketLayout):
         bg_file = layout.background
+        key = (layout.pk, layout.layout, bg_file.name if isinstance(bg_file, File) else None)
+        if key not in self._renderers:
+            objs = self.override_layout or json.loads(layout.layout) or self._legacy_layout()
 
-        if self.override_background:
-            bgf = default_storage.open(self.override_background.name, "rb")
-        elif isinstance(bg_file, File) and bg_file.name:
-            bgf = default_storage.open(bg_file.name, "rb")
-        else:
-            bgf = self._get_default_background()
+            if self.override_background:
+                bgf = default_storage.open(self.override_background.name, "rb")
+            elif isinstance(bg_file, File) and bg_file.name:
+                bgf = default_storage.open(bg_file.name, "rb")
+            else:
+                bgf = self._get_default_background()
+
+            self._renderers[key] = Renderer(self.event, objs, bgf)
+        return self._renderers[key]
 
+    def _draw_page(self, layout: TicketLayout, op: OrderPosition, order: Order):
+        buffer = BytesIO()
         p = self._create_canvas(buffer)
-        renderer = Renderer(self.event, objs, bgf)
+        renderer = self._get_renderer(layout)
         renderer.draw_page(p, order, op)
         p.save()
         return renderer.render_background(buffer, _('Ticket'))
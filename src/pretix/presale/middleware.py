@@ -38,6 +38,7 @@ from django_scopes import scope
 
 from pretix.base.timemachine import time_machine_now_assigned_from_request
 from pretix.presale.signals import process_response
+from pretix.presale.waitingroom import check_admission, renew_admission
 
 from .utils import _detect_event
 
@@ -72,7 +73,10 @@ class EventMiddleware:
                     identifier=request.environ.get('PRETIX_SALES_CHANNEL', 'web')
                 )
 
-            response = self.get_response(request)
+            response = check_admission(request, url.url_name)
+            if response is None:
+                response = self.get_response(request)
+                renew_admission(request, response)
 
             if hasattr(request, '_namespace') and request._namespace == 'presale' and hasattr(request, 'event'):
                 for receiver, r in process_response.send(request.event, request=request, response=response):
@@ -47,6 +47,7 @@ import pretix.presale.views.robots
 import pretix.presale.views.theme
 import pretix.presale.views.user
 import pretix.presale.views.waiting
+import pretix.presale.views.waitingroom
 import pretix.presale.views.widget
 
 # This is not a valid Django URL configuration, as the final
@@ -98,6 +99,7 @@ event_patterns = [
     re_path(r'unlock/(?P<hash>[a-z0-9]{64})/$', pretix.presale.views.user.UnlockHashView.as_view(),
             name='event.payment.unlock'),
     re_path(r'resend/$', pretix.presale.views.user.ResendLinkView.as_view(), name='event.resend_link'),
+    re_path(r'^queue/$', pretix.presale.views.waitingroom.QueueView.as_view(), name='event.waitingroom'),
 
     re_path(r'^favicon.ico/?$',
             pretix.presale.views.organizer.OrganizerFavicon.as_view(),
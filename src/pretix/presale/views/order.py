@@ -82,7 +82,9 @@ from pretix.base.services.orders import (
     change_payment_provider,
 )
 from pretix.base.services.pricing import get_price
-from pretix.base.services.tickets import generate, invalidate_cache
+from pretix.base.services.tickets import (
+    generate, get_cached_ticket, invalidate_cache,
+)
 from pretix.base.signals import order_modified, register_ticket_outputs
 from pretix.base.templatetags.money import money_filter
 from pretix.base.views.mixins import OrderQuestionsViewMixin
@@ -1260,16 +1262,13 @@ class OrderDownloadMixin:
 
     def get_last_ct(self):
         if 'position' in self.kwargs:
-            ct = CachedTicket.objects.filter(
-                order_position=self.order_position, provider=self.output.identifier, file__isnull=False
-            ).last()
+            return get_cached_ticket(CachedTicket.objects.filter(
+                order_position=self.order_position, provider=self.output.identifier
+            ))
         else:
-            ct = CachedCombinedTicket.objects.filter(
-                order=self.order, provider=self.output.identifier, file__isnull=False
-            ).last()
-        if not ct or not ct.file:
-            return None
-        return ct
+            return get_cached_ticket(CachedCombinedTicket.objects.filter(
+                order=self.order, provider=self.output.identifier
+            ))
 
 
 @method_decorator(xframe_options_exempt, 'dispatch')
@@ -611,9 +611,11 @@ def add_subevents_for_days(qs, before, after, ebd, timezones, sales_channel, eve
     )
     subevents = filter_subevents_with_plugins(list(qs), sales_channel)
 
+    subevents_to_compute = []
     quotas_to_compute = []
     for se in subevents:
         if se.presale_is_running:
+            subevents_to_compute.append(se)
             quotas_to_compute += se.active_quotas
             for q in se.active_quotas:
                 # save database lookups later
@@ -623,16 +625,14 @@ def add_subevents_for_days(qs, before, after, ebd, timezones, sales_channel, eve
                 else:
                     q.event = se.event
 
-    qcache = {}
     if quotas_to_compute:
+        # One batch for all dates of all events, this populates se.best_availability for everything we render below
         qa = QuotaAvailability()
         qa.queue(*quotas_to_compute)
         qa.compute(allow_cache=True)
-        qcache.update(qa.results)
+        qa.best_availability_summary(subevents_to_compute)
 
     for se in subevents:
-        if qcache:
-            se._quota_cache = qcache
         if event is not None:  # save database lookup later
             se.event = event
         kwargs = {'subevent': se.pk}
@@ -0,0 +1,78 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import math
+
+from django.http import HttpResponseRedirect
+from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views import View
+
+from pretix.helpers.cookies import (
+    set_cookie_without_samesite, thoroughly_delete_cookie,
+)
+from pretix.multidomain.urlreverse import eventreverse
+from pretix.presale.waitingroom import QUEUE_TTL, REFRESH_INTERVAL, WaitingRoom
+
+
+class QueueView(View):
+    """
+    The queue page of the virtual waiting room. It is intentionally independent of the shop templates and context
+    processors and does not touch the database beyond what ``EventMiddleware`` already did, since it needs to be
+    cheap to render for a very large number of visitors.
+    """
+
+    def get_next_url(self):
+        if "next" in self.request.GET and url_has_allowed_host_and_scheme(self.request.GET.get("next"), allowed_hosts=None):
+            return self.request.GET.get("next")
+        return eventreverse(self.request.event, 'presale:event.index')
+
+    def get(self, request, *args, **kwargs):
+        wr = WaitingRoom(request.event)
+        if not wr.enabled or wr.admission_age(request) is not None:
+            return HttpResponseRedirect(self.get_next_url())
+
+        position = wr.position_from_request(request)
+        new_position = position is None
+        if new_position:
+            position = wr.join()
+
+        admitted, wait_seconds = wr.status(position)
+        if admitted:
+            response = HttpResponseRedirect(self.get_next_url())
+            wr.admit(request, response)
+            thoroughly_delete_cookie(response, wr.queue_cookie_name())
+            return response
+
+        response = render(request, 'pretixpresale/event/waitingroom.html', {
+            'event': request.event,
+            'ahead': max(1, math.ceil(wait_seconds * wr.rate)),
+            'wait_minutes': max(1, math.ceil(wait_seconds / 60)),
+            'refresh_interval': REFRESH_INTERVAL,
+        })
+        if new_position:
+            set_cookie_without_samesite(
+                request, response, wr.queue_cookie_name(), wr.sign_position(position),
+                max_age=QUEUE_TTL, httponly=True,
+            )
+        patch_cache_control(response, private=True, max_age=REFRESH_INTERVAL)
+        return response
@@ -0,0 +1,265 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+"""
+A virtual waiting room that sheds load during high-demand on-sales before it reaches the database.
+
+Visitors that want to access the shop of an event with an active waiting room first need to join the queue. Every
+visitor gets a sequential position in the queue. A "head" pointer is moved forward at the configured admission rate,
+and every visitor whose position is behind the head may enter the shop. Admitted visitors receive a signed admission
+token in a cookie that is checked by ``EventMiddleware`` and does not require any database or Redis access.
+
+The head pointer behaves like a token bucket: it never moves more than one second worth of admissions ahead of the
+end of the queue, so visitors arriving at an empty queue are let in right away, but a sudden rush after a quiet
+phase is still admitted at the configured rate.
+"""
+import math
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponseRedirect, JsonResponse
+from django.utils.translation import gettext
+from redis.exceptions import WatchError
+
+from pretix.helpers.cookies import set_cookie_without_samesite
+from pretix.multidomain.urlreverse import eventreverse
+
+# URLs that a visitor can only access with a valid admission token if the waiting room is active. Everything
+# else, e.g. existing orders, stays accessible to everyone. Checkout steps are not included to allow visitors
+# to finish their purchase even if their admission has expired in the meantime.
+PROTECTED_URLS = {
+    'event.index',
+    'event.cart.add',
+    'event.cart.create',
+    'event.redeem',
+    'event.seatingplan',
+    'event.checkout.start',
+    'event.widget.productlist',
+}
+
+# Visitors are let in in batches every ADVANCE_INTERVAL seconds
+ADVANCE_INTERVAL = 1
+
+# The queue page reloads itself every REFRESH_INTERVAL seconds
+REFRESH_INTERVAL = 15
+
+# Queue positions are kept for QUEUE_TTL seconds after the last activity in the queue
+QUEUE_TTL = 24 * 3600
+
+# Admission tokens older than this are renewed on the next request to keep active visitors in the shop
+ADMISSION_RENEWAL_AGE = 60
+
+_SALT_QUEUE = 'pretix.presale.waitingroom.queue'
+_SALT_ADMISSION = 'pretix.presale.waitingroom.admission'
+
+
+class LocalMemoryBackend:
+    """
+    Keeps the queue state in process memory. Only useful for development and tests, since it does not share the
+    queue between multiple worker processes.
+    """
+    _lock = threading.Lock()
+    _state = {}
+
+    def join(self, key):
+        with self._lock:
+            state = self._state.setdefault(key, {'tail': 0, 'head': 0.0, 'tick': None})
+            state['tail'] += 1
+            return state['tail']
+
+    def advance(self, key, rate, now):
+        with self._lock:
+            state = self._state.setdefault(key, {'tail': 0, 'head': 0.0, 'tick': None})
+            if state['tick'] is None or now - state['tick'] >= ADVANCE_INTERVAL:
+                state['head'] = _advanced_head(state['head'], state['tick'], state['tail'], rate, now)
+                state['tick'] = now
+            return state['head'], state['tail']
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._state.clear()
+
+
+class RedisBackend:
+    def __init__(self):
+        import django_redis
+        self.redis = django_redis.get_redis_connection("redis")
+
+    def join(self, key):
+        tail = self.redis.incr(f'{key}:tail')
+        self.redis.expire(f'{key}:tail', QUEUE_TTL)
+        return tail
+
+    def advance(self, key, rate, now):
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(f'{key}:head')
+                head, tick = pipe.hmget(f'{key}:head', 'head', 'tick')
+                tail = int(pipe.get(f'{key}:tail') or 0)
+                head = float(head or 0)
+                tick = float(tick) if tick else None
+                if tick is not None and now - tick < ADVANCE_INTERVAL:
+                    pipe.unwatch()
+                    return head, tail
+                new_head = _advanced_head(head, tick, tail, rate, now)
+                pipe.multi()
+                pipe.hset(f'{key}:head', mapping={'head': repr(new_head), 'tick': repr(now)})
+                pipe.expire(f'{key}:head', QUEUE_TTL)
+                pipe.execute()
+                return new_head, tail
+            except WatchError:
+                # Somebody else moved the head forward at the same time, which is just as good
+                head = self.redis.hget(f'{key}:head', 'head')
+                return float(head or 0), int(self.redis.get(f'{key}:tail') or 0)
+
+
+def _advanced_head(head, tick, tail, rate, now):
+    burst = max(1.0, rate * ADVANCE_INTERVAL)
+    if tick is None:
+        return burst
+    return min(head + (now - tick) * rate, tail + burst)
+
+
+def get_backend():
+    if settings.HAS_REDIS:
+        return RedisBackend()
+    return LocalMemoryBackend()
+
+
+class WaitingRoom:
+    """
+    The waiting room of one event. ``rate`` is the number of visitors admitted per minute.
+    """
+
+    def __init__(self, event, backend=None):
+        self.event = event
+        self.backend = backend or get_backend()
+        self.key = f'pretix:waitingroom:{event.pk}'
+
+    @property
+    def enabled(self):
+        return self.event.settings.waiting_room_enabled
+
+    @property
+    def rate(self):
+        return max(self.event.settings.get('waiting_room_rate', as_type=int), 1) / 60
+
+    def join(self):
+        """
+        Adds a visitor to the end of the queue and returns their position.
+        """
+        return self.backend.join(self.key)
+
+    def status(self, position):
+        """
+        Returns a tuple of a boolean that tells if the visitor at ``position`` may enter and the estimated waiting
+        time in seconds.
+        """
+        head, tail = self.backend.advance(self.key, self.rate, time.time())
+        if position <= math.floor(head):
+            return True, 0
+        return False, (position - head) / self.rate
+
+    def queue_cookie_name(self):
+        return f'pretix_waitingroom_{self.event.pk}_queue'
+
+    def admission_cookie_name(self):
+        return f'pretix_waitingroom_{self.event.pk}'
+
+    def sign_position(self, position):
+        return signing.dumps({'e': self.event.pk, 'p': position}, salt=_SALT_QUEUE)
+
+    def position_from_request(self, request):
+        try:
+            data = signing.loads(request.COOKIES.get(self.queue_cookie_name(), ''), salt=_SALT_QUEUE,
+                                 max_age=QUEUE_TTL)
+        except signing.BadSignature:
+            return None
+        if data.get('e') != self.event.pk:
+            return None
+        return data.get('p')
+
+    def admission_validity(self):
+        return self.event.settings.get('waiting_room_admission_minutes', as_type=int) * 60
+
+    def admission_age(self, request):
+        """
+        Returns the age of the admission token of this request in seconds, or ``None`` if there is no valid token.
+        """
+        try:
+            data = signing.loads(request.COOKIES.get(self.admission_cookie_name(), ''), salt=_SALT_ADMISSION,
+                                 max_age=self.admission_validity())
+        except signing.BadSignature:
+            return None
+        if data.get('e') != self.event.pk:
+            return None
+        return time.time() - data.get('t', 0)
+
+    def admit(self, request, response):
+        """
+        Sets a fresh admission token on ``response``.
+        """
+        set_cookie_without_samesite(
+            request, response, self.admission_cookie_name(),
+            signing.dumps({'e': self.event.pk, 't': int(time.time())}, salt=_SALT_ADMISSION),
+            max_age=self.admission_validity(), httponly=True,
+        )
+
+
+def check_admission(request, url_name):
+    """
+    Called by ``EventMiddleware`` before a request is processed. Returns a redirect to the queue page if the
+    request needs to wait, otherwise ``None``.
+    """
+    event = getattr(request, 'event', None)
+    if event is None or url_name not in PROTECTED_URLS or not event.settings.waiting_room_enabled:
+        return None
+
+    wr = WaitingRoom(event)
+    age = wr.admission_age(request)
+    if age is None:
+        if url_name == 'event.widget.productlist':
+            # The widget loads the product list in the background and could not show the queue page
+            resp = JsonResponse({
+                'error': gettext('This ticket shop is very busy at the moment. Please open it in a new tab to wait '
+                                 'for your turn.')
+            })
+            resp['Access-Control-Allow-Origin'] = '*'
+            return resp
+        url = eventreverse(event, 'presale:event.waitingroom')
+        if request.method in ('GET', 'HEAD'):
+            url += '?next=' + quote(request.get_full_path())
+        return HttpResponseRedirect(url)
+    request._waiting_room_renew = age > ADMISSION_RENEWAL_AGE
+    return None
+
+
+def renew_admission(request, response):
+    """
+    Called by ``EventMiddleware`` after a request has been processed to extend the admission of active visitors.
+    """
+    if getattr(request, '_waiting_room_renew', False):
+        WaitingRoom(request.event).admit(request, response)
+    return response
@@ -115,6 +115,8 @@ LOG_CSP = config.getboolean('pretix', 'csp_log', fallback=False)
 CSP_ADDITIONAL_HEADER = config.get('pretix', 'csp_additional_header', fallback='')
 
 PDFTK = config.get('tools', 'pdftk', fallback=None)
+PDF_RENDERING_PROCESSES = config.getint('tools', 'pdf_rendering_processes', fallback=1)
+PDF_BARCODE_CACHE_SIZE = config.getint('tools', 'pdf_barcode_cache_size', fallback=1000)
 
 PRETIX_AUTH_BACKENDS = config.get('pretix', 'auth_backends', fallback='pretix.base.auth.NativeAuthBackend').split(',')
 
@@ -426,6 +428,13 @@ else:
     PRIORITY_CELERY_HIGHEST_FUNC = max
 
 CACHE_TICKETS_HOURS = config.getint('cache', 'tickets', fallback=24 * 3)
+CACHE_TICKETS_PREGENERATE = config.getboolean('cache', 'tickets_pregenerate', fallback=False)
+CACHE_TICKETS_PREGENERATE_LEAD_HOURS = config.getint('cache', 'tickets_pregenerate_lead_hours', fallback=12)
+
+CLEANUP_CART_BATCH_SIZE = config.getint('cleanup', 'cart_batch_size', fallback=1000)
+CLEANUP_CART_TIME_BUDGET = config.getint('cleanup', 'cart_time_budget', fallback=60)
+PERIODIC_ORDER_BATCH_SIZE = config.getint('periodic', 'order_batch_size', fallback=500)
+PERIODIC_ORDER_TIME_BUDGET = config.getint('periodic', 'order_time_budget', fallback=120)
 
 ENTROPY = {
     'order_code': config.getint('entropy', 'order_code', fallback=5),
@@ -435,6 +444,12 @@ ENTROPY = {
     'giftcard_secret': config.getint('entropy', 'giftcard_secret', fallback=12),
 }
 
+QUOTA_COUNTERS_ENABLED = config.getboolean('quotas', 'counters', fallback=False)
+QUOTA_SHARDS = config.getint('quotas', 'shards', fallback=0)
+
+CHECKIN_INDEX_ENABLED = config.getboolean('checkin', 'index', fallback=False)
+CHECKIN_COUNTERS_ENABLED = config.getboolean('checkin', 'counters', fallback=False)
+
 HAS_GEOIP = False
 if config.has_option('geoip', 'path'):
     HAS_GEOIP = True
@@ -784,6 +799,9 @@ CELERY_TASK_ROUTES = ([
     ('pretix.base.services.mail.*', {'queue': 'mail'}),
     ('pretix.base.services.update_check.*', {'queue': 'background'}),
     ('pretix.base.services.quotas.*', {'queue': 'background'}),
+    ('pretix.base.services.tickets.pregenerate_tickets', {'queue': 'background'}),
+    ('pretix.base.services.checkinindex.*', {'queue': 'background'}),
+    ('pretix.base.services.checkinsnapshot.*', {'queue': 'background'}),
     ('pretix.base.services.waitinglist.*', {'queue': 'background'}),
     ('pretix.base.services.notifications.*', {'queue': 'notifications'}),
     ('pretix.api.webhooks.*', {'queue': 'notifications'}),
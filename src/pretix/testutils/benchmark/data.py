@@ -0,0 +1,158 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import string
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+
+from pretix.base.models import (
+    CheckinList, Event, Item, ItemVariation, LogEntry, Order, OrderPosition,
+    Organizer, Quota, SubEvent,
+)
+
+
+class BenchmarkData:
+    """
+    Synthetic data set generated by ``generate_data``.
+    """
+
+    def __init__(self, organizer):
+        self.organizer = organizer
+        self.events = []
+        self.dates = {}  # event -> list of subevents, or [None] for events without subevents
+        self.items = {}  # event -> list of (item, variation or None)
+        self.quotas = {}  # (event, subevent) -> list of quotas
+        self.checkin_lists = {}  # event -> checkin list
+        self.paid_positions = {}  # event -> list of positions of paid orders
+
+
+def _random_code(length):
+    return get_random_string(length=length, allowed_chars=string.ascii_uppercase + string.digits)
+
+
+def generate_data(events=1, subevents=0, items=5, variations=0, quotas=1, orders=100, positions_per_order=2,
+                  quota_size=None):
+    """
+    Creates a new organizer with synthetic events. Every event gets ``items`` products with ``variations`` variations
+    each. If ``subevents`` is larger than zero, every event is an event series with that many dates. Every date gets
+    ``quotas`` quotas and the products are distributed over them round-robin. ``orders`` orders per event are created
+    with a mix of paid and pending orders, spread evenly over all dates and products.
+
+    If ``quota_size`` is not given, quotas are large enough to never sell out during a benchmark run.
+    """
+    slug = 'bench-' + get_random_string(length=8, allowed_chars=string.ascii_lowercase + string.digits)
+    organizer = Organizer.objects.create(name='Benchmark', slug=slug)
+    data = BenchmarkData(organizer)
+    web = organizer.sales_channels.get(identifier='web')
+    now_dt = now()
+
+    for e in range(events):
+        event = Event.objects.create(
+            organizer=organizer, name=f'Benchmark event {e + 1}', slug=f'event{e + 1}', currency='EUR',
+            date_from=now_dt + timedelta(days=30), live=True, has_subevents=subevents > 0,
+        )
+        event.settings.attendee_names_asked = False
+        data.events.append(event)
+
+        if subevents:
+            data.dates[event] = SubEvent.objects.bulk_create([
+                SubEvent(event=event, name=f'Date {s + 1}', active=True,
+                         date_from=now_dt + timedelta(days=1 + s // 10, hours=s % 10))
+                for s in range(subevents)
+            ])
+        else:
+            data.dates[event] = [None]
+
+        data.items[event] = []
+        for i in range(items):
+            item = Item.objects.create(
+                event=event, name=f'Product {i + 1}', default_price=Decimal('23.00'), admission=True,
+            )
+            if variations:
+                for v in ItemVariation.objects.bulk_create([
+                    ItemVariation(item=item, value=f'Variation {v + 1}', position=v) for v in range(variations)
+                ]):
+                    data.items[event].append((item, v))
+            else:
+                data.items[event].append((item, None))
+
+        size = quota_size if quota_size is not None else orders * positions_per_order + 100_000
+        quota_objects = Quota.objects.bulk_create([
+            Quota(event=event, subevent=se, name=f'Quota {q + 1}', size=size)
+            for se in data.dates[event]
+            for q in range(quotas)
+        ])
+        item_through, var_through = [], []
+        for i, q in enumerate(quota_objects):
+            data.quotas.setdefault((event, q.subevent), []).append(q)
+            for j, (item, var) in enumerate(data.items[event]):
+                if j % quotas == i % quotas:
+                    item_through.append(Quota.items.through(quota_id=q.pk, item_id=item.pk))
+                    if var:
+                        var_through.append(Quota.variations.through(quota_id=q.pk, itemvariation_id=var.pk))
+        Quota.items.through.objects.bulk_create(item_through)
+        Quota.variations.through.objects.bulk_create(var_through)
+
+        data.checkin_lists[event] = CheckinList.objects.create(event=event, name='Default', all_products=True)
+
+        order_objects = Order.objects.bulk_create([
+            Order(
+                event=event, organizer=organizer, code=_random_code(8), email=None, locale='en',
+                status=Order.STATUS_PAID if o % 4 else Order.STATUS_PENDING, sales_channel=web,
+                datetime=now_dt, expires=now_dt + timedelta(days=14),
+                total=Decimal('23.00') * positions_per_order,
+            )
+            for o in range(orders)
+        ])
+        position_objects = []
+        n = 0
+        for order in order_objects:
+            for p in range(positions_per_order):
+                item, var = data.items[event][n % len(data.items[event])]
+                position_objects.append(OrderPosition(
+                    order=order, organizer=organizer, positionid=p + 1, item=item, variation=var,
+                    subevent=data.dates[event][n % len(data.dates[event])],
+                    price=Decimal('23.00'), tax_rate=Decimal('0.00'), tax_value=Decimal('0.00'),
+                    secret=get_random_string(length=32), pseudonymization_id=_random_code(10),
+                ))
+                n += 1
+        OrderPosition.objects.bulk_create(position_objects)
+        for order in order_objects:
+            order.create_transactions(is_new=True, positions=[p for p in position_objects if p.order is order],
+                                      fees=[], dt_now=now_dt)
+
+        data.paid_positions[event] = [p for p in position_objects if p.order.status == Order.STATUS_PAID]
+
+    return data
+
+
+def delete_data(data):
+    """
+    Removes everything created by ``generate_data`` and the benchmark runs from the database again.
+    """
+    LogEntry.objects.filter(organizer_id=data.organizer.pk).delete()
+    for event in data.organizer.events.all():
+        event.delete_all_orders(really=True)
+    data.organizer.delete_sub_objects()
+    data.organizer.delete()
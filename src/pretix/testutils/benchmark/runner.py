@@ -0,0 +1,120 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import logging
+import math
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from pretix.base.services.locking import lock_wait_times_var
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    """
+    Returns the ``p``-th percentile of ``values`` using the nearest-rank method.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def _summary(values, scale=1):
+    if not values:
+        return None
+    return {
+        'min': min(values) * scale,
+        'mean': statistics.mean(values) * scale,
+        'p50': percentile(values, 50) * scale,
+        'p90': percentile(values, 90) * scale,
+        'p95': percentile(values, 95) * scale,
+        'p99': percentile(values, 99) * scale,
+        'max': max(values) * scale,
+    }
+
+
+class Scenario:
+    """
+    Base class for a benchmarked code path. ``prepare`` is called before every iteration and is not measured,
+    ``run`` is called with its return value and is measured.
+    """
+    name = None
+
+    def __init__(self, data):
+        self.data = data
+
+    def skip_reason(self):
+        """
+        Returns a message explaining why the scenario cannot run on the generated data, or ``None`` if it can.
+        """
+        return None
+
+    def prepare(self, iteration):
+        return None
+
+    def run(self, context):
+        raise NotImplementedError()
+
+
+def run_scenario(scenario, iterations, warmup=1):
+    """
+    Runs a scenario and returns a JSON-serializable dictionary with the latency (in milliseconds), the number of SQL
+    queries and the time spent waiting for locks (in milliseconds) per iteration.
+    """
+    latencies = []
+    query_counts = []
+    lock_waits = []
+    errors = 0
+
+    for i in range(warmup + iterations):
+        context = scenario.prepare(i)
+        waits = []
+        token = lock_wait_times_var.set(waits)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                t0 = time.perf_counter()
+                scenario.run(context)
+                duration = time.perf_counter() - t0
+        except Exception:
+            logger.exception(f'Benchmark scenario {scenario.name} failed')
+            errors += 1
+            continue
+        finally:
+            lock_wait_times_var.reset(token)
+
+        if i < warmup:
+            continue
+        latencies.append(duration)
+        query_counts.append(len(queries))
+        lock_waits.append(sum(waits))
+
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'latency_ms': _summary(latencies, scale=1000),
+        'queries': _summary(query_counts),
+        'lock_wait_ms': _summary(lock_waits, scale=1000),
+    }
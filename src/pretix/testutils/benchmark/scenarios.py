@@ -0,0 +1,163 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils.timezone import now
+
+from pretix.base.models import CartPosition
+from pretix.base.services.cart import CartManager
+from pretix.base.services.checkin import perform_checkin
+from pretix.base.services.locking import LOCK_TRUST_WINDOW
+from pretix.base.services.orders import _perform_order
+from pretix.base.services.quotas import QuotaAvailability
+from pretix.testutils.benchmark.runner import Scenario
+
+
+class QuotaComputeScenario(Scenario):
+    """
+    Computes all quotas of a random date without using the cache.
+    """
+    name = 'quota_compute'
+
+    def prepare(self, iteration):
+        return random.choice(list(self.data.quotas.values()))
+
+    def run(self, quotas):
+        qa = QuotaAvailability()
+        qa.queue(*quotas)
+        qa.compute()
+
+
+class QuotaComputeEventScenario(Scenario):
+    """
+    Computes all quotas of a random event at once, like a calendar or the backend quota overview does.
+    """
+    name = 'quota_compute_event'
+
+    def prepare(self, iteration):
+        event = random.choice(self.data.events)
+        return [q for (e, se), quotas in self.data.quotas.items() if e == event for q in quotas]
+
+    def run(self, quotas):
+        qa = QuotaAvailability()
+        qa.queue(*quotas)
+        qa.compute()
+
+
+class CartAddScenario(Scenario):
+    """
+    Adds one ticket for a random product and date to a new cart.
+    """
+    name = 'cart_add'
+
+    def prepare(self, iteration):
+        event = random.choice(self.data.events)
+        item, variation = random.choice(self.data.items[event])
+        subevent = random.choice(self.data.dates[event])
+        return event, [{
+            'item': item.pk,
+            'variation': variation.pk if variation else None,
+            'subevent': subevent.pk if subevent else None,
+            'count': 1,
+        }]
+
+    def run(self, context):
+        event, items = context
+        cm = CartManager(event=event, cart_id=str(uuid.uuid4()),
+                         sales_channel=self.data.organizer.sales_channels.get(identifier='web'))
+        cm.add_new_items(items)
+        cm.commit()
+
+
+class PerformOrderScenario(Scenario):
+    """
+    Turns a cart with two tickets for a random product and date into a pending order. The cart is about to expire,
+    so quotas need to be locked and checked again, which is the more expensive code path.
+    """
+    name = 'perform_order'
+
+    def prepare(self, iteration):
+        event = random.choice(self.data.events)
+        item, variation = random.choice(self.data.items[event])
+        subevent = random.choice(self.data.dates[event])
+        cart_id = str(uuid.uuid4())
+        positions = [
+            CartPosition.objects.create(
+                event=event, cart_id=cart_id, item=item, variation=variation, subevent=subevent,
+                price=Decimal('23.00'), listed_price=Decimal('23.00'), price_after_voucher=Decimal('23.00'),
+                expires=now() + timedelta(seconds=LOCK_TRUST_WINDOW // 2),
+            )
+            for _ in range(2)
+        ]
+        return event, cart_id, [p.pk for p in positions]
+
+    def run(self, context):
+        event, cart_id, position_ids = context
+        _perform_order(
+            event,
+            [{
+                'id': 'manual',
+                'provider': 'manual',
+                'max_value': None,
+                'min_value': None,
+                'multi_use_supported': False,
+                'info_data': {},
+            }],
+            position_ids, None, 'en', None, {}, 'web', cart_id=cart_id,
+        )
+
+
+class PerformCheckinScenario(Scenario):
+    """
+    Checks in a ticket of a paid order that is not checked in. Tickets are used in turn, and if there are more
+    iterations than tickets, the check-ins of the earlier iterations are removed before a ticket is used again.
+    """
+    name = 'perform_checkin'
+
+    def skip_reason(self):
+        if not any(self.data.paid_positions.values()):
+            return 'There are no paid orders to check in, since every fourth order is left pending. Use more --orders.'
+
+    def prepare(self, iteration):
+        event = random.choice([e for e in self.data.events if self.data.paid_positions[e]])
+        positions = self.data.paid_positions[event]
+        position = positions[iteration % len(positions)]
+        position.all_checkins.all().delete()
+        return position, self.data.checkin_lists[event]
+
+    def run(self, context):
+        position, checkin_list = context
+        perform_checkin(position, checkin_list, {})
+
+
+SCENARIOS = {
+    s.name: s for s in (
+        QuotaComputeScenario,
+        QuotaComputeEventScenario,
+        CartAddScenario,
+        PerformOrderScenario,
+        PerformCheckinScenario,
+    )
+}
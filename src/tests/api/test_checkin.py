@@ -20,6 +20,8 @@
 # <https://www.gnu.org/licenses/>.
 #
 import datetime
+import gzip
+import sqlite3
 import time
 from decimal import Decimal
 from unittest import mock
@@ -27,6 +29,7 @@ from urllib.parse import quote as urlquote
 
 import pytest
 from django.core.files.base import ContentFile
+from django.test import override_settings
 from django.utils.timezone import now
 from django_countries.fields import Country
 from django_scopes import scopes_disabled
@@ -674,6 +677,173 @@ def test_status(token_client, organizer, event, clist_all, item, other_item, ord
     ]
 
 
+@pytest.mark.django_db
+def test_status_etag(token_client, organizer, event, clist_all, item, other_item, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/status/'.format(organizer.slug, event.slug, clist_all.pk)
+    resp = token_client.get(url)
+    assert resp.status_code == 200
+    etag = resp['ETag']
+
+    resp = token_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 304
+    assert resp['ETag'] == etag
+
+    with scopes_disabled():
+        Checkin.objects.create(position=order.positions.first(), list=clist_all)
+    resp = token_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp.data['checkin_count'] == 1
+    assert resp['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_status_with_counters(token_client, organizer, event, clist_all, item, other_item, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/status/'.format(organizer.slug, event.slug, clist_all.pk)
+    with override_settings(CHECKIN_COUNTERS_ENABLED=True):
+        resp = token_client.get(url)
+        assert resp.status_code == 200
+        assert resp.data['checkin_count'] == 0
+        assert resp.data['position_count'] == 3
+        assert resp.data['inside_count'] == 0
+        with scopes_disabled():
+            assert clist_all.counters.exists()
+            op = order.positions.first()
+            Checkin.objects.create(position=op, list=clist_all)
+        resp = token_client.get(url)
+        assert resp.data['checkin_count'] == 1
+        assert resp.data['inside_count'] == 1
+        assert {i['id']: i['checkin_count'] for i in resp.data['items']} == {item.pk: 0, other_item.pk: 0, op.item_id: 1}
+
+
+@pytest.mark.django_db
+def test_positions_sync(token_client, organizer, event, clist_all, item, other_item, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/positions/sync/'.format(organizer.slug, event.slug, clist_all.pk)
+    with scopes_disabled():
+        Order.objects.filter(pk=order.pk).update(last_modified=now() - datetime.timedelta(minutes=5))
+        positions = list(order.all_positions.order_by('pk'))
+        Checkin.objects.create(position=positions[0], list=clist_all)
+        Order.objects.filter(pk=order.pk).update(last_modified=now() - datetime.timedelta(minutes=5))
+
+    resp = token_client.get(url + '?page_size=2')
+    assert resp.status_code == 200
+    assert [p['id'] for p in resp.data['results']] == [p.pk for p in positions[:2]]
+    assert resp.data['results'][0]['order'] == order.code
+    assert resp.data['results'][0]['checkins'][0]['type'] == 'entry'
+    assert resp.data['has_more']
+
+    resp = token_client.get(url + '?page_size=2&cursor=' + resp.data['cursor'])
+    assert [p['id'] for p in resp.data['results']] == [p.pk for p in positions[2:]]
+    assert not resp.data['has_more']
+    cursor = resp.data['cursor']
+
+    # Changes from the last seconds before the cursor are sent again
+    resp = token_client.get(url + '?cursor=' + cursor)
+    assert [p['id'] for p in resp.data['results']] == [p.pk for p in positions]
+    assert resp.data['cursor'] == cursor
+
+    with scopes_disabled():
+        Order.objects.filter(pk=order.pk).update(last_modified=now() - datetime.timedelta(hours=1))
+    resp = token_client.get(url + '?cursor=' + cursor)
+    assert resp.data['results'] == []
+    assert resp.data['cursor'] == cursor
+
+    with scopes_disabled():
+        positions[1].canceled = True
+        positions[1].save()
+        Order.objects.filter(pk=order.pk).update(last_modified=now() - datetime.timedelta(minutes=1))
+    resp = token_client.get(url + '?cursor=' + cursor)
+    assert len(resp.data['results']) == len(positions)
+    assert resp.data['results'][1]['canceled']
+
+    resp = token_client.get(url + '?cursor=foo')
+    assert resp.status_code == 400
+
+
+@pytest.mark.django_db
+def test_positions_sync_late_commit(token_client, organizer, event, clist_all, item, other_item, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/positions/sync/'.format(organizer.slug, event.slug, clist_all.pk)
+    with scopes_disabled():
+        Order.objects.filter(pk=order.pk).update(last_modified=now() - datetime.timedelta(minutes=1))
+        position = order.all_positions.order_by('pk').first()
+        late_order = Order.objects.create(
+            code='LATE1', event=event, email='dummy@dummy.test', status=Order.STATUS_PAID, locale='en',
+            datetime=now(), expires=now() + datetime.timedelta(days=10), total=0,
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        )
+        late_position = late_order.positions.create(item=item, price=0)
+        # Not visible yet, as if its transaction was still running
+        Order.objects.filter(pk=late_order.pk).update(last_modified=now() + datetime.timedelta(hours=1))
+
+    resp = token_client.get(url)
+    assert position.pk in [p['id'] for p in resp.data['results']]
+    assert late_position.pk not in [p['id'] for p in resp.data['results']]
+    assert not resp.data['has_more']
+    cursor = resp.data['cursor']
+
+    # A transaction that started before the first sync commits a change with an earlier modification time
+    with scopes_disabled():
+        Order.objects.filter(pk=late_order.pk).update(last_modified=now() - datetime.timedelta(minutes=1, seconds=5))
+    resp = token_client.get(url + '?cursor=' + cursor)
+    assert late_position.pk in [p['id'] for p in resp.data['results']]
+
+
+@pytest.mark.django_db
+def test_list_snapshot(token_client, organizer, event, clist_all, item, other_item, order, tmp_path):
+    with scopes_disabled():
+        positions = list(order.positions.order_by('pk'))
+        Checkin.objects.create(position=positions[0], list=clist_all)
+        event.revoked_secrets.create(secret='revoked')
+        expected_positions = [(p.pk, p.secret) for p in OrderPosition.all.filter(order__event=event).order_by('pk')]
+    resp = token_client.get('/api/v1/organizers/{}/events/{}/checkinlists/{}/snapshot/'.format(
+        organizer.slug, event.slug, clist_all.pk,
+    ))
+    assert resp.status_code == 200
+    assert resp['Content-Type'] == 'application/gzip'
+
+    path = tmp_path / 'snapshot.sqlite3'
+    path.write_bytes(gzip.decompress(b''.join(resp.streaming_content)))
+    conn = sqlite3.connect(str(path))
+    try:
+        assert conn.execute('SELECT id, secret FROM positions ORDER BY id').fetchall() == expected_positions
+        assert conn.execute('SELECT position, type FROM checkins').fetchall() == [(positions[0].pk, 'entry')]
+        assert {item.pk, other_item.pk} <= {r[0] for r in conn.execute('SELECT id FROM items')}
+        assert conn.execute('SELECT secret FROM revoked_secrets').fetchall() == [('revoked',)]
+        assert conn.execute("SELECT value FROM meta WHERE key = 'list'").fetchone() == (str(clist_all.pk),)
+    finally:
+        conn.close()
+
+
+@pytest.mark.django_db
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'snapshot-build-failure',
+}})
+def test_list_snapshot_build_failure(token_client, organizer, event, clist_all, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/snapshot/'.format(organizer.slug, event.slug, clist_all.pk)
+    with mock.patch('pretix.base.services.checkinsnapshot._write_snapshot', side_effect=sqlite3.OperationalError):
+        resp = token_client.get(url)
+    assert resp.status_code == 409
+    assert event.cache.get('checkin_snapshot_{}'.format(clist_all.pk)) is None
+
+    resp = token_client.get(url)
+    assert resp.status_code == 200
+
+
+@pytest.mark.django_db
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'snapshot-single-build',
+}})
+def test_list_snapshot_single_build(token_client, organizer, event, clist_all, order):
+    url = '/api/v1/organizers/{}/events/{}/checkinlists/{}/snapshot/'.format(organizer.slug, event.slug, clist_all.pk)
+    with mock.patch('pretix.base.services.checkinsnapshot.build_checkin_snapshot.apply_async') as apply_async:
+        assert token_client.get(url).status_code == 409
+        assert token_client.get(url).status_code == 409
+        # Another device claimed the build in the meantime
+        event.cache.delete('checkin_snapshot_{}'.format(clist_all.pk))
+        event.cache.add('checkin_snapshot_{}'.format(clist_all.pk), 'e4bd6bb3-63c4-4f86-a5b9-2f0d1b5b2d0b', 60)
+        assert token_client.get(url).status_code == 409
+    assert apply_async.call_count == 1
+
+
 def _redeem(token_client, org, clist, p, body=None):
     return token_client.post('/api/v1/organizers/{}/events/{}/checkinlists/{}/positions/{}/redeem/'.format(
         org.slug, clist.event.slug, clist.pk, p
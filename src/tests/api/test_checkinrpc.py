@@ -26,6 +26,7 @@ from unittest import mock
 import pytest
 from django.core.files.base import ContentFile
 from django.db import connection
+from django.test import override_settings
 from django.utils.timezone import now
 from django_countries.fields import Country
 from django_scopes import scopes_disabled
@@ -34,9 +35,13 @@ from i18nfield.strings import LazyI18nString
 from tests.const import SAMPLE_PNG
 
 from pretix.api.serializers.item import QuestionSerializer
+from pretix.api.views.checkin import _redeem_process
 from pretix.base.models import (
     Checkin, InvoiceAddress, Item, Order, OrderPosition, ReusableMedium,
 )
+from pretix.base.services.checkinindex import (
+    build_checkin_index, lookup_positions,
+)
 from pretix.testutils.db import readonly_db
 
 # Lots of this code is overlapping with test_checkin.py, and some of it is arguably redundant since it's triggering
@@ -216,6 +221,15 @@ def _redeem(token_client, org, clist, p, body=None, query='', headers={}):
     ), body, format='json', headers={})
 
 
+def _redeem_batch(token_client, org, clist, scans, body=None):
+    body = body or {}
+    body['lists'] = [clist.pk]
+    body['scans'] = scans
+    return token_client.post('/api/v1/organizers/{}/checkinrpc/redeem_batch/'.format(
+        org.slug,
+    ), body, format='json')
+
+
 @pytest.mark.django_db(transaction=True)
 def test_query_load(token_client, organizer, clist, event, order, django_assert_max_num_queries):
     with scopes_disabled():
@@ -944,6 +958,58 @@ def test_redeem_addon_if_match_ambiguous(token_client, organizer, clist, item, o
         assert not Checkin.objects.last()
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures("fakeredis_client")
+def test_redeem_with_checkin_index(token_client, organizer, clist, other_item, event, order):
+    with scopes_disabled():
+        clist.all_products = False
+        clist.addon_match = True
+        clist.allow_multiple_entries = True
+        clist.save()
+        clist.limit_products.set([other_item])
+        op = order.positions.get(positionid=1)
+        p = op.addons.all().first()
+
+    with override_settings(CHECKIN_INDEX_ENABLED=True):
+        # The first scan triggers building the index
+        resp = _redeem(token_client, organizer, clist, 'z3fsn8jyufm5kpk768q69gkbyr5f4h6w', {})
+        assert resp.status_code == 201
+        with scopes_disabled():
+            assert Checkin.objects.last().position == p
+            assert lookup_positions([event.pk], 'z3fsn8jyufm5kpk768q69gkbyr5f4h6w') == {op.pk}
+
+        resp = _redeem(token_client, organizer, clist, 'z3fsn8jyufm5kpk768q69gkbyr5f4h6w', {})
+        assert resp.status_code == 201
+        with scopes_disabled():
+            assert Checkin.objects.last().position == p
+
+        # An outdated index must not be trusted
+        op.secret = 'new_secret'
+        op.save()
+        resp = _redeem(token_client, organizer, clist, 'z3fsn8jyufm5kpk768q69gkbyr5f4h6w', {})
+        assert resp.status_code == 404
+        resp = _redeem(token_client, organizer, clist, 'new_secret', {})
+        assert resp.status_code == 201
+        with scopes_disabled():
+            assert Checkin.objects.last().position == p
+            assert lookup_positions([event.pk], 'new_secret') == {op.pk}
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("fakeredis_client")
+def test_checkin_index_requires_all_events(event, event2, order, order2):
+    with scopes_disabled():
+        op = order.positions.get(positionid=1)
+    with override_settings(CHECKIN_INDEX_ENABLED=True), mock.patch.object(build_checkin_index, 'apply_async') as aa:
+        build_checkin_index(event.pk)
+        assert lookup_positions([event.pk], op.secret) == {op.pk}
+        # Positions of the second event could be missing
+        assert lookup_positions([event.pk, event2.pk], op.secret) is None
+        aa.assert_called_once_with(kwargs={'event': event2.pk})
+        build_checkin_index(event2.pk)
+        assert lookup_positions([event.pk, event2.pk], op.secret) == {op.pk}
+
+
 @pytest.mark.django_db
 def test_redeem_addon_if_match_and_revoked_force(token_client, organizer, clist, other_item, event, order):
     with scopes_disabled():
@@ -1779,3 +1845,61 @@ def test_simulate_no_exchange(token_client, organizer, clist, event, order, item
     assert resp.data['reason'] == 'error'
     with scopes_disabled():
         assert not rm.linked_orderpositions.exists()
+
+
+@pytest.mark.django_db
+def test_redeem_batch(token_client, organizer, clist, event, order):
+    with scopes_disabled():
+        p = order.positions.first()
+    scans = [
+        {'secret': p.secret, 'type': 'entry', 'nonce': 'c', 'datetime': '2020-01-01T12:00:00Z'},
+        {'secret': p.secret, 'type': 'entry', 'nonce': 'a', 'datetime': '2020-01-01T10:00:00Z'},
+        {'secret': p.secret, 'type': 'exit', 'nonce': 'b', 'datetime': '2020-01-01T11:00:00Z'},
+        {'secret': 'unknown', 'type': 'entry', 'nonce': 'd', 'datetime': '2020-01-01T11:30:00Z'},
+    ]
+    resp = _redeem_batch(token_client, organizer, clist, scans)
+    assert resp.status_code == 200
+    assert [r['status'] for r in resp.data['results']] == ['ok', 'ok', 'ok', 'error']
+    assert resp.data['results'][3]['reason'] == 'invalid'
+    with scopes_disabled():
+        assert list(p.checkins.order_by('datetime').values_list('type', 'nonce')) == [
+            ('entry', 'a'), ('exit', 'b'), ('entry', 'c'),
+        ]
+
+    # Retrying the upload does not create the same check-ins again
+    resp = _redeem_batch(token_client, organizer, clist, scans)
+    assert resp.status_code == 200
+    assert [r['status'] for r in resp.data['results']] == ['ok', 'ok', 'ok', 'error']
+    with scopes_disabled():
+        assert p.checkins.count() == 3
+
+
+@pytest.mark.django_db
+def test_redeem_batch_unexpected_error(token_client, organizer, clist, event, order):
+    with scopes_disabled():
+        p = order.positions.first()
+
+    def redeem(**kwargs):
+        response = _redeem_process(**kwargs)
+        if kwargs['nonce'] == 'a':
+            raise ValueError('Unexpected')
+        return response
+
+    scans = [
+        {'secret': p.secret, 'type': 'entry', 'nonce': 'a', 'datetime': '2020-01-01T10:00:00Z'},
+        {'secret': p.secret, 'type': 'exit', 'nonce': 'b', 'datetime': '2020-01-01T11:00:00Z'},
+    ]
+    with mock.patch('pretix.api.views.checkin._redeem_process', side_effect=redeem):
+        resp = _redeem_batch(token_client, organizer, clist, scans)
+    assert resp.status_code == 200
+    assert [r['status'] for r in resp.data['results']] == ['error', 'ok']
+    assert resp.data['results'][0]['reason'] == 'error'
+    with scopes_disabled():
+        # The check-in of the failed scan has been rolled back
+        assert list(p.checkins.values_list('nonce', flat=True)) == ['b']
+
+
+@pytest.mark.django_db
+def test_redeem_batch_too_large(token_client, organizer, clist, event, order):
+    resp = _redeem_batch(token_client, organizer, clist, [{'secret': 'foo'}] * 1001)
+    assert resp.status_code == 400
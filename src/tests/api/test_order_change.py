@@ -2735,3 +2735,86 @@ def test_order_change_create_addon(token_client, organizer, event, order, quota,
         op = order.positions.last()
         assert op.positionid == 3
         assert op.addon_to.positionid == 1
+
+
+@pytest.mark.django_db
+def test_order_bulk_change(token_client, organizer, event, order):
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_change/'.format(organizer.slug, event.slug),
+        format='json', data={
+            'orders': ['FOO'],
+            'operations': [{'type': 'add_block', 'name': 'admin'}],
+        }
+    )
+    assert resp.status_code == 200
+    assert resp.data['status'] == 'ok'
+    assert resp.data['total'] == 1
+    assert resp.data['changed'] == 1
+    assert resp.data['failed'] == []
+    with scopes_disabled():
+        assert order.positions.first().blocked == ['admin']
+
+
+@pytest.mark.django_db
+def test_order_bulk_change_status_unknown(token_client, organizer, event, order):
+    resp = token_client.get(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_change/{}/'.format(organizer.slug, event.slug, 'foo')
+    )
+    assert resp.status_code == 404
+
+
+@pytest.mark.django_db
+def test_order_bulk_change_status_other_event(token_client, organizer, event, event2, order):
+    with mock.patch('pretix.api.views.order.bulk_change_orders.apply_async') as apply_async:
+        apply_async.return_value.id = 'abc'
+        apply_async.return_value.ready.return_value = False
+        resp = token_client.post(
+            '/api/v1/organizers/{}/events/{}/orders/bulk_change/'.format(organizer.slug, event.slug),
+            format='json', data={'operations': [{'type': 'add_block', 'name': 'admin'}]}
+        )
+    assert resp.status_code == 202
+    assert resp.data['id'] == 'abc'
+
+    resp = token_client.get(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_change/{}/'.format(organizer.slug, event2.slug, 'abc')
+    )
+    assert resp.status_code == 404
+
+    with mock.patch('pretix.api.views.order.AsyncResult') as async_result:
+        async_result.return_value.failed.return_value = False
+        async_result.return_value.successful.return_value = False
+        async_result.return_value.state = 'PENDING'
+        async_result.return_value.result = None
+        resp = token_client.get(
+            '/api/v1/organizers/{}/events/{}/orders/bulk_change/{}/'.format(organizer.slug, event.slug, 'abc')
+        )
+    assert resp.status_code == 409
+    assert resp.data['status'] == 'waiting'
+
+
+@pytest.mark.django_db
+def test_order_bulk_change_validation(token_client, organizer, event, order, item):
+    url = '/api/v1/organizers/{}/events/{}/orders/bulk_change/'.format(organizer.slug, event.slug)
+    resp = token_client.post(url, format='json', data={
+        'orders': ['UNKNOWN'],
+        'operations': [{'type': 'add_block', 'name': 'admin'}],
+    })
+    assert resp.status_code == 400
+    assert resp.data['orders'] == ['Unknown order codes: UNKNOWN']
+
+    resp = token_client.post(url, format='json', data={
+        'operations': [{'type': 'change_price'}],
+    })
+    assert resp.status_code == 400
+
+    resp = token_client.post(url, format='json', data={
+        'operations': [{'type': 'change_item', 'item': item.pk + 1000}],
+    })
+    assert resp.status_code == 400
+
+    resp = token_client.post(url, format='json', data={
+        'operations': [{'type': 'add_block', 'name': 'admin', 'filter': {'order': 1}}],
+    })
+    assert resp.status_code == 400
+    with scopes_disabled():
+        assert order.positions.first().blocked is None
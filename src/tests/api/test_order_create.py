@@ -29,16 +29,20 @@ import pytest
 from django.conf import settings
 from django.core import mail as djmail
 from django.core.files.base import ContentFile
+from django.test import override_settings
 from django.utils.timezone import now
 from django_countries.fields import Country
 from django_scopes import scopes_disabled
 from tests.const import SAMPLE_PNG
 
+from pretix.api.serializers.order import OrderCreateSerializer
 from pretix.base.models import (
     GiftCard, InvoiceAddress, Item, Order, OrderPayment, OrderPosition,
-    Organizer, Question, SeatingPlan,
+    Organizer, Question, QuotaCounter, SeatingPlan,
 )
 from pretix.base.models.orders import CartPosition, OrderFee, QuestionAnswer
+from pretix.base.services.checkincounters import checkin_list_counts
+from pretix.base.services.quotacounters import reconcile_quota_counters
 
 
 @pytest.fixture
@@ -2018,6 +2022,44 @@ def test_order_create_free(token_client, organizer, event, item, quota, question
     assert o.all_logentries().count() == 3
 
 
+@pytest.mark.django_db
+@override_settings(QUOTA_COUNTERS_ENABLED=True)
+def test_order_create_updates_quota_counters(token_client, organizer, event, item, quota, question):
+    with scopes_disabled():
+        reconcile_quota_counters([quota])
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=res
+    )
+    assert resp.status_code == 201
+    with scopes_disabled():
+        c = QuotaCounter.objects.get(quota=quota)
+    assert (c.paid_orders, c.pending_orders) == (0, 1)
+
+
+@pytest.mark.django_db
+@override_settings(CHECKIN_COUNTERS_ENABLED=True)
+def test_order_create_updates_checkin_counters(token_client, organizer, event, item, quota, question):
+    with scopes_disabled():
+        clist = event.checkin_lists.create(name='Default', all_products=True, include_pending=True)
+        assert checkin_list_counts(clist)[item.pk, None] == (0, 0, 0)
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=res
+    )
+    assert resp.status_code == 201
+    with scopes_disabled():
+        assert checkin_list_counts(clist)[item.pk, None] == (1, 0, 0)
+
+
 @pytest.mark.django_db
 def test_order_create_invalid_payment_provider(token_client, organizer, event, item, quota, question):
     res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
@@ -3678,3 +3720,147 @@ def test_order_create_use_gift_card_invalid_secret(token_client, organizer, even
         assert o.payments.count() == 2
         assert o.payments.all()[0].state == OrderPayment.PAYMENT_STATE_FAILED
         assert o.payments.all()[1].state == OrderPayment.PAYMENT_STATE_CONFIRMED
+
+
+@pytest.mark.django_db
+def test_order_bulk_create(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    invalid = copy.deepcopy(res)
+    invalid['positions'][0]['item'] = 9999
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=[res, invalid, res]
+    )
+    assert resp.status_code == 200
+    results = resp.data['results']
+    assert results[0]['success']
+    assert not results[1]['success']
+    assert results[1]['errors']['positions'][0]['item']
+    assert results[2]['success']
+    with scopes_disabled():
+        assert Order.objects.count() == 2
+        o = Order.objects.get(code=results[0]['data']['code'])
+        assert o.total == Decimal('23.25')
+        assert o.all_logentries().filter(action_type='pretix.event.order.placed').exists()
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_quota_shared_by_batch(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    quota.size = 2
+    quota.save()
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=[res, res, res]
+    )
+    assert resp.status_code == 200
+    results = resp.data['results']
+    assert [r['success'] for r in results] == [True, True, False]
+    assert results[2]['errors'] == {
+        'positions': [
+            {'item': ['There is not enough quota available on quota "Budget Quota" to perform the operation.']},
+        ]
+    }
+    with scopes_disabled():
+        assert Order.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_failed_order_releases_quota(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    quota.size = 1
+    quota.save()
+    with scopes_disabled():
+        voucher = event.vouchers.create(item=item, max_usages=1, valid_until=now() - datetime.timedelta(days=1))
+    invalid = copy.deepcopy(res)
+    invalid['positions'][0]['voucher'] = voucher.code
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=[invalid, res]
+    )
+    assert resp.status_code == 200
+    results = resp.data['results']
+    assert [r['success'] for r in results] == [False, True]
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_forced_order_uses_quota(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    quota.size = 1
+    quota.save()
+    forced = copy.deepcopy(res)
+    forced['force'] = True
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=[forced, res]
+    )
+    assert resp.status_code == 200
+    results = resp.data['results']
+    assert [r['success'] for r in results] == [True, False]
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_unexpected_error(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    orig_create = OrderCreateSerializer.create
+    calls = []
+
+    def create(self, validated_data):
+        calls.append(validated_data)
+        if len(calls) == 1:
+            raise RuntimeError('Something went wrong')
+        return orig_create(self, validated_data)
+
+    with mock.patch.object(OrderCreateSerializer, 'create', create):
+        resp = token_client.post(
+            '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+                organizer.slug, event.slug
+            ), format='json', data=[res, res]
+        )
+    assert resp.status_code == 200
+    results = resp.data['results']
+    assert [r['success'] for r in results] == [False, True]
+    assert results[0]['errors'] == {'non_field_errors': ['An internal error occurred while creating this order.']}
+    with scopes_disabled():
+        assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_rejects_simulation(token_client, organizer, event, item, quota, question):
+    res = copy.deepcopy(ORDER_CREATE_PAYLOAD)
+    res['positions'][0]['item'] = item.pk
+    res['positions'][0]['answers'][0]['question'] = question.pk
+    res['simulate'] = True
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data=[res]
+    )
+    assert resp.status_code == 200
+    assert resp.data['results'][0]['errors'] == {
+        'simulate': ['Simulation is not supported when creating multiple orders at once.']
+    }
+
+
+@pytest.mark.django_db
+def test_order_bulk_create_requires_list(token_client, organizer, event):
+    resp = token_client.post(
+        '/api/v1/organizers/{}/events/{}/orders/bulk_create/'.format(
+            organizer.slug, event.slug
+        ), format='json', data={}
+    )
+    assert resp.status_code == 400
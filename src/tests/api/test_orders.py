@@ -27,6 +27,7 @@ from unittest import mock
 
 import pytest
 from django.core import mail as djmail
+from django.test import override_settings
 from django.utils.timezone import now
 from django_countries.fields import Country
 from django_scopes import scopes_disabled
@@ -36,6 +37,7 @@ from tests.plugins.stripe.test_provider import MockedCharge
 
 from pretix.base.models import InvoiceAddress, Order, OrderPosition, Team
 from pretix.base.models.orders import OrderFee, OrderPayment, OrderRefund
+from pretix.base.services.checkincounters import checkin_list_counts
 
 
 @pytest.fixture
@@ -1579,6 +1581,24 @@ def test_order_mark_paid_unpaid(token_client, organizer, event, order):
     assert resp.data['status'] == Order.STATUS_PENDING
 
 
+@pytest.mark.django_db
+def test_order_mark_paid_unpaid_updates_checkin_counters(token_client, organizer, event, order):
+    order.status = Order.STATUS_PAID
+    order.save()
+    with scopes_disabled(), override_settings(CHECKIN_COUNTERS_ENABLED=True):
+        clist = event.checkin_lists.create(name='Default', all_products=True)
+        counts = checkin_list_counts(clist)
+        assert sum(c[0] for c in counts.values()) > 0
+        resp = token_client.post(
+            '/api/v1/organizers/{}/events/{}/orders/{}/mark_pending/'.format(
+                organizer.slug, event.slug, order.code
+            )
+        )
+        assert resp.status_code == 200
+        counts = checkin_list_counts(clist)
+        assert sum(c[0] for c in counts.values()) == 0
+
+
 @pytest.mark.django_db
 def test_order_mark_canceled_unpaid(token_client, organizer, event, order):
     order.status = Order.STATUS_CANCELED
@@ -0,0 +1,78 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import json
+
+import pytest
+from django.core.management import call_command
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Organizer
+from pretix.testutils.benchmark.runner import percentile
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(1, 101)), 95) == 95
+    assert percentile(list(range(1, 101)), 100) == 100
+
+
+@pytest.mark.django_db
+def test_benchmark_command(tmp_path):
+    call_command(
+        'benchmark', events=1, subevents=3, items=2, variations=2, quotas=2, orders=10, iterations=3, seed=1,
+        output=str(tmp_path / 'result.json'),
+    )
+    result = json.loads((tmp_path / 'result.json').read_text())
+    assert set(result['scenarios']) == {
+        'cart_add', 'perform_checkin', 'perform_order', 'quota_compute', 'quota_compute_event'
+    }
+    for name, r in result['scenarios'].items():
+        assert r['errors'] == 0, name
+        assert r['latency_ms']['p50'] <= r['latency_ms']['max']
+        assert r['queries']['min'] > 0
+    with scopes_disabled():
+        assert not Organizer.objects.filter(slug__startswith='bench-').exists()
+
+
+@pytest.mark.django_db
+def test_benchmark_checkin_more_iterations_than_tickets(tmp_path):
+    # Only one paid order with two tickets
+    call_command(
+        'benchmark', orders=2, iterations=5, seed=1, scenarios=['perform_checkin'],
+        output=str(tmp_path / 'result.json'),
+    )
+    result = json.loads((tmp_path / 'result.json').read_text())
+    assert result['scenarios']['perform_checkin']['errors'] == 0
+    assert result['scenarios']['perform_checkin']['queries']['min'] > 0
+
+
+@pytest.mark.django_db
+def test_benchmark_checkin_without_paid_orders(tmp_path):
+    # The only order is pending
+    call_command(
+        'benchmark', orders=1, iterations=2, seed=1, scenarios=['perform_checkin', 'quota_compute'],
+        output=str(tmp_path / 'result.json'),
+    )
+    result = json.loads((tmp_path / 'result.json').read_text())
+    assert 'paid orders' in result['scenarios']['perform_checkin']['skipped']
+    assert result['scenarios']['quota_compute']['errors'] == 0
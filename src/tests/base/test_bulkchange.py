@@ -0,0 +1,120 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core import mail as djmail
+from django.test import TestCase
+from django.utils.timezone import now
+from django_scopes import scope
+
+from pretix.base.models import Event, Item, Order, OrderPosition, Organizer
+from pretix.base.services.bulkchange import bulk_change_orders
+from pretix.testutils.scope import classscope
+
+
+class BulkChangeTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.o = Organizer.objects.create(name='Dummy', slug='dummy')
+        with scope(organizer=self.o):
+            self.event = Event.objects.create(organizer=self.o, name='Dummy', slug='dummy', date_from=now(),
+                                              plugins='tests.testdummy')
+            self.ticket = Item.objects.create(event=self.event, name='Early-bird ticket',
+                                              default_price=Decimal('23.00'), admission=True)
+            self.ticket2 = Item.objects.create(event=self.event, name='Late-bird ticket',
+                                               default_price=Decimal('23.00'), admission=True)
+            self.quota = self.event.quotas.create(name='Early', size=10)
+            self.quota.items.add(self.ticket)
+            self.quota2 = self.event.quotas.create(name='Late', size=1)
+            self.quota2.items.add(self.ticket2)
+            self.orders = []
+            for i in range(2):
+                order = Order.objects.create(
+                    code='FOO{}'.format(i), event=self.event, email='dummy@dummy.test',
+                    status=Order.STATUS_PENDING, locale='en',
+                    datetime=now(), expires=now() + timedelta(days=10),
+                    sales_channel=self.event.organizer.sales_channels.get(identifier="web"),
+                    total=Decimal('23.00'),
+                )
+                OrderPosition.objects.create(
+                    order=order, item=self.ticket, variation=None,
+                    price=Decimal("23.00"), attendee_name_parts={'full_name': "Peter"}, positionid=1
+                )
+                self.orders.append(order)
+
+    @classscope(attr='o')
+    def test_change_item_quota_shared_by_chunk(self):
+        result = bulk_change_orders(
+            self.event.pk,
+            operations=[{'type': 'change_item', 'item': self.ticket2.pk, 'filter': {'item': self.ticket.pk}}],
+        )
+        assert result['total'] == 2
+        assert result['changed'] == 1
+        assert result['failed'] == [{
+            'order': 'FOO1',
+            'error': 'The quota Late does not have enough capacity left to perform the operation.'
+        }]
+        assert self.orders[0].positions.get().item == self.ticket2
+        assert self.orders[1].positions.get().item == self.ticket
+
+    @classscope(attr='o')
+    def test_dry_run(self):
+        result = bulk_change_orders(
+            self.event.pk,
+            operations=[{'type': 'change_price', 'price': '12.00'}],
+            dry_run=True,
+        )
+        assert result['changed'] == 2
+        assert not result['failed']
+        for o in self.orders:
+            assert o.positions.get().price == Decimal('23.00')
+
+    @classscope(attr='o')
+    def test_add_block_filtered_orders(self):
+        result = bulk_change_orders(
+            self.event.pk,
+            operations=[
+                {'type': 'add_block', 'name': 'admin'},
+                {'type': 'change_price', 'price': '12.00', 'filter': {'item': self.ticket2.pk}},
+            ],
+            orders=[self.orders[1].pk],
+        )
+        assert result['total'] == 1
+        assert result['changed'] == 1
+        p = self.orders[1].positions.get()
+        assert p.blocked == ['admin']
+        assert p.price == Decimal('23.00')
+        assert not self.orders[0].positions.get().blocked
+
+    @classscope(attr='o')
+    def test_notifications_sent_after_commit(self):
+        djmail.outbox = []
+        with self.captureOnCommitCallbacks(execute=True):
+            result = bulk_change_orders(
+                self.event.pk,
+                operations=[{'type': 'change_price', 'price': '12.00'}],
+                notify=True,
+            )
+            assert result['changed'] == 2
+            assert not djmail.outbox
+        assert len(djmail.outbox) == 2
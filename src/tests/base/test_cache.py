@@ -71,3 +71,8 @@ class CacheTest(TestCase):
         }
         self.cache.set_many(inp)
         self.assertEqual(inp, self.cache.get_many(inp.keys()))
+
+    def test_add(self):
+        self.assertTrue(self.cache.add(self.testkey, "foo"))
+        self.assertFalse(self.cache.add(self.testkey, "bar"))
+        self.assertEqual(self.cache.get(self.testkey), "foo")
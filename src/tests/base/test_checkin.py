@@ -20,8 +20,9 @@
 # <https://www.gnu.org/licenses/>.
 #
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from unittest import mock
 
 import pytest
 from django.conf import settings
@@ -31,9 +32,10 @@ from freezegun import freeze_time
 
 from pretix.base.models import Checkin, Event, Order, OrderPosition, Organizer
 from pretix.base.services.checkin import (
-    CheckInError, RequiredQuestionsError, SQLLogic, perform_checkin,
-    process_exit_all,
+    CheckInError, LazyRuleVars, RequiredQuestionsError, SQLLogic,
+    perform_checkin, process_exit_all,
 )
+from pretix.base.signals import checkin_created
 
 
 @pytest.fixture(scope='function')
@@ -1184,6 +1186,27 @@ def test_rules_reasoning_prefer_number_over_date(event, position, clist):
         assert 'Minimum number of entries today exceeded' in str(excinfo.value)
 
 
+@pytest.mark.django_db
+def test_rules_variables_single_query(django_assert_num_queries, position, clist):
+    clist.allow_multiple_entries = True
+    clist.save()
+    with freeze_time("2020-01-01 10:00:00Z"):
+        perform_checkin(position, clist, {})
+        perform_checkin(position, clist, {})
+    with freeze_time("2020-01-02 10:00:00Z"):
+        perform_checkin(position, clist, {})
+        rule_data = LazyRuleVars(position, clist, now(), gate=None)
+        with django_assert_num_queries(1):
+            assert rule_data.entries_number == 3
+            assert rule_data.entries_today == 1
+            assert rule_data.entries_days == 2
+            assert rule_data.entries_since(datetime(2020, 1, 1, 12, 0, tzinfo=timezone.utc)) == 1
+            assert rule_data.entries_days_before(datetime(2020, 1, 1, 12, 0, tzinfo=timezone.utc)) == 1
+            assert rule_data.entry_status == 'present'
+            assert rule_data.minutes_since_first_entry == 24 * 60
+            assert rule_data.minutes_since_last_entry == 0
+
+
 @pytest.mark.django_db(transaction=True)
 def test_position_queries(django_assert_max_num_queries, position, clist):
     with django_assert_max_num_queries(12) as captured:
@@ -1210,6 +1233,38 @@ def test_auto_checkout_at_correct_time(event, position, clist):
     assert clist.exit_all_at == datetime(2020, 1, 3, 3, 0, tzinfo=event.timezone)
 
 
+@pytest.mark.django_db(transaction=True)
+def test_auto_checkout_in_chunks(event, position, clist, item, monkeypatch):
+    monkeypatch.setattr('pretix.base.services.checkin.EXIT_ALL_CHUNK_SIZE', 2)
+    positions = [position] + [
+        OrderPosition.objects.create(
+            order=position.order, item=item, variation=None, price=Decimal("23.00"), positionid=i + 2
+        )
+        for i in range(4)
+    ]
+    clist.exit_all_at = datetime(2020, 1, 2, 3, 0, tzinfo=event.timezone)
+    clist.save()
+    with freeze_time("2020-01-01 10:00:00+01:00"):
+        for p in positions[:4]:
+            perform_checkin(p, clist, {})
+
+    with freeze_time("2020-01-02 03:05:00+01:00"), mock.patch.object(checkin_created, 'send') as send:
+        process_exit_all(sender=None)
+
+    assert sorted(c.kwargs['checkin'].position_id for c in send.call_args_list) == sorted(p.pk for p in positions[:4])
+    assert clist.inside_count == 0
+    assert Checkin.objects.filter(list=clist, type=Checkin.TYPE_EXIT, auto_checked_in=True).count() == 4
+    position.order.refresh_from_db()
+    assert position.order.last_modified > datetime(2020, 1, 2, 3, 0, tzinfo=event.timezone)
+
+    # Exits that already exist are not created twice
+    clist.exit_all_at = datetime(2020, 1, 2, 3, 0, tzinfo=event.timezone)
+    clist.save()
+    with freeze_time("2020-01-02 03:10:00+01:00"):
+        process_exit_all(sender=None)
+    assert Checkin.objects.filter(list=clist, type=Checkin.TYPE_EXIT, auto_checked_in=True).count() == 4
+
+
 @pytest.mark.django_db(transaction=True)
 def test_auto_check_out_only_if_checked_in(event, position, clist):
     clist.exit_all_at = datetime(2020, 1, 2, 3, 0, tzinfo=event.timezone)
@@ -0,0 +1,169 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scope
+
+from pretix.base.models import (
+    Checkin, CheckinListCounter, Event, Item, Order, OrderPayment,
+    OrderPosition, Organizer,
+)
+from pretix.base.services.checkincounters import (
+    checkin_list_counts, reconcile_checkin_list_counters,
+    reconcile_checkin_list_counters_periodic,
+)
+from pretix.base.services.orders import cancel_order
+
+
+@pytest.fixture
+def event():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now() + timedelta(days=10),
+    )
+    with scope(organizer=o), override_settings(CHECKIN_COUNTERS_ENABLED=True):
+        yield event
+
+
+@pytest.fixture
+def item(event):
+    return Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+
+
+@pytest.fixture
+def clist(event):
+    return event.checkin_lists.create(name='Default', all_products=True)
+
+
+@pytest.fixture
+def order(event, item):
+    o = Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('46.00'),
+        sales_channel=event.organizer.sales_channels.get(identifier="web"),
+    )
+    for i in range(2):
+        OrderPosition.objects.create(order=o, item=item, variation=None, price=Decimal('23.00'), positionid=i + 1)
+    return o
+
+
+def _counts(clist, item):
+    c = CheckinListCounter.objects.get(checkin_list=clist, item=item, variation__isnull=True)
+    return c.position_count, c.checkin_count, c.inside_count
+
+
+@pytest.mark.django_db
+def test_counters_created_on_first_read(clist, item, order):
+    order.status = Order.STATUS_PAID
+    order.save()
+    assert not CheckinListCounter.objects.filter(checkin_list=clist).exists()
+    assert checkin_list_counts(clist) == {(item.pk, None): (2, 0, 0)}
+    assert _counts(clist, item) == (2, 0, 0)
+
+
+@pytest.mark.django_db
+def test_counters_disabled(clist, item, order):
+    with override_settings(CHECKIN_COUNTERS_ENABLED=False):
+        assert checkin_list_counts(clist) is None
+    assert not CheckinListCounter.objects.filter(checkin_list=clist).exists()
+
+
+@pytest.mark.django_db
+def test_deltas_on_checkins(clist, item, order):
+    order.status = Order.STATUS_PAID
+    order.save()
+    checkin_list_counts(clist)
+    op = order.positions.first()
+
+    Checkin.objects.create(position=op, list=clist, datetime=now() - timedelta(minutes=2))
+    assert _counts(clist, item) == (2, 1, 1)
+
+    Checkin.objects.create(position=op, list=clist, datetime=now() - timedelta(minutes=1))
+    assert _counts(clist, item) == (2, 1, 1)
+
+    ci_exit = Checkin.objects.create(position=op, list=clist, type=Checkin.TYPE_EXIT)
+    assert _counts(clist, item) == (2, 1, 0)
+
+    ci_exit.delete()
+    assert _counts(clist, item) == (2, 1, 1)
+
+    Checkin.all.create(position=order.positions.last(), list=clist, successful=False, error_reason='rules')
+    assert _counts(clist, item) == (2, 1, 1)
+
+
+@pytest.mark.django_db
+def test_checkins_of_invalid_positions_not_counted(clist, item, order):
+    checkin_list_counts(clist)
+    Checkin.objects.create(position=order.positions.first(), list=clist)
+    assert _counts(clist, item) == (0, 0, 0)
+
+
+@pytest.mark.django_db
+def test_deltas_on_order_changes(clist, item, order):
+    checkin_list_counts(clist)
+    p = order.payments.create(state=OrderPayment.PAYMENT_STATE_CREATED, provider='manual', amount=order.total)
+    p.confirm()
+    assert _counts(clist, item) == (2, 0, 0)
+
+    Checkin.objects.create(position=order.positions.first(), list=clist)
+    assert _counts(clist, item) == (2, 1, 1)
+
+    cancel_order(order.pk)
+    assert _counts(clist, item) == (0, 0, 0)
+
+
+@pytest.mark.django_db
+def test_list_change_drops_counters(event, clist, item, order):
+    order.status = Order.STATUS_PAID
+    order.save()
+    checkin_list_counts(clist)
+
+    clist.all_products = False
+    clist.save()
+    assert not CheckinListCounter.objects.filter(checkin_list=clist).exists()
+    assert checkin_list_counts(clist) == {}
+
+    clist.limit_products.add(item)
+    assert checkin_list_counts(clist) == {(item.pk, None): (2, 0, 0)}
+
+
+@pytest.mark.django_db
+def test_missing_product_triggers_rebuild(event, clist, item, order):
+    checkin_list_counts(clist)
+    other_item = Item.objects.create(event=event, name='Other', default_price=Decimal('23.00'))
+    assert (other_item.pk, None) not in checkin_list_counts(clist)
+    assert checkin_list_counts(clist, expected=[(other_item.pk, None)])[other_item.pk, None] == (0, 0, 0)
+
+
+@pytest.mark.django_db
+def test_periodic_reconciliation_repairs_drift(clist, item, order):
+    reconcile_checkin_list_counters(clist)
+    CheckinListCounter.objects.filter(checkin_list=clist).update(position_count=17, reconciled=now() - timedelta(hours=1))
+    order.touch()
+
+    reconcile_checkin_list_counters_periodic(None)
+    assert _counts(clist, item) == (0, 0, 0)
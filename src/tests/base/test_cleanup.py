@@ -0,0 +1,84 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import CartPosition, Event, Item, Organizer
+from pretix.base.services.cleanup import (
+    _delete_expired_cart_positions, clean_cart_positions,
+)
+
+
+@pytest.fixture
+def event():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    return Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now() + timedelta(days=10),
+    )
+
+
+@pytest.fixture
+def item(event):
+    return Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+
+
+def _cp(event, item, expires, addon_to=None):
+    return CartPosition.objects.create(
+        event=event, item=item, price=Decimal('23.00'), cart_id='foo', expires=expires, addon_to=addon_to,
+    )
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+@override_settings(CLEANUP_CART_BATCH_SIZE=2)
+def test_clean_cart_positions_chunked(event, item):
+    old = now() - timedelta(days=15)
+    for i in range(3):
+        parent = _cp(event, item, old)
+        _cp(event, item, old, addon_to=parent)
+    # Add-ons that are not old enough themselves are deleted together with their parent
+    _cp(event, item, now() - timedelta(days=1), addon_to=_cp(event, item, old))
+    valid = _cp(event, item, now() + timedelta(minutes=10))
+
+    clean_cart_positions(sender=None)
+    assert list(CartPosition.objects.all()) == [valid]
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+@override_settings(CLEANUP_CART_BATCH_SIZE=2)
+def test_clean_cart_positions_time_budget(event, item):
+    old = now() - timedelta(days=15)
+    for i in range(5):
+        _cp(event, item, old)
+
+    assert _delete_expired_cart_positions(now() - timedelta(days=14), deadline=time.monotonic() - 1) == 0
+    assert CartPosition.objects.count() == 5
+    assert _delete_expired_cart_positions(now() - timedelta(days=14), deadline=time.monotonic() + 60) == 5
+    assert CartPosition.objects.count() == 0
@@ -37,6 +37,7 @@ from datetime import date, datetime, timedelta, timezone
 from decimal import Decimal
 
 import pytest
+from django.core.management import call_command
 from django.db import DatabaseError, transaction
 from django.utils.itercompat import is_iterable
 from django.utils.timezone import now
@@ -46,13 +47,15 @@ from i18nfield.strings import LazyI18nString
 
 from pretix.base.invoice import addon_aware_groupby
 from pretix.base.models import (
-    Event, ExchangeRate, Invoice, InvoiceAddress, Item, ItemVariation, Order,
-    OrderPosition, Organizer,
+    Event, ExchangeRate, Invoice, InvoiceAddress, InvoiceNumberCounter, Item,
+    ItemVariation, Order, OrderPosition, Organizer,
 )
 from pretix.base.models.orders import OrderFee
+from pretix.base.services import invoices as invoice_services
 from pretix.base.services.invoices import (
     build_preview_invoice_pdf, generate_cancellation, generate_invoice,
-    invoice_pdf_task, invoice_qualified, regenerate_invoice,
+    invoice_pdf_batch_task, invoice_pdf_task, invoice_qualified,
+    regenerate_invoice,
 )
 from pretix.base.services.orders import OrderChangeManager
 
@@ -444,6 +447,59 @@ def test_pdf_generation(env):
     assert invoice_pdf_task(cancellation.pk)
 
 
+@pytest.mark.django_db
+def test_pdf_generation_batch(env):
+    event, order = env
+    inv = generate_invoice(order)
+    cancellation = generate_cancellation(inv)
+    with scopes_disabled():
+        Invoice.objects.filter(pk__in=[inv.pk, cancellation.pk]).update(file=None)
+
+    result = invoice_pdf_batch_task(event=event.pk, processes=1)
+    assert result['total'] == 2
+    assert result['rendered'] == 2
+    assert result['failed'] == 0
+    inv.refresh_from_db()
+    cancellation.refresh_from_db()
+    assert inv.file
+    assert cancellation.file
+
+    result = invoice_pdf_batch_task(event=event.pk, invoices=[inv.pk], processes=1)
+    assert result['total'] == 1
+    assert result['rendered'] == 1
+
+
+def _render_invoice_pdf_chunk_in_child(args):
+    # Runs in a pool process, which might not see the data of the test database. Every invoice is reported as failed,
+    # so the test can tell that the results have been collected from here.
+    event_id, invoice_ids = args
+    return 0, len(invoice_ids)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pdf_generation_batch_pool(env, monkeypatch):
+    event, order = env
+    inv = generate_invoice(order)
+    generate_cancellation(inv)
+
+    pools = []
+    real_process_pool = invoice_services.process_pool
+
+    def process_pool(processes, **kwargs):
+        pools.append(processes)
+        return real_process_pool(processes, **kwargs)
+
+    monkeypatch.setattr(invoice_services, 'INVOICE_PDF_CHUNK_SIZE', 1)
+    monkeypatch.setattr(invoice_services, 'process_pool', process_pool)
+    monkeypatch.setattr(invoice_services, '_render_invoice_pdf_chunk', _render_invoice_pdf_chunk_in_child)
+
+    result = invoice_pdf_batch_task(event=event.pk, processes=4)
+    assert pools == [2]
+    assert result['total'] == 2
+    assert result['rendered'] == 0
+    assert result['failed'] == 2
+
+
 @pytest.mark.django_db
 def test_pdf_generation_custom_text(env):
     event, order = env
@@ -614,6 +670,53 @@ def test_invoice_number_prefixes(env):
             )
 
 
+@pytest.mark.django_db
+def test_invoice_number_counter(env):
+    event, order = env
+    event.settings.set('invoice_numbers_consecutive', True)
+    event.settings.set('invoice_numbers_prefix', 'C-')
+
+    # Invoices from before the counter existed
+    for no in ('00001', '00002'):
+        Invoice.objects.create(
+            order=order, event=event, organizer=event.organizer, date=now().date(), locale='en',
+            prefix='C-', invoice_no=no,
+        )
+    assert generate_invoice(order).number == 'C-00003'
+    counter = InvoiceNumberCounter.objects.get(organizer=event.organizer, prefix='C-')
+    assert counter.value == 3
+
+    # The counter falls behind if a number is assigned manually
+    Invoice.objects.create(
+        order=order, event=event, organizer=event.organizer, date=now().date(), locale='en',
+        prefix='C-', invoice_no='00004',
+    )
+    assert generate_invoice(order).number == 'C-00005'
+    counter.refresh_from_db()
+    assert counter.value == 5
+
+
+@pytest.mark.django_db
+def test_check_invoice_counters_missing(env, capsys):
+    event, order = env
+    # Invoices of a prefix the counters have not been backfilled for
+    for no in ('00001', '00002'):
+        Invoice.objects.create(
+            order=order, event=event, organizer=event.organizer, date=now().date(), locale='en',
+            prefix='M-', invoice_no=no,
+        )
+    call_command('check_invoice_counters')
+    assert "Missing counter for organizer {}, prefix 'M-'".format(event.organizer.slug) in capsys.readouterr().out
+    assert not InvoiceNumberCounter.objects.filter(organizer=event.organizer, prefix='M-').exists()
+
+    call_command('check_invoice_counters', fix=True)
+    capsys.readouterr()
+    assert InvoiceNumberCounter.objects.get(organizer=event.organizer, prefix='M-').value == 2
+
+    call_command('check_invoice_counters')
+    assert 'Missing counter' not in capsys.readouterr().out
+
+
 @pytest.mark.django_db
 def test_sales_channels_qualify(env):
     event, order = env
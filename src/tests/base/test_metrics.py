@@ -38,9 +38,14 @@
 import base64
 
 import pytest
+from django.db import transaction
 from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
 
 from pretix.base import metrics
+from pretix.base.models import Event, Organizer
+from pretix.base.services.locking import lock_objects
 from pretix.base.views import metrics as metricsview
 
 
@@ -201,6 +206,36 @@ def test_histogram(monkeypatch):
     assert fake_redis.storage['my_histogram_bucket{dimension="two",le="1.0"}'] == 1
 
 
+@pytest.mark.django_db
+@override_settings(HAS_REDIS=True, METRICS_ENABLED=True)
+def test_lock_metrics(monkeypatch, django_capture_on_commit_callbacks):
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(metrics, "redis", fake_redis, raising=False)
+
+    with scopes_disabled():
+        o = Organizer.objects.create(name='Dummy', slug='dummy')
+        event = Event.objects.create(organizer=o, name='Dummy', slug='dummy', date_from=now())
+        quotas = [event.quotas.create(name=f'Q{i}', size=10) for i in range(3)]
+
+        with django_capture_on_commit_callbacks(execute=True), transaction.atomic():
+            lock_objects(quotas[:2], shared_lock_objects=[event])
+            # Not reported while the locks are held
+            assert not fake_redis.storage
+        assert fake_redis.storage['pretix_lock_wait_seconds_count{keyspace="quota",mode="exclusive"}'] == 1
+        assert fake_redis.storage['pretix_lock_wait_seconds_count{keyspace="event",mode="shared"}'] == 1
+        assert fake_redis.storage['pretix_lock_keys_per_call_bucket{le="3.0"}'] == 1
+        assert 'pretix_lock_keys_per_call_bucket{le="2.0"}' not in fake_redis.storage
+        assert 'pretix_lock_shared_fallback_total' not in fake_redis.storage
+
+        with django_capture_on_commit_callbacks(execute=True), transaction.atomic():
+            lock_objects(quotas, shared_lock_objects=[event],
+                         replace_exclusive_with_shared_when_exclusive_are_more_than=2)
+        assert fake_redis.storage['pretix_lock_shared_fallback_total'] == 1
+        assert fake_redis.storage['pretix_lock_wait_seconds_count{keyspace="event",mode="exclusive"}'] == 1
+        assert fake_redis.storage['pretix_lock_wait_seconds_count{keyspace="quota",mode="exclusive"}'] == 1
+        assert not any(k.startswith('pretix_lock_timeouts_total') for k in fake_redis.storage)
+
+
 @pytest.mark.django_db
 @override_settings(HAS_REDIS=True, METRICS_USER="foo", METRICS_PASSPHRASE="bar")
 def test_metrics_view(monkeypatch, client):
@@ -38,6 +38,7 @@ import time
 import zoneinfo
 from datetime import date, timedelta
 from decimal import Decimal
+from unittest import mock
 
 import pytest
 from dateutil.tz import tzoffset
@@ -63,7 +64,9 @@ from pretix.base.models.items import (
 )
 from pretix.base.reldate import RelativeDate, RelativeDateWrapper
 from pretix.base.services.orders import OrderError, cancel_order, perform_order
-from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotas import (
+    QuotaAvailability, invalidate_quota_cache,
+)
 from pretix.helpers import repeatable_reads_transaction
 from pretix.testutils.scope import classscope
 
@@ -567,6 +570,87 @@ class QuotaTestCase(BaseQuotaTestCase):
         qa.compute(allow_cache=True)
         assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 5)
 
+    @classscope(attr='o')
+    def test_cache_invalidation(self):
+        self.quota.items.add(self.item1)
+
+        qa = QuotaAvailability()
+        qa.queue(self.quota)
+        qa.compute(allow_cache=True)
+        assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+
+        CartPosition.objects.create(event=self.event, item=self.item1, price=2,
+                                    expires=now() + timedelta(days=3))
+
+        qa = QuotaAvailability()
+        qa.queue(self.quota)
+        qa.compute(allow_cache=True)
+        assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_quota_cache([self.quota])
+
+        # While another process is recomputing, the outdated value is used
+        token = QuotaAvailability()._acquire_recompute_lock({self.quota.pk})
+        qa = QuotaAvailability()
+        qa.queue(self.quota)
+        qa.compute(allow_cache=True)
+        assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+        QuotaAvailability()._release_recompute_lock({self.quota.pk}, token)
+
+        qa = QuotaAvailability()
+        qa.queue(self.quota)
+        qa.compute(allow_cache=True)
+        assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 1)
+
+    @classscope(attr='o')
+    def test_cache_invalidation_during_compute(self):
+        self.quota.items.add(self.item1)
+        compute = QuotaAvailability._compute
+
+        def _compute(qa, quotas, now_dt):
+            compute(qa, quotas, now_dt)
+            with self.captureOnCommitCallbacks(execute=True):
+                invalidate_quota_cache([self.quota])
+
+        with mock.patch.object(QuotaAvailability, '_compute', _compute):
+            qa = QuotaAvailability()
+            qa.queue(self.quota)
+            qa.compute(allow_cache=True)
+
+        fresh, outdated = QuotaAvailability()._read_cache([self.quota], False)
+        assert self.quota not in fresh
+        assert self.quota in outdated
+
+    @classscope(attr='o')
+    def test_cache_expiry(self):
+        self.quota.items.add(self.item1)
+
+        qa = QuotaAvailability()
+        qa.queue(self.quota)
+        qa.compute(allow_cache=True)
+        assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+
+        CartPosition.objects.create(event=self.event, item=self.item1, price=2,
+                                    expires=now() + timedelta(days=3))
+
+        with freeze_time(now() + timedelta(seconds=60)):
+            qa = QuotaAvailability()
+            qa.queue(self.quota)
+            qa.compute(allow_cache=True)
+            assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+
+        with freeze_time(now() + timedelta(seconds=150)):
+            qa = QuotaAvailability()
+            qa.queue(self.quota)
+            qa.compute(allow_cache=True, allow_cache_stale=True)
+            assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 2)
+
+            qa = QuotaAvailability()
+            qa.queue(self.quota)
+            qa.compute(allow_cache=True)
+            assert qa.results[self.quota] == (Quota.AVAILABILITY_OK, 1)
+
     @classscope(attr='o')
     def test_waitinglist_variation_fulfilled(self):
         self.quota.variations.add(self.var1)
@@ -2668,6 +2752,50 @@ class SubEventTest(TestCase):
         assert obj.best_availability == (Quota.AVAILABILITY_OK, None, None, False)
         assert not obj.best_availability_is_low
 
+    @classscope(attr='organizer')
+    def test_best_availability_summary(self):
+        event2 = Event.objects.create(
+            organizer=self.organizer, name='Dummy 2', slug='dummy2',
+            date_from=now(), has_subevents=True
+        )
+        item = Item.objects.create(event=self.event, name='Ticket', default_price=0, active=True)
+        item2 = Item.objects.create(event=event2, name='Ticket', default_price=0, active=True)
+        subevents = [self.se] + [
+            SubEvent.objects.create(name=f'Testsub {i}', date_from=now(), event=self.event)
+            for i in range(4)
+        ] + [
+            SubEvent.objects.create(name=f'Other {i}', date_from=now(), event=event2)
+            for i in range(3)
+        ]
+        for i, se in enumerate(subevents):
+            q = Quota.objects.create(event=se.event, name='Quota', size=2, subevent=se)
+            q.items.add(item if se.event == self.event else item2)
+            o = Order.objects.create(
+                code=f'FOO{i}', event=se.event, email='dummy@dummy.test',
+                sales_channel=self.organizer.sales_channels.get(identifier="web"),
+                status=Order.STATUS_PAID,
+                datetime=now(), expires=now() + timedelta(days=10),
+                total=Decimal("0"), locale='en'
+            )
+            for j in range(i % 3):
+                OrderPosition.objects.create(
+                    order=o, item=item if se.event == self.event else item2, subevent=se, price=Decimal("0"),
+                )
+
+        objs = list(SubEvent.annotated(SubEvent.objects.filter(event__organizer=self.organizer), 'web'))
+        qa = QuotaAvailability()
+        qa.queue(*[q for se in objs for q in se.active_quotas])
+        qa.compute()
+        summary = qa.best_availability_summary(objs)
+        for i, se in enumerate(subevents):
+            if i % 3 == 2:
+                assert summary[se.pk] == (Quota.AVAILABILITY_GONE, 0, 2, True)
+            else:
+                assert summary[se.pk] == (Quota.AVAILABILITY_OK, 2 - i % 3, 2, True)
+
+        with self.assertNumQueries(0):
+            assert {se.pk: se.best_availability for se in objs} == summary
+
 
 class CachedFileTestCase(TestCase):
     def test_file_handling(self):
@@ -23,11 +23,13 @@ import json
 import zoneinfo
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+from unittest import mock
 from zoneinfo import ZoneInfo
 
 import pytest
 from django.conf import settings
 from django.core import mail as djmail
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models import F, Sum
 from django.test import TestCase, TransactionTestCase, override_settings
@@ -40,8 +42,8 @@ from tests.testdummy.signals import FoobazSalesChannel
 
 from pretix.base.decimal import round_decimal
 from pretix.base.models import (
-    CartPosition, Event, GiftCard, Invoice, InvoiceAddress, Item, Order,
-    OrderPosition, Organizer, SeatingPlan,
+    CachedTicket, CartPosition, Event, GiftCard, Invoice, InvoiceAddress, Item,
+    Order, OrderPosition, Organizer, SeatingPlan,
 )
 from pretix.base.models.items import SubEventItem
 from pretix.base.models.orders import OrderFee, OrderPayment, OrderRefund
@@ -54,10 +56,12 @@ from pretix.base.services.invoices import (
     generate_cancellation, generate_invoice,
 )
 from pretix.base.services.orders import (
-    OrderChangeManager, OrderError, _create_order, approve_order, cancel_order,
-    deny_order, expire_orders, reactivate_order, send_download_reminders,
+    OrderChangeManager, OrderError, _create_order, _periodic_order_task_key,
+    approve_order, cancel_order, deny_order, expire_orders,
+    expire_orders_for_event, reactivate_order, send_download_reminders,
     send_expiry_warnings,
 )
+from pretix.base.services.tickets import pregenerate_order_tickets
 from pretix.plugins.banktransfer.payment import BankTransfer
 from pretix.testutils.mock import mocker_context
 from pretix.testutils.scope import classscope
@@ -327,6 +331,63 @@ def test_expiring(event):
     assert o2.transactions.aggregate(s=Sum(F('price') * F('count')))['s'] == Decimal('0.00')
 
 
+@pytest.mark.django_db
+@override_settings(PERIODIC_ORDER_BATCH_SIZE=1, PERIODIC_ORDER_TIME_BUDGET=0)
+def test_expiring_continues_in_chunks(event):
+    orders = [
+        Order.objects.create(
+            code='FOO{}'.format(i), event=event, email='dummy@dummy.test',
+            status=Order.STATUS_PENDING, locale='en',
+            datetime=now(), expires=now() - timedelta(days=10),
+            total=0,
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        ) for i in range(3)
+    ]
+    expire_orders(None)
+    for o in orders:
+        o.refresh_from_db()
+        assert o.status == Order.STATUS_EXPIRED
+
+
+@pytest.mark.django_db
+@override_settings(PERIODIC_ORDER_BATCH_SIZE=1, PERIODIC_ORDER_TIME_BUDGET=0)
+def test_expiring_continuation_keeps_run_marker(event):
+    for i in range(3):
+        Order.objects.create(
+            code='FOO{}'.format(i), event=event, email='dummy@dummy.test',
+            status=Order.STATUS_PENDING, locale='en',
+            datetime=now(), expires=now() - timedelta(days=10),
+            total=0,
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        )
+    key = _periodic_order_task_key(expire_orders_for_event, event.pk)
+    cache.delete(key)
+    with mock.patch.object(expire_orders_for_event, 'apply_async') as apply_async:
+        expire_orders_for_event.apply(kwargs={'event': event.pk})
+    assert apply_async.call_count == 1
+    assert cache.get(key)
+
+
+@pytest.mark.django_db
+def test_expiring_not_dispatched_if_auto_disabled(event):
+    Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test',
+        status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() - timedelta(days=10),
+        total=0,
+        sales_channel=event.organizer.sales_channels.get(identifier="web"),
+    )
+    event.organizer.settings.set('payment_term_expire_automatically', False)
+    with mock.patch.object(expire_orders_for_event, 'apply_async') as apply_async:
+        expire_orders(None)
+    assert not apply_async.called
+
+    event.settings.set('payment_term_expire_automatically', True)
+    with mock.patch.object(expire_orders_for_event, 'apply_async') as apply_async:
+        expire_orders(None)
+    assert apply_async.called
+
+
 @pytest.mark.django_db
 def test_expiring_paid_invoice(event):
     o2 = Order.objects.create(
@@ -1225,6 +1286,19 @@ class DownloadReminderTests(TestCase):
         send_download_reminders(sender=self.event)
         assert len(djmail.outbox) == 0
 
+    @classscope(attr='o')
+    @override_settings(CACHE_TICKETS_PREGENERATE=True, CACHE_TICKETS_PREGENERATE_LEAD_HOURS=48)
+    def test_tickets_pregenerated_before_reminder_date(self):
+        self.event.settings.mail_days_download_reminder = 1
+        self.event.settings.ticketoutput_testdummy__enabled = True
+        with self.captureOnCommitCallbacks(execute=True):
+            send_download_reminders(sender=self.event)
+        assert len(djmail.outbox) == 0
+        assert CachedTicket.objects.filter(order_position=self.op1, provider='testdummy').exists()
+        self.order.refresh_from_db()
+        assert not self.order.download_reminder_sent
+        assert pregenerate_order_tickets(self.order) == 0
+
 
 class OrderCancelTests(TestCase):
     def setUp(self):
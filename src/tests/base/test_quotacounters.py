@@ -0,0 +1,173 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scope
+
+from pretix.base.models import (
+    Event, Item, Order, OrderPayment, OrderPosition, Organizer, Quota,
+    QuotaCounter,
+)
+from pretix.base.services.orders import (
+    OrderChangeManager, cancel_order, mark_order_expired,
+)
+from pretix.base.services.quotacounters import (
+    reconcile_quota_counters, reconcile_quota_counters_periodic,
+)
+from pretix.base.services.quotas import QuotaAvailability
+
+
+@pytest.fixture
+def event():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now() + timedelta(days=10),
+    )
+    with scope(organizer=o), override_settings(QUOTA_COUNTERS_ENABLED=True):
+        yield event
+
+
+@pytest.fixture
+def item(event):
+    return Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+
+
+@pytest.fixture
+def quota(event, item):
+    q = Quota.objects.create(event=event, name='Tickets', size=3)
+    q.items.add(item)
+    return q
+
+
+@pytest.fixture
+def order(event, item):
+    o = Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_PENDING,
+        datetime=now(), expires=now() + timedelta(days=10), total=Decimal('46.00'),
+        sales_channel=event.organizer.sales_channels.get(identifier="web"),
+    )
+    for i in range(2):
+        OrderPosition.objects.create(order=o, item=item, variation=None, price=Decimal('23.00'), positionid=i + 1)
+    return o
+
+
+def _counter(quota):
+    c = QuotaCounter.objects.get(quota=quota)
+    return c.paid_orders, c.pending_orders
+
+
+@pytest.mark.django_db
+def test_reconcile_creates_counter(quota, order):
+    assert not QuotaCounter.objects.filter(quota=quota).exists()
+    reconcile_quota_counters([quota])
+    assert _counter(quota) == (0, 2)
+
+
+@pytest.mark.django_db
+def test_release_after_exit_not_counted(quota, order):
+    quota.release_after_exit = True
+    quota.save()
+    reconcile_quota_counters([quota])
+    assert not QuotaCounter.objects.filter(quota=quota).exists()
+
+
+@pytest.mark.django_db
+def test_deltas_on_status_changes(event, quota, order):
+    reconcile_quota_counters([quota])
+
+    p = order.payments.create(state=OrderPayment.PAYMENT_STATE_CREATED, provider='manual', amount=order.total)
+    p.confirm()
+    assert _counter(quota) == (2, 0)
+
+    cancel_order(order.pk)
+    assert _counter(quota) == (0, 0)
+
+
+@pytest.mark.django_db
+def test_deltas_on_expiry(event, quota, order):
+    reconcile_quota_counters([quota])
+    mark_order_expired(order)
+    assert _counter(quota) == (0, 0)
+
+
+@pytest.mark.django_db
+def test_deltas_on_order_change(event, quota, order, item):
+    other_item = Item.objects.create(event=event, name='Other', default_price=Decimal('23.00'))
+    Quota.objects.create(event=event, name='Other', size=None).items.add(other_item)
+    reconcile_quota_counters([quota])
+
+    ocm = OrderChangeManager(order, notify=False)
+    ocm.change_item(order.positions.first(), other_item, None)
+    ocm.commit(check_quotas=False)
+    assert _counter(quota) == (0, 1)
+
+
+@pytest.mark.django_db
+def test_compute_uses_counters_only_with_cache(event, quota, order):
+    reconcile_quota_counters([quota])
+    QuotaCounter.objects.filter(quota=quota).update(pending_orders=3)
+
+    qa = QuotaAvailability()
+    qa.queue(quota)
+    qa.compute(allow_cache=True)
+    assert qa.results[quota] == (Quota.AVAILABILITY_ORDERED, 0)
+
+    qa = QuotaAvailability()
+    qa.queue(quota)
+    qa.compute()
+    assert qa.results[quota] == (Quota.AVAILABILITY_OK, 1)
+
+
+@pytest.mark.django_db
+def test_compute_without_counter_falls_back(event, quota, order):
+    qa = QuotaAvailability()
+    qa.queue(quota)
+    qa.compute(allow_cache=True)
+    assert qa.results[quota] == (Quota.AVAILABILITY_OK, 1)
+
+
+@pytest.mark.django_db
+def test_compute_mixed_counted_and_uncounted(event, quota, order, item):
+    other = Quota.objects.create(event=event, name='Other', size=3)
+    other.items.add(item)
+    reconcile_quota_counters([quota])
+
+    qa = QuotaAvailability()
+    qa.queue(quota, other)
+    qa.compute(allow_cache=True)
+    assert qa.results[quota] == (Quota.AVAILABILITY_OK, 1)
+    assert qa.results[other] == (Quota.AVAILABILITY_OK, 1)
+
+
+@pytest.mark.django_db
+def test_periodic_reconciliation_repairs_drift(event, quota, order):
+    reconcile_quota_counters([quota])
+    QuotaCounter.objects.filter(quota=quota).update(pending_orders=17, reconciled=now() - timedelta(hours=1))
+    order.touch()
+
+    reconcile_quota_counters_periodic(None)
+    assert _counter(quota) == (0, 2)
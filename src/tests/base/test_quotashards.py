@@ -0,0 +1,192 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scope
+
+from pretix.base.models import (
+    CartPosition, Event, Item, Order, OrderPosition, Organizer, Quota,
+    QuotaShard, Voucher,
+)
+from pretix.base.services.cart import CartError, CartManager
+from pretix.base.services.quotas import QuotaAvailability
+from pretix.base.services.quotashards import quotas_with_low_shards
+
+
+@pytest.fixture
+def event():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    event = Event.objects.create(
+        organizer=o, name='Dummy', slug='dummy',
+        date_from=now() + timedelta(days=10), live=True,
+    )
+    with scope(organizer=o), override_settings(QUOTA_SHARDS=4):
+        yield event
+
+
+@pytest.fixture
+def item(event):
+    return Item.objects.create(event=event, name='Ticket', default_price=Decimal('23.00'))
+
+
+@pytest.fixture
+def quota(event, item):
+    q = Quota.objects.create(event=event, name='Tickets', size=100)
+    q.items.add(item)
+    return q
+
+
+def _add_to_cart(event, item, count, cart_id='foo'):
+    cm = CartManager(event=event, cart_id=cart_id, sales_channel=event.organizer.sales_channels.get(identifier="web"))
+    cm.add_new_items([{'item': item.pk, 'variation': None, 'count': count}])
+    cm.commit()
+
+
+def _tokens(quota):
+    return list(QuotaShard.objects.filter(quota=quota).order_by('index').values_list('tokens', flat=True))
+
+
+def _availability(quota, count_shard_tokens=False):
+    qa = QuotaAvailability(count_shard_tokens=count_shard_tokens)
+    qa.queue(quota)
+    qa.compute()
+    return qa.results[quota][1]
+
+
+@pytest.mark.django_db
+def test_first_operation_fills_shards(event, item, quota):
+    _add_to_cart(event, item, 2)
+    assert CartPosition.objects.count() == 2
+    # 98 left, half of it is distributed across 4 shards
+    assert _tokens(quota) == [12, 12, 12, 12]
+    assert _availability(quota, count_shard_tokens=True) == 50
+    # Everyone but the cart operations still sees the tokens as free capacity
+    assert _availability(quota) == 98
+
+
+@pytest.mark.django_db
+def test_reserve_from_shard(event, item, quota):
+    _add_to_cart(event, item, 2)
+    _add_to_cart(event, item, 3, cart_id='bar')
+    assert CartPosition.objects.count() == 5
+    assert sorted(_tokens(quota)) == [9, 12, 12, 12]
+    assert _availability(quota, count_shard_tokens=True) == 50
+    assert _availability(quota) == 95
+
+
+@pytest.mark.django_db
+def test_exhausted_shards_rebalanced(event, item, quota):
+    _add_to_cart(event, item, 2)
+    QuotaShard.objects.filter(quota=quota).update(tokens=1)
+    _add_to_cart(event, item, 2, cart_id='bar')
+    assert CartPosition.objects.count() == 4
+    # All tokens were returned and the remaining 96 tickets redistributed
+    assert _tokens(quota) == [12, 12, 12, 12]
+
+
+@pytest.mark.django_db
+def test_no_shards_close_to_sellout(event, item, quota):
+    quota.size = 20
+    quota.save()
+    _add_to_cart(event, item, 2)
+    assert QuotaShard.objects.filter(quota=quota).aggregate(s=Sum('tokens'))['s'] in (None, 0)
+    assert _availability(quota) == 18
+
+
+@pytest.mark.django_db
+def test_no_overbooking(event, item, quota):
+    quota.size = 50
+    quota.save()
+    _add_to_cart(event, item, 2)
+    for i in range(10):
+        try:
+            _add_to_cart(event, item, 10, cart_id=f'cart{i}')
+        except CartError:
+            pass
+    assert CartPosition.objects.count() == 50
+    assert _availability(quota) == 0
+
+
+@pytest.mark.django_db
+def test_disabled(event, item, quota):
+    with override_settings(QUOTA_SHARDS=0):
+        _add_to_cart(event, item, 2)
+    assert not QuotaShard.objects.exists()
+
+
+@pytest.mark.django_db
+def test_tokens_reclaimed_on_quota_change(event, item, quota):
+    _add_to_cart(event, item, 2)
+    assert _tokens(quota) == [12, 12, 12, 12]
+    quota.size = 10
+    quota.save()
+    assert _tokens(quota) == [0, 0, 0, 0]
+    assert _availability(quota) == 8
+
+
+@pytest.mark.django_db
+def test_no_tokens_for_closed_quota(event, item, quota):
+    _add_to_cart(event, item, 2)
+    quota.closed = True
+    quota.save(update_fields=['closed'])
+    assert _tokens(quota) == [0, 0, 0, 0]
+    with pytest.raises(CartError):
+        _add_to_cart(event, item, 2, cart_id='bar')
+    assert CartPosition.objects.count() == 2
+    assert _tokens(quota) == [0, 0, 0, 0]
+
+
+@pytest.mark.django_db
+def test_only_low_shards_refilled(event, item, quota):
+    _add_to_cart(event, item, 2)
+    assert quotas_with_low_shards({quota: 2}) == []
+    assert quotas_with_low_shards({quota: 13}) == [quota]
+    QuotaShard.objects.filter(quota=quota, index=0).update(tokens=3)
+    assert quotas_with_low_shards({quota: 2}) == [quota]
+
+
+@pytest.mark.django_db
+def test_order_uses_tokens(event, item, quota):
+    _add_to_cart(event, item, 2)
+    assert _tokens(quota) == [12, 12, 12, 12]
+    order = Order.objects.create(
+        code='FOO', event=event, email='dummy@dummy.test', status=Order.STATUS_EXPIRED, locale='en',
+        datetime=now(), expires=now() - timedelta(days=1), total=0,
+        sales_channel=event.organizer.sales_channels.get(identifier="web"),
+    )
+    for i in range(98):
+        OrderPosition.objects.create(order=order, item=item, variation=None, price=Decimal('0.00'), positionid=i + 1)
+    assert order._is_still_available(lock=True) is True
+    assert _tokens(quota) == [0, 0, 0, 0]
+
+
+@pytest.mark.django_db
+def test_voucher_uses_tokens(event, item, quota):
+    _add_to_cart(event, item, 2)
+    assert _tokens(quota) == [12, 12, 12, 12]
+    Voucher.clean_quota_check({'block_quota': True}, 98, None, event, quota, None, None)
+    assert _tokens(quota) == [0, 0, 0, 0]
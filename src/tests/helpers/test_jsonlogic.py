@@ -24,7 +24,7 @@ import os
 
 import pytest
 
-from pretix.helpers.jsonlogic import Logic
+from pretix.helpers.jsonlogic import Logic, compile_logic
 
 with open(os.path.join(os.path.dirname(__file__), 'jsonlogic-tests.json'), 'r') as f:
     data = json.load(f)
@@ -44,6 +44,11 @@ def test_shared_tests(logic, data, expected):
     assert Logic().apply(logic, data) == expected
 
 
+@pytest.mark.parametrize("logic,data,expected", params)
+def test_shared_tests_compiled(logic, data, expected):
+    assert Logic().apply_compiled(compile_logic(logic), data) == expected
+
+
 def test_unknown_operator():
     with pytest.raises(ValueError):
         assert Logic().apply({'unknownOp': []}, {})
@@ -53,3 +58,15 @@ def test_custom_operation():
     logic = Logic()
     logic.add_operation('double', lambda a: a * 2)
     assert logic.apply({'double': [{'var': 'value'}]}, {'value': 3}) == 6
+
+
+def test_compiled_custom_operation():
+    compiled = compile_logic({'double': [{'var': 'value'}]})
+    logic = Logic()
+    logic.add_operation('double', lambda a: a * 2)
+    assert logic.apply_compiled(compiled, {'value': 3}) == 6
+    logic = Logic()
+    logic.add_operation('double', lambda a: a * 3)
+    assert logic.apply_compiled(compiled, {'value': 3}) == 9
+    with pytest.raises(ValueError):
+        Logic().apply_compiled(compiled, {'value': 3})
@@ -0,0 +1,53 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+from unittest import mock
+
+from pretix.helpers.timing import PhaseTimer, phase_timer_var, timed_phase
+
+
+def test_nested_phases():
+    clock = iter([0.0, 1.0, 3.0, 6.0, 10.0, 15.0, 21.0])
+    with mock.patch('pretix.helpers.timing.time.perf_counter', lambda: next(clock)):
+        timer = PhaseTimer()  # t=0
+        with timer.phase('outer'):  # t=1
+            with timer.phase('inner'):  # t=3
+                timer.add('lock_wait', 1.0)
+            # t=6
+        # t=10
+        assert dict(timer.durations) == {'outer': 6.0, 'inner': 2.0, 'lock_wait': 1.0}
+        assert timer.as_dict() == {'outer': 6000.0, 'inner': 2000.0, 'lock_wait': 1000.0, 'other': 6000.0}
+
+
+def test_timed_phase_without_timer():
+    with timed_phase('foo'):
+        pass
+
+
+def test_timed_phase_with_timer():
+    timer = PhaseTimer()
+    token = phase_timer_var.set(timer)
+    try:
+        with timed_phase('foo'):
+            pass
+    finally:
+        phase_timer_var.reset(token)
+    assert 'foo' in timer.durations
@@ -22,8 +22,10 @@
 from datetime import timedelta
 from decimal import Decimal
 from io import BytesIO
+from unittest import mock
 
 import pytest
+from django.test import override_settings
 from django.utils.timezone import now
 from django_scopes import scope
 from pypdf import PdfReader
@@ -31,6 +33,8 @@ from pypdf import PdfReader
 from pretix.base.models import (
     Event, Item, ItemVariation, Order, OrderPosition, Organizer,
 )
+from pretix.base.pdf import Renderer, barcode_cache
+from pretix.plugins.ticketoutputpdf.exporters import AllTicketsPDF
 from pretix.plugins.ticketoutputpdf.ticketoutput import PdfTicketOutput
 
 
@@ -73,3 +77,77 @@ def test_generate_pdf(env0):
         assert ftype == 'application/pdf'
         pdf = PdfReader(BytesIO(buf))
         assert len(pdf.pages) == 1
+
+
+@pytest.mark.django_db
+def test_generate_order_reuses_renderer(env0):
+    event, order = env0
+    with scope(organizer=event.organizer):
+        o = PdfTicketOutput(event)
+        fname, ftype, buf = o.generate_order(order)
+        assert ftype == 'application/pdf'
+        pdf = PdfReader(BytesIO(buf))
+        assert len(pdf.pages) == 2
+        assert len(o._renderers) == 1
+
+
+@pytest.mark.django_db
+def test_text_content(env0):
+    event, order = env0
+    with scope(organizer=event.organizer):
+        op = order.positions.first()
+        r = Renderer(event, [], None)
+        o = {'content': 'other', 'text': '{order}-{secret} {unknown}'}
+        assert r._get_text_content(op, order, o) == 'FOOBAR-1234 {unknown}'
+        assert r._get_text_content(op, order, o) == 'FOOBAR-1234 {unknown}'
+        assert r._get_text_content(op, order, {'content': 'other', 'text': 'static'}) == 'static'
+        assert r._get_text_content(op, order, {'content': 'order'}) == 'FOOBAR'
+        assert r._get_text_content(op, order, {'content': 'itemmeta:foo'}) == ''
+        assert r._get_text_content(op, order, {'content': 'doesnotexist'}) == ''
+        assert r._get_text_content(op, order, {'content': ''}) == '(error)'
+
+
+@override_settings(PDF_BARCODE_CACHE_SIZE=2)
+def test_barcode_cache():
+    barcode_cache.clear()
+    d1 = barcode_cache.get('1234', 100, 'H')
+    assert barcode_cache.get('1234', 100, 'H') is d1
+    assert barcode_cache.get('1234', 100, 'H', color=[255, 0, 0]) is not d1
+    assert barcode_cache.get('1234', 50, 'H') is not d1
+    # The least recently used drawing has been evicted
+    assert barcode_cache.get('1234', 100, 'H') is not d1
+    barcode_cache.clear()
+
+
+@override_settings(METRICS_ENABLED=True)
+def test_barcode_cache_metrics_aggregated(monkeypatch):
+    barcode_cache.clear()
+    barcode_cache._flush_metrics(force=True)
+    monkeypatch.setattr(barcode_cache, 'metrics_flush_interval', 3)
+    with mock.patch('pretix.base.pdf.pretix_pdf_barcode_cache_results_total.inc') as inc:
+        barcode_cache.get('1234', 100, 'H')
+        barcode_cache.get('1234', 100, 'H')
+        assert not inc.called
+        barcode_cache.get('1234', 100, 'H')
+        assert inc.call_count == 2
+        inc.assert_any_call(1, pipeline=mock.ANY, result='miss')
+        inc.assert_any_call(2, pipeline=mock.ANY, result='hit')
+    barcode_cache.clear()
+
+
+@pytest.mark.django_db
+def test_export_all_tickets(env0):
+    event, order = env0
+    with scope(organizer=event.organizer):
+        event.settings.set('ticket_download_nonadm', True)
+        progress = []
+        e = AllTicketsPDF(event, organizer=event.organizer, progress_callback=progress.append)
+        fname, ftype, buf = e.render({
+            'include_pending': True,
+            'order_by': 'code',
+        })
+        assert fname == 'dummy_tickets.pdf'
+        assert ftype == 'application/pdf'
+        pdf = PdfReader(BytesIO(buf))
+        assert len(pdf.pages) == 2
+        assert progress[-1] == 100
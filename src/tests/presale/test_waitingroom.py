@@ -0,0 +1,97 @@
+#
+# This file is part of pretix (Community Edition).
+#
+# Copyright (C) 2014-2020  Raphael Michel and contributors
+# Copyright (C) 2020-today pretix GmbH and contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation in version 3 of the License.
+#
+# ADDITIONAL TERMS APPLY: Pursuant to Section 7 of the GNU Affero General Public License, additional terms are
+# applicable granting you additional permissions and placing additional restrictions on your usage of this software.
+# Please refer to the pretix LICENSE file to obtain the full terms applicable to this work. If you did not receive
+# this file, see <https://pretix.eu/about/en/license>.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.  If not, see
+# <https://www.gnu.org/licenses/>.
+#
+import datetime
+
+from django.test import TestCase
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+
+from pretix.base.models import Event, Organizer
+from pretix.presale.waitingroom import LocalMemoryBackend
+
+
+class WaitingRoomTest(TestCase):
+    @scopes_disabled()
+    def setUp(self):
+        super().setUp()
+        LocalMemoryBackend.clear()
+        self.orga = Organizer.objects.create(name='CCC', slug='ccc')
+        self.event = Event.objects.create(
+            organizer=self.orga, name='30C3', slug='30c3',
+            date_from=datetime.datetime(now().year + 1, 12, 26, 14, 0, tzinfo=datetime.timezone.utc),
+            live=True,
+        )
+        self.event.settings.waiting_room_enabled = True
+        self.event.settings.waiting_room_rate = 1
+
+    def test_disabled(self):
+        self.event.settings.waiting_room_enabled = False
+        resp = self.client.get('/ccc/30c3/')
+        assert resp.status_code == 200
+
+    def test_redirect_to_queue(self):
+        resp = self.client.get('/ccc/30c3/')
+        assert resp.status_code == 302
+        assert resp['Location'] == '/ccc/30c3/queue/?next=/ccc/30c3/'
+
+    def test_widget_product_list(self):
+        resp = self.client.get('/ccc/30c3/widget/product_list')
+        assert resp.status_code == 200
+        assert 'very busy' in resp.json()['error']
+        assert 'items_by_category' not in resp.json()
+
+        self.client.get('/ccc/30c3/queue/')
+        resp = self.client.get('/ccc/30c3/widget/product_list')
+        assert resp.status_code == 200
+        assert resp.json()['error'] is None
+
+    def test_unprotected_url(self):
+        resp = self.client.get('/ccc/30c3/resend/')
+        assert resp.status_code == 200
+
+    def test_admitted_immediately(self):
+        resp = self.client.get('/ccc/30c3/queue/?next=/ccc/30c3/')
+        assert resp.status_code == 302
+        assert resp['Location'] == '/ccc/30c3/'
+        assert 'pretix_waitingroom_%d' % self.event.pk in resp.cookies
+        resp = self.client.get('/ccc/30c3/')
+        assert resp.status_code == 200
+
+    def test_queued(self):
+        self.client_class().get('/ccc/30c3/queue/')
+        resp = self.client.get('/ccc/30c3/queue/')
+        assert resp.status_code == 200
+        assert b'1 person ahead of you' in resp.content
+        assert 'pretix_waitingroom_%d_queue' % self.event.pk in resp.cookies
+        position_cookie = resp.cookies['pretix_waitingroom_%d_queue' % self.event.pk].value
+
+        resp = self.client.get('/ccc/30c3/queue/')
+        assert resp.status_code == 200
+        assert self.client.cookies['pretix_waitingroom_%d_queue' % self.event.pk].value == position_cookie
+
+        resp = self.client.get('/ccc/30c3/')
+        assert resp.status_code == 302
+
+    def test_forged_admission(self):
+        self.client.cookies['pretix_waitingroom_%d' % self.event.pk] = 'foo'
+        resp = self.client.get('/ccc/30c3/')
+        assert resp.status_code == 302